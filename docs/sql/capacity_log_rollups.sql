@@ -0,0 +1,18 @@
+-- Agregados por hora del ledger de capacidad (capacity_logs)
+--
+-- La tarea rollup_capacity_ledger mueve aquí los capacity_logs más antiguos
+-- que CAPACITY_LEDGER_RETENTION_HOURS, agrupados por evento, hora y motivo.
+-- Aplicar una vez en Supabase (SQL Editor) antes de activar la tarea.
+
+CREATE TABLE IF NOT EXISTS capacity_log_rollups (
+    event_id     uuid        NOT NULL REFERENCES events(id) ON DELETE CASCADE,
+    bucket       timestamptz NOT NULL,
+    reason       text        NOT NULL,
+    delta_total  integer     NOT NULL DEFAULT 0,
+    entries      integer     NOT NULL DEFAULT 0,
+    PRIMARY KEY (event_id, bucket, reason)
+);
+
+-- El rollup recorre capacity_logs por antigüedad y el historial por evento
+CREATE INDEX IF NOT EXISTS idx_capacity_logs_created_at ON capacity_logs (created_at);
+CREATE INDEX IF NOT EXISTS idx_capacity_logs_event_created_at ON capacity_logs (event_id, created_at);
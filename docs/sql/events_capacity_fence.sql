@@ -0,0 +1,11 @@
+-- Fencing token del write-back de capacidad
+--
+-- CapacityEngine.flush_event escribe los deltas de Redis en events bajo el
+-- lock `capacity:sync:{event_id}` y guarda el fencing token de esa
+-- adquisición en capacity_fence. El UPDATE exige capacity_fence < token, así
+-- que un proceso cuyo lease venció y que ya fue reemplazado por otro no puede
+-- escribir aunque haya pasado DistributedLock.validate(). Aplicar una vez en
+-- Supabase (SQL Editor) antes de desplegar.
+
+ALTER TABLE events
+    ADD COLUMN IF NOT EXISTS capacity_fence bigint NOT NULL DEFAULT 0;
@@ -0,0 +1,13 @@
+-- Marcas compartidas de contadores de inventario degradados
+--
+-- Cuando un proceso no alcanza Redis, InventoryService reserva/libera
+-- directo en la DB y deja aquí una fila por evento ("{event_id}") o servicio
+-- ("service:{id}") en la misma transacción. La tarea flush_capacity_counters
+-- las consume y descarta esos contadores en Redis para que se vuelvan a
+-- sembrar desde la DB, aunque el proceso que cayó al fallback ya no exista.
+-- Aplicar una vez en Supabase (SQL Editor).
+
+CREATE TABLE IF NOT EXISTS inventory_degraded (
+    key        text        PRIMARY KEY,
+    marked_at  timestamptz NOT NULL DEFAULT now()
+);
@@ -0,0 +1,11 @@
+-- Índice para la reconciliación de pagos pendientes
+--
+-- La tarea reconcile_payments recorre las órdenes 'pending' de Payku y
+-- Mercado Pago con paginación keyset sobre (created_at, id), y el sweeper de
+-- holds busca ahí las pendientes vencidas que no tienen hold en Redis. El índice parcial
+-- solo contiene órdenes pendientes, así que se mantiene chico aunque la tabla
+-- crezca. Aplicar una vez en Supabase (SQL Editor).
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_orders_pending_created
+    ON orders (created_at, id)
+    WHERE status = 'pending';
@@ -0,0 +1,31 @@
+-- Outbox transaccional de efectos posteriores al pago
+--
+-- Los webhooks de pago escriben aquí una fila 'order_paid' en la misma
+-- transacción que marca la orden como 'completed'. La tarea relay_outbox la
+-- publica en la cola high_priority y process_order_post_payment genera los
+-- tickets, el PDF y el email. Aplicar una vez en Supabase (SQL Editor) antes
+-- de desplegar.
+
+CREATE TABLE IF NOT EXISTS outbox_events (
+    id                 uuid        PRIMARY KEY,
+    aggregate_id       uuid        NOT NULL,
+    event_type         text        NOT NULL,
+    payload            jsonb,
+    status             text        NOT NULL DEFAULT 'pending',
+    attempts           integer     NOT NULL DEFAULT 0,
+    available_at       timestamptz NOT NULL DEFAULT now(),
+    published_at       timestamptz,
+    tickets_issued_at  timestamptz,
+    email_sent_at      timestamptz,
+    locked_until       timestamptz,
+    processed_at       timestamptz,
+    last_error         text,
+    created_at         timestamptz NOT NULL DEFAULT now(),
+    -- Un webhook repetido no duplica los efectos de la orden
+    CONSTRAINT uq_outbox_events_aggregate_type UNIQUE (aggregate_id, event_type)
+);
+
+-- El relay solo recorre filas sin procesar
+CREATE INDEX IF NOT EXISTS idx_outbox_events_unprocessed
+    ON outbox_events (available_at)
+    WHERE processed_at IS NULL;
@@ -0,0 +1,33 @@
+-- Soporte del manifiesto offline de scanners
+--
+-- El manifiesto de cada evento se genera de forma incremental leyendo los
+-- tickets escritos desde la última versión. La versión sigue el orden de
+-- commit: el trigger guarda en manifest_xid el ID (64 bits) de la transacción
+-- que insertó o modificó la fila, y el servicio usa como versión el xmin del
+-- snapshot de cada lectura, así una transacción larga que confirma tarde no
+-- queda fuera (updated_at marca el inicio de la transacción, no el commit).
+-- El trigger cubre también los UPDATE hechos con SQL directo y sigue
+-- manteniendo updated_at. Requiere PostgreSQL 13+ (pg_current_xact_id).
+-- Aplicar una vez en Supabase (SQL Editor).
+
+-- Filas existentes con 0: entran en el primer manifiesto completo
+ALTER TABLE tickets ADD COLUMN IF NOT EXISTS manifest_xid bigint NOT NULL DEFAULT 0;
+
+DROP INDEX CONCURRENTLY IF EXISTS idx_tickets_event_updated;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tickets_event_manifest_xid
+    ON tickets (event_id, manifest_xid);
+
+CREATE OR REPLACE FUNCTION tickets_touch_updated_at() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' THEN
+        NEW.updated_at := now();
+    END IF;
+    NEW.manifest_xid := pg_current_xact_id()::text::bigint;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_tickets_touch_updated_at ON tickets;
+CREATE TRIGGER trg_tickets_touch_updated_at
+    BEFORE INSERT OR UPDATE ON tickets
+    FOR EACH ROW EXECUTE FUNCTION tickets_touch_updated_at();
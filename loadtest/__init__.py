@@ -0,0 +1,10 @@
+"""
+Pruebas de carga de la ruta de compra con proveedores falsos
+
+- loadtest.fakes: Payku, Mercado Pago, Resend, Supabase Auth y pdfsvc falsos
+  con latencia y tasa de errores configurables
+- loadtest.scenarios: pico de venta, navegación del catálogo, tormenta de
+  webhooks y ráfaga de escaneos
+- loadtest.checks: sobreventa, doble ingreso y efectos duplicados
+- python -m loadtest: corre un escenario e imprime el reporte
+"""
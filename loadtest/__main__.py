@@ -0,0 +1,126 @@
+"""
+Generador de carga de punta a punta
+
+Uso (con la API apuntando a los proveedores falsos, ver
+docker-compose.loadtest.yml):
+
+    python -m loadtest onsale --event-id <uuid> --buyers 2000 --concurrency 200
+    python -m loadtest onsale --event-id <uuid> --buyers 2000 --concurrency 200 --async
+    python -m loadtest browse --requests 20000 --concurrency 300
+    python -m loadtest webhooks --event-id <uuid> --orders 500 --duplicates 5
+    python -m loadtest scan --event-id <uuid> --tickets 500 --repeats 3
+
+Al terminar imprime p50/p95/p99 y throughput por operación, la espera por
+conexiones del pool de la DB (db_pool_checkout_wait_seconds de /metrics) y las
+verificaciones de consistencia del escenario (sobreventa, doble ingreso,
+efectos duplicados). Sale con código 1 si alguna verificación falla.
+"""
+from typing import List
+from shared.database import connection
+from shared.cache.redis_client import init_redis, close_redis
+from loadtest import checks, scenarios
+from loadtest.stats import Recorder, scrape_metrics, pool_wait_summary, render_report
+import argparse
+import asyncio
+import os
+import sys
+
+
+async def _settle(order_ids: List[str], seconds: float) -> List[checks.Check]:
+    """Esperar a que el consumidor de webhooks y el outbox terminen con las órdenes"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + seconds
+    while True:
+        results = await checks.order_checks(order_ids)
+        if all(ok for _, ok, _ in results) or loop.time() >= deadline:
+            return results
+        await asyncio.sleep(1)
+
+
+async def run(args) -> int:
+    await connection.init_db()
+    await init_redis()
+    ctx = scenarios.LoadContext(args.base_url, args.concurrency)
+
+    try:
+        metrics_before = await scrape_metrics(ctx.client, ctx.base_url)
+        results: List[checks.Check] = []
+
+        if args.scenario == "onsale":
+            order_ids = await scenarios.onsale(
+                ctx, args.event_id, args.buyers, args.concurrency,
+                tickets_per_buyer=args.tickets_per_buyer, accept_async=args.accept_async
+            )
+            ctx.recorder.stop()
+            results += await _settle(order_ids, args.settle)
+            results += await checks.capacity_checks(args.event_id)
+
+        elif args.scenario == "browse":
+            await scenarios.browse(ctx, args.requests, args.concurrency)
+            ctx.recorder.stop()
+
+        elif args.scenario == "webhooks":
+            order_ids = await checks.pending_orders(args.event_id, args.orders)
+            if len(order_ids) < args.orders:
+                # Crear las que falten sin pagarlas
+                order_ids += await scenarios.onsale(
+                    ctx, args.event_id, args.orders - len(order_ids), args.concurrency, pay=False
+                )
+            ctx.recorder = Recorder()  # medir solo la tormenta
+            await scenarios.webhook_storm(ctx, order_ids, args.duplicates, args.concurrency, args.sources)
+            ctx.recorder.stop()
+            results += await _settle(order_ids, args.settle)
+            results += await checks.capacity_checks(args.event_id)
+
+        elif args.scenario == "scan":
+            signatures = await checks.issued_qr_signatures(args.event_id, args.tickets)
+            if not signatures:
+                print(f"El evento {args.event_id} no tiene tickets emitidos sin usar (correr onsale antes)")
+                return 1
+            accepted = await scenarios.scan_burst(ctx, args.event_id, signatures, args.repeats, args.concurrency)
+            ctx.recorder.stop()
+            results += checks.scan_checks(accepted)
+
+        metrics_after = await scrape_metrics(ctx.client, ctx.base_url)
+        print(render_report(
+            args.scenario, ctx.recorder, pool_wait_summary(metrics_before, metrics_after), results
+        ))
+        return 0 if all(ok for _, ok, _ in results) else 1
+    finally:
+        await ctx.close()
+        await close_redis()
+        await connection.close_db()
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="loadtest", description="Pruebas de carga de la ruta de compra")
+    parser.add_argument("--base-url", default=os.getenv("LOADTEST_BASE_URL", "http://localhost:8000"))
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--settle", type=float, default=60, help="segundos de espera antes de verificar")
+    sub = parser.add_subparsers(dest="scenario", required=True)
+
+    onsale = sub.add_parser("onsale", help="pico de venta sobre un evento")
+    onsale.add_argument("--event-id", required=True)
+    onsale.add_argument("--buyers", type=int, default=1000)
+    onsale.add_argument("--tickets-per-buyer", type=int, default=1)
+    onsale.add_argument("--async", dest="accept_async", action="store_true", help="compras con Prefer: respond-async")
+
+    browse = sub.add_parser("browse", help="navegación mixta del catálogo")
+    browse.add_argument("--requests", type=int, default=10000)
+
+    webhooks = sub.add_parser("webhooks", help="tormenta de webhooks de pago duplicados")
+    webhooks.add_argument("--event-id", required=True)
+    webhooks.add_argument("--orders", type=int, default=200)
+    webhooks.add_argument("--duplicates", type=int, default=5)
+    webhooks.add_argument("--sources", type=int, default=50, help="IPs de origen de los webhooks")
+
+    scan = sub.add_parser("scan", help="ráfaga de escaneos en la puerta")
+    scan.add_argument("--event-id", required=True)
+    scan.add_argument("--tickets", type=int, default=500)
+    scan.add_argument("--repeats", type=int, default=3)
+
+    sys.exit(asyncio.run(run(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Verificaciones de consistencia después de una corrida (contra la DB y Redis)
+
+Usan DATABASE_URL / REDIS_URL, los mismos que la API.
+"""
+from sqlalchemy import select, func, text
+from typing import Dict, List, Tuple
+from shared.database import connection
+from shared.database.models import Order, Ticket
+from services.ticket_purchase.services.capacity_reconciliation_service import CapacityReconciliationService
+
+Check = Tuple[str, bool, str]
+
+
+async def capacity_checks(event_id: str) -> List[Check]:
+    """Sobreventa y desvío de capacidad del evento"""
+    async with connection.async_session_maker() as db:
+        report = await CapacityReconciliationService.audit_event(db, event_id)
+        await db.commit()
+
+    if report is None:
+        return [("evento", False, f"{event_id} no existe")]
+
+    occupied = report["reserved_seats"] + report["stray_tickets"]
+    return [
+        (
+            "sin sobreventa",
+            occupied <= report["capacity_total"],
+            f"{occupied} asientos ocupados de {report['capacity_total']}",
+        ),
+        (
+            "tickets <= capacidad",
+            report["active_tickets"] <= report["capacity_total"],
+            f"{report['active_tickets']} tickets vigentes",
+        ),
+        (
+            "capacity_available >= 0",
+            report["capacity_available"] >= 0,
+            f"capacity_available={report['capacity_available']}",
+        ),
+        (
+            "sin desvío de capacidad",
+            report["drift"] == 0,
+            f"esperado {report['expected_available']}, drift={report['drift']}",
+        ),
+    ]
+
+
+async def order_checks(order_ids: List[str]) -> List[Check]:
+    """Órdenes pagadas: completadas y con un solo order_paid en el outbox"""
+    if not order_ids:
+        return []
+
+    async with connection.async_session_maker() as db:
+        result = await db.execute(
+            select(Order.status, func.count()).where(Order.id.in_(order_ids)).group_by(Order.status)
+        )
+        statuses: Dict[str, int] = {status: count for status, count in result}
+        duplicated = await db.scalar(text("""
+            SELECT count(*) FROM (
+                SELECT aggregate_id FROM outbox_events
+                WHERE event_type = 'order_paid' AND aggregate_id = ANY(CAST(:ids AS uuid[]))
+                GROUP BY aggregate_id HAVING count(*) > 1
+            ) d
+        """), {"ids": order_ids})
+        await db.commit()
+
+    completed = statuses.get("completed", 0)
+    return [
+        (
+            "órdenes completadas",
+            completed == len(order_ids),
+            ", ".join(f"{status}={count}" for status, count in sorted(statuses.items())),
+        ),
+        (
+            "un order_paid por orden",
+            not duplicated,
+            f"{duplicated or 0} órdenes con efectos duplicados",
+        ),
+    ]
+
+
+def scan_checks(accepted: Dict[str, int]) -> List[Check]:
+    """Cada QR se acepta exactamente una vez"""
+    double_entries = sum(1 for count in accepted.values() if count > 1)
+    never_accepted = sum(1 for count in accepted.values() if count == 0)
+    return [
+        ("sin doble ingreso", double_entries == 0, f"{double_entries} QR aceptados más de una vez"),
+        ("todos los QR ingresan", never_accepted == 0, f"{never_accepted} QR nunca aceptados"),
+    ]
+
+
+async def pending_orders(event_id: str, limit: int) -> List[str]:
+    """Órdenes Mercado Pago pendientes del evento (para la tormenta de webhooks)"""
+    async with connection.async_session_maker() as db:
+        result = await db.execute(text("""
+            SELECT DISTINCT o.id, o.created_at FROM orders o
+            JOIN order_items oi ON oi.order_id = o.id
+            WHERE oi.event_id = :event_id AND o.status = 'pending' AND o.payment_provider = 'mercadopago'
+            ORDER BY o.created_at
+            LIMIT :limit
+        """), {"event_id": event_id, "limit": limit})
+        order_ids = [str(row.id) for row in result]
+        await db.commit()
+    return order_ids
+
+
+async def issued_qr_signatures(event_id: str, limit: int) -> List[str]:
+    """QR de tickets emitidos y aún no usados del evento (para la ráfaga de escaneos)"""
+    async with connection.async_session_maker() as db:
+        result = await db.execute(
+            select(Ticket.qr_signature)
+            .where(Ticket.event_id == event_id, Ticket.status == "issued")
+            .limit(limit)
+        )
+        signatures = list(result.scalars().all())
+        await db.commit()
+    return signatures
@@ -0,0 +1,235 @@
+"""
+Servidores falsos de los proveedores externos para pruebas de carga
+
+Un solo proceso FastAPI sirve los cinco upstreams bajo prefijos distintos:
+
+    /payku/api/transaction           PAYKU_API_URL=http://fakes:9900/payku/api
+    /mercadopago/...                 MERCADOPAGO_API_URL=http://fakes:9900/mercadopago
+    /resend/emails                   RESEND_API_URL=http://fakes:9900/resend/emails
+    /supabase/auth/v1/user           SUPABASE_URL=http://fakes:9900/supabase
+    /pdfsvc/tickets/pdf/...          PDFSVC_URL=http://fakes:9900/pdfsvc
+
+Latencia y errores por upstream (variables de entorno):
+
+    FAKE_<UPSTREAM>_LATENCY_MS   latencia media (default 50)
+    FAKE_<UPSTREAM>_JITTER_MS    variación uniforme +/- (default 20)
+    FAKE_<UPSTREAM>_ERROR_RATE   fracción de respuestas 503 (default 0)
+
+Pagos: FAKE_APPROVAL_RATE (default 1.0) es la fracción de pagos / transacciones
+que el proveedor reporta como aprobados; el resto queda rechazado.
+
+Uso:
+    python -m loadtest.fakes --port 9900
+"""
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
+from typing import Dict, Optional
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import uuid
+
+UPSTREAMS = ("payku", "mercadopago", "resend", "supabase", "pdfsvc")
+
+# PDF mínimo válido (una página en blanco)
+BLANK_PDF = (
+    b"%PDF-1.4\n1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj\n"
+    b"2 0 obj<</Type/Pages/Kids[3 0 R]/Count 1>>endobj\n"
+    b"3 0 obj<</Type/Page/Parent 2 0 R/MediaBox[0 0 200 200]>>endobj\n"
+    b"trailer<</Root 1 0 R>>\n%%EOF\n"
+)
+
+
+def _env(upstream: str, name: str, default: str) -> float:
+    return float(os.getenv(f"FAKE_{upstream.upper()}_{name}", default))
+
+
+class Behaviour:
+    """Latencia y tasa de errores de un upstream falso"""
+
+    def __init__(self, upstream: str):
+        self.upstream = upstream
+        self.latency = _env(upstream, "LATENCY_MS", "50") / 1000
+        self.jitter = _env(upstream, "JITTER_MS", "20") / 1000
+        self.error_rate = _env(upstream, "ERROR_RATE", "0")
+
+    async def apply(self) -> Optional[Response]:
+        """Esperar la latencia simulada; devuelve una respuesta de error si corresponde"""
+        delay = max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+        if delay:
+            await asyncio.sleep(delay)
+        if self.error_rate and random.random() < self.error_rate:
+            return JSONResponse({"message": f"{self.upstream} no disponible (fake)"}, status_code=503)
+        return None
+
+
+def _payment_status() -> str:
+    return "approved" if random.random() < float(os.getenv("FAKE_APPROVAL_RATE", "1.0")) else "rejected"
+
+
+def _jwt_claims(authorization: Optional[str]) -> Dict:
+    """Claims del JWT sin verificar firma (lo mismo que hace supabase_validator)"""
+    token = (authorization or "").removeprefix("Bearer ").strip()
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return json.loads(base64.urlsafe_b64decode(payload))
+    except (IndexError, ValueError):
+        return {}
+
+
+def create_app() -> FastAPI:
+    app = FastAPI(title="Proveedores falsos (loadtest)")
+    behaviours = {name: Behaviour(name) for name in UPSTREAMS}
+
+    # Estado en memoria: transacciones Payku, preferencias y pagos de Mercado Pago
+    transactions: Dict[str, Dict] = {}
+    preferences: Dict[str, Dict] = {}
+    payments: Dict[str, Dict] = {}
+
+    @app.middleware("http")
+    async def simulate(request: Request, call_next):
+        upstream = request.url.path.strip("/").split("/", 1)[0]
+        behaviour = behaviours.get(upstream)
+        if behaviour is not None:
+            error = await behaviour.apply()
+            if error is not None:
+                return error
+        return await call_next(request)
+
+    # ---------- Payku ----------
+
+    @app.post("/payku/api/transaction")
+    async def payku_create(request: Request):
+        data = await request.json()
+        transaction_id = f"trx{uuid.uuid4().hex[:16]}"
+        transactions[transaction_id] = {
+            "id": transaction_id,
+            "order": data.get("order"),
+            "status": "pending",
+            "amount": data.get("amount"),
+        }
+        return {
+            "id": transaction_id,
+            "status": "pending",
+            "url": f"http://fakes/payku/pay/{transaction_id}",
+        }
+
+    @app.get("/payku/api/transaction/{transaction_id}")
+    async def payku_get(transaction_id: str):
+        transaction = transactions.get(transaction_id)
+        if transaction is None:
+            return JSONResponse({"message": "Transacción no encontrada"}, status_code=404)
+        if transaction["status"] == "pending":
+            # El comprador "paga" la primera vez que alguien consulta
+            transaction["status"] = "success" if _payment_status() == "approved" else "failed"
+        return transaction
+
+    # ---------- Mercado Pago ----------
+
+    @app.post("/mercadopago/checkout/preferences")
+    async def mp_create_preference(request: Request):
+        data = await request.json()
+        preference_id = f"pref-{uuid.uuid4().hex[:16]}"
+        preferences[preference_id] = {
+            "id": preference_id,
+            "external_reference": data.get("external_reference"),
+            "back_urls": data.get("back_urls") or {},
+            "init_point": f"http://fakes/mercadopago/checkout/{preference_id}",
+            "sandbox_init_point": f"http://fakes/mercadopago/sandbox/{preference_id}",
+        }
+        return JSONResponse(preferences[preference_id], status_code=201)
+
+    @app.get("/mercadopago/checkout/preferences/{preference_id}")
+    async def mp_get_preference(preference_id: str):
+        preference = preferences.get(preference_id)
+        if preference is None:
+            return JSONResponse({"message": "preference not found"}, status_code=404)
+        return preference
+
+    def _payment(payment_id: str, external_reference: Optional[str] = None) -> Dict:
+        payment = payments.get(payment_id)
+        if payment is None:
+            # Pagos que el generador de webhooks inventa: "lt-<order_id>-<n>"
+            if external_reference is None and payment_id.startswith("lt-"):
+                external_reference = payment_id[3:].rsplit("-", 1)[0]
+            status = _payment_status()
+            payment = {
+                "id": payment_id,
+                "status": status,
+                "status_detail": "accredited" if status == "approved" else "cc_rejected_other_reason",
+                "external_reference": external_reference,
+                "transaction_amount": 0,
+            }
+            payments[payment_id] = payment
+        return payment
+
+    @app.post("/mercadopago/v1/payments")
+    async def mp_create_payment(request: Request):
+        data = await request.json()
+        payment = _payment(str(random.randint(10**10, 10**11)), data.get("external_reference"))
+        payment["transaction_amount"] = data.get("transaction_amount", 0)
+        return JSONResponse(payment, status_code=201)
+
+    @app.get("/mercadopago/v1/payments/search")
+    async def mp_search_payments(external_reference: str):
+        results = [p for p in payments.values() if p.get("external_reference") == external_reference]
+        return {"results": results, "paging": {"total": len(results)}}
+
+    @app.get("/mercadopago/v1/payments/{payment_id}")
+    async def mp_get_payment(payment_id: str):
+        return _payment(payment_id)
+
+    @app.get("/mercadopago/merchant_orders/{merchant_order_id}")
+    async def mp_get_merchant_order(merchant_order_id: str):
+        return {"id": merchant_order_id, "status": "closed", "order_status": "paid", "payments": []}
+
+    # ---------- Resend ----------
+
+    @app.post("/resend/emails")
+    async def resend_send():
+        return {"id": str(uuid.uuid4())}
+
+    # ---------- Supabase Auth ----------
+
+    @app.get("/supabase/auth/v1/user")
+    async def supabase_user(request: Request):
+        claims = _jwt_claims(request.headers.get("Authorization"))
+        if not claims.get("sub"):
+            return JSONResponse({"message": "invalid JWT"}, status_code=401)
+        return {"id": claims["sub"], "email": claims.get("email"), "aud": "authenticated"}
+
+    # ---------- pdfsvc ----------
+
+    @app.post("/pdfsvc/{path:path}")
+    async def pdfsvc_render(path: str):
+        return Response(content=BLANK_PDF, media_type="application/pdf")
+
+    @app.get("/health")
+    async def health():
+        return {
+            "status": "ok",
+            "transactions": len(transactions),
+            "preferences": len(preferences),
+            "payments": len(payments),
+        }
+
+    return app
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Proveedores falsos para pruebas de carga")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=9900)
+    args = parser.parse_args()
+
+    uvicorn.run(create_app(), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""
+Escenarios de carga contra la API
+
+Cada comprador virtual usa su propia IP (X-Forwarded-For) para que los rate
+limits por IP se comporten como con compradores reales. Los tokens son JWT
+firmados con una clave cualquiera: el fake de Supabase Auth no verifica la
+firma, igual que supabase_validator solo lee sus claims.
+"""
+from typing import Awaitable, Callable, Dict, List, Optional
+from jose import jwt
+from loadtest.stats import Recorder
+import asyncio
+import random
+import time
+import uuid
+
+import httpx
+
+API_PREFIX = "/api/v1"
+CATEGORIES = ("musica", "deporte", "teatro", "otro")
+
+
+def make_token(role: str = "user", user_id: Optional[str] = None) -> str:
+    user_id = user_id or str(uuid.uuid4())
+    now = int(time.time())
+    claims = {
+        "sub": user_id,
+        "email": f"{user_id[:8]}@loadtest.local",
+        "aud": "authenticated",
+        "iat": now,
+        "exp": now + 3600,
+        "app_metadata": {"role": role},
+        "user_metadata": {"role": role},
+    }
+    return jwt.encode(claims, "loadtest", algorithm="HS256")
+
+
+def client_ip(index: int) -> str:
+    return f"10.{(index >> 16) & 255}.{(index >> 8) & 255}.{index & 255}"
+
+
+class LoadContext:
+    """Cliente HTTP compartido y registro de resultados de una corrida"""
+
+    def __init__(self, base_url: str, concurrency: int, timeout: float = 30.0):
+        self.base_url = base_url.rstrip("/")
+        self.recorder = Recorder()
+        self.client = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=concurrency * 2, max_keepalive_connections=concurrency * 2),
+        )
+
+    async def request(
+        self,
+        operation: str,
+        method: str,
+        path: str,
+        ip_index: int = 0,
+        headers: Optional[Dict[str, str]] = None,
+        **kwargs
+    ) -> Optional[httpx.Response]:
+        """Request medido; el resultado se registra por código HTTP (o "error")"""
+        request_headers = {"X-Forwarded-For": client_ip(ip_index)}
+        if headers:
+            request_headers.update(headers)
+
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(
+                method, f"{self.base_url}{API_PREFIX}{path}", headers=request_headers, **kwargs
+            )
+        except httpx.HTTPError as e:
+            self.recorder.record(operation, time.perf_counter() - started, f"error:{type(e).__name__}")
+            return None
+        self.recorder.record(operation, time.perf_counter() - started, str(response.status_code))
+        return response
+
+    async def close(self):
+        await self.client.aclose()
+
+
+async def run_workers(count: int, concurrency: int, job: Callable[[int], Awaitable[None]]):
+    """Ejecutar `job(i)` para i en [0, count) con a lo sumo `concurrency` en paralelo"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def guarded(index: int):
+        async with semaphore:
+            await job(index)
+
+    await asyncio.gather(*(guarded(i) for i in range(count)))
+
+
+def _attendees(buyer: int, tickets: int) -> List[Dict]:
+    return [
+        {"name": f"Comprador {buyer} #{n}", "email": f"buyer{buyer}.{n}@loadtest.local"}
+        for n in range(tickets)
+    ]
+
+
+async def send_mp_webhook(ctx: LoadContext, order_id: str, attempt: int, ip_index: int) -> Optional[httpx.Response]:
+    """Notificación de pago de Mercado Pago; el fake responde el pago como aprobado"""
+    payment_id = f"lt-{order_id}-{attempt}"
+    return await ctx.request(
+        "webhook", "POST", "/purchases/webhook", ip_index,
+        params={"data.id": payment_id, "type": "payment"},
+        json={"type": "payment", "action": "payment.updated", "data": {"id": payment_id}},
+    )
+
+
+async def onsale(
+    ctx: LoadContext,
+    event_id: str,
+    buyers: int,
+    concurrency: int,
+    tickets_per_buyer: int = 1,
+    wait_seconds: int = 25,
+    pay: bool = True,
+    accept_async: bool = False
+) -> List[str]:
+    """
+    Pico de venta sobre un evento
+
+    Cada comprador: ve el evento, compra con Idempotency-Key (y reintenta una
+    vez con la misma key, como un doble click), paga (webhook de Mercado Pago)
+    y espera la confirmación por long-poll. Con pay=False solo crea las
+    órdenes (quedan pendientes). Con accept_async=True compra con
+    `Prefer: respond-async` y espera el link de pago por long-poll antes de
+    pagar (operación "payment_link").
+
+    Returns:
+        IDs de las órdenes creadas
+    """
+    orders: List[str] = []
+
+    async def buyer(index: int):
+        token = make_token()
+        auth = {"Authorization": f"Bearer {token}"}
+        await ctx.request("event_detail", "GET", f"/events/{event_id}", index)
+
+        body = {
+            "event_id": event_id,
+            "attendees": _attendees(index, tickets_per_buyer),
+            "payment_method": "mercadopago",
+        }
+        headers = {**auth, "Idempotency-Key": str(uuid.uuid4())}
+        if accept_async:
+            headers["Prefer"] = "respond-async"
+        response = await ctx.request("purchase", "POST", "/purchases", index, headers=headers, json=body)
+        # Doble click: debe devolver la misma orden sin volver a reservar
+        await ctx.request("purchase_retry", "POST", "/purchases", index, headers=headers, json=body)
+        if response is None or response.status_code not in (200, 202):
+            return
+
+        order_id = response.json().get("order_id")
+        orders.append(order_id)
+
+        if response.status_code == 202:
+            # El link de pago llega por el canal de estado
+            await ctx.request(
+                "payment_link", "GET", f"/purchases/{order_id}/wait", index, headers=auth,
+                params={"since": "pending", "timeout": wait_seconds},
+            )
+        if not pay:
+            return
+
+        await send_mp_webhook(ctx, order_id, 1, index)
+
+        started = time.perf_counter()
+        result = await ctx.request(
+            "wait", "GET", f"/purchases/{order_id}/wait", index, headers=auth,
+            params={"since": "pending", "timeout": wait_seconds},
+        )
+        if result is not None and result.status_code == 200 and result.json().get("status") == "completed":
+            ctx.recorder.record("paid_to_confirmed", time.perf_counter() - started, "completed")
+
+    await run_workers(buyers, concurrency, buyer)
+    return orders
+
+
+async def browse(ctx: LoadContext, requests: int, concurrency: int):
+    """Navegación mixta del catálogo: listado, filtros y detalle de eventos"""
+    listing = await ctx.request("events_list", "GET", "/events")
+    event_ids = [event["id"] for event in (listing.json() if listing is not None and listing.status_code == 200 else [])]
+
+    async def visitor(index: int):
+        roll = random.random()
+        if roll < 0.4 or not event_ids:
+            await ctx.request("events_list", "GET", "/events", index)
+        elif roll < 0.6:
+            await ctx.request("events_filter", "GET", "/events", index, params={"category": random.choice(CATEGORIES)})
+        else:
+            await ctx.request("event_detail", "GET", f"/events/{random.choice(event_ids)}", index)
+
+    await run_workers(requests, concurrency, visitor)
+
+
+async def webhook_storm(ctx: LoadContext, order_ids: List[str], duplicates: int, concurrency: int, sources: int):
+    """
+    Tormenta de webhooks: cada orden recibe `duplicates` notificaciones en
+    orden aleatorio, desde `sources` IPs (como los reintentos de Mercado Pago)
+    """
+    deliveries = [(order_id, attempt) for order_id in order_ids for attempt in range(1, duplicates + 1)]
+    random.shuffle(deliveries)
+
+    async def deliver(index: int):
+        order_id, attempt = deliveries[index]
+        await send_mp_webhook(ctx, order_id, attempt, index % max(1, sources))
+
+    await run_workers(len(deliveries), concurrency, deliver)
+
+
+async def scan_burst(ctx: LoadContext, event_id: str, qr_signatures: List[str], repeats: int, concurrency: int) -> Dict[str, int]:
+    """
+    Ráfaga de escaneos en la puerta: cada QR se escanea `repeats` veces en
+    paralelo desde distintos scanners
+
+    Returns:
+        {qr_signature: escaneos aceptados}
+    """
+    scanners = [str(uuid.uuid4()) for _ in range(max(1, min(concurrency, 20)))]
+    tokens = {scanner: make_token("scanner", scanner) for scanner in scanners}
+    scans = [qr for qr in qr_signatures for _ in range(repeats)]
+    random.shuffle(scans)
+    accepted: Dict[str, int] = {qr: 0 for qr in qr_signatures}
+
+    async def scan(index: int):
+        qr = scans[index]
+        scanner = scanners[index % len(scanners)]
+        response = await ctx.request(
+            "scan", "POST", "/tickets/validate", index % len(scanners),
+            headers={"Authorization": f"Bearer {tokens[scanner]}"},
+            json={"qr_signature": qr, "inspector_id": scanner, "event_id": event_id},
+        )
+        if response is not None and response.status_code == 200 and response.json().get("valid"):
+            accepted[qr] += 1
+
+    await run_workers(len(scans), concurrency, scan)
+    return accepted
@@ -0,0 +1,126 @@
+"""Registro de latencias, lectura de /metrics y reporte de una corrida"""
+from typing import Dict, List, Optional, Tuple
+import math
+import re
+import time
+
+import httpx
+
+POOL_WAIT_METRIC = "db_pool_checkout_wait_seconds"
+
+_SAMPLE_RE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{[^}]*\})?\s+(\S+)$')
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+class Recorder:
+    """Latencias y resultados por operación (p.ej. "purchase", "status", "scan")"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.outcomes: Dict[str, Dict[str, int]] = {}
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+
+    def record(self, operation: str, seconds: float, outcome: str):
+        self.latencies.setdefault(operation, []).append(seconds)
+        counts = self.outcomes.setdefault(operation, {})
+        counts[outcome] = counts.get(outcome, 0) + 1
+
+    def stop(self):
+        self.finished = time.perf_counter()
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.perf_counter()) - self.started
+
+
+async def scrape_metrics(client: httpx.AsyncClient, base_url: str) -> Dict[Tuple[str, str], float]:
+    """
+    Muestras de GET /metrics como {(nombre, labels): valor}
+
+    Las métricas son por proceso: con varios workers de uvicorn cada scrape
+    ve solo el que atendió el request.
+    """
+    try:
+        response = await client.get(f"{base_url}/metrics")
+        response.raise_for_status()
+    except httpx.HTTPError:
+        return {}
+
+    samples = {}
+    for line in response.text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        match = _SAMPLE_RE.match(line)
+        if match:
+            name, labels, value = match.groups()
+            samples[(name, labels or "")] = float(value.replace("+Inf", "inf"))
+    return samples
+
+
+def pool_wait_summary(before: Dict, after: Dict) -> Optional[Dict[str, float]]:
+    """Espera por conexiones del pool durante la corrida (diferencia entre scrapes)"""
+    count = after.get((f"{POOL_WAIT_METRIC}_count", ""), 0) - before.get((f"{POOL_WAIT_METRIC}_count", ""), 0)
+    if count <= 0:
+        return None
+    total = after.get((f"{POOL_WAIT_METRIC}_sum", ""), 0) - before.get((f"{POOL_WAIT_METRIC}_sum", ""), 0)
+
+    buckets = []
+    for (name, labels), value in after.items():
+        if name != f"{POOL_WAIT_METRIC}_bucket":
+            continue
+        bound = float(re.search(r'le="([^"]+)"', labels).group(1).replace("+Inf", "inf"))
+        buckets.append((bound, value - before.get((name, labels), 0)))
+    buckets.sort()
+
+    def quantile(q: float) -> float:
+        # Cota superior del bucket que contiene el cuantil
+        for bound, cumulative in buckets:
+            if cumulative >= q * count:
+                return bound
+        return math.inf
+
+    return {
+        "checkouts": count,
+        "mean_ms": total / count * 1000,
+        "p95_ms_le": quantile(0.95) * 1000,
+        "p99_ms_le": quantile(0.99) * 1000,
+    }
+
+
+def render_report(
+    scenario: str,
+    recorder: Recorder,
+    pool_wait: Optional[Dict[str, float]],
+    checks: List[Tuple[str, bool, str]]
+) -> str:
+    lines = [f"=== Escenario {scenario}: {recorder.elapsed:.1f}s ==="]
+    lines.append(
+        f"{'operación':<14}{'requests':>10}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  resultados"
+    )
+    for operation, latencies in sorted(recorder.latencies.items()):
+        outcomes = ", ".join(f"{k}={v}" for k, v in sorted(recorder.outcomes[operation].items()))
+        lines.append(
+            f"{operation:<14}{len(latencies):>10}{len(latencies) / recorder.elapsed:>10.1f}"
+            f"{percentile(latencies, 50) * 1000:>10.1f}{percentile(latencies, 95) * 1000:>10.1f}"
+            f"{percentile(latencies, 99) * 1000:>10.1f}  {outcomes}"
+        )
+
+    if pool_wait:
+        lines.append(
+            f"Pool DB: {pool_wait['checkouts']:.0f} checkouts, espera media {pool_wait['mean_ms']:.2f} ms, "
+            f"p95 <= {pool_wait['p95_ms_le']:.0f} ms, p99 <= {pool_wait['p99_ms_le']:.0f} ms"
+        )
+    else:
+        lines.append("Pool DB: sin datos (¿/metrics no disponible?)")
+
+    for name, ok, detail in checks:
+        lines.append(f"[{'OK' if ok else 'FALLA'}] {name}: {detail}")
+    return "\n".join(lines)
@@ -8,6 +8,8 @@ from contextlib import asynccontextmanager
 
 from shared.database.connection import init_db, close_db
 from shared.cache.redis_client import init_redis, close_redis
+from shared.utils.http_clients import init_http_clients, close_http_clients
+from services.ticket_purchase.services.order_status_hub import OrderStatusHub, check_order_token_secret
 from shared.utils.rate_limiter import limiter, rate_limit_exceeded_handler
 
 # Configurar logging
@@ -23,14 +25,18 @@ async def lifespan(app: FastAPI):
     """Lifecycle events de la aplicación"""
     # Startup
     logger.info("Iniciando aplicación...")
+    check_order_token_secret()
     await init_db()
     await init_redis()
+    await init_http_clients()
     logger.info("Aplicación iniciada")
     yield
     # Shutdown
     logger.info("Cerrando aplicación...")
     await close_db()
     await close_redis()
+    await close_http_clients()
+    await OrderStatusHub.close()
     logger.info("Aplicación cerrada")
 
 
@@ -76,6 +82,7 @@ app.add_exception_handler(RateLimitExceeded, rate_limit_exceeded_handler)
 # Incluir routers de cada servicio
 from services.ticket_validation.routes.validation import router as validation_router
 from services.ticket_purchase.routes.purchase import router as purchase_router
+from services.ticket_purchase.routes.admission import router as admission_router
 from services.ticket_purchase.routes.tickets import router as tickets_router
 from services.event_management.routes.events import router as events_router
 from services.notifications.routes.notifications import router as notifications_router
@@ -83,6 +90,7 @@ from services.admin.routes.admin import router as admin_router
 
 app.include_router(validation_router, prefix="/api/v1/tickets", tags=["tickets"])
 app.include_router(purchase_router, prefix="/api/v1/purchases", tags=["purchases"])
+app.include_router(admission_router, prefix="/api/v1/waiting-room", tags=["waiting-room"])
 app.include_router(tickets_router, prefix="/api/v1/tickets", tags=["tickets"])
 app.include_router(events_router, prefix="/api/v1/events", tags=["events"])
 app.include_router(notifications_router, prefix="/api/v1/notifications", tags=["notifications"])
@@ -116,6 +124,14 @@ async def ready():
         return {"status": "not ready", "error": str(e)}, 503
 
 
+@app.get("/metrics")
+async def metrics():
+    """Métricas del proceso en formato Prometheus (locks, etc.)"""
+    from fastapi.responses import PlainTextResponse
+    from shared.utils.metrics import render_latest
+    return PlainTextResponse(render_latest(), media_type="text/plain; version=0.0.4")
+
+
 @app.options("/{full_path:path}")
 async def options_handler(full_path: str):
     """Handler para requests OPTIONS (CORS preflight)"""
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Benchmark de los backends de inventario (redis vs database)
+
+Lanza N reservas concurrentes de 1 ticket contra un evento existente con cada
+backend, mide throughput y latencias, y al final libera todo lo reservado
+para dejar el evento como estaba.
+
+Uso:
+    python scripts/benchmark_inventory.py --event-id <uuid> --requests 2000 --concurrency 50
+"""
+import sys
+import os
+import time
+import asyncio
+import argparse
+import statistics
+
+# Agregar directorio raíz al path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.database import connection
+from shared.cache.redis_client import init_redis, close_redis
+from services.ticket_purchase.services import inventory_service
+from services.ticket_purchase.services.inventory_service import InventoryService
+from services.ticket_purchase.services.capacity_engine import CapacityEngine
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+async def run_backend(backend: str, event_id: str, requests: int, concurrency: int) -> dict:
+    """Ejecutar el benchmark con un backend"""
+    inventory_service.INVENTORY_BACKEND = backend
+
+    latencies = []
+    reserved = 0
+    rejected = 0
+    errors = 0
+    queue = asyncio.Queue()
+    for _ in range(requests):
+        queue.put_nowait(1)
+
+    async def worker():
+        nonlocal reserved, rejected, errors
+        async with connection.async_session_maker() as db:
+            while True:
+                try:
+                    quantity = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                start = time.perf_counter()
+                try:
+                    ok = await InventoryService.reserve_capacity(db, event_id, quantity, "benchmark")
+                    if ok:
+                        reserved += quantity
+                    else:
+                        rejected += 1
+                        await db.rollback()
+                except Exception as e:
+                    errors += 1
+                    await db.rollback()
+                    print(f"⚠️  [{backend}] Error: {e}")
+                latencies.append((time.perf_counter() - start) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+
+    # Devolver la capacidad reservada
+    async with connection.async_session_maker() as db:
+        if reserved:
+            await InventoryService.release_capacity(db, event_id, reserved, "benchmark_cleanup")
+        if backend == "redis":
+            await CapacityEngine.flush_event(db, event_id)
+
+    return {
+        "backend": backend,
+        "reserved": reserved,
+        "rejected": rejected,
+        "errors": errors,
+        "elapsed_s": elapsed,
+        "throughput": requests / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "mean_ms": statistics.mean(latencies) if latencies else 0.0,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark de backends de inventario")
+    parser.add_argument("--event-id", required=True, help="ID de un evento existente (de pruebas)")
+    parser.add_argument("--requests", type=int, default=1000, help="Cantidad de reservas por backend")
+    parser.add_argument("--concurrency", type=int, default=20, help="Reservas concurrentes")
+    parser.add_argument(
+        "--backends", default="redis,database",
+        help="Backends a comparar, separados por coma"
+    )
+    parser.add_argument("--shards", type=int, default=1, help="Shards de capacidad para el backend redis")
+    args = parser.parse_args()
+
+    await init_db_and_redis()
+
+    if args.shards > 1:
+        async with connection.async_session_maker() as db:
+            await CapacityEngine.set_shard_count(db, args.event_id, args.shards)
+
+    try:
+        results = []
+        for backend in args.backends.split(","):
+            backend = backend.strip()
+            print(f"\n▶ Backend '{backend}': {args.requests} reservas, concurrencia {args.concurrency}")
+            results.append(await run_backend(backend, args.event_id, args.requests, args.concurrency))
+
+        print("\nbackend    reservadas  rechazadas  errores  req/s     p50 ms   p95 ms   p99 ms")
+        for r in results:
+            print(
+                f"{r['backend']:<10} {r['reserved']:>10}  {r['rejected']:>10}  {r['errors']:>7}  "
+                f"{r['throughput']:>8.1f}  {r['p50_ms']:>7.2f}  {r['p95_ms']:>7.2f}  {r['p99_ms']:>7.2f}"
+            )
+    finally:
+        if args.shards > 1:
+            async with connection.async_session_maker() as db:
+                await CapacityEngine.set_shard_count(db, args.event_id, 1)
+        await connection.close_db()
+        await close_redis()
+
+
+async def init_db_and_redis():
+    await connection.init_db()
+    await init_redis()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
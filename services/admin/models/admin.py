@@ -1,5 +1,5 @@
 """Modelos Pydantic para administración"""
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 from typing import Optional, List, Dict
 from datetime import datetime
 
@@ -173,6 +173,50 @@ class AdminEventsListResponse(BaseModel):
     events: List[AdminEventResponse]
 
 
+class CapacityShardsRequest(BaseModel):
+    """Request para configurar el sharding de capacidad de un evento"""
+    shards: int = Field(..., ge=1, le=64)
+
+
+class CapacityShardsResponse(BaseModel):
+    """Configuración de sharding de capacidad de un evento"""
+    event_id: str
+    shards: int
+    capacity_available: Optional[int] = None
+
+
+class CapacityAuditResponse(BaseModel):
+    """Capacidad mantenida vs. capacidad esperada según las órdenes activas"""
+    event_id: str
+    capacity_total: int
+    capacity_available: int
+    reserved_seats: int
+    active_tickets: int
+    stray_tickets: int = 0
+    ledger_net: int = 0
+    expected_available: int
+    drift: int
+    recent_seats: int = 0  # Asientos de órdenes dentro de la ventana de hold
+    repairable: bool = False  # La reconciliación lo corrige sola (capacidad de más)
+    in_flight: bool = False  # Capacidad de menos con compras en curso
+
+
+class CapacityHistoryEntry(BaseModel):
+    """Movimientos de capacidad de una hora agrupados por motivo"""
+    bucket: datetime
+    reason: str
+    delta: int
+    entries: int
+
+
+class CapacityHistoryResponse(BaseModel):
+    """Historial de capacidad de un evento"""
+    event_id: str
+    since: datetime
+    until: datetime
+    history: List[CapacityHistoryEntry]
+
+
 # ==================== TICKETS ADMIN ====================
 
 class OrderUserInfo(BaseModel):
@@ -9,6 +9,7 @@ import json
 
 from shared.database.session import get_db
 from shared.auth.dependencies import get_current_admin, get_current_admin_or_coordinator
+from shared.utils.idempotency import IdempotentRoute, idempotent
 from services.admin.models.admin import (
     OrganizerResponse,
     ScannerResponse,
@@ -44,7 +45,11 @@ from services.admin.models.admin import (
     OrderResponse,
     TicketDetailResponse,
     CreateManualTicketsRequest,
-    CreateManualTicketsResponse
+    CreateManualTicketsResponse,
+    CapacityShardsRequest,
+    CapacityShardsResponse,
+    CapacityAuditResponse,
+    CapacityHistoryResponse
 )
 from services.admin.services.organizer_service import OrganizerService
 from services.admin.services.user_management_service import UserManagementService
@@ -53,6 +58,11 @@ from services.admin.services.admin_events_service import AdminEventsService
 from services.admin.services.tickets_admin_service import TicketsAdminService
 from services.admin.services.admin_orders_service import AdminOrdersService
 from services.admin.services.manual_tickets_service import ManualTicketsService
+from services.ticket_purchase.services.inventory_service import InventoryService
+from services.ticket_purchase.services.capacity_reconciliation_service import CapacityReconciliationService
+from services.ticket_purchase.services.capacity_ledger import CapacityLedger
+from services.ticket_purchase.services.admission_service import AdmissionService
+from services.ticket_purchase.models.admission import WaitingRoomConfigRequest, WaitingRoomConfigResponse
 from shared.database.models import (
     Ticket as TicketModel,
     TicketChildDetail as TicketChildDetailsModel,
@@ -62,7 +72,7 @@ from shared.database.models import (
 )
 
 
-router = APIRouter()
+router = APIRouter(route_class=IdempotentRoute)
 
 
 # ==================== ORGANIZER ====================
@@ -445,6 +455,127 @@ async def get_admin_events(
     return AdminEventsListResponse(events=admin_events)
 
 
+@router.put("/events/{event_id}/capacity-shards", response_model=CapacityShardsResponse)
+async def configure_capacity_shards(
+    event_id: str,
+    request: CapacityShardsRequest,
+    db: AsyncSession = Depends(get_db),
+    current_user: Dict = Depends(get_current_admin)
+):
+    """
+    Configurar el sharding de capacidad de un evento
+
+    Para lanzamientos masivos la capacidad se reparte en N sub-contadores
+    en Redis; shards=1 vuelve al contador único. El cambio aplica los
+    deltas pendientes y vuelve a sembrar los contadores desde la DB.
+
+    Requiere autenticación de admin
+    """
+    try:
+        shards, available = await InventoryService.configure_shards(db, event_id, request.shards)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+    return CapacityShardsResponse(
+        event_id=event_id,
+        shards=shards,
+        capacity_available=available
+    )
+
+
+@router.get("/events/{event_id}/capacity-audit", response_model=CapacityAuditResponse)
+async def audit_event_capacity(
+    event_id: str,
+    db: AsyncSession = Depends(get_db),
+    current_user: Dict = Depends(get_current_admin)
+):
+    """
+    Verificar la capacidad de un evento contra sus órdenes activas
+
+    Solo reporta: drift != 0 indica que capacity_available se desvió de
+    capacity_total - asientos reservados - tickets vigentes de órdenes
+    inactivas. La corrección en bloque la hace la tarea reconcile_capacity.
+
+    Requiere autenticación de admin
+    """
+    report = await CapacityReconciliationService.audit_event(db, event_id)
+    if not report:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Evento no encontrado"
+        )
+
+    return CapacityAuditResponse(**report)
+
+
+@router.get("/events/{event_id}/capacity-history", response_model=CapacityHistoryResponse)
+async def get_event_capacity_history(
+    event_id: str,
+    since: Optional[datetime] = Query(None, description="Desde (por defecto: 30 días antes de until)"),
+    until: Optional[datetime] = Query(None, description="Hasta (por defecto: ahora)"),
+    db: AsyncSession = Depends(get_db),
+    current_user: Dict = Depends(get_current_admin)
+):
+    """
+    Historial de capacidad de un evento por hora y motivo
+
+    Combina los agregados compactados (capacity_log_rollups) con las
+    entradas recientes de capacity_logs.
+
+    Requiere autenticación de admin
+    """
+    from datetime import timedelta, timezone
+
+    # Fechas sin zona horaria se interpretan como UTC
+    if until and until.tzinfo is None:
+        until = until.replace(tzinfo=timezone.utc)
+    if since and since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+
+    until = until or datetime.now(timezone.utc)
+    since = since or until - timedelta(days=30)
+    if since >= until:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="'since' debe ser anterior a 'until'"
+        )
+
+    history = await CapacityLedger.get_history(db, event_id, since, until)
+    return CapacityHistoryResponse(
+        event_id=event_id,
+        since=since,
+        until=until,
+        history=history
+    )
+
+
+@router.put("/events/{event_id}/waiting-room", response_model=WaitingRoomConfigResponse)
+async def configure_waiting_room(
+    event_id: str,
+    request: WaitingRoomConfigRequest,
+    current_user: Dict = Depends(get_current_admin)
+):
+    """
+    Activar o desactivar la sala de espera de compras de un evento
+
+    Con la sala activa, POST /api/v1/purchases exige un admission token
+    obtenido en /api/v1/waiting-room. `max_rate` limita las compras
+    admitidas por segundo (además del ajuste por latencia medida).
+
+    Requiere autenticación de admin
+    """
+    config = await AdmissionService.set_config(event_id, request.enabled, request.max_rate)
+
+    return WaitingRoomConfigResponse(
+        event_id=event_id,
+        enabled=config["enabled"],
+        max_rate=config["max_rate"]
+    )
+
+
 # ==================== TICKETS ====================
 
 @router.get("/events/{event_id}/tickets", response_model=AdminTicketsListResponse)
@@ -859,6 +990,7 @@ async def get_order_detail(
 
 
 @router.post("/orders/{order_id}/confirm", response_model=OrderResponse)
+@idempotent()
 async def confirm_order(
     order_id: str,
     db: AsyncSession = Depends(get_db),
@@ -953,6 +1085,7 @@ async def confirm_order(
 # ==================== MANUAL TICKETS ====================
 
 @router.post("/manual-tickets", response_model=CreateManualTicketsResponse, status_code=status.HTTP_201_CREATED)
+@idempotent()
 async def create_manual_tickets(
     request: CreateManualTicketsRequest,
     db: AsyncSession = Depends(get_db),
@@ -1,16 +1,16 @@
 """Servicio para crear tickets manualmente (admin)"""
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, insert
 from typing import Dict, Optional
 from datetime import datetime
 import uuid
 
 from shared.database.models import (
-    Order, OrderItem, Ticket, Event, TicketType, EventService,
+    Order, OrderItem, Event, TicketType, EventService,
     OrderServiceItem, OrderCommission
 )
 from services.ticket_purchase.services.inventory_service import InventoryService
-from shared.utils.qr_generator import generate_qr_signature
+from services.ticket_purchase.services.ticket_issuance_service import TicketIssuanceService
 
 
 class ManualTicketsService:
@@ -73,6 +73,8 @@ class ManualTicketsService:
 
         # Calcular precios de servicios adicionales
         services_subtotal = 0.0
+        event_services = []
+        selected_services: Dict[str, int] = {}
         if services:
             service_ids = [uuid.UUID(s["service_id"]) for s in services if s.get("quantity", 0) > 0]
             
@@ -89,6 +91,7 @@ class ManualTicketsService:
                     if service_request:
                         service_quantity = service_request.get("quantity", 0)
                         if service_quantity > 0:
+                            selected_services[str(service.id)] = service_quantity
                             services_subtotal += float(service.price) * service_quantity
 
         # Calcular comisiones (1500 CLP por ticket)
@@ -117,14 +120,14 @@ class ManualTicketsService:
         db.add(order)
         await db.flush()
 
-        # Reservar capacidad
-        reserved = await self.inventory_service.reserve_capacity(
-            db, event_id, quantity, f"manual_order_{order.id}"
+        # Reservar capacidad y stock de servicios (todo o nada)
+        reserved, reserve_message = await self.inventory_service.reserve_order(
+            db, event_id, quantity, selected_services, f"manual_order_{order.id}"
         )
 
         if not reserved:
             await db.rollback()
-            raise ValueError("No se pudo reservar capacidad")
+            raise ValueError(reserve_message)
 
         try:
             # Crear order item para tickets
@@ -141,78 +144,63 @@ class ManualTicketsService:
             await db.flush()
 
             # Crear order service items para servicios adicionales
-            if services:
-                for service_request in services:
-                    if service_request.get("quantity", 0) > 0:
-                        service_id = uuid.UUID(service_request["service_id"])
-                        
-                        # Obtener el servicio
-                        stmt_service = select(EventService).where(EventService.id == service_id)
-                        result_service = await db.execute(stmt_service)
-                        service = result_service.scalar_one_or_none()
-                        
-                        if service:
-                            service_quantity = service_request["quantity"]
-                            service_item = OrderServiceItem(
-                                id=uuid.uuid4(),
-                                order_id=order.id,
-                                event_id=event_id,
-                                service_id=service.id,
-                                quantity=service_quantity,
-                                unit_price=service.price,
-                                final_price=float(service.price) * service_quantity
-                            )
-                            db.add(service_item)
+            for service in event_services:
+                service_quantity = selected_services.get(str(service.id))
+                if service_quantity:
+                    service_item = OrderServiceItem(
+                        id=uuid.uuid4(),
+                        order_id=order.id,
+                        event_id=event_id,
+                        service_id=service.id,
+                        quantity=service_quantity,
+                        unit_price=service.price,
+                        final_price=float(service.price) * service_quantity
+                    )
+                    db.add(service_item)
 
             await db.flush()
 
-            # Crear tickets con estado "issued"
-            tickets_created = []
-            for i in range(quantity):
-                ticket_id = uuid.uuid4()
-                qr_signature = generate_qr_signature(str(ticket_id))
-
-                ticket = Ticket(
-                    id=ticket_id,
+            # Crear tickets con estado "issued" (un INSERT multi-fila / COPY)
+            ticket_rows = [
+                TicketIssuanceService.build_ticket_row(
                     order_item_id=order_item.id,
                     event_id=event_id,
-                    holder_first_name=buyer["first_name"],
-                    holder_last_name=buyer.get("last_name", ""),
-                    holder_email=buyer.get("email", "").lower().strip() if buyer.get("email") else None,
-                    holder_document_type=buyer.get("document_type") or "RUT",  # Por defecto RUT
-                    holder_document_number=buyer.get("document_number") or None,
+                    first_name=buyer["first_name"],
+                    last_name=buyer.get("last_name", ""),
+                    email=buyer.get("email"),
+                    document_type=buyer.get("document_type") or "RUT",  # Por defecto RUT
+                    document_number=buyer.get("document_number") or None,
                     is_child=False,  # Por ahora solo adultos
-                    qr_signature=qr_signature,
-                    status="issued",  # Ya emitidos
-                    issued_at=datetime.utcnow()
-                )
-                db.add(ticket)
-                await db.flush()
-
-                # Crear registro de comisión
-                commission = OrderCommission(
-                    id=uuid.uuid4(),
-                    order_id=order.id,
-                    ticket_id=ticket.id,
-                    ticket_type="adult",
-                    commission_amount=COMMISSION_PER_TICKET
+                    status="issued"  # Ya emitidos
                 )
-                db.add(commission)
-
-                tickets_created.append(ticket)
+                for _ in range(quantity)
+            ]
+            await TicketIssuanceService.insert_tickets(db, ticket_rows, return_tickets=False)
+
+            # Crear registros de comisión
+            await db.execute(insert(OrderCommission), [
+                {
+                    "id": uuid.uuid4(),
+                    "order_id": order.id,
+                    "ticket_id": ticket_row["id"],
+                    "ticket_type": "adult",
+                    "commission_amount": COMMISSION_PER_TICKET,
+                }
+                for ticket_row in ticket_rows
+            ])
 
             await db.commit()
             await db.refresh(order)
 
             return {
                 "order_id": str(order.id),
-                "tickets_created": len(tickets_created)
+                "tickets_created": len(ticket_rows)
             }
 
         except Exception as e:
             # Si algo falla, liberar capacidad y hacer rollback
-            await self.inventory_service.release_capacity(
-                db, event_id, quantity, "manual_ticket_creation_failed"
+            await self.inventory_service.release_order(
+                db, event_id, quantity, selected_services, "manual_ticket_creation_failed"
             )
             await db.rollback()
             raise ValueError(f"Error al crear tickets: {str(e)}")
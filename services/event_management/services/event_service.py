@@ -7,6 +7,8 @@ from datetime import datetime, timezone
 from uuid import UUID
 from shared.database.models import Event, Organizer, TicketType
 from shared.cache.redis_client import cache_get, cache_set, cache_delete, get_redis
+from services.ticket_purchase.services.inventory_service import InventoryService
+from services.ticket_purchase.services.purchase_context_cache import PurchaseContextCache
 
 
 class EventService:
@@ -267,6 +269,8 @@ class EventService:
 
             await db.commit()
 
+        # Un contexto de compra leído entre los commits anteriores quedaría incompleto
+        await PurchaseContextCache.invalidate(event.id)
 
         return event
 
@@ -317,6 +321,13 @@ class EventService:
             # TODO: Verificar si el usuario es admin
             raise ValueError("No tienes permisos para editar este evento")
 
+        capacity_changed = "capacity_total" in event_data or "capacity_available" in event_data
+        removed_service_ids = []
+        if capacity_changed:
+            # Aplicar reservas pendientes de Redis antes de recalcular la capacidad
+            await InventoryService.flush_pending(db, event_id)
+            await db.refresh(event)
+
         # Actualizar campos
         if "name" in event_data:
             event.name = event_data["name"]
@@ -378,8 +389,11 @@ class EventService:
         if "services" in event_data:
             from shared.database.models import EventService as EventServiceModel            # Eliminar servicios existentes
             from sqlalchemy import delete as sql_delete
-            delete_stmt = sql_delete(EventServiceModel).where(EventServiceModel.event_id == event_id)
-            await db.execute(delete_stmt)
+            delete_stmt = sql_delete(EventServiceModel).where(
+                EventServiceModel.event_id == event_id
+            ).returning(EventServiceModel.id)
+            result_deleted = await db.execute(delete_stmt)
+            removed_service_ids = [str(service_id) for service_id in result_deleted.scalars().all()]
             await db.flush()  # ✅ Aplicar eliminaciones inmediatamente
 
             # Crear nuevos servicios
@@ -402,6 +416,14 @@ class EventService:
         await db.commit()
         await db.refresh(event)
 
+        if capacity_changed or removed_service_ids:
+            # Los contadores se vuelven a sembrar desde la nueva capacidad y
+            # se descarta el stock de los servicios reemplazados
+            await InventoryService.invalidate_counters(db, event_id, removed_service_ids)
+
+        # Nombre, precios y servicios pueden haber cambiado
+        await PurchaseContextCache.invalidate(event_id)
+
         # Invalidar cache
         await EventService._invalidate_events_cache()
 
@@ -438,12 +460,24 @@ class EventService:
             # TODO: Verificar si el usuario es admin
             raise ValueError("No tienes permisos para eliminar este evento")
 
+        # Aplicar reservas pendientes de Redis antes de verificar
+        await InventoryService.flush_pending(db, event_id)
+        await db.refresh(event)
+
         # Verificar que no haya tickets vendidos
         if event.capacity_available < event.capacity_total:
             raise ValueError("No se puede eliminar un evento con tickets vendidos")
 
+        from shared.database.models import EventService as EventServiceModel
+        result_services = await db.execute(
+            select(EventServiceModel.id).where(EventServiceModel.event_id == event_id)
+        )
+        removed_service_ids = [str(service_id) for service_id in result_services.scalars().all()]
+
         await db.delete(event)
         await db.commit()
+        await InventoryService.invalidate_counters(db, event_id, removed_service_ids)
+        await PurchaseContextCache.invalidate(event_id)
 
         # Invalidar cache
         await EventService._invalidate_events_cache()
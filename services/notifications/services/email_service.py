@@ -4,12 +4,14 @@ import logging
 from typing import Optional, List, Union
 import base64
 import io
-import resend
 import qrcode
 from app.core.config import settings
+from shared.utils.http_clients import get_http_client
 
 logger = logging.getLogger(__name__)
 
+RESEND_API_URL = os.getenv("RESEND_API_URL", "https://api.resend.com/emails")
+
 
 class EmailService:
     """Servicio para enviar emails usando Resend (desarrollo y producción)"""
@@ -22,8 +24,6 @@ class EmailService:
             logger.warning("RESEND_API_KEY no configurado. Los emails no se enviarán.")
             self.resend_configured = False
         else:
-            # Configurar API key de Resend
-            resend.api_key = self.resend_api_key
             self.resend_configured = True
             logger.info(f"EmailService (Resend) inicializado con from: {self.from_email}")
 
@@ -148,24 +148,22 @@ class EmailService:
             if resend_attachments:
                 params["attachments"] = resend_attachments
 
-            # Enviar email usando Resend
-            # Resend SDK es síncrono, pero podemos ejecutarlo en un thread pool
-            import asyncio
-            loop = asyncio.get_event_loop()
-
-            # Usar la API correcta de Resend
-            def send_email_sync():
-                try:
-                    return resend.Emails.send(params)
-                except Exception as e:
-                    logger.error(f"Error en Resend SDK: {e}")
-                    return {"error": str(e)}
+            # Enviar email con la API REST de Resend sobre el cliente HTTP compartido
+            # (el SDK es síncrono y abría una conexión por email en un thread pool)
+            response = await get_http_client("resend").post(
+                RESEND_API_URL,
+                json=params,
+                headers={"Authorization": f"Bearer {self.resend_api_key}"}
+            )
 
-            result = await loop.run_in_executor(None, send_email_sync)
+            try:
+                result = response.json()
+            except ValueError:
+                result = {}
 
-            if result.get("error"):
-                error_msg = result.get("error", "Unknown error")
-                logger.error(f"Error enviando email a {to_emails}: {error_msg}")
+            if response.status_code >= 400:
+                error_msg = result.get("message") or response.text or "Unknown error"
+                logger.error(f"Error enviando email a {to_emails}: {response.status_code} - {error_msg}")
                 return False
 
             logger.info(f"Email enviado exitosamente a {to_emails}: {subject} (ID: {result.get('id', 'N/A')})")
@@ -0,0 +1,27 @@
+"""Modelos Pydantic para la sala de espera de compras"""
+from pydantic import BaseModel, Field
+from typing import Optional
+
+
+class WaitingRoomStatusResponse(BaseModel):
+    """Estado de un turno en la sala de espera"""
+    enabled: bool  # False si el evento no tiene sala de espera (se compra directo)
+    admitted: bool
+    position: Optional[int] = None  # Personas delante en la fila
+    eta_seconds: Optional[int] = None  # Tiempo estimado hasta ser admitido
+    admit_rate: Optional[float] = None  # Compras admitidas por segundo
+    queue_token: Optional[str] = None  # Solo al entrar a la fila; usar para consultar el estado
+    admission_token: Optional[str] = None  # Enviar en X-Admission-Token al comprar
+
+
+class WaitingRoomConfigRequest(BaseModel):
+    """Request para configurar la sala de espera de un evento"""
+    enabled: bool
+    max_rate: Optional[float] = Field(None, gt=0)  # Tope de compras/segundo (opcional)
+
+
+class WaitingRoomConfigResponse(BaseModel):
+    """Configuración de la sala de espera de un evento"""
+    event_id: str
+    enabled: bool
+    max_rate: Optional[float] = None
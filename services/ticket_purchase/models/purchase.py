@@ -39,6 +39,7 @@ class PurchaseResponse(BaseModel):
     preference_id: Optional[str] = None  # ID de preferencia para usar con Payment Brick
     status: str  # pending, completed, failed
     payment_method: Optional[str] = None  # 'mercadopago' | 'bank_transfer'
+    order_token: Optional[str] = None  # Acceso al canal de estado de la orden sin Authorization
 
 
 class ServiceItemResponse(BaseModel):
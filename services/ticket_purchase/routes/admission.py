@@ -0,0 +1,55 @@
+"""Rutas de la sala de espera (admission control) de compras"""
+from fastapi import APIRouter, HTTPException, status, Request, Header
+from typing import Optional
+from shared.utils.rate_limiter import limiter, RATE_LIMITS
+from services.ticket_purchase.models.admission import WaitingRoomStatusResponse
+from services.ticket_purchase.services.admission_service import AdmissionService
+
+
+router = APIRouter()
+
+
+@router.post("/{event_id}/join", response_model=WaitingRoomStatusResponse)
+@limiter.limit(RATE_LIMITS["purchase"])
+async def join_waiting_room(
+    request: Request,  # Necesario para rate limiter
+    event_id: str
+):
+    """
+    Entrar a la fila de compra de un evento
+
+    Si el evento no tiene sala de espera activa responde `enabled: false`
+    y el frontend puede comprar directamente.
+
+    Devuelve un `queue_token` para consultar la posición en
+    GET /{event_id}/status.
+    """
+    return WaitingRoomStatusResponse(**await AdmissionService.join(event_id))
+
+
+@router.get("/{event_id}/status", response_model=WaitingRoomStatusResponse)
+async def get_waiting_room_status(
+    event_id: str,
+    x_queue_token: Optional[str] = Header(None, alias="X-Queue-Token")
+):
+    """
+    Posición y tiempo estimado de un turno
+
+    Endpoint liviano pensado para polling (solo Redis, sin DB). Cuando el
+    turno es admitido incluye el `admission_token` para POST /api/v1/purchases.
+    """
+    if not x_queue_token:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Falta el header X-Queue-Token"
+        )
+
+    try:
+        result = await AdmissionService.get_status(event_id, x_queue_token)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+    return WaitingRoomStatusResponse(**result)
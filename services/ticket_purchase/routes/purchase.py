@@ -1,29 +1,49 @@
 """Rutas de compra de tickets"""
-from datetime import datetime
-from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Query
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-from sqlalchemy.sql import func
 from typing import Dict, Optional
+import asyncio
+import json
 import logging
+import os
+import time
 from shared.database.session import get_db
 from shared.database.models import Order, Event
 from shared.auth.dependencies import get_current_user, get_optional_user
 from shared.utils.rate_limiter import limiter, RATE_LIMITS
+from shared.utils.idempotency import IdempotentRoute, idempotent
 from services.ticket_purchase.models.purchase import (
     PurchaseRequest,
     PurchaseResponse,
     OrderStatusResponse
 )
 from services.ticket_purchase.services.purchase_service import PurchaseService
+from services.ticket_purchase.services.mercado_pago_service import MERCADOPAGO_CANCEL_STATUSES
+from services.ticket_purchase.services.admission_service import AdmissionService
+from services.ticket_purchase.services.webhook_ingestion_service import WebhookIngestionService
+from services.ticket_purchase.services.order_status_hub import (
+    OrderStatusHub, is_final, progress, order_token, verify_order_token
+)
 
 logger = logging.getLogger(__name__)
 
-router = APIRouter()
+router = APIRouter(route_class=IdempotentRoute)
+
+# Duración máxima de un stream SSE de estado (el cliente reconecta) y cada
+# cuántos segundos se envía un heartbeat
+ORDER_STATUS_STREAM_SECONDS = int(os.getenv("ORDER_STATUS_STREAM_SECONDS", "300"))
+ORDER_STATUS_HEARTBEAT_SECONDS = int(os.getenv("ORDER_STATUS_HEARTBEAT_SECONDS", "15"))
+
+# Aceptación asíncrona de compras (202 + order token) para todas las compras
+# online; con false cada cliente puede pedirla con `Prefer: respond-async`
+PURCHASE_ASYNC_ACCEPTANCE = os.getenv("PURCHASE_ASYNC_ACCEPTANCE", "false").lower() == "true"
 
 
 @router.post("", response_model=PurchaseResponse)
 @limiter.limit(RATE_LIMITS["purchase"])  # 10 intentos por minuto por IP
+@idempotent()
 async def create_purchase(
     request: Request,  # Necesario para rate limiter
     purchase_request: PurchaseRequest,
@@ -37,6 +57,11 @@ async def create_purchase(
 
     NOTA: user_id es opcional ahora. Si se proporciona sin autenticación, se ignora y la compra es anónima.
     Si se proporciona con autenticación, debe coincidir con el usuario autenticado.
+
+    Aceptación asíncrona (PURCHASE_ASYNC_ACCEPTANCE o header `Prefer: respond-async`):
+    responde 202 apenas la orden queda reservada y guardada, sin esperar al
+    proveedor de pago. El payment_link llega por /{order_id}/events o
+    /{order_id}/wait (usando el order_token de la respuesta).
     """
     import logging
     logger = logging.getLogger(__name__)
@@ -79,20 +104,62 @@ async def create_purchase(
         # Si hay error, ignorar user_id y continuar como compra anónima
         purchase_request.user_id = None
 
+    # Sala de espera: si el evento la tiene activa, exigir admission token
+    try:
+        admission = await AdmissionService.verify_admission(
+            purchase_request.event_id,
+            request.headers.get("X-Admission-Token")
+        )
+    except PermissionError as e:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=str(e)
+        )
+    except Exception as e:
+        # Si Redis no responde, no bloquear las compras
+        logger.warning(f"No se pudo verificar la sala de espera: {e}")
+        admission = None
+
     service = PurchaseService()
 
     try:
-        result = await service.create_purchase(db, purchase_request)
+        started = time.perf_counter()
+        accept_async = PURCHASE_ASYNC_ACCEPTANCE or "respond-async" in request.headers.get("Prefer", "").lower()
+        result = await service.create_purchase(db, purchase_request, accept_async=accept_async)
+        await AdmissionService.record_purchase_latency(time.perf_counter() - started)
+        try:
+            await AdmissionService.consume_admission(purchase_request.event_id, admission)
+        except Exception as e:
+            # La compra ya está confirmada: el turno sigue reservado hasta que vence
+            logger.warning(f"No se pudo marcar el admission token como usado: {e}")
+        admission = None  # Ya no se devuelve aunque algo falle después
+        result["order_token"] = order_token(result["order_id"])
+
+        if result.pop("accepted", False):
+            base_path = request.url.path.rstrip("/")
+            order_path = f"{base_path}/{result['order_id']}"
+            return JSONResponse(
+                status_code=status.HTTP_202_ACCEPTED,
+                content={
+                    **PurchaseResponse(**result).model_dump(),
+                    "events_url": f"{order_path}/events?token={result['order_token']}",
+                    "wait_url": f"{order_path}/wait?token={result['order_token']}",
+                },
+                headers={"Location": f"{order_path}/status", "Preference-Applied": "respond-async"}
+            )
+
         response = PurchaseResponse(**result)
         return response
     except ValueError as e:
         logger.error(f"ValueError en create_purchase: {str(e)}", exc_info=True)
+        await AdmissionService.release_admission(purchase_request.event_id, admission)
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=str(e)
         )
     except Exception as e:
         logger.error(f"Exception en create_purchase: {str(e)}", exc_info=True)
+        await AdmissionService.release_admission(purchase_request.event_id, admission)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error procesando compra: {str(e)}"
@@ -108,7 +175,9 @@ async def mercado_pago_webhook(
     """
     Webhook para recibir notificaciones de Mercado Pago
 
-    No requiere autenticación (Mercado Pago valida la firma)
+    No requiere autenticación (Mercado Pago valida la firma). La notificación
+    se guarda en el stream de webhooks y se procesa en webhook_consumer; si
+    Redis no está disponible se procesa en línea.
     """
     service = PurchaseService()
 
@@ -123,8 +192,6 @@ async def mercado_pago_webhook(
         # Obtener body
         data = await request.json()
 
-        import logging
-        logger = logging.getLogger(__name__)
         logger.info(f"Webhook recibido - x-signature: {signature is not None}, x-request-id: {request_id}")
 
         # Verificar firma del webhook
@@ -140,7 +207,12 @@ async def mercado_pago_webhook(
             logger.warning("Webhook con firma inválida, pero procesando de todas formas (modo desarrollo)")
             # En producción, podrías retornar 401 aquí
 
-        # Procesar webhook
+        # Persistir la notificación y responder de inmediato
+        message_id = await WebhookIngestionService.ingest("mercadopago", data, signature_valid=is_valid)
+        if message_id:
+            return {"status": "queued", "message_id": message_id}
+
+        # Procesar webhook en línea (ingestión asíncrona desactivada o Redis caído)
         success = await service.process_payment_webhook(db, data)
         logger.info(f"Webhook procesado - resultado: {success}")
 
@@ -150,8 +222,6 @@ async def mercado_pago_webhook(
             return {"status": "ignored"}
     except Exception as e:
         # Log error pero retornar 200 para que Mercado Pago no reintente inmediatamente
-        import logging
-        logger = logging.getLogger(__name__)
         logger.error(f"Error procesando webhook: {e}", exc_info=True)
         return {"status": "error", "message": str(e)}
 
@@ -165,7 +235,8 @@ async def payku_webhook(
     """
     Webhook para recibir notificaciones de Payku
 
-    No requiere autenticación (Payku valida la firma)
+    No requiere autenticación (Payku valida la firma). Igual que el de
+    Mercado Pago, se encola en el stream de webhooks.
     """
     service = PurchaseService()
 
@@ -173,153 +244,15 @@ async def payku_webhook(
         # Obtener body
         data = await request.json()
 
-        import logging
-        logger = logging.getLogger(__name__)
         logger.info("Webhook Payku recibido")
 
-        # Procesar webhook de Payku
-        payku_service = service.payku_service
-        webhook_info = payku_service.process_webhook(data)
-
-        # Obtener order_id del webhook
-        order_id = webhook_info.get("order_id")
-        if not order_id:
-            logger.warning("No se encontró order_id en el webhook Payku")
-            return {"status": "ignored", "message": "No order_id found"}
+        # Persistir la notificación y responder de inmediato
+        message_id = await WebhookIngestionService.ingest("payku", data)
+        if message_id:
+            return {"status": "queued", "message_id": message_id}
 
-        # Buscar orden
-        from sqlalchemy import select
-        from shared.database.models import Order
-        stmt = select(Order).where(Order.id == order_id)
-        result = await db.execute(stmt)
-        order = result.scalar_one_or_none()
-
-        if not order:
-            print(f"⚠️  [WEBHOOK PAYKU] Orden {order_id} no encontrada")
-            return {"status": "ignored", "message": f"Order {order_id} not found"}
-
-        # Actualizar estado según el webhook
-        status = webhook_info.get("status")
-        print(f"🔔 [WEBHOOK PAYKU] Estado recibido: {status}")
-
-        if status == "approved":
-            # CRÍTICO: Capturar valores ANTES de cualquier operación que pueda causar rollback
-            order_id_str = str(order.id)
-            idempotency_key_str = str(order.idempotency_key) if order.idempotency_key else None
-
-            print(f"✅ [WEBHOOK PAYKU] Pago aprobado! Actualizando orden {order_id_str} a 'completed'")
-            order.status = "completed"
-            order.paid_at = datetime.utcnow()
-            await db.flush()
-
-            # Intentar recuperar attendees - PRIORIDAD 1: desde la base de datos (más confiable)
-            attendees_data = None
-            if order.attendees_data:
-                attendees_data = order.attendees_data
-                print(f"🔍 [WEBHOOK PAYKU] ✅ Attendees recuperados de la base de datos: {len(attendees_data)}")
-
-            # PRIORIDAD 2: Si no están en BD, intentar desde cache
-            if not attendees_data and idempotency_key_str:
-                from shared.cache.redis_client import cache_get
-                attendees_cache_key = f"purchase:attendees:{idempotency_key_str}"
-                attendees_data = await cache_get(attendees_cache_key)
-                print(f"🔍 [WEBHOOK PAYKU] Buscando attendees en cache: {attendees_cache_key}")
-                print(f"🔍 [WEBHOOK PAYKU] Attendees encontrados: {attendees_data is not None}")
-                if attendees_data:
-                    print(f"🔍 [WEBHOOK PAYKU] ✅ Attendees recuperados del cache: {len(attendees_data)}")
-                    # Guardar en BD para futuras referencias
-                    order.attendees_data = attendees_data
-                    await db.flush()
-
-            # OPTIMIZACIÓN: Generar tickets en background (no bloquea respuesta del webhook)
-            # CRÍTICO: Los tickets SIEMPRE deben crearse con los datos del formulario
-            try:
-                if attendees_data:
-                    # Generar tickets de forma asíncrona en background
-                    from asyncio import create_task
-                    create_task(
-                        service._generate_tickets_background(
-                            order_id_str,
-                            attendees_data
-                        )
-                    )
-                    print(f"🚀 [WEBHOOK PAYKU] Iniciando generación de tickets en background para orden {order_id_str}")
-                    # Responder inmediatamente sin esperar generación de tickets
-                    await db.commit()
-                    await db.refresh(order)
-                    print(f"✅ [WEBHOOK PAYKU] Orden actualizada, tickets se generarán en background")
-                else:
-                    # Si no hay attendees, esto es un error crítico - NO crear tickets genéricos
-                    raise ValueError(
-                        f"❌ ERROR CRÍTICO: No se encontraron datos de attendees para orden {order_id_str}. "
-                        f"Los tickets NO pueden crearse sin los datos del formulario. "
-                        f"Idempotency key: {idempotency_key_str}. "
-                        f"La orden quedará marcada como 'completed' pero SIN TICKETS. "
-                        f"Se requiere intervención manual para generar los tickets con los datos correctos."
-                    )
-            except ValueError as e:
-                # Si falla por falta de attendees, esto es un error crítico
-                await db.rollback()
-                import traceback
-                print(f"❌ [WEBHOOK PAYKU] ERROR CRÍTICO: No se encontraron datos de attendees para orden {order_id_str}")
-                print(f"❌ [WEBHOOK PAYKU] Error: {str(e)}")
-                print(f"❌ [WEBHOOK PAYKU] Idempotency key: {idempotency_key_str}")
-                print(f"❌ [WEBHOOK PAYKU] Traceback: {traceback.format_exc()}")
-                # Marcar orden como paid pero sin tickets - requiere intervención manual
-                # Usar order_id_str en lugar de order.id para evitar MissingGreenlet
-                try:
-                    # select ya está importado al inicio del archivo, no importar nuevamente
-                    from shared.database.models import Order
-                    stmt = select(Order).where(Order.id == order_id_str)
-                    result = await db.execute(stmt)
-                    order_for_update = result.scalar_one_or_none()
-                    if order_for_update:
-                        order_for_update.status = "completed"
-                        await db.commit()
-                except Exception as commit_error:
-                    print(f"❌ [WEBHOOK PAYKU] Error crítico al hacer commit: {str(commit_error)}")
-                    await db.rollback()
-                print(f"⚠️  [WEBHOOK PAYKU] Orden {order_id_str} marcada como completed SIN TICKETS.")
-                print(f"⚠️  [WEBHOOK PAYKU] REQUIERE GENERACIÓN MANUAL DE TICKETS.")
-            except Exception as e:
-                await db.rollback()
-                # Log error pero no fallar el webhook
-                import traceback
-                print(f"❌ [WEBHOOK PAYKU] Error generando tickets para orden {order_id_str}: {str(e)}")
-                print(f"❌ [WEBHOOK PAYKU] Traceback: {traceback.format_exc()}")
-                # Marcar orden como paid aunque falle la generación de tickets
-                try:
-                    # select ya está importado al inicio del archivo, no importar nuevamente
-                    from shared.database.models import Order
-                    stmt = select(Order).where(Order.id == order_id_str)
-                    result = await db.execute(stmt)
-                    order_for_update = result.scalar_one_or_none()
-                    if order_for_update:
-                        order_for_update.status = "completed"
-                        await db.commit()
-                except Exception as commit_error:
-                    print(f"❌ [WEBHOOK PAYKU] Error crítico al hacer commit: {str(commit_error)}")
-                    await db.rollback()
-                print(f"⚠️  [WEBHOOK PAYKU] Orden {order_id_str} marcada como completed sin tickets. Se pueden generar manualmente.")
-
-            return {"status": "ok", "message": "Payment approved and tickets generated"}
-
-        elif status in ["rejected", "cancelled"]:
-            print(f"❌ [WEBHOOK PAYKU] Pago rechazado/cancelado. Actualizando orden {order.id} a 'cancelled'")
-            order.status = "cancelled"
-            await db.commit()
-
-            # Liberar capacidad
-            for order_item in order.order_items:
-                await service.inventory_service.release_capacity(
-                    db, str(order_item.event_id), order_item.quantity, "payment_failed"
-                )
-
-            return {"status": "ok", "message": "Payment cancelled"}
-
-        # Si el estado es "pending", el webhook se recibió pero el pago aún no está aprobado
-        print(f"⏳ [WEBHOOK PAYKU] Estado '{status}' - El pago aún está pendiente.")
-        return {"status": "ignored", "message": f"Payment still {status}"}
+        # Procesar webhook en línea (ingestión asíncrona desactivada o Redis caído)
+        return await service.process_payku_webhook(db, data)
 
     except Exception as e:
         # Log error pero retornar 200 para que Payku no reintente inmediatamente
@@ -373,86 +306,15 @@ async def verify_payku_payment(
 
         # Mapear estados de Payku
         if status in ["success", "approved", "completado", "completed"]:
-            # Pago exitoso - actualizar orden
-            if order.status != "completed":
-                order.status = "completed"
-                order.paid_at = datetime.utcnow()
-                await db.flush()
-
-                # Intentar recuperar attendees del cache
-                attendees_data = None
-                if order.idempotency_key:
-                    from shared.cache.redis_client import cache_get
-                    attendees_cache_key = f"purchase:attendees:{order.idempotency_key}"
-                    attendees_data = await cache_get(attendees_cache_key)
-                    print(f"🔍 [VERIFY PAYKU] Attendees del cache: {attendees_data}")
-
-                # Si no hay attendees en cache, intentar obtenerlos de otra forma
-                # Por ahora, generar tickets sin attendees (usará valores por defecto)
-                if not attendees_data:
-                    print(f"⚠️  [VERIFY PAYKU] No se encontraron attendees en cache. Intentando generar tickets sin datos específicos...")
-                    # Intentar generar tickets sin attendees_data - el método debería manejar esto
-                    try:
-                        await service._generate_tickets(db, order, ticket_status="issued")
-                    except ValueError as e:
-                        # Si falla por falta de attendees, crear tickets básicos
-                        print(f"⚠️  [VERIFY PAYKU] Error generando tickets: {e}")
-                        print(f"⚠️  [VERIFY PAYKU] Creando tickets básicos sin datos de attendees...")
-                        # Crear tickets básicos usando los order_items
-                        from shared.database.models import OrderItem, Ticket, TicketType
-                        from shared.utils.qr_generator import generate_qr_signature
-                        import uuid
-
-                        stmt_items = select(OrderItem).where(OrderItem.order_id == order.id)
-                        result_items = await db.execute(stmt_items)
-                        order_items = result_items.scalars().all()
-
-                        for order_item in order_items:
-                            # Obtener tipo de ticket
-                            stmt_type = select(TicketType).where(TicketType.id == order_item.ticket_type_id)
-                            result_type = await db.execute(stmt_type)
-                            ticket_type = result_type.scalar_one_or_none()
-
-                            if not ticket_type:
-                                continue
-
-                            # Crear tickets básicos
-                            for i in range(order_item.quantity):
-                                ticket_id = uuid.uuid4()
-                                qr_signature = generate_qr_signature(str(ticket_id))
-                                ticket = Ticket(
-                                    id=ticket_id,
-                                    order_item_id=order_item.id,
-                                    event_id=order_item.event_id,
-                                    holder_first_name="Asistente",
-                                    holder_last_name=f"#{i+1}",
-                                    holder_email=None,
-                                    is_child=ticket_type.is_child or False,
-                                    qr_signature=qr_signature,
-                                    status="issued",
-                                    issued_at=datetime.utcnow()
-                                )
-                                db.add(ticket)
-
-                        await db.flush()
-                        print(f"✅ [VERIFY PAYKU] Tickets básicos creados exitosamente")
-
-                await db.commit()
-
-                return {"status": "ok", "message": "Pago verificado y tickets generados", "order_status": "completed"}
-            else:
-                return {"status": "ok", "message": "Pago ya estaba completado", "order_status": "completed"}
+            # Pago exitoso: mismo camino que el webhook. Tickets, PDF y email
+            # quedan en el outbox y los emite el consumidor de order_paid
+            if order.status != "completed" and await service._complete_paid_order(db, order):
+                return {"status": "ok", "message": "Pago verificado, tickets en proceso", "order_status": "completed"}
+            return {"status": "ok", "message": "Pago ya estaba completado", "order_status": "completed"}
         elif status == "failed":
             # Pago rechazado
             if order.status != "cancelled":
-                order.status = "cancelled"
-                await db.commit()
-
-                # Liberar capacidad
-                for order_item in order.order_items:
-                    await service.inventory_service.release_capacity(
-                        db, str(order_item.event_id), order_item.quantity, "payment_failed"
-                    )
+                await service._cancel_order(db, order, "payment_failed")
 
             return {"status": "ok", "message": "Pago rechazado", "order_status": "cancelled"}
         else:
@@ -469,6 +331,7 @@ async def verify_payku_payment(
 @router.get("/{order_id}/status", response_model=OrderStatusResponse)
 async def get_order_status(
     order_id: str,
+    token: Optional[str] = Query(None, description="order_token devuelto por la compra"),
     db: AsyncSession = Depends(get_db),
     current_user: Optional[Dict] = Depends(get_optional_user)
 ):
@@ -501,12 +364,26 @@ async def get_order_status(
             detail="Orden no encontrada"
         )
 
-    # Verificar acceso:
-    # 1. Si la orden es anónima (sin user_id), permitir acceso sin autenticación
-    #    (el order_id es un UUID único, suficiente para verificar)
-    # 2. Si la orden tiene user_id, verificar que coincida con el usuario autenticado
-    # 3. Admins/coordinadores siempre pueden ver cualquier orden
-    if order.user_id:
+    _check_order_access(order.user_id, current_user, order_id, token)
+
+    return OrderStatusResponse(**order_status)
+
+
+def _check_order_access(
+    order_user_id,
+    current_user: Optional[Dict],
+    order_id: Optional[str] = None,
+    token: Optional[str] = None
+):
+    """
+    Verificar acceso al estado de una orden:
+    1. Si la orden es anónima (sin user_id), permitir acceso sin autenticación
+       (el order_id es un UUID único, suficiente para verificar)
+    2. Si la orden tiene user_id, verificar que coincida con el usuario autenticado
+       o que venga el order_token que devolvió la compra
+    3. Admins/coordinadores siempre pueden ver cualquier orden
+    """
+    if order_user_id and not (order_id and verify_order_token(order_id, token)):
         # Orden con user_id - requiere autenticación y verificación
         if not current_user:
             raise HTTPException(
@@ -514,19 +391,137 @@ async def get_order_status(
                 detail="Debes estar autenticado para ver esta orden"
             )
         # Verificar que el usuario coincida o sea admin/coordinator
-        if str(order.user_id) != current_user.get("user_id"):
+        if str(order_user_id) != current_user.get("user_id"):
             if current_user.get("role") not in ["admin", "coordinator"]:
                 raise HTTPException(
                     status_code=status.HTTP_403_FORBIDDEN,
                     detail="No tienes acceso a esta orden"
                 )
-    # Si no tiene user_id (compra anónima), permitir acceso sin autenticación
-    # El order_id es suficiente para verificar el estado
 
-    return OrderStatusResponse(**order_status)
+
+async def _current_order_event(
+    db: AsyncSession,
+    order_id: str,
+    current_user: Optional[Dict],
+    token: Optional[str] = None
+) -> Dict:
+    """Estado actual para el canal push: el más avanzado entre la DB y el último publicado"""
+    snapshot = await PurchaseService().get_order_status_snapshot(db, order_id)
+    if not snapshot:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Orden no encontrada"
+        )
+    _check_order_access(snapshot.pop("user_id"), current_user, order_id, token)
+
+    last = await OrderStatusHub.last_event(order_id)
+    if last and progress(last) > progress(snapshot):
+        return last
+    return snapshot
+
+
+@router.get("/{order_id}/events")
+async def stream_order_status(
+    order_id: str,
+    token: Optional[str] = Query(None, description="order_token devuelto por la compra"),
+    db: AsyncSession = Depends(get_db),
+    current_user: Optional[Dict] = Depends(get_optional_user)
+):
+    """
+    Cambios de estado de una orden por Server-Sent Events
+
+    Reemplaza el polling de /status: envía el estado actual y luego cada
+    cambio publicado (webhooks, outbox, expiración) hasta un estado final o
+    hasta ORDER_STATUS_STREAM_SECONDS. No consulta al proveedor de pago.
+    EventSource no envía Authorization: las órdenes con usuario se abren con
+    ?token=<order_token>.
+    """
+    queue = await OrderStatusHub.subscribe(order_id)
+    try:
+        current = await _current_order_event(db, order_id, current_user, token)
+    except Exception:
+        OrderStatusHub.unsubscribe(order_id, queue)
+        raise
+
+    async def event_stream():
+        try:
+            yield f"event: status\ndata: {json.dumps(current)}\n\n"
+            if is_final(current):
+                return
+
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + ORDER_STATUS_STREAM_SECONDS
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    event = await asyncio.wait_for(
+                        queue.get(), timeout=min(ORDER_STATUS_HEARTBEAT_SECONDS, remaining)
+                    )
+                except asyncio.TimeoutError:
+                    # Heartbeat para que proxies no corten la conexión
+                    yield ": keep-alive\n\n"
+                    continue
+
+                yield f"event: status\ndata: {json.dumps(event)}\n\n"
+                if is_final(event):
+                    break
+        finally:
+            OrderStatusHub.unsubscribe(order_id, queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.get("/{order_id}/wait")
+async def wait_order_status(
+    order_id: str,
+    since: str = Query("pending", description="Último estado conocido por el cliente"),
+    tickets_issued: bool = Query(False, description="Si el cliente ya vio los tickets emitidos"),
+    payment_ready: bool = Query(False, description="Si el cliente ya tiene el link de pago"),
+    timeout: int = Query(25, ge=1, le=60),
+    token: Optional[str] = Query(None, description="order_token devuelto por la compra"),
+    db: AsyncSession = Depends(get_db),
+    current_user: Optional[Dict] = Depends(get_optional_user)
+):
+    """
+    Long-poll del estado de una orden
+
+    Responde apenas la orden avanza respecto de `since` (o al vencer
+    `timeout`, con changed=false). Alternativa a /events para clientes que
+    necesitan enviar Authorization (EventSource no permite headers). Tras
+    una compra aceptada en modo asíncrono, since=pending responde cuando
+    llega el payment_link.
+    """
+    known = {"status": since, "tickets_issued": tickets_issued, "payment_link": payment_ready}
+    queue = await OrderStatusHub.subscribe(order_id)
+    try:
+        current = await _current_order_event(db, order_id, current_user, token)
+        if progress(current) > progress(known):
+            return {**current, "changed": True}
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return {**current, "changed": False}
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=remaining)
+            except asyncio.TimeoutError:
+                return {**current, "changed": False}
+            if progress(event) > progress(known):
+                return {**event, "changed": True}
+    finally:
+        OrderStatusHub.unsubscribe(order_id, queue)
 
 
 @router.post("/process-payment")
+@idempotent()
 async def process_payment(
     request: Request,
     db: AsyncSession = Depends(get_db)
@@ -763,7 +758,7 @@ async def process_payment(
         service = PurchaseService()
         mercado_pago_service = service.mercado_pago_service
 
-        payment = mercado_pago_service.create_payment_with_token(
+        payment = await mercado_pago_service.create_payment_with_token_async(
             token=token,
             transaction_amount=transaction_amount,
             description=description,
@@ -787,51 +782,26 @@ async def process_payment(
 
         print(f"[DEBUG process_payment] Estado del pago recibido: {payment_status} (detail: {payment_status_detail})")
 
-        # Si el pago fue rechazado inmediatamente, actualizar el estado de la orden
-        if payment_status in ["rejected", "cancelled", "refunded"]:
-            print(f"❌ [process_payment] Pago rechazado inmediatamente. Actualizando orden {order_id} a 'cancelled'")
+        # Un rechazo no cierra la orden: el comprador puede reintentar con otro
+        # medio hasta que venza el hold (misma política que el webhook)
+        if payment_status in MERCADOPAGO_CANCEL_STATUSES:
+            print(f"❌ [process_payment] Pago devuelto inmediatamente. Actualizando orden {order_id} a 'cancelled'")
 
-            # Cargar order_items ANTES de hacer commit (necesario para evitar MissingGreenlet)
-            from sqlalchemy.orm import selectinload
-            from shared.database.models import OrderItem
-            result = await db.execute(
-                select(OrderItem).where(OrderItem.order_id == order.id)
-            )
-            order_items = result.scalars().all()
-
-            order.status = "cancelled"
-            await db.commit()
-
-            # Liberar capacidad
             service = PurchaseService()
-            for order_item in order_items:
-                await service.inventory_service.release_capacity(
-                    db, str(order_item.event_id), order_item.quantity, "payment_failed"
-                )
+            await service._cancel_order(db, order, "payment_failed")
 
             await db.refresh(order)
         elif payment_status == "approved":
             # Si el pago fue aprobado inmediatamente, actualizar el estado
             print(f"✅ [process_payment] Pago aprobado inmediatamente. Actualizando orden {order_id} a 'completed'")
-            order.status = "completed"
-            order.paid_at = datetime.utcnow()
-            await db.commit()
-
-            # Generar tickets
             service = PurchaseService()
-            try:
-                await service._generate_tickets(db, order, ticket_status="issued")
-                await db.commit()
-            except Exception as e:
-                await db.rollback()
-                print(f"Error generando tickets para orden {order.id}: {e}")
-                # Marcar orden como paid aunque falle la generación de tickets
-                order.status = "completed"
-                await db.commit()
+            # payment_reference, estado y fila order_paid del outbox en un solo
+            # commit; tickets, PDF y email los emite el consumidor del outbox
+            await service._complete_paid_order(db, order)
 
             await db.refresh(order)
         else:
-            # Si el pago está pendiente, solo guardar el payment_reference
+            # Pendiente o rechazado: solo guardar el payment_reference
             # El webhook actualizará el estado cuando el pago se complete
             print(f"⏳ [process_payment] Pago en estado '{payment_status}'. Esperando webhook para actualizar estado.")
             await db.commit()
@@ -1146,9 +1116,8 @@ async def admin_complete_order(
         print(f"[ADMIN] Orden actual - Status: {order.status}, Provider: {order.payment_provider}")
 
         # Actualizar orden a completada
-        order.status = "completed"
-        order.paid_at = func.now()
-        await db.commit()
+        await service._mark_order_paid(db, order)
+        await service.inventory_service.commit_reservations(db)
         await db.refresh(order)
 
         print(f"[ADMIN] Orden actualizada a 'completed'")
@@ -1188,7 +1157,9 @@ async def admin_complete_order(
             ticket_status="issued"
         )
 
+        await db.commit()
         print(f"[ADMIN] Generados {len(tickets)} tickets")
+        await OrderStatusHub.publish(order.id, "completed", tickets_issued=bool(tickets))
 
         # Enviar emails con tickets
         # TODO: Implementar envío de emails cuando el servicio de email esté configurado
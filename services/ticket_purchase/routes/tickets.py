@@ -12,6 +12,7 @@ import os
 from shared.database.session import get_db
 from shared.auth.dependencies import get_current_user
 from shared.database.models import Ticket, Order, OrderItem, Event, TicketType
+from shared.utils.http_clients import get_http_client
 
 
 router = APIRouter()
@@ -358,27 +359,26 @@ async def download_ticket_pdf(
     }
     
     try:
-        # Llamar al servicio de PDF
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(
-                f"{pdfsvc_url}/tickets/pdf",
-                json=ticket_data
-            )
-            
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail="Error generando PDF"
-                )
-            
-            # Retornar PDF como streaming response
-            return StreamingResponse(
-                BytesIO(response.content),
-                media_type="application/pdf",
-                headers={
-                    "Content-Disposition": f"attachment; filename=ticket-{ticket_id}.pdf"
-                }
+        # Llamar al servicio de PDF (cliente compartido con keep-alive)
+        response = await get_http_client("pdfsvc").post(
+            f"{pdfsvc_url}/tickets/pdf",
+            json=ticket_data
+        )
+        
+        if response.status_code != 200:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Error generando PDF"
             )
+        
+        # Retornar PDF como streaming response
+        return StreamingResponse(
+            BytesIO(response.content),
+            media_type="application/pdf",
+            headers={
+                "Content-Disposition": f"attachment; filename=ticket-{ticket_id}.pdf"
+            }
+        )
     except httpx.TimeoutException:
         raise HTTPException(
             status_code=status.HTTP_504_GATEWAY_TIMEOUT,
@@ -0,0 +1,313 @@
+"""
+Sala de espera virtual (admission control) para POST /api/v1/purchases
+
+Por cada evento con sala de espera activa:
+- `waiting_room:{event}:seq`    número correlativo de la fila (INCR al entrar)
+- `waiting_room:{event}:head`   último número admitido
+- `waiting_room:{event}:bucket` token bucket que avanza `head` a la tasa de admisión
+
+No hay proceso en background: `head` avanza de forma perezosa cada vez que
+alguien consulta su posición. Quien queda admitido recibe un admission token
+firmado que desbloquea la compra (header X-Admission-Token).
+
+La tasa de admisión se ajusta con la latencia medida de create_purchase
+(EWMA): con N compras concurrentes sostenibles y una latencia L, la tasa
+máxima es N / L compras por segundo (ley de Little).
+"""
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+from jose import JWTError, jwt
+from shared.cache.redis_client import get_redis
+from shared.auth.jwt_handler import JWT_SECRET_KEY, JWT_ALGORITHM
+import json
+import logging
+import math
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+ADMISSION_SECRET = os.getenv("ADMISSION_TOKEN_SECRET", JWT_SECRET_KEY)
+# Minutos que un admission token permite comprar
+ADMISSION_TOKEN_TTL_MINUTES = int(os.getenv("ADMISSION_TOKEN_TTL_MINUTES", "10"))
+# Compras concurrentes que el backend sostiene (pool de DB: 3 + 5 en Supabase)
+TARGET_CONCURRENCY = float(os.getenv("WAITING_ROOM_TARGET_CONCURRENCY", "8"))
+# Tasa de admisión por defecto (compras/segundo) si no hay latencia medida
+DEFAULT_ADMIT_RATE = float(os.getenv("WAITING_ROOM_DEFAULT_RATE", "5"))
+MIN_ADMIT_RATE = float(os.getenv("WAITING_ROOM_MIN_RATE", "0.5"))
+# Peso de cada muestra nueva en el EWMA de latencia
+LATENCY_EWMA_ALPHA = 0.2
+
+CONFIG_KEY = "waiting_room:config"
+LATENCY_KEY = "waiting_room:purchase_latency"
+
+
+# KEYS: head, seq, bucket | ARGV: now, rate, burst
+# Avanza head según los tokens acumulados desde la última consulta
+_ADVANCE_LUA = """
+local now = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local burst = tonumber(ARGV[3])
+local seq = tonumber(redis.call('GET', KEYS[2]) or '0')
+local head = tonumber(redis.call('GET', KEYS[1]) or '0')
+local bucket = redis.call('HMGET', KEYS[3], 'tokens', 'ts')
+local tokens = tonumber(bucket[1] or '0')
+local ts = tonumber(bucket[2] or ARGV[1])
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local admit = math.min(math.floor(tokens), seq - head)
+if admit > 0 then
+    head = redis.call('INCRBY', KEYS[1], admit)
+    tokens = tokens - admit
+end
+redis.call('HSET', KEYS[3], 'tokens', tostring(tokens), 'ts', ARGV[1])
+redis.call('EXPIRE', KEYS[3], 86400)
+return head
+"""
+
+# KEYS: latency | ARGV: sample, alpha
+_EWMA_LUA = """
+local current = redis.call('GET', KEYS[1])
+local sample = tonumber(ARGV[1])
+local value = sample
+if current then
+    local alpha = tonumber(ARGV[2])
+    value = alpha * sample + (1 - alpha) * tonumber(current)
+end
+redis.call('SET', KEYS[1], tostring(value), 'EX', 3600)
+return tostring(value)
+"""
+
+
+class AdmissionService:
+    """Fila FIFO por evento con tokens de admisión firmados"""
+
+    @staticmethod
+    def _key(event_id: str, name: str) -> str:
+        return f"waiting_room:{event_id}:{name}"
+
+    # ==================== CONFIGURACIÓN ====================
+
+    @staticmethod
+    async def get_config(event_id: str) -> Optional[Dict]:
+        """Configuración de la sala de espera del evento (None si no está activa)"""
+        redis_conn = await get_redis()
+        value = await redis_conn.hget(CONFIG_KEY, str(event_id))
+        if not value:
+            return None
+        config = json.loads(value)
+        return config if config.get("enabled") else None
+
+    @staticmethod
+    async def set_config(event_id: str, enabled: bool, max_rate: Optional[float] = None) -> Dict:
+        """Activar/desactivar la sala de espera de un evento"""
+        redis_conn = await get_redis()
+        event_id = str(event_id)
+
+        if not enabled:
+            await redis_conn.hdel(CONFIG_KEY, event_id)
+            await AdmissionService._reset_queue(event_id)
+            return {"enabled": False, "max_rate": None}
+
+        if not await AdmissionService.get_config(event_id):
+            # Fila nueva: la numeración vuelve a 1, así que no deben quedar
+            # marcas de turnos usados de una sala anterior
+            await AdmissionService._reset_queue(event_id)
+
+        config = {"enabled": True, "max_rate": max_rate}
+        await redis_conn.hset(CONFIG_KEY, event_id, json.dumps(config))
+        return config
+
+    @staticmethod
+    async def _reset_queue(event_id: str):
+        """Borrar fila, token bucket y marcas de admission tokens usados"""
+        redis_conn = await get_redis()
+        keys = [
+            AdmissionService._key(event_id, "seq"),
+            AdmissionService._key(event_id, "head"),
+            AdmissionService._key(event_id, "bucket"),
+        ]
+        async for key in redis_conn.scan_iter(match=AdmissionService._key(event_id, "used:*"), count=500):
+            keys.append(key)
+            if len(keys) >= 500:
+                await redis_conn.delete(*keys)
+                keys = []
+        if keys:
+            await redis_conn.delete(*keys)
+
+    # ==================== TASA DE ADMISIÓN ====================
+
+    @staticmethod
+    async def record_purchase_latency(seconds: float):
+        """Registrar la latencia de una compra en el EWMA global"""
+        try:
+            redis_conn = await get_redis()
+            await redis_conn.eval(_EWMA_LUA, 1, LATENCY_KEY, seconds, LATENCY_EWMA_ALPHA)
+        except Exception as e:
+            logger.warning(f"No se pudo registrar latencia de compra: {e}")
+
+    @staticmethod
+    async def get_admit_rate(config: Dict) -> float:
+        """Compras por segundo a admitir según latencia medida y tope del evento"""
+        redis_conn = await get_redis()
+        latency = await redis_conn.get(LATENCY_KEY)
+
+        rate = DEFAULT_ADMIT_RATE
+        if latency and float(latency) > 0:
+            rate = TARGET_CONCURRENCY / float(latency)
+
+        if config.get("max_rate"):
+            rate = min(rate, float(config["max_rate"]))
+
+        return max(MIN_ADMIT_RATE, rate)
+
+    # ==================== FILA ====================
+
+    @staticmethod
+    async def join(event_id: str) -> Dict:
+        """
+        Entrar a la fila de un evento
+
+        Returns:
+            Estado de la fila; incluye admission_token si la sala no está activa
+            o si la fila está vacía y se admite de inmediato
+        """
+        event_id = str(event_id)
+        config = await AdmissionService.get_config(event_id)
+        if not config:
+            return {"enabled": False, "admitted": True, "admission_token": None}
+
+        redis_conn = await get_redis()
+        seq = await redis_conn.incr(AdmissionService._key(event_id, "seq"))
+        queue_token = jwt.encode(
+            {"type": "queue", "event_id": event_id, "seq": seq, "iat": datetime.utcnow()},
+            ADMISSION_SECRET,
+            algorithm=JWT_ALGORITHM
+        )
+
+        status = await AdmissionService._status(event_id, seq, config)
+        status["queue_token"] = queue_token
+        return status
+
+    @staticmethod
+    async def get_status(event_id: str, queue_token: str) -> Dict:
+        """Posición, ETA y (si corresponde) admission token de un turno"""
+        event_id = str(event_id)
+        try:
+            payload = jwt.decode(queue_token, ADMISSION_SECRET, algorithms=[JWT_ALGORITHM])
+        except JWTError:
+            raise ValueError("Turno de fila inválido")
+
+        if payload.get("type") != "queue" or payload.get("event_id") != event_id:
+            raise ValueError("Turno de fila inválido para este evento")
+
+        config = await AdmissionService.get_config(event_id)
+        if not config:
+            return {"enabled": False, "admitted": True, "admission_token": None}
+
+        return await AdmissionService._status(event_id, int(payload["seq"]), config)
+
+    @staticmethod
+    async def _status(event_id: str, seq: int, config: Dict) -> Dict:
+        redis_conn = await get_redis()
+        rate = await AdmissionService.get_admit_rate(config)
+        # Burst de ~1 segundo para no dejar pasar ráfagas después de una pausa
+        burst = max(1.0, rate)
+
+        head = int(await redis_conn.eval(
+            _ADVANCE_LUA, 3,
+            AdmissionService._key(event_id, "head"),
+            AdmissionService._key(event_id, "seq"),
+            AdmissionService._key(event_id, "bucket"),
+            time.time(), rate, burst
+        ))
+
+        position = max(0, seq - head)
+        admitted = position == 0
+
+        return {
+            "enabled": True,
+            "admitted": admitted,
+            "position": position,
+            "eta_seconds": 0 if admitted else int(math.ceil(position / rate)),
+            "admit_rate": round(rate, 2),
+            "admission_token": AdmissionService._issue_admission_token(event_id, seq) if admitted else None,
+        }
+
+    # ==================== ADMISSION TOKENS ====================
+
+    @staticmethod
+    def _issue_admission_token(event_id: str, seq: int) -> str:
+        expire = datetime.utcnow() + timedelta(minutes=ADMISSION_TOKEN_TTL_MINUTES)
+        return jwt.encode(
+            {"type": "admission", "event_id": event_id, "seq": seq, "exp": expire},
+            ADMISSION_SECRET,
+            algorithm=JWT_ALGORITHM
+        )
+
+    @staticmethod
+    async def verify_admission(event_id: str, admission_token: Optional[str]) -> Optional[Dict]:
+        """
+        Validar que una compra viene de la sala de espera (si el evento la tiene)
+
+        Returns:
+            Payload del token, o None si el evento no tiene sala de espera
+
+        El turno se reserva de forma atómica (SET NX): dos compras
+        concurrentes con el mismo token no pueden pasar las dos. Quien llama
+        debe confirmarlo con consume_admission si la compra se hizo, o
+        devolverlo con release_admission si falló.
+
+        Raises:
+            PermissionError si falta el token, es inválido o ya se usó
+        """
+        event_id = str(event_id)
+        config = await AdmissionService.get_config(event_id)
+        if not config:
+            return None
+
+        if not admission_token:
+            raise PermissionError("Este evento tiene sala de espera. Ingresa a la fila para comprar.")
+
+        try:
+            payload = jwt.decode(admission_token, ADMISSION_SECRET, algorithms=[JWT_ALGORITHM])
+        except JWTError:
+            raise PermissionError("Admission token inválido o expirado. Vuelve a ingresar a la fila.")
+
+        if payload.get("type") != "admission" or payload.get("event_id") != event_id:
+            raise PermissionError("Admission token inválido para este evento")
+
+        redis_conn = await get_redis()
+        claimed = await redis_conn.set(
+            AdmissionService._key(event_id, f"used:{payload['seq']}"),
+            "claimed",
+            nx=True,
+            ex=ADMISSION_TOKEN_TTL_MINUTES * 60
+        )
+        if not claimed:
+            raise PermissionError("Este admission token ya fue utilizado")
+
+        return payload
+
+    @staticmethod
+    async def consume_admission(event_id: str, payload: Optional[Dict]):
+        """Marcar como usado un admission token reservado, después de una compra exitosa"""
+        if not payload:
+            return
+        redis_conn = await get_redis()
+        await redis_conn.set(
+            AdmissionService._key(str(event_id), f"used:{payload['seq']}"),
+            "1",
+            ex=ADMISSION_TOKEN_TTL_MINUTES * 60
+        )
+
+    @staticmethod
+    async def release_admission(event_id: str, payload: Optional[Dict]):
+        """Devolver un admission token reservado cuando la compra falló (no lanza)"""
+        if not payload:
+            return
+        try:
+            redis_conn = await get_redis()
+            await redis_conn.delete(AdmissionService._key(str(event_id), f"used:{payload['seq']}"))
+        except Exception as e:
+            # El token queda reservado hasta que vence; el comprador vuelve a la fila
+            logger.warning(f"No se pudo liberar el admission token del evento {event_id}: {e}")
@@ -0,0 +1,850 @@
+"""
+Motor de capacidad basado en contadores atómicos en Redis
+
+Cada evento tiene un contador `capacity:event:{id}:available` sembrado desde
+events.capacity_available. Las reservas y liberaciones se hacen con scripts Lua
+que verifican y modifican el contador en una sola operación (sin locks), y cada
+cambio se acumula como delta en el hash `capacity:pending`. La tarea Celery
+`flush_capacity_counters` escribe esos deltas de vuelta a la DB periódicamente,
+así que events.capacity_available es siempre el agregado que ve el catálogo.
+Cada write-back guarda el fencing token de su lock en events.capacity_fence y
+solo aplica si es mayor que el guardado (docs/sql/events_capacity_fence.sql).
+
+Modo sharded (opcional, por evento): para lanzamientos masivos la capacidad se
+reparte en N sub-contadores `capacity:event:{id}:shard:{i}`. Cada reserva toma
+de un shard al azar; si no le alcanza, un script toma de todos los shards a la
+vez y redistribuye lo que sobra en partes iguales.
+
+Servicios adicionales (comida, estacionamiento): cada EventService con stock
+limitado tiene su contador `capacity:service:{id}:available` y sus deltas van
+al hash `capacity:pending:services` (campo `{event_id}:{service_id}`). Una
+orden reserva asientos + servicios con un solo script (todo o nada). Un
+servicio con stock <= 0 se considera ilimitado y no se descuenta.
+"""
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, text
+from typing import Dict, List, Optional, Tuple
+from shared.database.models import Event, EventService
+from shared.cache.redis_client import get_redis, DistributedLock, LockError
+import logging
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+
+# Códigos de retorno de los scripts Lua
+NOT_SEEDED = -2
+INSUFFICIENT = -1
+STOCK_INSUFFICIENT = -3
+
+# Valor del contador de un servicio sin límite de stock
+UNLIMITED = "unlimited"
+
+MAX_SHARDS = 64
+
+# Segundos que se cachea en memoria la cantidad de shards de un evento
+SHARD_CONFIG_TTL = 5
+
+
+# KEYS: available, pending | ARGV: quantity, event_id
+# También se usa sobre un shard individual
+_RESERVE_LUA = """
+local available = redis.call('GET', KEYS[1])
+if not available then
+    return -2
+end
+local quantity = tonumber(ARGV[1])
+if tonumber(available) < quantity then
+    return -1
+end
+redis.call('HINCRBY', KEYS[2], ARGV[2], -quantity)
+return redis.call('DECRBY', KEYS[1], quantity)
+"""
+
+# KEYS: available, total, pending | ARGV: quantity, event_id
+_RELEASE_LUA = """
+local available = redis.call('GET', KEYS[1])
+if not available then
+    return -2
+end
+available = tonumber(available)
+local total = tonumber(redis.call('GET', KEYS[2]) or available)
+local released = math.min(tonumber(ARGV[1]), total - available)
+if released <= 0 then
+    return available
+end
+redis.call('HINCRBY', KEYS[3], ARGV[2], released)
+return redis.call('INCRBY', KEYS[1], released)
+"""
+
+# KEYS: available, total, pending, shards_meta, shard_1..shard_n
+# ARGV: db_available, db_total, event_id, n
+# El delta pendiente aún no escrito en la DB se suma al valor leído
+_SEED_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 1 or redis.call('EXISTS', KEYS[4]) == 1 then
+    return 0
+end
+local pending = tonumber(redis.call('HGET', KEYS[3], ARGV[3]) or '0')
+local total = tonumber(ARGV[2])
+local available = tonumber(ARGV[1]) + pending
+if available < 0 then
+    available = 0
+end
+if available > total then
+    available = total
+end
+redis.call('SET', KEYS[2], total)
+local n = tonumber(ARGV[4])
+if n <= 1 then
+    redis.call('SET', KEYS[1], available)
+    return 1
+end
+redis.call('SET', KEYS[4], n)
+local base = math.floor(available / n)
+local extra = available - base * n
+for i = 1, n do
+    local value = base
+    if i <= extra then
+        value = value + 1
+    end
+    redis.call('SET', KEYS[4 + i], value)
+end
+return 1
+"""
+
+# KEYS: pending, shard_1..shard_n | ARGV: quantity, event_id
+# Reserva tomando de todos los shards y redistribuye el sobrante
+_RESERVE_SPREAD_LUA = """
+local quantity = tonumber(ARGV[1])
+local n = #KEYS - 1
+local values = {}
+local sum = 0
+for i = 1, n do
+    local value = redis.call('GET', KEYS[i + 1])
+    if not value then
+        return -2
+    end
+    values[i] = tonumber(value)
+    sum = sum + values[i]
+end
+if sum < quantity then
+    return -1
+end
+redis.call('HINCRBY', KEYS[1], ARGV[2], -quantity)
+local left = sum - quantity
+local base = math.floor(left / n)
+local extra = left - base * n
+for i = 1, n do
+    local value = base
+    if i <= extra then
+        value = value + 1
+    end
+    redis.call('SET', KEYS[i + 1], value)
+end
+return left
+"""
+
+# KEYS: shard_1..shard_n | Redistribuir la capacidad en partes iguales
+_REBALANCE_LUA = """
+local n = #KEYS
+local sum = 0
+for i = 1, n do
+    local value = redis.call('GET', KEYS[i])
+    if not value then
+        return -2
+    end
+    sum = sum + tonumber(value)
+end
+local base = math.floor(sum / n)
+local extra = sum - base * n
+for i = 1, n do
+    local value = base
+    if i <= extra then
+        value = value + 1
+    end
+    redis.call('SET', KEYS[i], value)
+end
+return sum
+"""
+
+# KEYS: total, pending, shard_1..shard_n | ARGV: quantity, event_id, shard_index
+_RELEASE_SHARDED_LUA = """
+local n = #KEYS - 2
+local sum = 0
+for i = 1, n do
+    local value = redis.call('GET', KEYS[i + 2])
+    if not value then
+        return -2
+    end
+    sum = sum + tonumber(value)
+end
+local total = tonumber(redis.call('GET', KEYS[1]) or sum)
+local released = math.min(tonumber(ARGV[1]), total - sum)
+if released <= 0 then
+    return sum
+end
+redis.call('INCRBY', KEYS[2 + tonumber(ARGV[3])], released)
+redis.call('HINCRBY', KEYS[2], ARGV[2], released)
+return sum + released
+"""
+
+# KEYS: pending | ARGV: event_id
+_DRAIN_LUA = """
+local delta = redis.call('HGET', KEYS[1], ARGV[1])
+if delta then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+end
+return delta
+"""
+
+# KEYS: pending | ARGV: field_1..field_n
+# Igual que _DRAIN_LUA pero para varios campos; devuelve los deltas en orden
+_DRAIN_MANY_LUA = """
+local deltas = redis.call('HMGET', KEYS[1], unpack(ARGV))
+redis.call('HDEL', KEYS[1], unpack(ARGV))
+return deltas
+"""
+
+# KEYS: available, pending, service_pending, service_1..service_n
+# ARGV: quantity, event_id, field_1, quantity_1, ..., field_n, quantity_n
+# Verifica asientos y stock de todos los servicios antes de descontar nada.
+# Devuelve {capacidad restante, 0} o {código de error, índice del servicio}
+_RESERVE_ORDER_LUA = """
+local quantity = tonumber(ARGV[1])
+local n = #KEYS - 3
+if quantity > 0 then
+    local available = redis.call('GET', KEYS[1])
+    if not available then
+        return {-2, 0}
+    end
+    if tonumber(available) < quantity then
+        return {-1, 0}
+    end
+end
+local stocks = {}
+for i = 1, n do
+    local stock = redis.call('GET', KEYS[3 + i])
+    if not stock then
+        return {-2, i}
+    end
+    if stock ~= 'unlimited' and tonumber(stock) < tonumber(ARGV[2 + 2 * i]) then
+        return {-3, i}
+    end
+    stocks[i] = stock
+end
+for i = 1, n do
+    if stocks[i] ~= 'unlimited' then
+        local service_quantity = tonumber(ARGV[2 + 2 * i])
+        redis.call('DECRBY', KEYS[3 + i], service_quantity)
+        redis.call('HINCRBY', KEYS[3], ARGV[1 + 2 * i], -service_quantity)
+    end
+end
+local remaining = 0
+if quantity > 0 then
+    redis.call('HINCRBY', KEYS[2], ARGV[2], -quantity)
+    remaining = redis.call('DECRBY', KEYS[1], quantity)
+end
+return {remaining, 0}
+"""
+
+# KEYS: service_pending, available_1..available_n, total_1..total_n
+# ARGV: field_1, quantity_1, ..., field_n, quantity_n
+_RELEASE_SERVICES_LUA = """
+local n = (#KEYS - 1) / 2
+for i = 1, n do
+    if not redis.call('GET', KEYS[1 + i]) then
+        return -2
+    end
+end
+for i = 1, n do
+    local stock = redis.call('GET', KEYS[1 + i])
+    if stock ~= 'unlimited' then
+        local total = tonumber(redis.call('GET', KEYS[1 + n + i]) or stock)
+        local released = math.min(tonumber(ARGV[2 * i]), total - tonumber(stock))
+        if released > 0 then
+            redis.call('INCRBY', KEYS[1 + i], released)
+            redis.call('HINCRBY', KEYS[1], ARGV[2 * i - 1], released)
+        end
+    end
+end
+return 1
+"""
+
+# KEYS: available, total, service_pending | ARGV: db_available, db_stock, field
+_SEED_SERVICE_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+local stock = tonumber(ARGV[2])
+if stock <= 0 then
+    redis.call('SET', KEYS[1], 'unlimited')
+    return 1
+end
+local pending = tonumber(redis.call('HGET', KEYS[3], ARGV[3]) or '0')
+local available = math.max(0, math.min(stock, tonumber(ARGV[1]) + pending))
+redis.call('SET', KEYS[2], stock)
+redis.call('SET', KEYS[1], available)
+return 1
+"""
+
+
+# Cache local: event_id -> (shards, expires_at)
+_shard_config_cache: Dict[str, tuple] = {}
+
+
+class CapacityEngine:
+    """Contadores de capacidad por evento en Redis con write-back a la DB"""
+
+    PENDING_KEY = "capacity:pending"
+    SERVICE_PENDING_KEY = "capacity:pending:services"
+    SHARDS_CONFIG_KEY = "capacity:shards:config"
+
+    @staticmethod
+    def available_key(event_id: str) -> str:
+        return f"capacity:event:{event_id}:available"
+
+    @staticmethod
+    def total_key(event_id: str) -> str:
+        return f"capacity:event:{event_id}:total"
+
+    @staticmethod
+    def shards_meta_key(event_id: str) -> str:
+        """Cantidad de shards con la que se sembró el evento"""
+        return f"capacity:event:{event_id}:shards"
+
+    @staticmethod
+    def shard_keys(event_id: str, shards: int) -> List[str]:
+        return [f"capacity:event:{event_id}:shard:{i}" for i in range(shards)]
+
+    @staticmethod
+    def service_available_key(service_id: str) -> str:
+        return f"capacity:service:{service_id}:available"
+
+    @staticmethod
+    def service_total_key(service_id: str) -> str:
+        return f"capacity:service:{service_id}:total"
+
+    @staticmethod
+    def service_pending_field(event_id: str, service_id: str) -> str:
+        """Campo del delta pendiente (incluye el evento para flushear bajo su lock)"""
+        return f"{event_id}:{service_id}"
+
+    @staticmethod
+    def _sync_lock(event_id: str) -> DistributedLock:
+        """
+        Lock usado solo en rutas frías (siembra y write-back) para que una
+        siembra nunca lea la DB entre el drenado de un delta y su commit
+        """
+        return DistributedLock(f"capacity:sync:{event_id}", timeout=5, expire=10)
+
+    @staticmethod
+    async def get_shard_count(event_id: str, refresh: bool = False) -> int:
+        """Cantidad de shards configurada para el evento (1 = sin sharding)"""
+        event_id = str(event_id)
+        cached = _shard_config_cache.get(event_id)
+        if cached and not refresh and cached[1] > time.monotonic():
+            return cached[0]
+
+        redis_conn = await get_redis()
+        value = await redis_conn.hget(CapacityEngine.SHARDS_CONFIG_KEY, event_id)
+        shards = max(1, min(MAX_SHARDS, int(value))) if value else 1
+        _shard_config_cache[event_id] = (shards, time.monotonic() + SHARD_CONFIG_TTL)
+        return shards
+
+    @staticmethod
+    async def set_shard_count(db: AsyncSession, event_id: str, shards: int) -> int:
+        """
+        Configurar la cantidad de shards de un evento
+
+        Aplica los deltas pendientes y descarta los contadores actuales; la
+        siguiente operación los vuelve a sembrar con el nuevo layout.
+        """
+        redis_conn = await get_redis()
+        event_id = str(event_id)
+        shards = max(1, min(MAX_SHARDS, int(shards)))
+
+        await CapacityEngine.flush_event(db, event_id)
+        if shards > 1:
+            await redis_conn.hset(CapacityEngine.SHARDS_CONFIG_KEY, event_id, shards)
+        else:
+            await redis_conn.hdel(CapacityEngine.SHARDS_CONFIG_KEY, event_id)
+        await CapacityEngine.invalidate(event_id)
+
+        _shard_config_cache[event_id] = (shards, time.monotonic() + SHARD_CONFIG_TTL)
+        return shards
+
+    @staticmethod
+    async def seed(db: AsyncSession, event_id: str) -> bool:
+        """
+        Sembrar los contadores de un evento desde la DB (si no existen)
+
+        Returns:
+            False si el evento no existe
+        """
+        redis_conn = await get_redis()
+        event_id = str(event_id)
+
+        async with CapacityEngine._sync_lock(event_id):
+            stmt = select(Event.capacity_available, Event.capacity_total).where(Event.id == event_id)
+            result = await db.execute(stmt)
+            row = result.first()
+
+            if not row:
+                return False
+
+            shards = await CapacityEngine.get_shard_count(event_id, refresh=True)
+            keys = [
+                CapacityEngine.available_key(event_id),
+                CapacityEngine.total_key(event_id),
+                CapacityEngine.PENDING_KEY,
+                CapacityEngine.shards_meta_key(event_id),
+            ]
+            if shards > 1:
+                keys.extend(CapacityEngine.shard_keys(event_id, shards))
+
+            await redis_conn.eval(
+                _SEED_LUA, len(keys), *keys,
+                row.capacity_available, row.capacity_total, event_id, shards
+            )
+            return True
+
+    @staticmethod
+    async def _read_available(event_id: str, shards: int) -> Optional[int]:
+        redis_conn = await get_redis()
+        if shards <= 1:
+            value = await redis_conn.get(CapacityEngine.available_key(event_id))
+            return int(value) if value is not None else None
+
+        values = await redis_conn.mget(CapacityEngine.shard_keys(event_id, shards))
+        if any(value is None for value in values):
+            return None
+        return sum(int(value) for value in values)
+
+    @staticmethod
+    async def get_available(db: AsyncSession, event_id: str) -> Optional[int]:
+        """Capacidad disponible agregada (None si el evento no existe)"""
+        event_id = str(event_id)
+
+        for attempt in range(2):
+            shards = await CapacityEngine.get_shard_count(event_id, refresh=attempt > 0)
+            value = await CapacityEngine._read_available(event_id, shards)
+            if value is not None:
+                return value
+            if not await CapacityEngine.seed(db, event_id):
+                return None
+
+        return None
+
+    @staticmethod
+    async def _reserve_sharded(event_id: str, quantity: int, shards: int) -> int:
+        """Reservar desde un shard al azar, con fallback a todos los shards"""
+        redis_conn = await get_redis()
+        keys = CapacityEngine.shard_keys(event_id, shards)
+
+        result = await redis_conn.eval(
+            _RESERVE_LUA, 2, random.choice(keys), CapacityEngine.PENDING_KEY,
+            quantity, event_id
+        )
+        if result == NOT_SEEDED:
+            return NOT_SEEDED
+
+        if result == INSUFFICIENT:
+            # El shard elegido no alcanza: tomar de todos y rebalancear
+            return int(await redis_conn.eval(
+                _RESERVE_SPREAD_LUA, len(keys) + 1, CapacityEngine.PENDING_KEY, *keys,
+                quantity, event_id
+            ))
+
+        if result == 0:
+            # Shard agotado: repartir lo que queda en los demás
+            await redis_conn.eval(_REBALANCE_LUA, len(keys), *keys)
+
+        return int(result)
+
+    @staticmethod
+    async def reserve(db: AsyncSession, event_id: str, quantity: int) -> int:
+        """
+        Verificar y decrementar el contador de forma atómica
+
+        Returns:
+            Capacidad restante (del shard, en modo sharded), o INSUFFICIENT si
+            no alcanza / el evento no existe
+        """
+        redis_conn = await get_redis()
+        event_id = str(event_id)
+
+        for attempt in range(2):
+            shards = await CapacityEngine.get_shard_count(event_id, refresh=attempt > 0)
+            if shards > 1:
+                result = await CapacityEngine._reserve_sharded(event_id, quantity, shards)
+            else:
+                result = await redis_conn.eval(
+                    _RESERVE_LUA, 2,
+                    CapacityEngine.available_key(event_id),
+                    CapacityEngine.PENDING_KEY,
+                    quantity, event_id
+                )
+            if result != NOT_SEEDED:
+                return int(result)
+            if not await CapacityEngine.seed(db, event_id):
+                return INSUFFICIENT
+
+        return INSUFFICIENT
+
+    @staticmethod
+    async def release(db: AsyncSession, event_id: str, quantity: int) -> Optional[int]:
+        """
+        Incrementar el contador sin exceder capacity_total
+
+        Returns:
+            Capacidad disponible resultante (None si el evento no existe)
+        """
+        redis_conn = await get_redis()
+        event_id = str(event_id)
+
+        for attempt in range(2):
+            shards = await CapacityEngine.get_shard_count(event_id, refresh=attempt > 0)
+            if shards > 1:
+                result = await redis_conn.eval(
+                    _RELEASE_SHARDED_LUA, shards + 2,
+                    CapacityEngine.total_key(event_id),
+                    CapacityEngine.PENDING_KEY,
+                    *CapacityEngine.shard_keys(event_id, shards),
+                    quantity, event_id, random.randint(1, shards)
+                )
+            else:
+                result = await redis_conn.eval(
+                    _RELEASE_LUA, 3,
+                    CapacityEngine.available_key(event_id),
+                    CapacityEngine.total_key(event_id),
+                    CapacityEngine.PENDING_KEY,
+                    quantity, event_id
+                )
+            if result != NOT_SEEDED:
+                return int(result)
+            if not await CapacityEngine.seed(db, event_id):
+                return None
+
+        return None
+
+    @staticmethod
+    async def seed_services(db: AsyncSession, event_id: str, service_ids: List[str]) -> bool:
+        """
+        Sembrar los contadores de stock de servicios del evento (si no existen)
+
+        Returns:
+            False si alguno de los servicios no existe en el evento
+        """
+        redis_conn = await get_redis()
+        event_id = str(event_id)
+
+        async with CapacityEngine._sync_lock(event_id):
+            stmt = select(EventService.id, EventService.stock, EventService.stock_available).where(
+                EventService.event_id == event_id,
+                EventService.id.in_(service_ids)
+            )
+            result = await db.execute(stmt)
+            rows = result.all()
+
+            if len(rows) != len(set(service_ids)):
+                return False
+
+            for row in rows:
+                service_id = str(row.id)
+                await redis_conn.eval(
+                    _SEED_SERVICE_LUA, 3,
+                    CapacityEngine.service_available_key(service_id),
+                    CapacityEngine.service_total_key(service_id),
+                    CapacityEngine.SERVICE_PENDING_KEY,
+                    row.stock_available, row.stock,
+                    CapacityEngine.service_pending_field(event_id, service_id)
+                )
+            return True
+
+    @staticmethod
+    async def _reserve_items(
+        db: AsyncSession,
+        event_id: str,
+        quantity: int,
+        services: Dict[str, int]
+    ) -> Tuple[int, Optional[str]]:
+        """Asientos (evento sin shards) + servicios en un solo script"""
+        redis_conn = await get_redis()
+        service_ids = list(services.keys())
+
+        keys = [
+            CapacityEngine.available_key(event_id),
+            CapacityEngine.PENDING_KEY,
+            CapacityEngine.SERVICE_PENDING_KEY,
+        ]
+        keys.extend(CapacityEngine.service_available_key(service_id) for service_id in service_ids)
+        args = [quantity, event_id]
+        for service_id in service_ids:
+            args.extend([CapacityEngine.service_pending_field(event_id, service_id), services[service_id]])
+
+        for _ in range(3):
+            result, index = await redis_conn.eval(_RESERVE_ORDER_LUA, len(keys), *keys, *args)
+            result, index = int(result), int(index)
+            failed_service = service_ids[index - 1] if index else None
+
+            if result != NOT_SEEDED:
+                return result, failed_service
+
+            if failed_service is None:
+                if not await CapacityEngine.seed(db, event_id):
+                    return INSUFFICIENT, None
+            elif not await CapacityEngine.seed_services(db, event_id, service_ids):
+                return STOCK_INSUFFICIENT, None
+
+        return INSUFFICIENT, None
+
+    @staticmethod
+    async def reserve_order(
+        db: AsyncSession,
+        event_id: str,
+        quantity: int,
+        services: Dict[str, int]
+    ) -> Tuple[int, Optional[str]]:
+        """
+        Reservar asientos del evento y stock de servicios (todo o nada)
+
+        Args:
+            services: {service_id: cantidad}
+
+        Returns:
+            (capacidad restante o código de error, servicio sin stock)
+            El código es INSUFFICIENT (asientos) o STOCK_INSUFFICIENT (servicio)
+        """
+        event_id = str(event_id)
+        if not services:
+            return await CapacityEngine.reserve(db, event_id, quantity), None
+
+        if await CapacityEngine.get_shard_count(event_id) <= 1:
+            return await CapacityEngine._reserve_items(db, event_id, quantity, services)
+
+        # Evento sharded: los asientos no caben en el mismo script; se
+        # reservan primero y se devuelven si algún servicio no alcanza
+        remaining = await CapacityEngine.reserve(db, event_id, quantity)
+        if remaining == INSUFFICIENT:
+            return INSUFFICIENT, None
+
+        result, failed_service = await CapacityEngine._reserve_items(db, event_id, 0, services)
+        if result < 0:
+            await CapacityEngine.release(db, event_id, quantity)
+            return result, failed_service
+
+        return remaining, None
+
+    @staticmethod
+    async def release_services(db: AsyncSession, event_id: str, services: Dict[str, int]):
+        """Devolver stock de servicios sin exceder su stock total"""
+        if not services:
+            return
+        redis_conn = await get_redis()
+        event_id = str(event_id)
+        service_ids = list(services.keys())
+
+        keys = [CapacityEngine.SERVICE_PENDING_KEY]
+        keys.extend(CapacityEngine.service_available_key(service_id) for service_id in service_ids)
+        keys.extend(CapacityEngine.service_total_key(service_id) for service_id in service_ids)
+        args = []
+        for service_id in service_ids:
+            args.extend([CapacityEngine.service_pending_field(event_id, service_id), services[service_id]])
+
+        for _ in range(2):
+            result = await redis_conn.eval(_RELEASE_SERVICES_LUA, len(keys), *keys, *args)
+            if result != NOT_SEEDED:
+                return
+            if not await CapacityEngine.seed_services(db, event_id, service_ids):
+                # Servicio eliminado: no hay stock que devolver
+                return
+
+    @staticmethod
+    async def rebalance(event_id: str) -> Optional[int]:
+        """Redistribuir en partes iguales la capacidad de un evento sharded"""
+        redis_conn = await get_redis()
+        shards = await CapacityEngine.get_shard_count(event_id)
+        if shards <= 1:
+            return None
+        result = await redis_conn.eval(
+            _REBALANCE_LUA, shards, *CapacityEngine.shard_keys(str(event_id), shards)
+        )
+        return None if result == NOT_SEEDED else int(result)
+
+    @staticmethod
+    async def _drain_service_deltas(event_id: str) -> Dict[str, int]:
+        """Tomar (y borrar) los deltas de stock pendientes de los servicios del evento"""
+        redis_conn = await get_redis()
+        fields = [
+            field async for field, _ in redis_conn.hscan_iter(
+                CapacityEngine.SERVICE_PENDING_KEY, match=f"{event_id}:*"
+            )
+        ]
+        if not fields:
+            return {}
+
+        deltas = await redis_conn.eval(_DRAIN_MANY_LUA, 1, CapacityEngine.SERVICE_PENDING_KEY, *fields)
+        return {
+            field.split(":", 1)[1]: int(delta)
+            for field, delta in zip(fields, deltas)
+            if delta is not None and int(delta) != 0
+        }
+
+    @staticmethod
+    async def flush_event(db: AsyncSession, event_id: str) -> int:
+        """
+        Escribir en la DB el delta pendiente de un evento (y de sus servicios)
+
+        Un dueño cuyo lease venció y que ya fue reemplazado no escribe: el
+        UPDATE exige capacity_fence < token y los deltas vuelven al hash.
+
+        Returns:
+            Delta de capacidad aplicado (0 si no había cambios pendientes)
+        """
+        redis_conn = await get_redis()
+        event_id = str(event_id)
+
+        async with CapacityEngine._sync_lock(event_id) as lock:
+            delta = await redis_conn.eval(_DRAIN_LUA, 1, CapacityEngine.PENDING_KEY, event_id)
+            delta = int(delta) if delta is not None else 0
+            service_deltas = await CapacityEngine._drain_service_deltas(event_id)
+            if delta == 0 and not service_deltas:
+                return 0
+
+            try:
+                # El token de esta adquisición queda en la fila: si otro dueño
+                # (con un token mayor) ya escribió, el UPDATE no aplica nada
+                fenced = await db.execute(
+                    text("""
+                        UPDATE events
+                        SET capacity_available = LEAST(capacity_total, GREATEST(0, capacity_available + :delta)),
+                            capacity_fence = :fence
+                        WHERE id = CAST(:event_id AS uuid) AND capacity_fence < :fence
+                        RETURNING id
+                    """),
+                    {"delta": delta, "event_id": event_id, "fence": lock.token}
+                )
+                if fenced.first() is None:
+                    await CapacityEngine._reject_fence(db, event_id, lock)
+                if service_deltas:
+                    await db.execute(
+                        text("""
+                            UPDATE event_services
+                            SET stock_available = LEAST(stock, GREATEST(0, stock_available + :delta))
+                            WHERE id = CAST(:service_id AS uuid) AND stock > 0
+                        """),
+                        [
+                            {"delta": service_delta, "service_id": service_id}
+                            for service_id, service_delta in service_deltas.items()
+                        ]
+                    )
+                # Si el lease venció, otra siembra pudo leer la DB sin este delta
+                await lock.validate()
+                await db.commit()
+            except Exception:
+                await db.rollback()
+                # Devolver los deltas al hash para el siguiente ciclo
+                if delta:
+                    await redis_conn.hincrby(CapacityEngine.PENDING_KEY, event_id, delta)
+                for service_id, service_delta in service_deltas.items():
+                    await redis_conn.hincrby(
+                        CapacityEngine.SERVICE_PENDING_KEY,
+                        CapacityEngine.service_pending_field(event_id, service_id),
+                        service_delta
+                    )
+                raise
+
+            return delta
+
+    @staticmethod
+    async def _reject_fence(db: AsyncSession, event_id: str, lock: DistributedLock):
+        """
+        El UPDATE con fencing no aplicó: decidir si el evento no existe o si
+        el token quedó viejo
+
+        Raises:
+            LockError si la DB ya tiene un token igual o mayor
+        """
+        result = await db.execute(
+            text("SELECT capacity_fence FROM events WHERE id = CAST(:event_id AS uuid)"),
+            {"event_id": event_id}
+        )
+        stored = result.scalar_one_or_none()
+        if stored is None:
+            # Evento borrado: no hay fila que proteger
+            return
+        # Si Redis perdió el contador de tokens, la próxima adquisición lo supera
+        await lock.advance_fence(stored)
+        raise LockError(
+            f"Write-back de capacidad rechazado para evento {event_id}: token {lock.token} <= {stored}"
+        )
+
+    @staticmethod
+    async def flush_all(db: AsyncSession) -> Dict[str, int]:
+        """Escribir en la DB los deltas pendientes de todos los eventos"""
+        redis_conn = await get_redis()
+        event_ids = set(await redis_conn.hkeys(CapacityEngine.PENDING_KEY))
+        event_ids.update(
+            field.split(":", 1)[0]
+            for field in await redis_conn.hkeys(CapacityEngine.SERVICE_PENDING_KEY)
+        )
+
+        flushed = {}
+        for event_id in event_ids:
+            try:
+                delta = await CapacityEngine.flush_event(db, event_id)
+            except Exception as e:
+                logger.error(f"Error escribiendo capacidad del evento {event_id}: {e}")
+                continue
+            if delta:
+                flushed[event_id] = delta
+
+        return flushed
+
+    @staticmethod
+    async def invalidate(event_id: str):
+        """
+        Descartar los contadores de un evento para que se vuelvan a sembrar
+        desde la DB (p.ej. después de editar capacity_total)
+
+        El delta pendiente se conserva: la siguiente siembra lo suma al valor
+        de la DB y el write-back lo aplica igual.
+        """
+        redis_conn = await get_redis()
+        event_id = str(event_id)
+
+        seeded_shards = await redis_conn.get(CapacityEngine.shards_meta_key(event_id))
+        keys = [
+            CapacityEngine.available_key(event_id),
+            CapacityEngine.total_key(event_id),
+            CapacityEngine.shards_meta_key(event_id),
+        ]
+        if seeded_shards:
+            keys.extend(CapacityEngine.shard_keys(event_id, int(seeded_shards)))
+
+        await redis_conn.delete(*keys)
+
+    @staticmethod
+    async def invalidate_services(service_ids: List[str]):
+        """Descartar contadores de stock para volver a sembrarlos (conserva los deltas)"""
+        if not service_ids:
+            return
+        redis_conn = await get_redis()
+        keys = []
+        for service_id in service_ids:
+            keys.append(CapacityEngine.service_available_key(str(service_id)))
+            keys.append(CapacityEngine.service_total_key(str(service_id)))
+        await redis_conn.delete(*keys)
+
+    @staticmethod
+    async def discard_services(event_id: str, service_ids: List[str]):
+        """Borrar contadores y deltas pendientes de servicios eliminados"""
+        if not service_ids:
+            return
+        redis_conn = await get_redis()
+        await CapacityEngine.invalidate_services(service_ids)
+        await redis_conn.hdel(
+            CapacityEngine.SERVICE_PENDING_KEY,
+            *[CapacityEngine.service_pending_field(str(event_id), str(service_id)) for service_id in service_ids]
+        )
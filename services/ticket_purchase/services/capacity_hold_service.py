@@ -0,0 +1,200 @@
+"""
+Holds de capacidad con expiración
+
+Cada orden pendiente de pago (Mercado Pago / Payku) registra un hold en el
+sorted set `capacity:holds` con su timestamp de expiración como score. Un
+sweeper periódico toma los holds vencidos, marca las órdenes como `expired`
+y devuelve la capacidad (y el stock de servicios) al inventario.
+
+El sorted set es un índice, no la fuente de verdad: el sweeper además busca
+en la DB las órdenes online pendientes creadas hace más de HOLD_TTL_SECONDS.
+"""
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, update, func
+from typing import List, Optional
+from datetime import timedelta
+from redis.exceptions import RedisError
+from shared.database.models import Order, OrderItem, OrderServiceItem
+from shared.cache.redis_client import get_redis
+from services.ticket_purchase.services.inventory_service import InventoryService
+from services.ticket_purchase.services.order_status_hub import OrderStatusHub
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Segundos que una orden pendiente mantiene su capacidad reservada
+HOLD_TTL_SECONDS = int(os.getenv("CAPACITY_HOLD_TTL_SECONDS", "900"))
+
+# Proveedores cuyas órdenes pendientes retienen capacidad solo mientras dura el hold
+ONLINE_PROVIDERS = ("mercadopago", "payku")
+
+REDIS_FAILURES = (RedisError, OSError)
+
+
+class CapacityHoldService:
+    """Holds de capacidad por orden con TTL"""
+
+    HOLDS_KEY = "capacity:holds"
+
+    @staticmethod
+    async def place_hold(order_id: str, ttl: Optional[int] = None) -> float:
+        """
+        Registrar (o renovar) el hold de una orden
+
+        Returns:
+            Timestamp epoch de expiración
+        """
+        redis_conn = await get_redis()
+        expires_at = time.time() + (ttl or HOLD_TTL_SECONDS)
+        await redis_conn.zadd(CapacityHoldService.HOLDS_KEY, {str(order_id): expires_at})
+        return expires_at
+
+    @staticmethod
+    async def release_hold(order_id: str) -> bool:
+        """
+        Quitar el hold de una orden (pagada o cancelada)
+
+        Returns:
+            True si la orden tenía un hold activo
+        """
+        redis_conn = await get_redis()
+        removed = await redis_conn.zrem(CapacityHoldService.HOLDS_KEY, str(order_id))
+        return bool(removed)
+
+    @staticmethod
+    async def get_expired(limit: int = 100) -> List[str]:
+        """Obtener hasta `limit` órdenes cuyo hold ya venció"""
+        redis_conn = await get_redis()
+        return await redis_conn.zrangebyscore(
+            CapacityHoldService.HOLDS_KEY, "-inf", time.time(), start=0, num=limit
+        )
+
+    @staticmethod
+    async def get_overdue(db: AsyncSession, limit: int = 100) -> List[str]:
+        """
+        Órdenes online pendientes más viejas que el TTL del hold, según la DB
+
+        Respaldo del sorted set: cubre las órdenes cuyo hold nunca llegó a
+        Redis (caída entre el commit y place_hold) o se perdió (flush,
+        eviction, failover).
+        """
+        result = await db.execute(
+            select(Order.id)
+            .where(
+                Order.status == "pending",
+                Order.payment_provider.in_(ONLINE_PROVIDERS),
+                Order.created_at < func.now() - timedelta(seconds=HOLD_TTL_SECONDS),
+            )
+            .order_by(Order.created_at)
+            .limit(limit)
+        )
+        return [str(order_id) for order_id in result.scalars().all()]
+
+    @staticmethod
+    async def _expire_orders(db: AsyncSession, order_ids: List[str]) -> List[str]:
+        """
+        Expirar las órdenes aún pendientes de `order_ids` y liberar su capacidad (con commit)
+
+        El UPDATE condicional (status = 'pending') garantiza que solo se libera
+        capacidad de órdenes que este sweeper efectivamente expiró, aunque
+        corran varios en paralelo o el pago llegue al mismo tiempo.
+
+        Returns:
+            IDs de las órdenes expiradas
+        """
+        result = await db.execute(
+            update(Order)
+            .where(Order.id.in_(order_ids), Order.status == "pending")
+            .values(status="expired")
+            .returning(Order.id)
+        )
+        expired_ids = [row.id for row in result]
+
+        # {event_id: (cantidad, {service_id: cantidad})}
+        released = {}
+        if expired_ids:
+            # Agrupar cantidades por evento para liberar una vez por evento
+            result_items = await db.execute(
+                select(OrderItem.event_id, func.sum(OrderItem.quantity))
+                .where(OrderItem.order_id.in_(expired_ids))
+                .group_by(OrderItem.event_id)
+            )
+            for event_id, quantity in result_items:
+                released[str(event_id)] = (int(quantity), {})
+
+            result_services = await db.execute(
+                select(OrderServiceItem.event_id, OrderServiceItem.service_id, func.sum(OrderServiceItem.quantity))
+                .where(OrderServiceItem.order_id.in_(expired_ids))
+                .group_by(OrderServiceItem.event_id, OrderServiceItem.service_id)
+            )
+            for event_id, service_id, quantity in result_services:
+                released.setdefault(str(event_id), (0, {}))[1][str(service_id)] = int(quantity)
+
+        await db.commit()
+
+        for event_id, (quantity, services) in released.items():
+            try:
+                await InventoryService.release_order(
+                    db, event_id, quantity, services, "hold_expired"
+                )
+            except Exception as e:
+                logger.error(f"Error liberando capacidad expirada del evento {event_id}: {e}")
+
+        try:
+            redis_conn = await get_redis()
+            await redis_conn.zrem(CapacityHoldService.HOLDS_KEY, *order_ids)
+        except REDIS_FAILURES as e:
+            # Sin hold en el índice la orden ya no es 'pending': no se vuelve a tomar
+            logger.warning(f"No se pudieron quitar {len(order_ids)} holds del índice: {e}")
+
+        for order_id in expired_ids:
+            await OrderStatusHub.publish(order_id, "expired")
+
+        return [str(order_id) for order_id in expired_ids]
+
+    @staticmethod
+    async def sweep_expired(db: AsyncSession, batch_size: int = 100) -> int:
+        """
+        Expirar órdenes con hold vencido y liberar su capacidad por lotes
+
+        El sorted set es solo un índice rápido: después de vaciarlo se buscan
+        en la DB las órdenes online que siguen pendientes pasado el TTL, así
+        que una orden sin hold en Redis no retiene su capacidad para siempre.
+        Si Redis no responde se usa solo la DB.
+
+        Returns:
+            Cantidad de órdenes expiradas
+        """
+        total_expired = 0
+
+        try:
+            while True:
+                order_ids = await CapacityHoldService.get_expired(batch_size)
+                if not order_ids:
+                    break
+                total_expired += len(await CapacityHoldService._expire_orders(db, order_ids))
+                if len(order_ids) < batch_size:
+                    break
+        except REDIS_FAILURES as e:
+            await db.rollback()
+            logger.warning(f"Índice de holds no disponible, se expira solo desde la DB: {e}")
+
+        backstop_expired = 0
+        while True:
+            order_ids = await CapacityHoldService.get_overdue(db, batch_size)
+            if not order_ids:
+                break
+            backstop_expired += len(await CapacityHoldService._expire_orders(db, order_ids))
+            if len(order_ids) < batch_size:
+                break
+
+        if backstop_expired:
+            logger.warning(f"{backstop_expired} órdenes pendientes expiradas sin hold en Redis")
+        total_expired += backstop_expired
+
+        if total_expired:
+            logger.info(f"{total_expired} órdenes pendientes expiradas y capacidad liberada")
+
+        return total_expired
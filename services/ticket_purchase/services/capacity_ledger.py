@@ -0,0 +1,261 @@
+"""
+Ledger de capacidad (capacity_logs) con escritura diferida
+
+Cada reserva/liberación del backend redis deja su entrada en la lista
+`capacity:ledger:buffer` en vez de insertar una fila dentro de la transacción
+de la compra. La tarea `flush_capacity_ledger` vacía el buffer con un INSERT
+multi-fila, y `rollup_capacity_ledger` compacta las entradas antiguas en
+capacity_log_rollups (evento / hora / motivo) para que la tabla no crezca sin
+límite en eventos grandes.
+"""
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import text
+from redis.exceptions import RedisError
+from typing import Dict, List, Optional
+from shared.database.models import CapacityLog
+from shared.cache.redis_client import get_redis
+from datetime import datetime, timedelta, timezone
+import json
+import logging
+import os
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Entradas más antiguas que esto se compactan en capacity_log_rollups
+LEDGER_RETENTION_HOURS = int(os.getenv("CAPACITY_LEDGER_RETENTION_HOURS", "72"))
+LEDGER_FLUSH_BATCH = 1000
+LEDGER_ROLLUP_BATCH = 5000
+
+# Los motivos por orden ("order_<uuid>", "manual_order_<uuid>") se agrupan
+# sin el ID al compactar: order, manual_order, order_late_payment, ...
+_REASON_ID_PATTERN = r"_?[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}"
+
+
+# KEYS: buffer | ARGV: batch_size
+# Toma y recorta el inicio de la lista en una sola operación
+_POP_BATCH_LUA = """
+local entries = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #entries > 0 then
+    redis.call('LTRIM', KEYS[1], #entries, -1)
+end
+return entries
+"""
+
+# Eventos eliminados mientras sus entradas esperaban en el buffer se descartan
+_INSERT_BATCH_SQL = text("""
+    INSERT INTO capacity_logs (id, event_id, delta, reason, caused_by_user, created_at)
+    SELECT l.id, l.event_id, l.delta, l.reason, l.caused_by_user, l.created_at
+    FROM unnest(
+        CAST(:ids AS uuid[]),
+        CAST(:event_ids AS uuid[]),
+        CAST(:deltas AS int[]),
+        CAST(:reasons AS text[]),
+        CAST(:users AS uuid[]),
+        CAST(:created_at AS timestamptz[])
+    ) AS l(id, event_id, delta, reason, caused_by_user, created_at)
+    WHERE EXISTS (SELECT 1 FROM events e WHERE e.id = l.event_id)
+""")
+
+_ROLLUP_SQL = text("""
+    WITH moved AS (
+        DELETE FROM capacity_logs
+        WHERE id IN (
+            SELECT id FROM capacity_logs
+            WHERE created_at < :cutoff
+            ORDER BY created_at
+            LIMIT :batch_size
+        )
+        RETURNING event_id, created_at, delta, reason
+    ), rolled AS (
+        INSERT INTO capacity_log_rollups AS r (event_id, bucket, reason, delta_total, entries)
+        SELECT
+            event_id,
+            date_trunc('hour', created_at),
+            COALESCE(regexp_replace(reason, :id_pattern, '', 'g'), 'unknown'),
+            sum(delta),
+            count(*)
+        FROM moved
+        GROUP BY 1, 2, 3
+        ON CONFLICT (event_id, bucket, reason) DO UPDATE
+        SET delta_total = r.delta_total + EXCLUDED.delta_total,
+            entries = r.entries + EXCLUDED.entries
+    )
+    SELECT count(*) FROM moved
+""")
+
+_HISTORY_SQL = text("""
+    SELECT bucket, reason, sum(delta_total) AS delta, sum(entries) AS entries
+    FROM (
+        SELECT bucket, reason, delta_total, entries
+        FROM capacity_log_rollups
+        WHERE event_id = CAST(:event_id AS uuid) AND bucket >= :since AND bucket < :until
+        UNION ALL
+        SELECT
+            date_trunc('hour', created_at),
+            COALESCE(regexp_replace(reason, :id_pattern, '', 'g'), 'unknown'),
+            delta,
+            1
+        FROM capacity_logs
+        WHERE event_id = CAST(:event_id AS uuid) AND created_at >= :since AND created_at < :until
+    ) history
+    GROUP BY bucket, reason
+    ORDER BY bucket, reason
+""")
+
+
+class CapacityLedger:
+    """Buffer en Redis + escritura por lotes + rollup por hora de capacity_logs"""
+
+    BUFFER_KEY = "capacity:ledger:buffer"
+
+    @staticmethod
+    async def record(
+        db: AsyncSession,
+        event_id: str,
+        delta: int,
+        reason: str,
+        caused_by_user: Optional[str] = None,
+        commit: bool = False
+    ):
+        """
+        Registrar un movimiento de capacidad ya confirmado
+
+        Llamar después del commit del movimiento: el buffer de Redis no se
+        revierte con la transacción, así que registrar antes deja entradas
+        fantasma si el commit falla.
+
+        Si Redis no está disponible la entrada se agrega a la sesión como
+        CapacityLog: se confirma con la transacción del llamador, o en una
+        propia con commit=True.
+        """
+        entry = {
+            "id": str(uuid.uuid4()),
+            "event_id": str(event_id),
+            "delta": int(delta),
+            "reason": reason,
+            "caused_by_user": str(caused_by_user) if caused_by_user else None,
+            "ts": time.time(),
+        }
+        try:
+            redis_conn = await get_redis()
+            await redis_conn.rpush(CapacityLedger.BUFFER_KEY, json.dumps(entry))
+        except (RedisError, OSError) as e:
+            logger.warning(f"Buffer del ledger no disponible ({e}), escribiendo capacity_log directo")
+            db.add(CapacityLog(
+                id=uuid.UUID(entry["id"]),
+                event_id=event_id,
+                delta=delta,
+                reason=reason,
+                caused_by_user=caused_by_user,
+                created_at=datetime.utcnow()
+            ))
+            if commit:
+                try:
+                    await db.commit()
+                except Exception as commit_error:
+                    # El movimiento ya está confirmado: perder la entrada no debe romper al llamador
+                    await db.rollback()
+                    logger.error(f"No se pudo escribir capacity_log de {event_id} ({delta}, {reason}): {commit_error}")
+
+    @staticmethod
+    async def flush(db: AsyncSession, batch_size: int = LEDGER_FLUSH_BATCH) -> int:
+        """
+        Escribir en capacity_logs las entradas del buffer
+
+        Returns:
+            Cantidad de entradas tomadas del buffer
+        """
+        redis_conn = await get_redis()
+        total = 0
+
+        while True:
+            raw_entries = await redis_conn.eval(_POP_BATCH_LUA, 1, CapacityLedger.BUFFER_KEY, batch_size)
+            if not raw_entries:
+                break
+
+            entries = [json.loads(raw) for raw in raw_entries]
+            try:
+                await db.execute(_INSERT_BATCH_SQL, {
+                    "ids": [entry["id"] for entry in entries],
+                    "event_ids": [entry["event_id"] for entry in entries],
+                    "deltas": [entry["delta"] for entry in entries],
+                    "reasons": [entry["reason"] for entry in entries],
+                    "users": [entry["caused_by_user"] for entry in entries],
+                    "created_at": [datetime.fromtimestamp(entry["ts"], tz=timezone.utc) for entry in entries],
+                })
+                await db.commit()
+            except Exception:
+                await db.rollback()
+                # Devolver el lote al inicio del buffer en el mismo orden
+                await redis_conn.lpush(CapacityLedger.BUFFER_KEY, *reversed(raw_entries))
+                raise
+
+            total += len(entries)
+            if len(entries) < batch_size:
+                break
+
+        return total
+
+    @staticmethod
+    async def rollup(
+        db: AsyncSession,
+        retention_hours: int = LEDGER_RETENTION_HOURS,
+        batch_size: int = LEDGER_ROLLUP_BATCH
+    ) -> int:
+        """
+        Compactar capacity_logs más antiguos que `retention_hours` en
+        capacity_log_rollups, por lotes de `batch_size` filas
+
+        Returns:
+            Cantidad de entradas compactadas
+        """
+        cutoff = datetime.now(timezone.utc) - timedelta(hours=retention_hours)
+        total = 0
+
+        while True:
+            result = await db.execute(_ROLLUP_SQL, {
+                "cutoff": cutoff,
+                "batch_size": batch_size,
+                "id_pattern": _REASON_ID_PATTERN,
+            })
+            moved = result.scalar() or 0
+            await db.commit()
+
+            total += moved
+            if moved < batch_size:
+                break
+
+        return total
+
+    @staticmethod
+    async def get_history(
+        db: AsyncSession,
+        event_id: str,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None
+    ) -> List[Dict]:
+        """
+        Historial de capacidad de un evento por hora y motivo
+
+        Combina los agregados compactados con las entradas recientes.
+        """
+        until = until or datetime.now(timezone.utc)
+        since = since or until - timedelta(days=30)
+
+        result = await db.execute(_HISTORY_SQL, {
+            "event_id": str(event_id),
+            "since": since,
+            "until": until,
+            "id_pattern": _REASON_ID_PATTERN,
+        })
+        return [
+            {
+                "bucket": row.bucket,
+                "reason": row.reason,
+                "delta": int(row.delta),
+                "entries": int(row.entries),
+            }
+            for row in result
+        ]
@@ -0,0 +1,308 @@
+"""
+Verificación y reparación offline de la capacidad de los eventos
+
+events.capacity_available se mantiene de forma incremental: se descuenta al
+reservar (orden creada) y se devuelve al cancelar/expirar. La emisión de
+tickets no vuelve a contar nada. Este servicio recalcula lo esperado a partir
+de las órdenes activas y los tickets para detectar (y opcionalmente corregir)
+desvíos causados fuera del camino de compra: ediciones de capacidad, el
+stored procedure confirm_pending_order, fallas a mitad de una compra, etc.
+
+La reconciliación completa recorre los eventos con un cursor del lado del
+servidor y calcula cada lote con SQL agregado, así que la memoria usada no
+depende de la cantidad de eventos ni de tickets.
+
+La reparación automática solo baja capacity_available (drift > 0) y solo en
+eventos sin órdenes más nuevas que la ventana de hold. Una reserva de Redis
+puede aplicarse a la DB antes de que su orden confirme, así que un
+capacity_available menor que lo esperado puede ser una compra en curso: ese
+desvío nunca se corrige solo, se reporta (como "en curso" si el evento tiene
+órdenes recientes, o para revisión manual si no).
+"""
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, text
+from typing import Dict, List, Optional
+from shared.database.models import Event
+from services.ticket_purchase.services.inventory_service import InventoryService
+from services.ticket_purchase.services.capacity_ledger import CapacityLedger
+from services.ticket_purchase.services.capacity_hold_service import HOLD_TTL_SECONDS
+import logging
+
+logger = logging.getLogger(__name__)
+
+RECONCILE_BATCH_SIZE = 500
+# Cantidad máxima de desvíos detallados en el reporte
+MAX_REPORTED_DISCREPANCIES = 100
+
+# Asientos esperados por evento:
+#   reserved_seats = órdenes que mantienen capacidad (pending/processing/completed)
+#   stray_tickets  = tickets vigentes cuya orden ya no está activa (siguen ocupando lugar)
+#   ledger_net     = suma del ledger (capacity_logs + rollups), solo informativo
+#   recent_seats   = asientos de órdenes más nuevas que la ventana de hold
+# capacity_log_rollups solo existe si se aplicó docs/sql/capacity_log_rollups.sql:
+# sin la tabla el ledger se calcula solo con capacity_logs
+_ROLLUPS_LEDGER_SQL = """
+            UNION ALL
+            SELECT event_id, delta_total FROM capacity_log_rollups
+            WHERE event_id IN (SELECT id FROM batch)"""
+
+_AUDIT_BATCH_SQL_TEMPLATE = """
+    WITH batch AS (
+        SELECT unnest(CAST(:event_ids AS uuid[])) AS id
+    ), reserved AS (
+        SELECT
+            oi.event_id,
+            sum(oi.quantity) AS seats,
+            sum(oi.quantity) FILTER (
+                WHERE o.created_at > now() - make_interval(secs => CAST(:hold_seconds AS integer))
+            ) AS recent_seats
+        FROM order_items oi
+        JOIN orders o ON o.id = oi.order_id
+        WHERE oi.event_id IN (SELECT id FROM batch)
+          AND o.status IN ('pending', 'processing', 'completed')
+        GROUP BY oi.event_id
+    ), ticket_counts AS (
+        SELECT
+            t.event_id,
+            count(*) AS active_tickets,
+            count(*) FILTER (WHERE o.status NOT IN ('pending', 'processing', 'completed')) AS stray_tickets
+        FROM tickets t
+        JOIN order_items oi ON oi.id = t.order_item_id
+        JOIN orders o ON o.id = oi.order_id
+        WHERE t.event_id IN (SELECT id FROM batch) AND t.status <> 'cancelled'
+        GROUP BY t.event_id
+    ), ledger AS (
+        SELECT event_id, sum(delta) AS net
+        FROM (
+            SELECT event_id, delta FROM capacity_logs
+            WHERE event_id IN (SELECT id FROM batch){rollups}
+        ) entries
+        GROUP BY event_id
+    ), audit AS (
+        SELECT
+            e.id AS event_id,
+            e.capacity_total,
+            e.capacity_available,
+            COALESCE(r.seats, 0) AS reserved_seats,
+            COALESCE(r.recent_seats, 0) AS recent_seats,
+            COALESCE(tc.active_tickets, 0) AS active_tickets,
+            COALESCE(tc.stray_tickets, 0) AS stray_tickets,
+            COALESCE(l.net, 0) AS ledger_net,
+            GREATEST(0, e.capacity_total - COALESCE(r.seats, 0) - COALESCE(tc.stray_tickets, 0)) AS expected_available
+        FROM events e
+        JOIN batch b ON b.id = e.id
+        LEFT JOIN reserved r ON r.event_id = e.id
+        LEFT JOIN ticket_counts tc ON tc.event_id = e.id
+        LEFT JOIN ledger l ON l.event_id = e.id
+    )
+    SELECT *, capacity_available - expected_available AS drift
+    FROM audit
+    WHERE NOT :only_drift OR capacity_available <> expected_available
+"""
+
+_AUDIT_BATCH_SQL = text(_AUDIT_BATCH_SQL_TEMPLATE.format(rollups=_ROLLUPS_LEDGER_SQL))
+_AUDIT_BATCH_NO_ROLLUPS_SQL = text(_AUDIT_BATCH_SQL_TEMPLATE.format(rollups=""))
+
+# Corrección optimista: solo se toca la fila si no cambió desde la auditoría, y
+# solo para bajar capacity_available (la dirección que no puede sobrevender)
+_REPAIR_BATCH_SQL = text("""
+    UPDATE events e
+    SET capacity_available = f.expected
+    FROM unnest(
+        CAST(:event_ids AS uuid[]),
+        CAST(:observed AS int[]),
+        CAST(:expected AS int[])
+    ) AS f(id, observed, expected)
+    WHERE e.id = f.id AND e.capacity_available = f.observed AND f.expected < f.observed
+    RETURNING e.id, f.expected - f.observed AS delta
+""")
+
+
+class CapacityReconciliationService:
+    """Comparar la capacidad mantenida incrementalmente con las órdenes reales"""
+
+    # ¿Existe capacity_log_rollups? (se consulta una vez por proceso)
+    _has_rollups: Optional[bool] = None
+
+    @classmethod
+    async def _audit_sql(cls, db: AsyncSession):
+        if cls._has_rollups is None:
+            cls._has_rollups = bool(await db.scalar(
+                text("SELECT to_regclass('capacity_log_rollups') IS NOT NULL")
+            ))
+            if not cls._has_rollups:
+                logger.warning(
+                    "capacity_log_rollups no existe (docs/sql/capacity_log_rollups.sql): "
+                    "el ledger de la auditoría usa solo capacity_logs"
+                )
+        return _AUDIT_BATCH_SQL if cls._has_rollups else _AUDIT_BATCH_NO_ROLLUPS_SQL
+
+    @staticmethod
+    def _row_to_report(row) -> Dict:
+        drift = int(row.drift)
+        return {
+            "event_id": str(row.event_id),
+            "capacity_total": row.capacity_total,
+            "capacity_available": row.capacity_available,
+            "reserved_seats": int(row.reserved_seats),
+            "active_tickets": int(row.active_tickets),
+            "stray_tickets": int(row.stray_tickets),
+            "ledger_net": int(row.ledger_net),
+            "expected_available": int(row.expected_available),
+            "drift": drift,
+            "recent_seats": int(row.recent_seats),
+            # Solo se corrige automáticamente hacia abajo y sin órdenes en la ventana de hold
+            "repairable": drift > 0 and not int(row.recent_seats),
+            "in_flight": drift != 0 and int(row.recent_seats) > 0,
+        }
+
+    @staticmethod
+    async def _audit_batch(db: AsyncSession, event_ids: List[str], only_drift: bool) -> List[Dict]:
+        sql = await CapacityReconciliationService._audit_sql(db)
+        result = await db.execute(sql, {
+            "event_ids": [str(event_id) for event_id in event_ids],
+            "only_drift": only_drift,
+            "hold_seconds": HOLD_TTL_SECONDS,
+        })
+        return [CapacityReconciliationService._row_to_report(row) for row in result]
+
+    @staticmethod
+    async def audit_event(db: AsyncSession, event_id: str) -> Optional[Dict]:
+        """
+        Calcular la capacidad esperada de un evento y su desvío
+
+        Aplica primero los deltas pendientes de Redis para comparar contra el
+        valor real. No corrige nada.
+
+        Returns:
+            Reporte del evento, o None si no existe
+        """
+        event_id = str(event_id)
+        await InventoryService.flush_pending(db, event_id)
+
+        reports = await CapacityReconciliationService._audit_batch(db, [event_id], only_drift=False)
+        if not reports:
+            return None
+
+        report = reports[0]
+        if report["drift"]:
+            logger.warning(
+                f"Desvío de capacidad en evento {event_id}: "
+                f"capacity_available={report['capacity_available']}, esperado={report['expected_available']}"
+            )
+        return report
+
+    @staticmethod
+    async def _repair_batch(db: AsyncSession, discrepancies: List[Dict]) -> int:
+        """
+        Corregir en bloque los eventos asentados con capacity_available de más
+
+        Antes de corregir se aplican los deltas de Redis de cada evento y se
+        vuelve a auditar, para no pisar reservas recién hechas. Los desvíos
+        hacia arriba (capacidad de menos) no se tocan: pueden ser compras en
+        curso y subir la capacidad podría sobrevender.
+        """
+        event_ids = [item["event_id"] for item in discrepancies if item["repairable"]]
+        if not event_ids:
+            return 0
+        for event_id in event_ids:
+            await InventoryService.flush_pending(db, event_id)
+
+        confirmed = [
+            item for item in await CapacityReconciliationService._audit_batch(db, event_ids, only_drift=True)
+            if item["repairable"]
+        ]
+        if not confirmed:
+            await db.commit()
+            return 0
+
+        result = await db.execute(_REPAIR_BATCH_SQL, {
+            "event_ids": [item["event_id"] for item in confirmed],
+            "observed": [item["capacity_available"] for item in confirmed],
+            "expected": [item["expected_available"] for item in confirmed],
+        })
+        repaired = result.all()
+
+        await db.commit()
+        for event_id, delta in repaired:
+            await CapacityLedger.record(db, str(event_id), int(delta), "reconciliation", commit=True)
+
+        # Los contadores de Redis se vuelven a sembrar desde el valor corregido
+        for event_id, _ in repaired:
+            await InventoryService.invalidate_counters(db, str(event_id))
+
+        return len(repaired)
+
+    @staticmethod
+    async def reconcile_all(
+        stream_db: AsyncSession,
+        db: AsyncSession,
+        repair: bool = False,
+        batch_size: int = RECONCILE_BATCH_SIZE
+    ) -> Dict:
+        """
+        Auditar (y opcionalmente reparar) la capacidad de todos los eventos
+
+        Args:
+            stream_db: Sesión que mantiene abierto el cursor sobre events
+            db: Sesión para las consultas agregadas y las correcciones
+            repair: Corregir capacity_available de los eventos con desvío
+            batch_size: Eventos por lote
+
+        Returns:
+            Resumen con conteos y hasta MAX_REPORTED_DISCREPANCIES desvíos
+        """
+        summary = {
+            "events_checked": 0,
+            "discrepancies": 0,
+            "repaired": 0,
+            "needs_review": 0,
+            "in_flight": 0,
+            "total_drift": 0,
+            "details": [],
+        }
+
+        # Partir de la DB al día con los contadores de Redis
+        await InventoryService.flush_all_pending(db)
+
+        result = await stream_db.stream(
+            select(Event.id).order_by(Event.id).execution_options(yield_per=batch_size)
+        )
+        async for partition in result.partitions(batch_size):
+            event_ids = [str(row.id) for row in partition]
+            summary["events_checked"] += len(event_ids)
+
+            discrepancies = await CapacityReconciliationService._audit_batch(db, event_ids, only_drift=True)
+            # Cerrar la transacción de lectura entre lotes
+            await db.commit()
+            if not discrepancies:
+                continue
+
+            summary["discrepancies"] += len(discrepancies)
+            summary["in_flight"] += sum(1 for item in discrepancies if item["in_flight"])
+            summary["needs_review"] += sum(
+                1 for item in discrepancies if item["drift"] < 0 and not item["in_flight"]
+            )
+            summary["total_drift"] += sum(item["drift"] for item in discrepancies)
+            room = MAX_REPORTED_DISCREPANCIES - len(summary["details"])
+            if room > 0:
+                summary["details"].extend(discrepancies[:room])
+
+            if repair:
+                try:
+                    summary["repaired"] += await CapacityReconciliationService._repair_batch(db, discrepancies)
+                except Exception as e:
+                    await db.rollback()
+                    logger.error(f"Error corrigiendo capacidad de {len(discrepancies)} eventos: {e}")
+
+        await stream_db.commit()
+
+        if summary["discrepancies"]:
+            logger.warning(
+                f"Reconciliación de capacidad: {summary['discrepancies']} eventos con desvío "
+                f"(drift total {summary['total_drift']}), {summary['repaired']} corregidos, "
+                f"{summary['needs_review']} con capacidad de menos para revisar, "
+                f"{summary['in_flight']} con compras en curso"
+            )
+
+        return summary
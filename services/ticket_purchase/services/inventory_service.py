@@ -1,16 +1,227 @@
 """Servicio de gestión de inventario y capacidad"""
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
-from typing import List, Tuple
-from shared.database.models import Event, TicketType, CapacityLog
-from shared.cache.redis_client import DistributedLock
-from datetime import datetime
+from sqlalchemy import select, text
+from redis.exceptions import RedisError
+from typing import Dict, Optional, Set, Tuple
+from shared.database.models import Event
+from services.ticket_purchase.services.capacity_ledger import CapacityLedger
+from services.ticket_purchase.services.capacity_engine import (
+    CapacityEngine, INSUFFICIENT, STOCK_INSUFFICIENT
+)
+import logging
+import os
 import uuid
 
+logger = logging.getLogger(__name__)
+
+# Backend de inventario por deployment:
+#   redis    -> contadores atómicos en Redis con write-back (por defecto)
+#   database -> UPDATE condicional directo sobre events (sin Redis)
+INVENTORY_BACKEND = os.getenv("INVENTORY_BACKEND", "redis").lower()
+
+# Errores de Redis que activan el fallback a la DB
+REDIS_FAILURES = (RedisError, OSError)
+
+# Eventos (y servicios, como "service:{id}") modificados por el fallback
+# mientras Redis estaba caído. Sus contadores deben volver a sembrarse desde
+# la DB cuando Redis se recupere. Este set es solo el atajo del proceso: la
+# marca compartida queda en la tabla inventory_degraded.
+_degraded_events: Set[str] = set()
+
+# Clave en session.info con las reservas hechas en Redis por reserve_order(commit=False)
+# que todavía esperan el commit del llamador
+PENDING_RESERVATIONS_KEY = "inventory_pending_reservations"
+
+
+# Reserva + log de capacidad en un solo round trip
+_RESERVE_SQL = text("""
+    WITH reserved AS (
+        UPDATE events
+        SET capacity_available = capacity_available - :quantity
+        WHERE id = CAST(:event_id AS uuid) AND capacity_available >= :quantity
+        RETURNING id, capacity_available
+    ), logged AS (
+        INSERT INTO capacity_logs (id, event_id, delta, reason, created_at)
+        SELECT CAST(:log_id AS uuid), id, -:quantity, :reason, now() FROM reserved
+    )
+    SELECT capacity_available FROM reserved
+""")
+
+_RELEASE_SQL = text("""
+    WITH released AS (
+        UPDATE events
+        SET capacity_available = LEAST(capacity_total, capacity_available + :quantity)
+        WHERE id = CAST(:event_id AS uuid)
+        RETURNING id, capacity_available
+    ), logged AS (
+        INSERT INTO capacity_logs (id, event_id, delta, reason, created_at)
+        SELECT CAST(:log_id AS uuid), id, :quantity, :reason, now() FROM released
+    )
+    SELECT capacity_available FROM released
+""")
+
+# Asientos + stock de servicios en una sentencia. Cada UPDATE solo toma las
+# filas que alcanzan; si faltó alguna, el savepoint se revierte completo.
+# Servicios con stock <= 0 son ilimitados: cuentan como reservados sin descontar.
+_RESERVE_ORDER_SQL = text("""
+    WITH requested AS (
+        SELECT * FROM unnest(CAST(:service_ids AS uuid[]), CAST(:service_quantities AS int[]))
+            AS r(service_id, quantity)
+    ), reserved AS (
+        UPDATE events
+        SET capacity_available = capacity_available - :quantity
+        WHERE id = CAST(:event_id AS uuid) AND capacity_available >= :quantity
+        RETURNING id
+    ), reserved_services AS (
+        UPDATE event_services es
+        SET stock_available = CASE WHEN es.stock > 0
+            THEN es.stock_available - r.quantity ELSE es.stock_available END
+        FROM requested r
+        WHERE es.id = r.service_id
+          AND es.event_id = CAST(:event_id AS uuid)
+          AND (es.stock <= 0 OR es.stock_available >= r.quantity)
+        RETURNING es.id
+    ), logged AS (
+        INSERT INTO capacity_logs (id, event_id, delta, reason, created_at)
+        SELECT CAST(:log_id AS uuid), id, -:quantity, :reason, now() FROM reserved
+    )
+    SELECT
+        (SELECT count(*) FROM reserved) AS events_reserved,
+        (SELECT count(*) FROM reserved_services) AS services_reserved
+""")
+
+_RELEASE_SERVICES_SQL = text("""
+    UPDATE event_services es
+    SET stock_available = LEAST(es.stock, es.stock_available + r.quantity)
+    FROM unnest(CAST(:service_ids AS uuid[]), CAST(:service_quantities AS int[]))
+        AS r(service_id, quantity)
+    WHERE es.id = r.service_id AND es.stock > 0
+""")
+
+# Marca compartida: se escribe en la transacción del fallback, así que solo
+# queda si el cambio en la DB se confirma
+_MARK_DEGRADED_SQL = text("""
+    INSERT INTO inventory_degraded (key, marked_at)
+    SELECT unnest(CAST(:keys AS text[])), now()
+    ON CONFLICT (key) DO UPDATE SET marked_at = EXCLUDED.marked_at
+""")
+
+_CLAIM_DEGRADED_SQL = text("""
+    SELECT key FROM inventory_degraded
+    ORDER BY marked_at
+    LIMIT :limit
+    FOR UPDATE SKIP LOCKED
+""")
+
+_CLEAR_DEGRADED_SQL = text("""
+    DELETE FROM inventory_degraded WHERE key = ANY(CAST(:keys AS text[]))
+""")
+
+STOCK_MESSAGE = "Stock insuficiente para uno de los servicios seleccionados"
+
+
+class _ReservationRejected(Exception):
+    """Reserva de orden rechazada dentro del savepoint (revierte todo)"""
+
 
 class InventoryService:
     """Servicio para manejar inventario y capacidad de eventos"""
-    
+
+    _has_degraded_table: Optional[bool] = None
+
+    @staticmethod
+    def uses_redis() -> bool:
+        return INVENTORY_BACKEND != "database"
+
+    @classmethod
+    async def _degraded_table_ready(cls, db: AsyncSession) -> bool:
+        if cls._has_degraded_table is None:
+            cls._has_degraded_table = bool(await db.scalar(
+                text("SELECT to_regclass('inventory_degraded') IS NOT NULL")
+            ))
+            if not cls._has_degraded_table:
+                logger.warning(
+                    "inventory_degraded no existe (docs/sql/inventory_degraded.sql): "
+                    "las marcas de fallback quedan solo en memoria del proceso"
+                )
+        return cls._has_degraded_table
+
+    @staticmethod
+    async def _resync_degraded_events():
+        """Descartar contadores de eventos modificados durante el fallback"""
+        while _degraded_events:
+            event_id = _degraded_events.pop()
+            try:
+                if event_id.startswith("service:"):
+                    await CapacityEngine.invalidate_services([event_id.split(":", 1)[1]])
+                else:
+                    await CapacityEngine.invalidate(event_id)
+            except REDIS_FAILURES:
+                _degraded_events.add(event_id)
+                raise
+
+    @staticmethod
+    async def _mark_degraded(db: AsyncSession, event_id: str, error: Exception, service_ids=()):
+        """
+        Marcar contadores a resembrar, en el proceso y en inventory_degraded
+
+        La fila compartida va en la transacción del llamador (en un savepoint,
+        para no abortarla si falla) y la consume resync_shared_degraded.
+        """
+        logger.warning(f"Redis no disponible para inventario ({error}), usando la DB para evento {event_id}")
+        keys = [str(event_id)] + [f"service:{service_id}" for service_id in service_ids]
+        _degraded_events.update(keys)
+        try:
+            if await InventoryService._degraded_table_ready(db):
+                async with db.begin_nested():
+                    await db.execute(_MARK_DEGRADED_SQL, {"keys": keys})
+        except Exception as e:
+            logger.error(f"No se pudo registrar la marca compartida de inventario para {event_id}: {e}")
+
+    @staticmethod
+    async def resync_shared_degraded(db: AsyncSession, limit: int = 500) -> int:
+        """
+        Descartar los contadores marcados en inventory_degraded (con commit)
+
+        Cubre las marcas de procesos que cayeron al fallback y terminaron (o
+        nunca volvieron a tocar esos eventos) antes de que Redis se recupere.
+        Si Redis sigue caído las marcas quedan para la próxima pasada.
+
+        Returns:
+            Cantidad de contadores descartados
+        """
+        if not InventoryService.uses_redis() or not await InventoryService._degraded_table_ready(db):
+            return 0
+
+        result = await db.execute(_CLAIM_DEGRADED_SQL, {"limit": limit})
+        keys = list(result.scalars().all())
+        if not keys:
+            await db.commit()
+            return 0
+
+        try:
+            event_ids = [key for key in keys if not key.startswith("service:")]
+            service_ids = [key.split(":", 1)[1] for key in keys if key.startswith("service:")]
+            for event_id in event_ids:
+                await CapacityEngine.invalidate(event_id)
+            if service_ids:
+                await CapacityEngine.invalidate_services(service_ids)
+        except REDIS_FAILURES as e:
+            await db.rollback()
+            logger.warning(f"Redis sigue sin responder, {len(keys)} contadores degradados pendientes: {e}")
+            return 0
+
+        await db.execute(_CLEAR_DEGRADED_SQL, {"keys": keys})
+        await db.commit()
+        return len(keys)
+
+    @staticmethod
+    def _normalize_services(services: Optional[Dict[str, int]]) -> Dict[str, int]:
+        """{service_id: cantidad} sin cantidades en cero"""
+        if not services:
+            return {}
+        return {str(service_id): int(quantity) for service_id, quantity in services.items() if int(quantity) > 0}
+
     @staticmethod
     async def check_capacity(
         db: AsyncSession,
@@ -19,67 +230,80 @@ class InventoryService:
     ) -> Tuple[bool, str]:
         """
         Verificar si hay capacidad disponible
-        
+
         Returns:
             (is_available, message)
         """
-        stmt = select(Event).where(Event.id == event_id)
-        result = await db.execute(stmt)
-        event = result.scalar_one_or_none()
-        
-        if not event:
+        available = None
+        if InventoryService.uses_redis():
+            try:
+                available = await CapacityEngine.get_available(db, event_id)
+            except REDIS_FAILURES as e:
+                await InventoryService._mark_degraded(db, event_id, e)
+                available = await InventoryService._get_available_db(db, event_id)
+        else:
+            available = await InventoryService._get_available_db(db, event_id)
+
+        if available is None:
             return False, "Evento no encontrado"
-        
-        if event.capacity_available < quantity:
-            return False, f"Capacidad insuficiente. Disponible: {event.capacity_available}, Solicitado: {quantity}"
-        
+
+        if available < quantity:
+            return False, f"Capacidad insuficiente. Disponible: {available}, Solicitado: {quantity}"
+
         return True, "OK"
-    
+
     @staticmethod
     async def reserve_capacity(
         db: AsyncSession,
         event_id: str,
         quantity: int,
-        reason: str = "ticket_purchase"
+        reason: str = "ticket_purchase",
+        commit: bool = True
     ) -> bool:
         """
-        Reservar capacidad usando lock distribuido
-        
+        Reservar capacidad sin locks
+
+        Con el backend redis el decremento es atómico en Redis y
+        events.capacity_available se actualiza en background; si Redis
+        falla se usa el UPDATE condicional en la DB.
+
+        Args:
+            commit: Si es False la reserva queda en la transacción del llamador,
+                que debe terminarla con commit_reservations/rollback_reservations
+
         Returns:
             True si se reservó, False si no había capacidad
         """
-        lock_key = f"event:capacity:{event_id}"
-        
-        async with DistributedLock(lock_key, timeout=5, expire=10):
-            # Verificar capacidad nuevamente dentro del lock
-            stmt = select(Event).where(Event.id == event_id)
-            result = await db.execute(stmt)
-            event = result.scalar_one_or_none()
-            
-            if not event:
-                return False
-            
-            if event.capacity_available < quantity:
-                return False
-            
-            # Decrementar capacidad
-            event.capacity_available -= quantity
-            
-            # Registrar en log
-            capacity_log = CapacityLog(
-                id=uuid.uuid4(),
-                event_id=event_id,
-                delta=-quantity,
-                reason=reason,
-                created_at=datetime.utcnow()
-            )
-            db.add(capacity_log)
-            
-            await db.commit()
-            await db.refresh(event)
-            
+        if not InventoryService.uses_redis():
+            return await InventoryService._reserve_db(db, event_id, quantity, reason, commit)
+
+        try:
+            await InventoryService._resync_degraded_events()
+            remaining = await CapacityEngine.reserve(db, event_id, quantity)
+        except REDIS_FAILURES as e:
+            await InventoryService._mark_degraded(db, event_id, e)
+            return await InventoryService._reserve_db(db, event_id, quantity, reason, commit)
+
+        if remaining == INSUFFICIENT:
+            return False
+
+        if not commit:
+            # El ledger se registra en commit_reservations
+            InventoryService._defer_reservation(db, event_id, quantity, {}, reason)
             return True
-    
+
+        try:
+            await db.commit()
+        except Exception:
+            # Compensar la reserva si la transacción no se pudo confirmar
+            await db.rollback()
+            await CapacityEngine.release(db, event_id, quantity)
+            raise
+
+        # Registrar en el ledger (buffer en Redis, se escribe por lotes)
+        await CapacityLedger.record(db, event_id, -quantity, reason, commit=True)
+        return True
+
     @staticmethod
     async def release_capacity(
         db: AsyncSession,
@@ -87,30 +311,298 @@ class InventoryService:
         quantity: int,
         reason: str = "order_cancelled"
     ):
-        """Liberar capacidad reservada"""
-        lock_key = f"event:capacity:{event_id}"
-        
-        async with DistributedLock(lock_key, timeout=5, expire=10):
-            stmt = select(Event).where(Event.id == event_id)
-            result = await db.execute(stmt)
-            event = result.scalar_one_or_none()
-            
-            if not event:
-                return
-            
-            # Incrementar capacidad (sin exceder el total)
-            new_capacity = min(event.capacity_available + quantity, event.capacity_total)
-            event.capacity_available = new_capacity
-            
-            # Registrar en log
-            capacity_log = CapacityLog(
-                id=uuid.uuid4(),
-                event_id=event_id,
-                delta=quantity,
-                reason=reason,
-                created_at=datetime.utcnow()
-            )
-            db.add(capacity_log)
-            
+        """Liberar capacidad reservada (sin exceder capacity_total)"""
+        if not InventoryService.uses_redis():
+            await InventoryService._release_db(db, event_id, quantity, reason)
+            return
+
+        try:
+            await InventoryService._resync_degraded_events()
+            available = await CapacityEngine.release(db, event_id, quantity)
+        except REDIS_FAILURES as e:
+            await InventoryService._mark_degraded(db, event_id, e)
+            await InventoryService._release_db(db, event_id, quantity, reason)
+            return
+
+        if available is None:
+            return
+
+        await db.commit()
+
+        # Registrar en el ledger (buffer en Redis, se escribe por lotes)
+        await CapacityLedger.record(db, event_id, quantity, reason, commit=True)
+
+    @staticmethod
+    async def reserve_order(
+        db: AsyncSession,
+        event_id: str,
+        quantity: int,
+        services: Optional[Dict[str, int]] = None,
+        reason: str = "ticket_purchase",
+        commit: bool = True
+    ) -> Tuple[bool, str]:
+        """
+        Reservar asientos del evento y stock de servicios adicionales (todo o nada)
+
+        Args:
+            services: {service_id: cantidad} de servicios del evento
+            commit: Si es False la reserva queda en la transacción del llamador,
+                que debe terminarla con commit_reservations/rollback_reservations
+
+        Returns:
+            (reserved, message)
+        """
+        services = InventoryService._normalize_services(services)
+        if not services:
+            reserved = await InventoryService.reserve_capacity(db, event_id, quantity, reason, commit)
+            return reserved, "OK" if reserved else "No se pudo reservar capacidad"
+
+        if not InventoryService.uses_redis():
+            return await InventoryService._reserve_order_db(db, event_id, quantity, services, reason, commit)
+
+        try:
+            await InventoryService._resync_degraded_events()
+            result, _ = await CapacityEngine.reserve_order(db, event_id, quantity, services)
+        except REDIS_FAILURES as e:
+            await InventoryService._mark_degraded(db, event_id, e, services.keys())
+            return await InventoryService._reserve_order_db(db, event_id, quantity, services, reason, commit)
+
+        if result == INSUFFICIENT:
+            return False, "No se pudo reservar capacidad"
+        if result == STOCK_INSUFFICIENT:
+            return False, STOCK_MESSAGE
+
+        if not commit:
+            # El ledger se registra en commit_reservations
+            InventoryService._defer_reservation(db, event_id, quantity, services, reason)
+            return True, "OK"
+
+        try:
+            await db.commit()
+        except Exception:
+            # Compensar la reserva si la transacción no se pudo confirmar
+            await db.rollback()
+            await CapacityEngine.release_services(db, event_id, services)
+            await CapacityEngine.release(db, event_id, quantity)
+            raise
+
+        # Registrar en el ledger (buffer en Redis, se escribe por lotes)
+        await CapacityLedger.record(db, event_id, -quantity, reason, commit=True)
+        return True, "OK"
+
+    @staticmethod
+    def _defer_reservation(
+        db: AsyncSession,
+        event_id: str,
+        quantity: int,
+        services: Dict[str, int],
+        reason: str
+    ):
+        """Recordar en la sesión una reserva de Redis que depende del commit del llamador"""
+        db.info.setdefault(PENDING_RESERVATIONS_KEY, []).append((str(event_id), quantity, services, reason))
+
+    @staticmethod
+    async def commit_reservations(db: AsyncSession):
+        """
+        Confirmar la transacción que contiene reservas hechas con commit=False
+
+        Si el commit falla se revierten también las reservas de Redis. Las
+        entradas del ledger se registran recién después del commit.
+        """
+        try:
+            await db.commit()
+        except Exception:
+            await InventoryService.rollback_reservations(db)
+            raise
+        for event_id, quantity, _services, reason in db.info.pop(PENDING_RESERVATIONS_KEY, []):
+            await CapacityLedger.record(db, event_id, -quantity, reason, commit=True)
+
+    @staticmethod
+    async def rollback_reservations(db: AsyncSession):
+        """
+        Revertir la transacción y las reservas hechas con commit=False
+
+        Las reservas del fallback en DB se deshacen con el rollback; las de
+        Redis se devuelven a los contadores.
+        """
+        await db.rollback()
+        for event_id, quantity, services, _reason in db.info.pop(PENDING_RESERVATIONS_KEY, []):
+            try:
+                if services:
+                    await CapacityEngine.release_services(db, event_id, services)
+                await CapacityEngine.release(db, event_id, quantity)
+            except REDIS_FAILURES as e:
+                logger.error(
+                    f"No se pudo devolver la reserva de {quantity} asientos del evento {event_id}: {e}"
+                )
+
+    @staticmethod
+    async def release_order(
+        db: AsyncSession,
+        event_id: str,
+        quantity: int,
+        services: Optional[Dict[str, int]] = None,
+        reason: str = "order_cancelled"
+    ):
+        """Liberar asientos y stock de servicios de una orden"""
+        services = InventoryService._normalize_services(services)
+        if services:
+            if not InventoryService.uses_redis():
+                await InventoryService._release_services_db(db, services)
+            else:
+                try:
+                    await InventoryService._resync_degraded_events()
+                    await CapacityEngine.release_services(db, event_id, services)
+                except REDIS_FAILURES as e:
+                    await InventoryService._mark_degraded(db, event_id, e, services.keys())
+                    await InventoryService._release_services_db(db, services)
+
+        if quantity > 0:
+            await InventoryService.release_capacity(db, event_id, quantity, reason)
+
+    @staticmethod
+    async def flush_pending(db: AsyncSession, event_id: str):
+        """Escribir en la DB las reservas de Redis aún no aplicadas al evento"""
+        if not InventoryService.uses_redis():
+            return
+        try:
+            await CapacityEngine.flush_event(db, event_id)
+        except REDIS_FAILURES as e:
+            await InventoryService._mark_degraded(db, event_id, e)
+
+    @staticmethod
+    async def flush_all_pending(db: AsyncSession):
+        """Escribir en la DB los deltas pendientes de todos los eventos"""
+        if not InventoryService.uses_redis():
+            return
+        try:
+            await CapacityEngine.flush_all(db)
+        except REDIS_FAILURES as e:
+            logger.warning(f"No se pudieron aplicar los deltas de capacidad pendientes: {e}")
+
+    @staticmethod
+    async def invalidate_counters(db: AsyncSession, event_id: str, removed_service_ids=()):
+        """
+        Forzar que los contadores del evento se vuelvan a sembrar desde la DB
+
+        Se llama después del commit del cambio; si Redis falla, la marca
+        compartida se confirma sola.
+
+        Args:
+            removed_service_ids: servicios eliminados del evento (se descartan
+                sus contadores y deltas pendientes)
+        """
+        if not InventoryService.uses_redis():
+            return
+        removed_service_ids = [str(service_id) for service_id in removed_service_ids]
+        try:
+            await CapacityEngine.invalidate(event_id)
+            await CapacityEngine.discard_services(event_id, removed_service_ids)
+        except REDIS_FAILURES as e:
+            await InventoryService._mark_degraded(db, event_id, e, removed_service_ids)
+            await db.commit()
+
+    @staticmethod
+    async def configure_shards(db: AsyncSession, event_id: str, shards: int) -> Tuple[int, Optional[int]]:
+        """
+        Configurar cuántos sub-contadores usa la capacidad de un evento
+
+        Solo disponible con el backend redis.
+
+        Returns:
+            (shards, capacity_available agregada)
+        """
+        if not InventoryService.uses_redis():
+            raise ValueError("El sharding de capacidad requiere INVENTORY_BACKEND=redis")
+
+        shards = await CapacityEngine.set_shard_count(db, event_id, shards)
+        available = await CapacityEngine.get_available(db, event_id)
+        if available is None:
+            raise ValueError("Evento no encontrado")
+
+        return shards, available
+
+    @staticmethod
+    async def _get_available_db(db: AsyncSession, event_id: str) -> Optional[int]:
+        stmt = select(Event.capacity_available).where(Event.id == event_id)
+        result = await db.execute(stmt)
+        return result.scalar_one_or_none()
+
+    @staticmethod
+    async def _reserve_db(
+        db: AsyncSession,
+        event_id: str,
+        quantity: int,
+        reason: str,
+        commit: bool = True
+    ) -> bool:
+        """Reserva con UPDATE condicional + insert del log en la misma sentencia"""
+        result = await db.execute(_RESERVE_SQL, {
+            "event_id": str(event_id),
+            "quantity": quantity,
+            "log_id": str(uuid.uuid4()),
+            "reason": reason,
+        })
+        remaining = result.scalar_one_or_none()
+
+        if remaining is None:
+            return False
+
+        if commit:
             await db.commit()
+        return True
+
+    @staticmethod
+    async def _release_db(
+        db: AsyncSession,
+        event_id: str,
+        quantity: int,
+        reason: str
+    ):
+        await db.execute(_RELEASE_SQL, {
+            "event_id": str(event_id),
+            "quantity": quantity,
+            "log_id": str(uuid.uuid4()),
+            "reason": reason,
+        })
+        await db.commit()
 
+    @staticmethod
+    async def _reserve_order_db(
+        db: AsyncSession,
+        event_id: str,
+        quantity: int,
+        services: Dict[str, int],
+        reason: str,
+        commit: bool = True
+    ) -> Tuple[bool, str]:
+        """Reserva de asientos + servicios en un savepoint"""
+        try:
+            async with db.begin_nested():
+                result = await db.execute(_RESERVE_ORDER_SQL, {
+                    "event_id": str(event_id),
+                    "quantity": quantity,
+                    "service_ids": list(services.keys()),
+                    "service_quantities": list(services.values()),
+                    "log_id": str(uuid.uuid4()),
+                    "reason": reason,
+                })
+                row = result.one()
+                if row.events_reserved != 1:
+                    raise _ReservationRejected("No se pudo reservar capacidad")
+                if row.services_reserved != len(services):
+                    raise _ReservationRejected(STOCK_MESSAGE)
+        except _ReservationRejected as e:
+            return False, str(e)
+
+        if commit:
+            await db.commit()
+        return True, "OK"
+
+    @staticmethod
+    async def _release_services_db(db: AsyncSession, services: Dict[str, int]):
+        await db.execute(_RELEASE_SERVICES_SQL, {
+            "service_ids": list(services.keys()),
+            "service_quantities": list(services.values()),
+        })
+        await db.commit()
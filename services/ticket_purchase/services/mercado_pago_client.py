@@ -0,0 +1,83 @@
+"""
+Cliente asyncio de la API REST de Mercado Pago
+
+Cubre los endpoints que usa MercadoPagoService (preferencias, pagos y
+merchant orders) sobre el cliente httpx compartido del upstream
+`mercadopago`, sin threads. Las respuestas tienen la misma forma que las del
+SDK oficial (`{"status": <http>, "response": <json>}`), así que el manejo de
+errores de MercadoPagoService es el mismo para ambos caminos.
+"""
+from typing import Dict, Optional
+from urllib.parse import urlencode
+from shared.utils.http_clients import get_http_client
+import logging
+import os
+import uuid
+
+logger = logging.getLogger(__name__)
+
+MERCADOPAGO_API_URL = os.getenv("MERCADOPAGO_API_URL", "https://api.mercadopago.com")
+
+
+class MercadoPagoClient:
+    """Endpoints de Mercado Pago usados por el backend"""
+
+    def __init__(self, access_token: str):
+        self.access_token = access_token
+
+    async def _request(
+        self,
+        method: str,
+        path: str,
+        json: Optional[Dict] = None,
+        headers: Optional[Dict[str, str]] = None
+    ) -> Dict:
+        request_headers = {
+            "Authorization": f"Bearer {self.access_token}",
+            "Content-Type": "application/json",
+        }
+        if method == "POST":
+            # Mercado Pago exige X-Idempotency-Key en los POST de pagos
+            request_headers["X-Idempotency-Key"] = str(uuid.uuid4())
+        if headers:
+            request_headers.update(headers)
+
+        response = await get_http_client("mercadopago").request(
+            method,
+            f"{MERCADOPAGO_API_URL}{path}",
+            json=json,
+            headers=request_headers
+        )
+
+        try:
+            body = response.json() if response.content else {}
+        except ValueError:
+            body = {"message": response.text}
+
+        result = {"status": response.status_code, "response": body}
+        if response.status_code >= 400 and isinstance(body, dict):
+            result["message"] = body.get("message") or body.get("error") or "Error desconocido"
+        return result
+
+    async def create_preference(self, preference_data: Dict) -> Dict:
+        return await self._request("POST", "/checkout/preferences", json=preference_data)
+
+    async def get_preference(self, preference_id: str) -> Dict:
+        return await self._request("GET", f"/checkout/preferences/{preference_id}")
+
+    async def create_payment(self, payment_data: Dict, headers: Optional[Dict[str, str]] = None) -> Dict:
+        return await self._request("POST", "/v1/payments", json=payment_data, headers=headers)
+
+    async def get_payment(self, payment_id: str) -> Dict:
+        return await self._request("GET", f"/v1/payments/{payment_id}")
+
+    async def get_merchant_order(self, merchant_order_id: str) -> Dict:
+        return await self._request("GET", f"/merchant_orders/{merchant_order_id}")
+
+    async def search_payments(self, external_reference: str) -> Dict:
+        query = urlencode({
+            "external_reference": external_reference,
+            "sort": "date_created",
+            "criteria": "desc",
+        })
+        return await self._request("GET", f"/v1/payments/search?{query}")
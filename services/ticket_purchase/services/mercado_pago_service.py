@@ -1,15 +1,38 @@
 """Servicio de integración con Mercado Pago - Con soporte async"""
 import os
-import asyncio
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple
 import mercadopago
+from mercadopago.config import RequestOptions
 import httpx
 from datetime import datetime, timedelta
 from app.core.config import settings
+from services.ticket_purchase.services.mercado_pago_client import MercadoPagoClient
+from shared.utils.single_flight import SingleFlight
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Una sola consulta en curso por pago / merchant order (webhooks repetidos, polling)
+_verifications = SingleFlight("mercadopago_verify")
+
+# Estados de pago que cierran la orden (el dinero se devolvió). Un rechazo no:
+# el comprador puede reintentar con otro medio hasta que venza el hold. Misma
+# política en webhook, /process-payment y reconciliador.
+MERCADOPAGO_CANCEL_STATUSES = ("refunded", "charged_back")
+
+
+class MercadoPagoAPIError(Exception):
+    """Respuesta de error de la API de Mercado Pago (con su status HTTP)"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+    @property
+    def permanent(self) -> bool:
+        """4xx distinto de 429: reintentar no cambia la respuesta (p.ej. recurso inexistente)"""
+        return self.status_code is not None and 400 <= self.status_code < 500 and self.status_code != 429
+
 
 class MercadoPagoService:
     """Servicio para manejar pagos con Mercado Pago"""
@@ -25,6 +48,8 @@ class MercadoPagoService:
 
         self.access_token = access_token
         self.sdk = mercadopago.SDK(access_token)
+        # Cliente async nativo (httpx compartido) para los métodos *_async
+        self.client = MercadoPagoClient(access_token)
         self.webhook_secret = settings.MERCADOPAGO_WEBHOOK_SECRET or os.getenv("MERCADOPAGO_WEBHOOK_SECRET")
         self.environment = settings.MERCADOPAGO_ENVIRONMENT or os.getenv("MERCADOPAGO_ENVIRONMENT", "sandbox")
 
@@ -65,46 +90,20 @@ class MercadoPagoService:
             print(f"[ERROR] Error validando token: {str(e)}")
             return False
 
-    def create_preference(
+    def _build_preference_data(
         self,
         order_id: str,
-        title: str = "",
-        total_amount: float = 0.0,
-        currency: str = "CLP",
-        description: str = "",
-        items: Optional[list] = None,
-        back_urls: Optional[Dict[str, str]] = None,
-        payer_email: Optional[str] = None,
-        payer_name: Optional[str] = None,
-        payer_identification: Optional[Dict[str, str]] = None
+        title: str,
+        total_amount: float,
+        currency: str,
+        description: str,
+        items: Optional[list],
+        back_urls: Optional[Dict[str, str]],
+        payer_email: Optional[str],
+        payer_name: Optional[str],
+        payer_identification: Optional[Dict[str, str]]
     ) -> Dict:
-        """
-        Crear preferencia de pago en Mercado Pago
-
-        Args:
-            order_id: ID de la orden (external_reference)
-            title: Título general (usado si no se proporcionan items)
-            total_amount: Monto total (usado si no se proporcionan items)
-            currency: Moneda (CLP, USD, etc.)
-            description: Descripción general
-            items: Lista de items con estructura:
-                [
-                    {
-                        "title": "Nombre del item",
-                        "description": "Descripción opcional",
-                        "quantity": 2,
-                        "unit_price": 15000.0
-                    },
-                    ...
-                ]
-            back_urls: URLs de retorno personalizadas
-
-        Returns:
-            dict con preference_id y init_point (payment_link)
-
-        Nota: Si se proporcionan items, se usan esos. Si no, se usa title/total_amount
-        para mantener compatibilidad con código existente.
-        """
+        """Armar el body de la preferencia (ver create_preference)"""
         # URLs de retorno
         # Nota: Estas URLs deben coincidir con las rutas del frontend
         # IMPORTANTE: Mercado Pago puede rechazar URLs HTTP en sandbox
@@ -243,16 +242,10 @@ class MercadoPagoService:
             print(f"[ERROR MercadoPago] back_urls en preference_data: {preference_data.get('back_urls')}")
             raise ValueError("Las back_urls no pueden estar vacías en la preferencia")
 
-        # Crear preferencia
-        try:
-            preference_response = self.sdk.preference().create(preference_data)
-        except Exception as e:
-            # Capturar errores de conexión o del SDK
-            error_msg = f"Error al comunicarse con Mercado Pago: {str(e)}"
-            print(f"[ERROR] {error_msg}")
-            print(f"[ERROR] Token usado: {self.access_token[:30]}...{self.access_token[-20:]}")
-            raise Exception(error_msg)
+        return preference_data
 
+    def _parse_preference_response(self, preference_response: Dict, back_urls: Dict[str, str]) -> Dict:
+        """Validar la respuesta de creación de preferencia y extraer el link de pago"""
         if preference_response["status"] != 201:
             error_message = preference_response.get('message', 'Error desconocido')
             error_status = preference_response.get('status', 'N/A')
@@ -351,51 +344,99 @@ class MercadoPagoService:
             "init_point": preference.get("init_point")
         }
 
+    def create_preference(
+        self,
+        order_id: str,
+        title: str = "",
+        total_amount: float = 0.0,
+        currency: str = "CLP",
+        description: str = "",
+        items: Optional[list] = None,
+        back_urls: Optional[Dict[str, str]] = None,
+        payer_email: Optional[str] = None,
+        payer_name: Optional[str] = None,
+        payer_identification: Optional[Dict[str, str]] = None
+    ) -> Dict:
+        """
+        Crear preferencia de pago en Mercado Pago
+
+        Args:
+            order_id: ID de la orden (external_reference)
+            title: Título general (usado si no se proporcionan items)
+            total_amount: Monto total (usado si no se proporcionan items)
+            currency: Moneda (CLP, USD, etc.)
+            description: Descripción general
+            items: Lista de items con estructura:
+                [
+                    {
+                        "title": "Nombre del item",
+                        "description": "Descripción opcional",
+                        "quantity": 2,
+                        "unit_price": 15000.0
+                    },
+                    ...
+                ]
+            back_urls: URLs de retorno personalizadas
+
+        Returns:
+            dict con preference_id y init_point (payment_link)
+
+        Nota: Si se proporcionan items, se usan esos. Si no, se usa title/total_amount
+        para mantener compatibilidad con código existente.
+        """
+        preference_data = self._build_preference_data(
+            order_id, title, total_amount, currency, description,
+            items, back_urls, payer_email, payer_name, payer_identification
+        )
+
+        # Crear preferencia
+        try:
+            preference_response = self.sdk.preference().create(preference_data)
+        except Exception as e:
+            # Capturar errores de conexión o del SDK
+            error_msg = f"Error al comunicarse con Mercado Pago: {str(e)}"
+            print(f"[ERROR] {error_msg}")
+            print(f"[ERROR] Token usado: {self.access_token[:30]}...{self.access_token[-20:]}")
+            raise Exception(error_msg)
+
+        return self._parse_preference_response(preference_response, preference_data["back_urls"])
+
     def get_preference(self, preference_id: str) -> Optional[Dict]:
         """Obtener una preferencia existente por su ID"""
         try:
             preference_response = self.sdk.preference().get(preference_id)
-
-            if preference_response["status"] != 200:
-                print(f"[WARNING] Error obteniendo preferencia {preference_id}: {preference_response.get('message')}")
-                return None
-
-            return preference_response["response"]
         except Exception as e:
             print(f"[ERROR] Excepción al obtener preferencia {preference_id}: {str(e)}")
             return None
+        return self._parse_get_preference_response(preference_id, preference_response)
 
-    def create_payment_with_token(
+    @staticmethod
+    def _parse_get_preference_response(preference_id: str, preference_response: Dict) -> Optional[Dict]:
+        if preference_response["status"] != 200:
+            print(f"[WARNING] Error obteniendo preferencia {preference_id}: {preference_response.get('message')}")
+            return None
+        return preference_response["response"]
+
+    def _build_payment_request(
         self,
         token: str,
         transaction_amount: float,
         description: str,
         installments: int,
         payment_method_id: str,
-        issuer_id: Optional[str] = None,
-        payer_email: Optional[str] = None,
-        payer_identification: Optional[Dict[str, str]] = None,
-        payer_first_name: Optional[str] = None,
-        payer_last_name: Optional[str] = None,
-        external_reference: Optional[str] = None,
-        device_id: Optional[str] = None
-    ) -> Dict:
+        issuer_id: Optional[str],
+        payer_email: Optional[str],
+        payer_identification: Optional[Dict[str, str]],
+        payer_first_name: Optional[str],
+        payer_last_name: Optional[str],
+        external_reference: Optional[str],
+        device_id: Optional[str]
+    ) -> Tuple[Dict, Dict[str, str]]:
         """
-        Crear un pago usando un token de tarjeta generado por el Payment Brick
-
-        Args:
-            token: Token de la tarjeta generado por el Payment Brick
-            transaction_amount: Monto de la transacción
-            description: Descripción del pago
-            installments: Número de cuotas
-            payment_method_id: ID del método de pago (ej: 'master', 'visa')
-            issuer_id: ID del emisor de la tarjeta (opcional)
-            payer_email: Email del pagador
-            payer_identification: Identificación del pagador (tipo y número)
-            external_reference: Referencia externa (order_id)
+        Armar body y headers del pago con token (ver create_payment_with_token)
 
         Returns:
-            dict con la respuesta del pago de Mercado Pago
+            (payment_data, headers extra: X-Idempotency-Key y X-meli-session-id)
         """
         payment_data = {
             "transaction_amount": float(transaction_amount),
@@ -501,12 +542,10 @@ class MercadoPagoService:
                 f"Cambia MERCADOPAGO_ENVIRONMENT a 'sandbox' o usa un token de producción."
             )
 
-        # Si estamos en sandbox pero el token es APP_USR-, el SDK puede intentar usar la API de producción
-        # Solución: Usar la API directamente con requests especificando la URL base de sandbox
+        # Con token APP_USR- el entorno lo decide el token, no la URL: avisar si no coincide
         if not token_is_test and is_sandbox_env:
             print(f"[WARNING MercadoPago] ⚠️  Token APP_USR- detectado en entorno sandbox")
-            print(f"[WARNING MercadoPago]    Usando API directa con URL de sandbox para evitar 'Unauthorized use of live credentials'")
-            print(f"[WARNING MercadoPago]    Esto es necesario porque el SDK puede usar la API de producción con tokens APP_USR-")
+            print(f"[WARNING MercadoPago]    Mercado Pago puede responder 'Unauthorized use of live credentials'")
 
         print(f"[DEBUG MercadoPago] Creando pago con token:")
         print(f"[DEBUG MercadoPago]   - environment: {self.environment}")
@@ -520,131 +559,20 @@ class MercadoPagoService:
         print(f"[DEBUG MercadoPago]   - payer_email: {payer_email}")
         print(f"[DEBUG MercadoPago]   - payment_data completo: {payment_data}")
 
-        # Si estamos en sandbox con token APP_USR-, usar la API directamente con requests
-        # para forzar el uso de la URL de sandbox
-        if not token_is_test and is_sandbox_env:
-            try:
-                # URL base de la API de Mercado Pago para sandbox
-                # Para Chile (MLC), la URL de sandbox es la misma pero el token determina el entorno
-                # Sin embargo, podemos intentar usar la API directamente
-                api_url = "https://api.mercadopago.com/v1/payments"
-
-                headers = {
-                    "Authorization": f"Bearer {self.access_token}",
-                    "Content-Type": "application/json",
-                    "X-Idempotency-Key": external_reference or f"payment_{datetime.utcnow().isoformat()}"
-                }
-
-                # Agregar Device ID si está disponible (importante para mejorar tasa de aprobación)
-                if device_id:
-                    headers["X-meli-session-id"] = device_id
-                    print(f"[DEBUG MercadoPago] ✅ Device ID incluido en header X-meli-session-id: {device_id[:20]}...")
-                else:
-                    print(f"[WARNING MercadoPago] ⚠️  Device ID no disponible. Esto puede afectar la tasa de aprobación.")
-
-                print(f"[DEBUG MercadoPago] Usando API directa (requests) para forzar sandbox")
-                print(f"[DEBUG MercadoPago]   - URL: {api_url}")
-                print(f"[DEBUG MercadoPago]   - Headers: Authorization: Bearer {self.access_token[:30]}...")
-
-                response = requests.post(api_url, json=payment_data, headers=headers, timeout=30)
-
-                print(f"[DEBUG MercadoPago] Respuesta HTTP: Status {response.status_code}")
-
-                if response.status_code not in [200, 201]:
-                    error_data = response.json() if response.text else {}
-                    error_message = error_data.get('message', 'Error desconocido')
-                    error_status = response.status_code
-                    error_cause = error_data.get('cause', [])
-
-                    if error_cause:
-                        if isinstance(error_cause, list) and len(error_cause) > 0:
-                            error_message += f" - Causa: {error_cause[0]}"
-                        else:
-                            error_message += f" - Causa: {error_cause}"
-
-                    if 'error' in error_data:
-                        error_message += f" - Error: {error_data['error']}"
-
-                    print(f"[ERROR] Error creando pago de Mercado Pago")
-                    print(f"[ERROR] Status HTTP: {error_status}")
-                    print(f"[ERROR] Mensaje: {error_message}")
-                    print(f"[ERROR] Respuesta completa: {error_data}")
-
-                    raise Exception(f"Error creando pago: {error_message}")
-
-                # Parsear respuesta exitosa
-                payment = response.json()
-                payment_response = {
-                    "status": response.status_code,
-                    "response": payment
-                }
-                print(f"[DEBUG MercadoPago] Pago creado exitosamente usando API directa")
-
-            except requests.exceptions.RequestException as e:
-                error_msg = f"Error al comunicarse con la API de Mercado Pago: {str(e)}"
-                print(f"[ERROR] {error_msg}")
-                import traceback
-                print(f"[ERROR] Traceback: {traceback.format_exc()}")
-                raise Exception(error_msg)
-            except Exception as e:
-                error_msg = f"Error al crear pago con Mercado Pago: {str(e)}"
-                print(f"[ERROR] {error_msg}")
-                import traceback
-                print(f"[ERROR] Traceback: {traceback.format_exc()}")
-                raise Exception(error_msg)
+        headers = {
+            "X-Idempotency-Key": external_reference or f"payment_{datetime.utcnow().isoformat()}"
+        }
+        # Device ID en X-meli-session-id (importante para mejorar tasa de aprobación)
+        if device_id:
+            headers["X-meli-session-id"] = device_id
+            print(f"[DEBUG MercadoPago] ✅ Device ID incluido en header X-meli-session-id: {device_id[:20]}...")
         else:
-            # Si tenemos Device ID, usar API directa para poder enviar el header X-meli-session-id
-            # El SDK no permite enviar headers personalizados
-            if device_id:
-                try:
-                    api_url = "https://api.mercadopago.com/v1/payments"
-                    headers = {
-                        "Authorization": f"Bearer {self.access_token}",
-                        "Content-Type": "application/json",
-                        "X-Idempotency-Key": external_reference or f"payment_{datetime.utcnow().isoformat()}",
-                        "X-meli-session-id": device_id  # Device ID para mejorar aprobación
-                    }
-
-                    print(f"[DEBUG MercadoPago] Usando API directa para incluir Device ID")
-                    print(f"[DEBUG MercadoPago]   - Device ID: {device_id[:20]}...")
-
-                    response = requests.post(api_url, json=payment_data, headers=headers, timeout=30)
-
-                    if response.status_code not in [200, 201]:
-                        error_data = response.json() if response.text else {}
-                        error_message = error_data.get('message', 'Error desconocido')
-                        raise Exception(f"Error creando pago: {error_message}")
-
-                    payment = response.json()
-                    payment_response = {
-                        "status": response.status_code,
-                        "response": payment
-                    }
-                    print(f"[DEBUG MercadoPago] Pago creado exitosamente con Device ID")
-                except requests.exceptions.RequestException as e:
-                    print(f"[WARNING MercadoPago] Error usando API directa con Device ID: {e}")
-                    print(f"[WARNING MercadoPago] Intentando con SDK como fallback...")
-                    # Fallback al SDK si falla la API directa
-                    payment_response = self.sdk.payment().create(payment_data)
-                    print(f"[DEBUG MercadoPago] Respuesta de Mercado Pago (SDK fallback): {payment_response}")
-                except Exception as e:
-                    print(f"[WARNING MercadoPago] Error usando API directa con Device ID: {e}")
-                    print(f"[WARNING MercadoPago] Intentando con SDK como fallback...")
-                    # Fallback al SDK si falla la API directa
-                    payment_response = self.sdk.payment().create(payment_data)
-                    print(f"[DEBUG MercadoPago] Respuesta de Mercado Pago (SDK fallback): {payment_response}")
-            else:
-                # Usar el SDK normalmente si no hay Device ID
-                try:
-                    payment_response = self.sdk.payment().create(payment_data)
-                    print(f"[DEBUG MercadoPago] Respuesta de Mercado Pago (SDK): {payment_response}")
-                except Exception as e:
-                    error_msg = f"Error al crear pago con Mercado Pago: {str(e)}"
-                    print(f"[ERROR] {error_msg}")
-                    import traceback
-                    print(f"[ERROR] Traceback: {traceback.format_exc()}")
-                    raise Exception(error_msg)
+            print(f"[WARNING MercadoPago] ⚠️  Device ID no disponible. Esto puede afectar la tasa de aprobación.")
+
+        return payment_data, headers
 
+    def _parse_payment_response(self, payment_response) -> Dict:
+        """Validar la respuesta de creación de pago y devolver el pago"""
         # El SDK de Mercado Pago puede retornar diferentes estructuras
         # Verificar si es un dict con 'status' o si es directamente la respuesta
         if isinstance(payment_response, dict):
@@ -703,12 +631,70 @@ class MercadoPagoService:
 
         return payment
 
+    def create_payment_with_token(
+        self,
+        token: str,
+        transaction_amount: float,
+        description: str,
+        installments: int,
+        payment_method_id: str,
+        issuer_id: Optional[str] = None,
+        payer_email: Optional[str] = None,
+        payer_identification: Optional[Dict[str, str]] = None,
+        payer_first_name: Optional[str] = None,
+        payer_last_name: Optional[str] = None,
+        external_reference: Optional[str] = None,
+        device_id: Optional[str] = None
+    ) -> Dict:
+        """
+        Crear un pago usando un token de tarjeta generado por el Payment Brick
+
+        Args:
+            token: Token de la tarjeta generado por el Payment Brick
+            transaction_amount: Monto de la transacción
+            description: Descripción del pago
+            installments: Número de cuotas
+            payment_method_id: ID del método de pago (ej: 'master', 'visa')
+            issuer_id: ID del emisor de la tarjeta (opcional)
+            payer_email: Email del pagador
+            payer_identification: Identificación del pagador (tipo y número)
+            external_reference: Referencia externa (order_id)
+
+        Returns:
+            dict con la respuesta del pago de Mercado Pago
+        """
+        payment_data, headers = self._build_payment_request(
+            token, transaction_amount, description, installments, payment_method_id,
+            issuer_id, payer_email, payer_identification, payer_first_name,
+            payer_last_name, external_reference, device_id
+        )
+
+        try:
+            payment_response = self.sdk.payment().create(
+                payment_data,
+                RequestOptions(custom_headers=headers)
+            )
+            print(f"[DEBUG MercadoPago] Respuesta de Mercado Pago (SDK): {payment_response}")
+        except Exception as e:
+            error_msg = f"Error al crear pago con Mercado Pago: {str(e)}"
+            print(f"[ERROR] {error_msg}")
+            import traceback
+            print(f"[ERROR] Traceback: {traceback.format_exc()}")
+            raise Exception(error_msg)
+
+        return self._parse_payment_response(payment_response)
+
     def verify_payment(self, payment_id: str) -> Dict:
         """Verificar estado de un pago"""
         payment_response = self.sdk.payment().get(payment_id)
+        return self._parse_verify_payment_response(payment_response)
 
+    @staticmethod
+    def _parse_verify_payment_response(payment_response: Dict) -> Dict:
         if payment_response["status"] != 200:
-            raise Exception(f"Error obteniendo pago: {payment_response.get('message')}")
+            raise MercadoPagoAPIError(
+                f"Error obteniendo pago: {payment_response.get('message')}", payment_response["status"]
+            )
 
         return payment_response["response"]
 
@@ -717,16 +703,21 @@ class MercadoPagoService:
         try:
             # Usar el SDK para obtener la orden
             order_response = self.sdk.merchant_order().get(order_id)
-
-            if order_response.get("status") != 200:
-                raise Exception(f"Error obteniendo orden: {order_response.get('message')}")
-
-            return order_response.get("response", {})
+            return self._parse_verify_order_response(order_response)
         except Exception as e:
             # Si falla, puede ser una simulación con datos de prueba
             print(f"⚠️  No se pudo obtener orden {order_id}: {e}")
             raise
 
+    @staticmethod
+    def _parse_verify_order_response(order_response: Dict) -> Dict:
+        if order_response.get("status") != 200:
+            raise MercadoPagoAPIError(
+                f"Error obteniendo orden: {order_response.get('message')}", order_response.get("status")
+            )
+
+        return order_response.get("response", {})
+
     def verify_webhook(
         self,
         data: Dict,
@@ -824,7 +815,7 @@ class MercadoPagoService:
             return False
 
     # =========================================================================
-    # MÉTODOS ASYNC - Wrappers para no bloquear el event loop
+    # MÉTODOS ASYNC - Cliente httpx nativo (sin thread pool), mismas firmas
     # =========================================================================
 
     async def create_preference_async(
@@ -840,36 +831,69 @@ class MercadoPagoService:
         payer_name: Optional[str] = None,
         payer_identification: Optional[Dict[str, str]] = None
     ) -> Dict:
-        """
-        Crear preferencia de pago en Mercado Pago (ASYNC)
-
-        Ejecuta el método síncrono en un thread pool para no bloquear el event loop.
-        """
-        return await asyncio.to_thread(
-            self.create_preference,
-            order_id=order_id,
-            title=title,
-            total_amount=total_amount,
-            currency=currency,
-            description=description,
-            items=items,
-            back_urls=back_urls,
-            payer_email=payer_email,
-            payer_name=payer_name,
-            payer_identification=payer_identification
+        """Crear preferencia de pago en Mercado Pago (ASYNC)"""
+        preference_data = self._build_preference_data(
+            order_id, title, total_amount, currency, description,
+            items, back_urls, payer_email, payer_name, payer_identification
         )
 
+        try:
+            preference_response = await self.client.create_preference(preference_data)
+        except httpx.HTTPError as e:
+            error_msg = f"Error al comunicarse con Mercado Pago: {str(e)}"
+            print(f"[ERROR] {error_msg}")
+            raise Exception(error_msg)
+
+        return self._parse_preference_response(preference_response, preference_data["back_urls"])
+
     async def get_preference_async(self, preference_id: str) -> Optional[Dict]:
         """Obtener una preferencia existente por su ID (ASYNC)"""
-        return await asyncio.to_thread(self.get_preference, preference_id)
+        try:
+            preference_response = await self.client.get_preference(preference_id)
+        except httpx.HTTPError as e:
+            print(f"[ERROR] Excepción al obtener preferencia {preference_id}: {str(e)}")
+            return None
+        return self._parse_get_preference_response(preference_id, preference_response)
 
     async def verify_payment_async(self, payment_id: str) -> Dict:
         """Verificar estado de un pago (ASYNC)"""
-        return await asyncio.to_thread(self.verify_payment, payment_id)
+        payment_response = await _verifications.do(
+            f"payment:{payment_id}", lambda: self.client.get_payment(payment_id)
+        )
+        return self._parse_verify_payment_response(payment_response)
 
     async def verify_order_async(self, order_id: str) -> Dict:
         """Verificar estado de una orden (ASYNC)"""
-        return await asyncio.to_thread(self.verify_order, order_id)
+        try:
+            order_response = await _verifications.do(
+                f"merchant_order:{order_id}", lambda: self.client.get_merchant_order(order_id)
+            )
+            return self._parse_verify_order_response(order_response)
+        except Exception as e:
+            # Si falla, puede ser una simulación con datos de prueba
+            print(f"⚠️  No se pudo obtener orden {order_id}: {e}")
+            raise
+
+    async def find_order_payment_status_async(self, order_id: str) -> Optional[str]:
+        """
+        Estado de pago de una orden buscando sus pagos por external_reference (ASYNC)
+
+        Returns:
+            "approved" si algún pago fue aprobado, si no el estado del pago más
+            reciente, o None si la orden aún no tiene pagos
+        """
+        search_response = await _verifications.do(
+            f"search:{order_id}", lambda: self.client.search_payments(order_id)
+        )
+        if search_response.get("status") != 200:
+            raise Exception(f"Error buscando pagos de la orden: {search_response.get('message')}")
+
+        payments = search_response.get("response", {}).get("results", [])
+        if not payments:
+            return None
+        if any(payment.get("status") == "approved" for payment in payments):
+            return "approved"
+        return payments[0].get("status")
 
     async def create_payment_with_token_async(
         self,
@@ -887,19 +911,18 @@ class MercadoPagoService:
         device_id: Optional[str] = None
     ) -> Dict:
         """Crear un pago usando un token de tarjeta (ASYNC)"""
-        return await asyncio.to_thread(
-            self.create_payment_with_token,
-            token=token,
-            transaction_amount=transaction_amount,
-            description=description,
-            installments=installments,
-            payment_method_id=payment_method_id,
-            issuer_id=issuer_id,
-            payer_email=payer_email,
-            payer_identification=payer_identification,
-            payer_first_name=payer_first_name,
-            payer_last_name=payer_last_name,
-            external_reference=external_reference,
-            device_id=device_id
+        payment_data, headers = self._build_payment_request(
+            token, transaction_amount, description, installments, payment_method_id,
+            issuer_id, payer_email, payer_identification, payer_first_name,
+            payer_last_name, external_reference, device_id
         )
 
+        try:
+            payment_response = await self.client.create_payment(payment_data, headers=headers)
+            print(f"[DEBUG MercadoPago] Respuesta HTTP: Status {payment_response['status']}")
+        except httpx.HTTPError as e:
+            error_msg = f"Error al comunicarse con la API de Mercado Pago: {str(e)}"
+            print(f"[ERROR] {error_msg}")
+            raise Exception(error_msg)
+
+        return self._parse_payment_response(payment_response)
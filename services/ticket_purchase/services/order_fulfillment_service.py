@@ -0,0 +1,140 @@
+"""
+Consumidor de `order_paid` del outbox: tickets, PDF y email de una orden pagada
+
+Cada paso deja su marca en la fila del outbox para que una re-entrega (relay
+o retry de Celery) no repita lo ya hecho:
+
+1. Tickets: bajo FOR UPDATE de la fila; solo se generan si la orden no tiene.
+2. Email (PDF + Resend): se toma un lease (locked_until) antes de enviar y se
+   marca email_sent_at al terminar. Solo una caída entre el envío y esa marca
+   puede repetir el email, cuando vence el lease.
+"""
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, func, text
+from typing import Dict
+from datetime import datetime, timezone
+from shared.database.models import Order, OrderItem, Ticket, OutboxEvent
+from services.ticket_purchase.services.order_status_hub import OrderStatusHub
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Segundos que un consumidor se reserva el envío del email de una orden
+EMAIL_LEASE_SECONDS = int(os.getenv("OUTBOX_EMAIL_LEASE_SECONDS", "300"))
+
+_CLAIM_EMAIL_SQL = text("""
+    UPDATE outbox_events
+    SET locked_until = now() + make_interval(secs => CAST(:lease AS integer))
+    WHERE id = :id
+      AND email_sent_at IS NULL
+      AND (locked_until IS NULL OR locked_until < now())
+    RETURNING id
+""")
+
+_RELEASE_EMAIL_SQL = text("""
+    UPDATE outbox_events SET locked_until = NULL, last_error = :error WHERE id = :id
+""")
+
+_FINISH_SQL = text("""
+    UPDATE outbox_events
+    SET status = 'processed',
+        processed_at = now(),
+        locked_until = NULL,
+        email_sent_at = CASE WHEN :email_sent THEN now() ELSE email_sent_at END
+    WHERE id = :id
+""")
+
+
+class OrderFulfillmentService:
+    """Efectos posteriores al pago, idempotentes por paso"""
+
+    @staticmethod
+    async def process_order_paid(db: AsyncSession, outbox_id: str) -> Dict:
+        """
+        Generar tickets y enviar el email de la orden de un evento `order_paid`
+
+        Returns:
+            Resumen de lo hecho en esta ejecución
+        """
+        from services.ticket_purchase.services.purchase_service import PurchaseService
+
+        service = PurchaseService()
+        summary = {"outbox_id": str(outbox_id), "tickets_generated": 0, "email_sent": False}
+
+        # --- Paso 1: tickets ---
+        result = await db.execute(
+            select(OutboxEvent).where(OutboxEvent.id == outbox_id).with_for_update()
+        )
+        outbox = result.scalar_one_or_none()
+        if outbox is None or outbox.processed_at is not None:
+            await db.commit()
+            summary["skipped"] = "already_processed"
+            return summary
+
+        order = await db.get(Order, outbox.aggregate_id)
+        if order is None or order.status != "completed":
+            # La orden ya no está pagada (reembolso/cancelación): nada que emitir
+            outbox.status = "processed"
+            outbox.processed_at = datetime.now(timezone.utc)
+            outbox.last_error = f"Orden en estado {order.status if order else 'inexistente'}"
+            await db.commit()
+            summary["skipped"] = "order_not_completed"
+            return summary
+
+        if outbox.tickets_issued_at is None:
+            existing = await db.scalar(
+                select(func.count(Ticket.id))
+                .join(OrderItem, Ticket.order_item_id == OrderItem.id)
+                .where(OrderItem.order_id == order.id)
+            )
+            if not existing:
+                tickets = await service._generate_tickets(
+                    db, order, ticket_status="issued", send_emails=False
+                )
+                summary["tickets_generated"] = len(tickets)
+            outbox.tickets_issued_at = datetime.now(timezone.utc)
+            await db.commit()
+            await OrderStatusHub.publish(order.id, "completed", tickets_issued=True)
+        else:
+            await db.commit()
+
+        # --- Paso 2: PDF + email ---
+        if outbox.email_sent_at is None:
+            claimed = await db.execute(_CLAIM_EMAIL_SQL, {"id": outbox.id, "lease": EMAIL_LEASE_SECONDS})
+            has_lease = claimed.first() is not None
+            await db.commit()
+
+            if not has_lease:
+                # Otro consumidor está enviando el email
+                summary["skipped"] = "email_in_progress"
+                return summary
+
+            result_tickets = await db.execute(
+                select(Ticket)
+                .join(OrderItem, Ticket.order_item_id == OrderItem.id)
+                .where(OrderItem.order_id == order.id, Ticket.status != "cancelled")
+                .order_by(Ticket.issued_at, Ticket.id)
+            )
+            tickets = result_tickets.scalars().all()
+
+            sent = await service._send_ticket_emails(db, order, tickets)
+            if not sent:
+                # Liberar el lease para que el retry lo intente de inmediato
+                await db.execute(_RELEASE_EMAIL_SQL, {
+                    "id": outbox.id,
+                    "error": "No se pudo generar el PDF o enviar el email",
+                })
+                await db.commit()
+                raise RuntimeError(f"No se pudo enviar el email de la orden {order.id}")
+
+            summary["email_sent"] = True
+
+        await db.execute(_FINISH_SQL, {"id": outbox.id, "email_sent": summary["email_sent"]})
+        await db.commit()
+
+        logger.info(
+            f"Orden {order.id} procesada desde outbox: {summary['tickets_generated']} tickets, "
+            f"email {'enviado' if summary['email_sent'] else 'ya enviado'}"
+        )
+        return summary
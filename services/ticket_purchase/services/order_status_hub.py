@@ -0,0 +1,225 @@
+"""
+Push del estado de órdenes (SSE / long-poll) sobre Redis pub/sub
+
+Quien cambia el estado de una orden (webhooks, outbox, sweeper de holds,
+cancelaciones) llama a `OrderStatusHub.publish` después del commit. El evento
+se publica en `order:status:{order_id}` y además queda como último estado en
+`order:status:last:{order_id}` (TTL ORDER_STATUS_LAST_TTL), así que un
+suscriptor que llega tarde no pierde un cambio ocurrido entre su lectura
+inicial y la suscripción.
+
+Cada proceso de la API mantiene UNA sola conexión pub/sub (PSUBSCRIBE
+`order:status:*`) y reparte los mensajes a las colas locales de los clientes
+que esperan esa orden. Miles de compradores esperando cuestan una cola en
+memoria cada uno, no una conexión Redis ni consultas a la DB o al proveedor.
+
+Con la aceptación asíncrona de compras, el link de pago también llega por este
+canal: un evento 'pending' con `payment_link` cuando el worker crea el pago.
+El order token (HMAC del order_id) da acceso al canal sin Authorization, que
+EventSource no puede enviar.
+"""
+from redis.exceptions import RedisError
+from typing import Dict, Optional, Set
+from datetime import datetime, timezone
+from shared.cache.redis_client import get_redis
+from shared.utils.metrics import counter, gauge
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = "order:status:"
+LAST_PREFIX = "order:status:last:"
+# Segundos que se conserva el último estado publicado de una orden
+ORDER_STATUS_LAST_TTL = int(os.getenv("ORDER_STATUS_LAST_TTL", "3600"))
+
+# Clave propia de los order tokens: obligatoria fuera de desarrollo (ver
+# check_order_token_secret). En desarrollo, sin configurar, se usa una clave
+# aleatoria por proceso: los tokens no sobreviven a un reinicio
+ORDER_TOKEN_SECRET = os.getenv("ORDER_TOKEN_SECRET", "").strip()
+_IS_DEVELOPMENT = os.getenv("APP_ENV", "development") == "development"
+if not ORDER_TOKEN_SECRET and _IS_DEVELOPMENT:
+    ORDER_TOKEN_SECRET = secrets.token_hex(32)
+
+# Estados tras los que no habrá más cambios que esperar
+FINAL_STATUSES = frozenset({"cancelled", "expired", "refunded"})
+
+REDIS_FAILURES = (RedisError, OSError)
+
+_published = counter(
+    "order_status_published_total",
+    "Cambios de estado de orden publicados por estado",
+    ("status",)
+)
+_waiters = gauge(
+    "order_status_waiters",
+    "Clientes esperando cambios de estado de órdenes en este proceso"
+)
+
+
+def progress(event: Dict) -> int:
+    """
+    Avance de una orden: pending (0) < pending con link de pago (1) <
+    completed (2) < completed con tickets (3) < final (4)
+
+    Sirve para quedarse con el evento más nuevo entre la DB y Redis.
+    """
+    status = event.get("status")
+    if status in FINAL_STATUSES:
+        return 4
+    if status == "completed":
+        return 3 if event.get("tickets_issued") else 2
+    return 1 if event.get("payment_link") else 0
+
+
+def check_order_token_secret():
+    """Fallar al iniciar si falta ORDER_TOKEN_SECRET fuera de desarrollo"""
+    if not ORDER_TOKEN_SECRET:
+        raise RuntimeError(
+            "ORDER_TOKEN_SECRET no está configurada: es obligatoria fuera de desarrollo "
+            "(generar con: openssl rand -hex 32)"
+        )
+
+
+def order_token(order_id) -> str:
+    """Token de la orden para consultar su estado sin autenticación"""
+    check_order_token_secret()
+    digest = hmac.new(ORDER_TOKEN_SECRET.encode(), str(order_id).encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:18]).decode()
+
+
+def verify_order_token(order_id, token: Optional[str]) -> bool:
+    return bool(token) and hmac.compare_digest(order_token(order_id), token)
+
+
+def is_final(event: Dict) -> bool:
+    """¿El evento cierra la espera? (estado final o tickets ya emitidos)"""
+    status = event.get("status")
+    return status in FINAL_STATUSES or (status == "completed" and bool(event.get("tickets_issued")))
+
+
+class OrderStatusHub:
+    """Publicación y suscripción por proceso a cambios de estado de órdenes"""
+
+    _subscribers: Dict[str, Set[asyncio.Queue]] = {}
+    _listener: Optional[asyncio.Task] = None
+    _loop: Optional[asyncio.AbstractEventLoop] = None
+    _ready: Optional[asyncio.Event] = None
+
+    @staticmethod
+    async def publish(order_id, status: str, **extra):
+        """Publicar un cambio de estado (llamar después del commit; no lanza)"""
+        order_id = str(order_id)
+        event = {
+            "order_id": order_id,
+            "status": status,
+            "at": datetime.now(timezone.utc).isoformat(),
+            **extra,
+        }
+        payload = json.dumps(event)
+        try:
+            redis_conn = await get_redis()
+            async with redis_conn.pipeline(transaction=False) as pipe:
+                pipe.set(f"{LAST_PREFIX}{order_id}", payload, ex=ORDER_STATUS_LAST_TTL)
+                pipe.publish(f"{CHANNEL_PREFIX}{order_id}", payload)
+                await pipe.execute()
+            _published.inc(status=status)
+        except REDIS_FAILURES as e:
+            # Los clientes caen al estado de la DB cuando vence su espera
+            logger.warning(f"No se pudo publicar estado {status} de la orden {order_id}: {e}")
+
+    @staticmethod
+    async def last_event(order_id) -> Optional[Dict]:
+        """Último evento publicado de la orden, si sigue en Redis"""
+        try:
+            redis_conn = await get_redis()
+            payload = await redis_conn.get(f"{LAST_PREFIX}{order_id}")
+        except REDIS_FAILURES as e:
+            logger.warning(f"No se pudo leer el último estado de la orden {order_id}: {e}")
+            return None
+        return json.loads(payload) if payload else None
+
+    @classmethod
+    async def _listen(cls):
+        """Única suscripción del proceso; reparte los mensajes a las colas locales"""
+        while True:
+            pubsub = None
+            try:
+                redis_conn = await get_redis()
+                pubsub = redis_conn.pubsub()
+                await pubsub.psubscribe(f"{CHANNEL_PREFIX}*")
+                cls._ready.set()
+                async for message in pubsub.listen():
+                    if message.get("type") != "pmessage":
+                        continue
+                    order_id = message["channel"][len(CHANNEL_PREFIX):]
+                    queues = cls._subscribers.get(order_id)
+                    if not queues:
+                        continue
+                    event = json.loads(message["data"])
+                    for queue in list(queues):
+                        queue.put_nowait(event)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                cls._ready.clear()
+                logger.error(f"Suscripción de estados de órdenes caída, reconectando: {e}")
+                await asyncio.sleep(1)
+            finally:
+                if pubsub is not None:
+                    try:
+                        await pubsub.reset()
+                    except Exception:
+                        pass
+
+    @classmethod
+    async def _ensure_listener(cls):
+        loop = asyncio.get_running_loop()
+        if cls._listener is None or cls._listener.done() or cls._loop is not loop:
+            cls._loop = loop
+            cls._ready = asyncio.Event()
+            cls._listener = loop.create_task(cls._listen())
+        try:
+            # Esperar el PSUBSCRIBE para que la lectura posterior de last_event cubra el hueco
+            await asyncio.wait_for(cls._ready.wait(), timeout=2)
+        except asyncio.TimeoutError:
+            logger.warning("Suscripción de estados de órdenes aún no lista")
+
+    @classmethod
+    async def subscribe(cls, order_id) -> asyncio.Queue:
+        """
+        Cola local que recibe los eventos de la orden (liberar con unsubscribe)
+
+        Leer el estado actual DESPUÉS de suscribirse para no perder cambios.
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        cls._subscribers.setdefault(str(order_id), set()).add(queue)
+        _waiters.inc()
+        await cls._ensure_listener()
+        return queue
+
+    @classmethod
+    def unsubscribe(cls, order_id, queue: asyncio.Queue):
+        queues = cls._subscribers.get(str(order_id))
+        if queues is not None and queue in queues:
+            queues.discard(queue)
+            _waiters.dec()
+            if not queues:
+                cls._subscribers.pop(str(order_id), None)
+
+    @classmethod
+    async def close(cls):
+        """Detener la suscripción del proceso (shutdown de la API)"""
+        if cls._listener is not None:
+            cls._listener.cancel()
+            try:
+                await cls._listener
+            except (asyncio.CancelledError, Exception):
+                pass
+            cls._listener = None
@@ -0,0 +1,188 @@
+"""
+Outbox transaccional para los efectos posteriores al pago
+
+El webhook que marca una orden como 'completed' escribe en la misma
+transacción una fila en outbox_events. La tarea `relay_outbox` toma las filas
+pendientes con FOR UPDATE SKIP LOCKED (varios relays no se pisan) y las
+publica en la cola high_priority como `process_order_post_payment`.
+
+Una fila publicada que no llega a procesarse (broker o worker caído) se vuelve
+a publicar después de OUTBOX_REDELIVERY_SECONDS, así que los efectos
+sobreviven a caídas; el consumidor es idempotente por pasos
+(OrderFulfillmentService).
+
+Las compras aceptadas en modo asíncrono escriben `order_payment_requested`
+junto con la orden: el worker `create_order_payment` crea el pago en el
+proveedor. Ese evento se despacha apenas se confirma la transacción
+(`dispatch`) y el relay queda como respaldo.
+"""
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from typing import Dict, Optional
+from shared.database.models import OutboxEvent
+from shared.cache.celery_app import celery_app
+import logging
+import os
+import uuid
+
+logger = logging.getLogger(__name__)
+
+ORDER_PAID = "order_paid"
+ORDER_PAYMENT_REQUESTED = "order_payment_requested"
+
+# Tarea Celery que consume cada tipo de evento
+EVENT_TASKS = {
+    ORDER_PAID: "process_order_post_payment",
+    ORDER_PAYMENT_REQUESTED: "create_order_payment",
+}
+
+OUTBOX_RELAY_BATCH = int(os.getenv("OUTBOX_RELAY_BATCH", "100"))
+# Segundos sin procesar tras los que una fila publicada se vuelve a publicar
+OUTBOX_REDELIVERY_SECONDS = int(os.getenv("OUTBOX_REDELIVERY_SECONDS", "900"))
+# Backoff máximo (segundos) entre intentos de publicación fallidos
+OUTBOX_MAX_BACKOFF_SECONDS = 300
+# Publicaciones tras las que una fila se deja de reintentar (queda para revisión manual)
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "10"))
+
+# Filas listas para (re)publicar. SKIP LOCKED reparte el trabajo entre relays
+_CLAIM_SQL = text("""
+    SELECT id, aggregate_id, event_type, attempts
+    FROM outbox_events
+    WHERE processed_at IS NULL
+      AND attempts < :max_attempts
+      AND (
+        (status = 'pending' AND available_at <= now())
+        OR (status = 'published' AND published_at < now() - make_interval(secs => CAST(:redelivery AS integer)))
+      )
+    ORDER BY available_at
+    LIMIT :batch_size
+    FOR UPDATE SKIP LOCKED
+""")
+
+_MARK_PUBLISHED_SQL = text("""
+    UPDATE outbox_events
+    SET status = 'published', published_at = now(), attempts = attempts + 1, last_error = NULL
+    WHERE id = ANY(CAST(:ids AS uuid[]))
+""")
+
+# Tomar una fila recién escrita para publicarla sin esperar al relay
+_CLAIM_ONE_SQL = text("""
+    UPDATE outbox_events
+    SET status = 'published', published_at = now(), attempts = attempts + 1
+    WHERE id = :id AND status = 'pending' AND processed_at IS NULL
+    RETURNING id
+""")
+
+_MARK_FAILED_SQL = text("""
+    UPDATE outbox_events
+    SET status = 'pending',
+        attempts = attempts + 1,
+        available_at = now() + make_interval(secs => CAST(:backoff AS integer)),
+        last_error = :error
+    WHERE id = :id
+""")
+
+
+class OutboxService:
+    """Escritura y relay de outbox_events"""
+
+    @staticmethod
+    async def enqueue(
+        db: AsyncSession,
+        aggregate_id: str,
+        event_type: str,
+        payload: Optional[Dict] = None
+    ) -> Optional[uuid.UUID]:
+        """
+        Agregar un evento al outbox dentro de la transacción del llamador
+
+        Un evento repetido para el mismo agregado (webhook reintentado) se ignora.
+
+        Returns:
+            ID de la fila creada, o None si el evento ya existía
+        """
+        stmt = pg_insert(OutboxEvent).values(
+            id=uuid.uuid4(),
+            aggregate_id=uuid.UUID(str(aggregate_id)),
+            event_type=event_type,
+            payload=payload or {},
+        ).on_conflict_do_nothing(index_elements=["aggregate_id", "event_type"]).returning(OutboxEvent.id)
+        result = await db.execute(stmt)
+        return result.scalar_one_or_none()
+
+    @staticmethod
+    async def dispatch(db: AsyncSession, outbox_id, aggregate_id, event_type: str) -> bool:
+        """
+        Publicar un evento ya confirmado sin esperar al relay (con commit)
+
+        La fila se marca 'published' antes de enviar, así que el relay no la
+        vuelve a publicar mientras tanto. Si el envío falla queda pendiente
+        y la toma el relay en su próxima pasada.
+
+        Returns:
+            True si se publicó
+        """
+        result = await db.execute(_CLAIM_ONE_SQL, {"id": outbox_id})
+        claimed = result.scalar_one_or_none() is not None
+        await db.commit()
+        if not claimed:
+            return False
+
+        try:
+            celery_app.send_task(
+                EVENT_TASKS[event_type],
+                kwargs={"order_id": str(aggregate_id), "outbox_id": str(outbox_id)},
+            )
+            return True
+        except Exception as e:
+            logger.error(f"Error publicando evento de outbox {outbox_id} ({event_type}): {e}")
+            await db.execute(_MARK_FAILED_SQL, {"id": outbox_id, "backoff": 0, "error": str(e)[:500]})
+            await db.commit()
+            return False
+
+    @staticmethod
+    async def relay(db: AsyncSession, batch_size: int = OUTBOX_RELAY_BATCH) -> int:
+        """
+        Publicar en Celery los eventos pendientes
+
+        Returns:
+            Cantidad de eventos publicados
+        """
+        total = 0
+        while True:
+            result = await db.execute(_CLAIM_SQL, {
+                "batch_size": batch_size,
+                "redelivery": OUTBOX_REDELIVERY_SECONDS,
+                "max_attempts": OUTBOX_MAX_ATTEMPTS,
+            })
+            rows = result.all()
+            if not rows:
+                await db.commit()
+                break
+
+            published = []
+            for row in rows:
+                task_name = EVENT_TASKS.get(row.event_type)
+                try:
+                    if task_name is None:
+                        raise ValueError(f"Tipo de evento sin consumidor: {row.event_type}")
+                    celery_app.send_task(
+                        task_name,
+                        kwargs={"order_id": str(row.aggregate_id), "outbox_id": str(row.id)},
+                    )
+                    published.append(str(row.id))
+                except Exception as e:
+                    backoff = min(OUTBOX_MAX_BACKOFF_SECONDS, 2 ** min(row.attempts, 8))
+                    logger.error(f"Error publicando evento de outbox {row.id} ({row.event_type}): {e}")
+                    await db.execute(_MARK_FAILED_SQL, {"id": row.id, "backoff": backoff, "error": str(e)[:500]})
+
+            if published:
+                await db.execute(_MARK_PUBLISHED_SQL, {"ids": published})
+            await db.commit()
+
+            total += len(published)
+            if len(rows) < batch_size:
+                break
+
+        return total
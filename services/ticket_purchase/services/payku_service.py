@@ -4,10 +4,14 @@ from typing import Dict, Optional
 import httpx
 from datetime import datetime
 from app.core.config import settings
+from shared.utils.http_clients import get_http_client
+from shared.utils.single_flight import SingleFlight
 import logging
 
 logger = logging.getLogger(__name__)
 
+_verifications = SingleFlight("payku_verify")
+
 
 class PaykuService:
     """Servicio para manejar pagos con Payku"""
@@ -39,6 +43,8 @@ class PaykuService:
             print(f"[INFO Payku] ✅ Usando ambiente PRODUCCIÓN")
             print(f"[INFO Payku] ⚠️  IMPORTANTE: Asegúrate de tener tokens de PRODUCCIÓN obtenidos desde https://app.payku.cl")
 
+        # PAYKU_API_URL apunta a otro servidor (p.ej. el fake de loadtest/)
+        self.base_api_url = os.getenv("PAYKU_API_URL") or self.base_api_url
         self.api_url = f"{self.base_api_url}/transaction"
         self.base_url = settings.APP_BASE_URL or os.getenv("APP_BASE_URL", "http://localhost:3000")
         # Para redirects, usar APP_BASE_URL directamente (localhost:3000 en desarrollo)
@@ -128,13 +134,12 @@ class PaykuService:
         logger.info(f"Creando transacción Payku para orden {order_id}, monto: {amount_int}")
 
         try:
-            # Usar httpx async para no bloquear el event loop
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    self.api_url,
-                    json=transaction_data,
-                    headers=headers
-                )
+            # Cliente httpx compartido (pool keep-alive) para no bloquear el event loop
+            response = await get_http_client("payku").post(
+                self.api_url,
+                json=transaction_data,
+                headers=headers
+            )
 
             logger.debug(f"Payku respuesta HTTP: Status {response.status_code}")
 
@@ -208,6 +213,13 @@ class PaykuService:
         Returns:
             dict con el estado de la transacción
         """
+        # Una sola consulta a Payku por transacción en curso (pestañas, polling, webhooks)
+        return await _verifications.do(
+            str(transaction_id), lambda: self._fetch_transaction(transaction_id)
+        )
+
+    async def _fetch_transaction(self, transaction_id: str) -> Dict:
+        """Consultar la transacción en Payku (sin coalescing)"""
         try:
             verify_url = f"{self.api_url}/{transaction_id}"
 
@@ -216,8 +228,7 @@ class PaykuService:
                 "Content-Type": "application/json"
             }
 
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.get(verify_url, headers=headers)
+            response = await get_http_client("payku").get(verify_url, headers=headers)
 
             if response.status_code != 200:
                 error_data = response.json() if response.text else {}
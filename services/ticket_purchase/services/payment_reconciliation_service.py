@@ -0,0 +1,181 @@
+"""
+Reconciliación de órdenes pendientes con el proveedor de pago
+
+Las órdenes Payku / Mercado Pago que siguen en 'pending' más de
+PAYMENT_RECONCILE_MIN_AGE_MINUTES (webhook perdido, comprador que cerró la
+pestaña) se resuelven acá en segundo plano, sin depender de que alguien
+consulte /status:
+
+1. Se recorren con paginación keyset sobre (created_at, id), sin OFFSET.
+2. Cada página se verifica con el proveedor con concurrencia acotada
+   (PAYMENT_RECONCILE_CONCURRENCY) sobre los clientes HTTP compartidos y el
+   single-flight de verificaciones, sin retener la conexión a la DB.
+3. Las órdenes pagadas se completan en una sola transacción por página; las
+   rechazadas se cancelan liberando su capacidad.
+4. Tickets, PDF y email de las pagadas quedan encolados en el outbox
+   (`order_paid`), igual que desde el webhook.
+
+Las órdenes más viejas que PAYMENT_RECONCILE_MAX_AGE_HOURS ya no se consultan:
+el hold de capacidad las expira.
+"""
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, tuple_
+from typing import Dict, List, Optional, Tuple
+from datetime import datetime, timedelta, timezone
+from shared.database.models import Order
+from services.ticket_purchase.services.mercado_pago_service import MERCADOPAGO_CANCEL_STATUSES
+from shared.utils.metrics import counter
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+PAYMENT_RECONCILE_MIN_AGE_MINUTES = int(os.getenv("PAYMENT_RECONCILE_MIN_AGE_MINUTES", "10"))
+PAYMENT_RECONCILE_MAX_AGE_HOURS = int(os.getenv("PAYMENT_RECONCILE_MAX_AGE_HOURS", "48"))
+PAYMENT_RECONCILE_PAGE_SIZE = int(os.getenv("PAYMENT_RECONCILE_PAGE_SIZE", "100"))
+PAYMENT_RECONCILE_CONCURRENCY = int(os.getenv("PAYMENT_RECONCILE_CONCURRENCY", "8"))
+# Tope de órdenes por corrida para que una corrida no se solape con la siguiente
+PAYMENT_RECONCILE_MAX_ORDERS = int(os.getenv("PAYMENT_RECONCILE_MAX_ORDERS", "1000"))
+
+PROVIDERS = ("payku", "mercadopago")
+
+# Estados del proveedor -> transición de la orden
+PAYKU_STATUS_MAPPING = {
+    "success": "completed",
+    "approved": "completed",
+    "completado": "completed",
+    "completed": "completed",
+    "failed": "cancelled",
+    "rejected": "cancelled",
+    "cancelled": "cancelled",
+    "cancelado": "cancelled",
+}
+# Un pago rechazado de Mercado Pago no cierra la orden: el comprador puede
+# reintentar con otro medio hasta que venza el hold
+MERCADOPAGO_STATUS_MAPPING = {
+    "approved": "completed",
+    **{status: "cancelled" for status in MERCADOPAGO_CANCEL_STATUSES},
+}
+
+_reconciled = counter(
+    "payment_reconcile_orders_total",
+    "Órdenes pendientes revisadas por el reconciliador por proveedor y resultado",
+    ("provider", "result")
+)
+
+
+class PaymentReconciliationService:
+    """Resolver órdenes pendientes consultando al proveedor por lotes"""
+
+    @staticmethod
+    async def _next_page(
+        db: AsyncSession,
+        cursor: Optional[Tuple[datetime, str]],
+        limit: int
+    ) -> List[Order]:
+        now = datetime.now(timezone.utc)
+        stmt = (
+            select(Order)
+            .where(
+                Order.status == "pending",
+                Order.payment_provider.in_(PROVIDERS),
+                Order.created_at < now - timedelta(minutes=PAYMENT_RECONCILE_MIN_AGE_MINUTES),
+                Order.created_at > now - timedelta(hours=PAYMENT_RECONCILE_MAX_AGE_HOURS),
+            )
+            .order_by(Order.created_at, Order.id)
+            .limit(limit)
+        )
+        if cursor is not None:
+            stmt = stmt.where(tuple_(Order.created_at, Order.id) > cursor)
+        result = await db.execute(stmt)
+        return list(result.scalars().all())
+
+    @staticmethod
+    async def _provider_transition(purchase_service, order: Order) -> Optional[str]:
+        """Estado al que debe pasar la orden según el proveedor (None = sigue pendiente)"""
+        if order.payment_provider == "payku":
+            if not order.payment_reference:
+                return None
+            transaction_data = await purchase_service.payku_service.verify_transaction(order.payment_reference)
+            status = (transaction_data.get("status") or "").lower()
+            payment_data = transaction_data.get("payment") or {}
+            if payment_data.get("status"):
+                status = payment_data["status"].lower()
+            return PAYKU_STATUS_MAPPING.get(status)
+
+        status = await purchase_service.mercado_pago_service.find_order_payment_status_async(str(order.id))
+        return MERCADOPAGO_STATUS_MAPPING.get(status)
+
+    @staticmethod
+    async def _verify_page(purchase_service, orders: List[Order]) -> Dict[str, List[Order]]:
+        semaphore = asyncio.Semaphore(PAYMENT_RECONCILE_CONCURRENCY)
+
+        async def verify(order: Order) -> Tuple[Order, Optional[str]]:
+            async with semaphore:
+                try:
+                    return order, await PaymentReconciliationService._provider_transition(purchase_service, order)
+                except Exception as e:
+                    logger.warning(f"No se pudo verificar la orden {order.id} con {order.payment_provider}: {e}")
+                    _reconciled.inc(provider=order.payment_provider, result="error")
+                    return order, "error"
+
+        transitions: Dict[str, List[Order]] = {"completed": [], "cancelled": []}
+        for order, transition in await asyncio.gather(*(verify(order) for order in orders)):
+            if transition in transitions:
+                transitions[transition].append(order)
+            elif transition is None:
+                _reconciled.inc(provider=order.payment_provider, result="pending")
+        return transitions
+
+    @staticmethod
+    async def reconcile(db: AsyncSession, max_orders: int = PAYMENT_RECONCILE_MAX_ORDERS) -> Dict:
+        """
+        Revisar las órdenes pendientes viejas y aplicar lo que diga el proveedor
+
+        Returns:
+            dict con checked, completed y cancelled
+        """
+        from services.ticket_purchase.services.purchase_service import PurchaseService
+
+        purchase_service = PurchaseService()
+        summary = {"checked": 0, "completed": 0, "cancelled": 0}
+        cursor = None
+
+        while summary["checked"] < max_orders:
+            orders = await PaymentReconciliationService._next_page(
+                db, cursor, min(PAYMENT_RECONCILE_PAGE_SIZE, max_orders - summary["checked"])
+            )
+            if not orders:
+                break
+            cursor = (orders[-1].created_at, orders[-1].id)
+            summary["checked"] += len(orders)
+
+            # No retener la conexión mientras se consulta a los proveedores
+            await db.commit()
+
+            transitions = await PaymentReconciliationService._verify_page(purchase_service, orders)
+
+            if transitions["completed"]:
+                completed = await purchase_service.complete_paid_orders(db, transitions["completed"])
+                summary["completed"] += len(completed)
+                for order in transitions["completed"]:
+                    _reconciled.inc(
+                        provider=order.payment_provider,
+                        result="completed" if str(order.id) in completed else "skipped"
+                    )
+
+            for order in transitions["cancelled"]:
+                try:
+                    cancelled = await purchase_service._cancel_order(db, order, "payment_failed")
+                except Exception as e:
+                    await db.rollback()
+                    logger.error(f"Error cancelando la orden {order.id} en la reconciliación: {e}")
+                    continue
+                summary["cancelled"] += int(cancelled)
+                _reconciled.inc(provider=order.payment_provider, result="cancelled" if cancelled else "skipped")
+
+            if len(orders) < PAYMENT_RECONCILE_PAGE_SIZE:
+                break
+
+        return summary
@@ -0,0 +1,278 @@
+"""
+Cache del contexto de compra de un evento
+
+Guarda la parte estática de la configuración de venta de un evento (datos del
+evento, tipos de ticket y catálogo de servicios con sus precios) para que
+create_purchase no vuelva a consultarla en cada compra. La capacidad y el
+stock NO forman parte del contexto: siguen saliendo de InventoryService.
+
+Dos niveles:
+- LRU en memoria por proceso, que se usa sin consultar Redis durante
+  PURCHASE_CONTEXT_LOCAL_TTL segundos.
+- `purchase:context:{event}` en Redis, compartido entre procesos.
+
+La invalidación es por versión: `purchase:context:{event}:version` se
+incrementa en cada cambio del evento y cada snapshot guarda la versión con la
+que se leyó de la DB. Un snapshot con otra versión se descarta, así que un
+lector lento no puede reinstalar datos viejos después de una invalidación.
+"""
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+from redis.exceptions import RedisError
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+from collections import OrderedDict
+from decimal import Decimal
+from shared.database.models import Event, TicketType, EventService
+from shared.cache.redis_client import get_redis
+from shared.utils.metrics import counter
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Segundos que vive el snapshot en Redis (cota de staleness si falla una invalidación)
+PURCHASE_CONTEXT_TTL = int(os.getenv("PURCHASE_CONTEXT_TTL", "300"))
+# Segundos que el LRU local confía en su copia sin verificar la versión en Redis
+PURCHASE_CONTEXT_LOCAL_TTL = float(os.getenv("PURCHASE_CONTEXT_LOCAL_TTL", "5"))
+PURCHASE_CONTEXT_LOCAL_SIZE = int(os.getenv("PURCHASE_CONTEXT_LOCAL_SIZE", "256"))
+
+REDIS_FAILURES = (RedisError, OSError)
+
+_lookups = counter(
+    "purchase_context_lookups_total",
+    "Lecturas del contexto de compra por origen (local, redis, db)",
+    ("source",)
+)
+
+
+class EventSnapshot(NamedTuple):
+    id: uuid.UUID
+    name: str
+    allow_children: bool
+
+
+class TicketTypeSnapshot(NamedTuple):
+    id: uuid.UUID
+    name: str
+    price: Decimal
+    is_child: bool
+
+
+class ServiceSnapshot(NamedTuple):
+    id: uuid.UUID
+    name: str
+    price: Decimal
+    service_type: str
+
+
+class PurchaseContext(NamedTuple):
+    """Configuración de venta inmutable de un evento"""
+
+    version: int
+    event: EventSnapshot
+    ticket_types: Tuple[TicketTypeSnapshot, ...]
+    services: Dict[str, ServiceSnapshot]
+
+    def default_ticket_type(self) -> Optional[TicketTypeSnapshot]:
+        """Tipo de ticket por defecto (el primero que no es de niño)"""
+        for ticket_type in self.ticket_types:
+            if not ticket_type.is_child:
+                return ticket_type
+        return None
+
+    def services_for(self, service_ids: Iterable) -> List[ServiceSnapshot]:
+        """Servicios del evento con esos IDs (los ajenos al evento se ignoran)"""
+        services = []
+        for service_id in service_ids:
+            service = self.services.get(str(service_id))
+            if service is not None:
+                services.append(service)
+        return services
+
+    def to_dict(self) -> Dict:
+        return {
+            "version": self.version,
+            "event": {
+                "id": str(self.event.id),
+                "name": self.event.name,
+                "allow_children": self.event.allow_children,
+            },
+            "ticket_types": [
+                {"id": str(tt.id), "name": tt.name, "price": str(tt.price), "is_child": tt.is_child}
+                for tt in self.ticket_types
+            ],
+            "services": [
+                {"id": str(s.id), "name": s.name, "price": str(s.price), "service_type": s.service_type}
+                for s in self.services.values()
+            ],
+        }
+
+    @staticmethod
+    def from_dict(data: Dict) -> "PurchaseContext":
+        services = [
+            ServiceSnapshot(uuid.UUID(s["id"]), s["name"], Decimal(s["price"]), s["service_type"])
+            for s in data["services"]
+        ]
+        return PurchaseContext(
+            version=int(data["version"]),
+            event=EventSnapshot(
+                uuid.UUID(data["event"]["id"]),
+                data["event"]["name"],
+                bool(data["event"]["allow_children"]),
+            ),
+            ticket_types=tuple(
+                TicketTypeSnapshot(uuid.UUID(tt["id"]), tt["name"], Decimal(tt["price"]), bool(tt["is_child"]))
+                for tt in data["ticket_types"]
+            ),
+            services={str(s.id): s for s in services},
+        )
+
+
+# event_id -> (contexto, instante monotónico hasta el que se usa sin verificar)
+_local: "OrderedDict[str, Tuple[PurchaseContext, float]]" = OrderedDict()
+_local_lock = threading.Lock()
+
+
+class PurchaseContextCache:
+    """LRU local + Redis con invalidación por versión"""
+
+    @staticmethod
+    def _payload_key(event_id: str) -> str:
+        return f"purchase:context:{event_id}"
+
+    @staticmethod
+    def _version_key(event_id: str) -> str:
+        return f"purchase:context:{event_id}:version"
+
+    @staticmethod
+    def _remember(event_id: str, context: PurchaseContext):
+        with _local_lock:
+            _local[event_id] = (context, time.monotonic() + PURCHASE_CONTEXT_LOCAL_TTL)
+            _local.move_to_end(event_id)
+            while len(_local) > PURCHASE_CONTEXT_LOCAL_SIZE:
+                _local.popitem(last=False)
+
+    @staticmethod
+    def _forget(event_id: str):
+        with _local_lock:
+            _local.pop(event_id, None)
+
+    @staticmethod
+    async def _load(db: AsyncSession, event_id: str, version: int) -> Optional[PurchaseContext]:
+        """Leer el contexto desde la DB"""
+        result_event = await db.execute(
+            select(Event.id, Event.name, Event.allow_children).where(Event.id == event_id)
+        )
+        event_row = result_event.first()
+        if event_row is None:
+            return None
+
+        result_types = await db.execute(
+            select(TicketType.id, TicketType.name, TicketType.price, TicketType.is_child)
+            .where(TicketType.event_id == event_id)
+            .order_by(TicketType.created_at, TicketType.id)
+        )
+        result_services = await db.execute(
+            select(EventService.id, EventService.name, EventService.price, EventService.service_type)
+            .where(EventService.event_id == event_id)
+            .order_by(EventService.created_at, EventService.id)
+        )
+
+        services = [
+            ServiceSnapshot(row.id, row.name, Decimal(row.price), row.service_type or "general")
+            for row in result_services
+        ]
+        return PurchaseContext(
+            version=version,
+            event=EventSnapshot(event_row.id, event_row.name, bool(event_row.allow_children)),
+            ticket_types=tuple(
+                TicketTypeSnapshot(row.id, row.name, Decimal(row.price), bool(row.is_child))
+                for row in result_types
+            ),
+            services={str(s.id): s for s in services},
+        )
+
+    @staticmethod
+    async def get(db: AsyncSession, event_id: str) -> Optional[PurchaseContext]:
+        """
+        Contexto de compra del evento
+
+        Returns:
+            PurchaseContext, o None si el evento no existe
+        """
+        event_id = str(event_id)
+        with _local_lock:
+            entry = _local.get(event_id)
+            if entry is not None:
+                _local.move_to_end(event_id)
+        if entry is not None and entry[1] > time.monotonic():
+            _lookups.inc(source="local")
+            return entry[0]
+
+        redis_conn = None
+        version = 0
+        try:
+            redis_conn = await get_redis()
+            raw_version, payload = await redis_conn.mget(
+                PurchaseContextCache._version_key(event_id),
+                PurchaseContextCache._payload_key(event_id)
+            )
+            version = int(raw_version or 0)
+
+            # La copia local sigue vigente si nadie invalidó el evento
+            if entry is not None and entry[0].version == version:
+                PurchaseContextCache._remember(event_id, entry[0])
+                _lookups.inc(source="local")
+                return entry[0]
+
+            if payload:
+                data = json.loads(payload)
+                if data.get("version") == version:
+                    context = PurchaseContext.from_dict(data)
+                    PurchaseContextCache._remember(event_id, context)
+                    _lookups.inc(source="redis")
+                    return context
+        except REDIS_FAILURES as e:
+            logger.warning(f"Cache de contexto de compra no disponible ({e}), leyendo desde la DB")
+            redis_conn = None
+
+        _lookups.inc(source="db")
+        context = await PurchaseContextCache._load(db, event_id, version)
+        if context is None:
+            return None
+
+        if redis_conn is not None:
+            try:
+                await redis_conn.set(
+                    PurchaseContextCache._payload_key(event_id),
+                    json.dumps(context.to_dict()),
+                    ex=PURCHASE_CONTEXT_TTL
+                )
+            except REDIS_FAILURES as e:
+                logger.warning(f"No se pudo guardar el contexto de compra del evento {event_id}: {e}")
+
+        PurchaseContextCache._remember(event_id, context)
+        return context
+
+    @staticmethod
+    async def invalidate(event_id: str):
+        """
+        Invalidar el contexto de un evento (llamar después del commit)
+
+        Los otros procesos lo notan en su próxima verificación de versión,
+        a más tardar PURCHASE_CONTEXT_LOCAL_TTL segundos después.
+        """
+        event_id = str(event_id)
+        PurchaseContextCache._forget(event_id)
+        try:
+            redis_conn = await get_redis()
+            async with redis_conn.pipeline(transaction=True) as pipe:
+                pipe.incr(PurchaseContextCache._version_key(event_id))
+                pipe.delete(PurchaseContextCache._payload_key(event_id))
+                await pipe.execute()
+        except REDIS_FAILURES as e:
+            logger.error(f"No se pudo invalidar el contexto de compra del evento {event_id}: {e}")
@@ -1,22 +1,32 @@
 """Servicio principal de compra de tickets"""
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
+from sqlalchemy import select, func, update
 from typing import List, Dict, Optional
-from datetime import datetime, date
+from datetime import datetime, timezone
 import uuid
 import hashlib
 import os
 from shared.database.models import (
-    Order, OrderItem, Ticket, Event, TicketType, EventService,
-    TicketChildDetail, TicketChildMedication, OrderCommission, OrderServiceItem
+    Order, OrderItem, Ticket, Event, TicketType,
+    OrderServiceItem, OutboxEvent
 )
-from shared.utils.qr_generator import generate_qr_signature
 from services.ticket_purchase.models.purchase import PurchaseRequest, AttendeeData
 from services.ticket_purchase.services.inventory_service import InventoryService
-from services.ticket_purchase.services.mercado_pago_service import MercadoPagoService
+from services.ticket_purchase.services.capacity_hold_service import CapacityHoldService
+from services.ticket_purchase.services.ticket_issuance_service import TicketIssuanceService
+from services.ticket_purchase.services.purchase_context_cache import PurchaseContextCache
+from services.ticket_purchase.services.outbox_service import (
+    OutboxService, ORDER_PAID, ORDER_PAYMENT_REQUESTED
+)
+from services.ticket_purchase.services.webhook_dedup_service import WebhookDedupStore
+from services.ticket_purchase.services.order_status_hub import OrderStatusHub
+from services.ticket_purchase.services.mercado_pago_service import (
+    MercadoPagoService, MercadoPagoAPIError, MERCADOPAGO_CANCEL_STATUSES
+)
 from services.ticket_purchase.services.payku_service import PaykuService
 from services.notifications.services.email_service import EmailService
 from shared.cache.redis_client import cache_get, cache_set
+from shared.utils.http_clients import get_http_client
 import logging
 
 logger = logging.getLogger(__name__)
@@ -47,11 +57,17 @@ class PurchaseService:
     async def create_purchase(
         self,
         db: AsyncSession,
-        request: PurchaseRequest
+        request: PurchaseRequest,
+        accept_async: bool = False
     ) -> Dict:
         """
         Crear orden de compra y generar link de pago
 
+        Con accept_async=True (pagos online) la orden se valida, reserva y
+        guarda igual, pero el pago en el proveedor lo crea el worker
+        create_order_payment: la respuesta vuelve con accepted=True y sin
+        payment_link, que el cliente recibe por el canal de estado de la orden.
+
         Returns:
             dict con order_id, payment_link, status
         """
@@ -115,6 +131,10 @@ class PurchaseService:
             # Re-lanzar el error para que el endpoint retorne 500
             raise Exception(f"Error de conexión a la base de datos: {error_msg}. Verifica que la base de datos esté disponible.")
 
+        # Cerrar la transacción de lectura: las ramas siguientes pueden llamar a
+        # Payku/Mercado Pago y no deben retener una conexión del pool mientras tanto
+        await db.commit()
+
         if existing_order:
             # Si el método de pago del request NO coincide con el de la orden existente,
             # crear una nueva orden (no usar idempotencia en este caso)
@@ -149,7 +169,7 @@ class PurchaseService:
                                 for att in request.attendees
                             ]
 
-                            tickets = await self._generate_tickets(
+                            await self._generate_tickets(
                                 db, existing_order, attendees_data_for_existing, ticket_status="pending"
                             )
                             await db.commit()
@@ -314,6 +334,9 @@ class PurchaseService:
                                         "number": first_attendee.document_number
                                     }
 
+                            # Liberar la conexión antes de llamar a Mercado Pago
+                            await db.commit()
+
                             # Crear nueva preferencia (ASYNC)
                             preference = await self.mercado_pago_service.create_preference_async(
                                 order_id=str(existing_order.id),
@@ -344,18 +367,32 @@ class PurchaseService:
                     }
                 # Si existing_order es None, continuar con la creación de una nueva orden
 
-        # Verificar que el evento existe
-        stmt_event = select(Event).where(Event.id == request.event_id)
-        result_event = await db.execute(stmt_event)
-        event = result_event.scalar_one_or_none()
-
-        if not event:
+        # Pipeline de una orden nueva, con un solo commit para todo lo persistido:
+        #   1. validar    contexto del evento (cache), asistentes y capacidad
+        #   2. precio     totales con los precios del contexto
+        #   3. reservar   asientos y stock (la parte en DB queda en la transacción)
+        #   4. persistir  orden, items y servicios (y tickets si es transferencia)
+        #   5. proveedor  Payku / Mercado Pago, sin transacción ni conexión tomada
+        #                 (en modo asíncrono: evento en el outbox para el worker)
+        #   6. finalizar  referencia del pago y respuesta en cache
+
+        # --- 1. Validar ---
+        # Configuración de venta del evento (evento, tipos de ticket y servicios)
+        # desde el cache de contexto: con cache caliente no hay consultas de catálogo
+        context = await PurchaseContextCache.get(db, request.event_id)
+
+        if not context:
             raise ValueError("Evento no encontrado")
+        event = context.event
 
-        # Calcular totales
         total_quantity = len(request.attendees)
 
-        # Verificar capacidad
+        # Validar que todos los attendees tengan email
+        for attendee in request.attendees:
+            if not attendee.email:
+                raise ValueError(f"Todos los asistentes deben tener un correo electrónico. Falta email para: {attendee.name}")
+
+        # Verificar capacidad (rechazo temprano; la reserva real es atómica)
         available, message = await self.inventory_service.check_capacity(
             db, request.event_id, total_quantity
         )
@@ -363,46 +400,42 @@ class PurchaseService:
             raise ValueError(message)
 
         # Obtener tipo de ticket (asumimos que hay un tipo por defecto)
-        stmt_ticket_type = select(TicketType).where(
-            TicketType.event_id == request.event_id,
-            TicketType.is_child == False
-        ).limit(1)
-        result_ticket_type = await db.execute(stmt_ticket_type)
-        ticket_type = result_ticket_type.scalar_one_or_none()
+        ticket_type = context.default_ticket_type()
 
         if not ticket_type:
             raise ValueError("No se encontró tipo de ticket para el evento")
 
-        # Calcular precios de tickets
-        subtotal = float(ticket_type.price) * total_quantity
-
-        # Calcular precios de servicios adicionales
-        services_subtotal = 0.0
+        # Servicios adicionales: se toman del contexto y se reutilizan para
+        # precios, order service items, reserva de stock e items de pago
+        services = []
+        selected_services: Dict[str, int] = {}
         if request.selected_services:
-            stmt_services = select(EventService).where(
-                EventService.event_id == request.event_id,
-                EventService.id.in_(list(request.selected_services.keys()))
-            )
-            result_services = await db.execute(stmt_services)
-            services = result_services.scalars().all()
+            # Convertir las keys de string a UUID
+            service_ids = []
+            for key, quantity in request.selected_services.items():
+                if not quantity or quantity <= 0:
+                    continue
+                try:
+                    service_ids.append(uuid.UUID(key))
+                except (ValueError, TypeError):
+                    continue  # Saltar IDs inválidos
+
+            services = context.services_for(service_ids)
 
             for service in services:
-                quantity = request.selected_services.get(str(service.id), 0)
-                if quantity > 0:
-                    services_subtotal += float(service.price) * quantity
+                selected_services[str(service.id)] = request.selected_services[str(service.id)]
 
-        discount_total = 0.0  # TODO: Aplicar descuentos si hay
-        total = subtotal + services_subtotal - discount_total
+        # --- 2. Precio ---
+        subtotal = float(ticket_type.price) * total_quantity
 
-        # Validar que todos los attendees tengan email
-        for attendee in request.attendees:
-            if not attendee.email:
-                raise ValueError(f"Todos los asistentes deben tener un correo electrónico. Falta email para: {attendee.name}")
+        services_subtotal = 0.0
+        for service in services:
+            services_subtotal += float(service.price) * selected_services[str(service.id)]
 
-        # El método de pago ya se determinó arriba
+        discount_total = 0.0  # TODO: Aplicar descuentos si hay
+        total = subtotal + services_subtotal - discount_total
 
-        # Preparar datos de attendees ANTES de crear la orden
-        # IMPORTANTE: Esto debe hacerse antes de crear el Order para poder guardarlo en attendees_data
+        # Preparar datos de attendees para guardarlos en la orden y recuperarlos después del pago
         attendees_data = []
         for att in request.attendees:
             child_details_dict = None
@@ -422,328 +455,436 @@ class PurchaseService:
                 "child_details": child_details_dict
             })
 
-        # Crear orden - user_id es opcional ahora
-        # IMPORTANTE: Guardar datos de attendees en la orden para recuperarlos después del pago
-        order = Order(
-            id=uuid.uuid4(),
-            user_id=uuid.UUID(request.user_id) if request.user_id else None,
-            subtotal=subtotal + services_subtotal,  # Incluir servicios en subtotal
-            discount_total=discount_total,
-            total=total,
-            currency="CLP",
-            status="pending",
-            payment_provider=payment_method,
-            receipt_url=request.receipt_url if is_bank_transfer else None,
-            idempotency_key=idempotency_key,
-            attendees_data=attendees_data,  # Guardar datos de attendees en la base de datos
-            created_at=datetime.utcnow()
-        )
-        db.add(order)
-        await db.flush()
+        # --- 3. Reservar ---
+        # Sin commit: la reserva se confirma junto con la orden en el paso 4
+        order_id = uuid.uuid4()
+        try:
+            reserved, reserve_message = await self.inventory_service.reserve_order(
+                db, request.event_id, total_quantity, selected_services, f"order_{order_id}", commit=False
+            )
+        except Exception:
+            await self.inventory_service.rollback_reservations(db)
+            raise
 
-        # Crear order item para tickets
-        order_item = OrderItem(
-            id=uuid.uuid4(),
-            order_id=order.id,
-            event_id=request.event_id,
-            ticket_type_id=ticket_type.id,
-            quantity=total_quantity,
-            unit_price=ticket_type.price,
-            final_price=subtotal
-        )
-        db.add(order_item)
-        await db.flush()
+        if not reserved:
+            await self.inventory_service.rollback_reservations(db)
+            raise ValueError(reserve_message)
 
-        # Crear order service items para servicios adicionales
-        if request.selected_services:
-            # Convertir las keys de string a UUID
-            service_ids = []
-            for key in request.selected_services.keys():
-                try:
-                    service_ids.append(uuid.UUID(key))
-                except (ValueError, TypeError):
-                    continue  # Saltar IDs inválidos
+        # --- 4. Persistir ---
+        # Desde aquí hasta el commit cualquier error devuelve la reserva
+        # (también la de Redis); el ledger se registra recién con el commit
+        accept_async = accept_async and not is_bank_transfer
+        payment_request_id = None
 
-            if service_ids:
-                stmt_services = select(EventService).where(
-                    EventService.event_id == request.event_id,
-                    EventService.id.in_(service_ids)
+        try:
+            # Order, OrderItem y OrderServiceItem se escriben en el flush del commit
+            # (un INSERT por tabla); user_id es opcional
+            order = Order(
+                id=order_id,
+                user_id=uuid.UUID(request.user_id) if request.user_id else None,
+                subtotal=subtotal + services_subtotal,  # Incluir servicios en subtotal
+                discount_total=discount_total,
+                total=total,
+                currency="CLP",
+                status="pending",
+                payment_provider=payment_method,
+                receipt_url=request.receipt_url if is_bank_transfer else None,
+                idempotency_key=idempotency_key,
+                attendees_data=attendees_data,  # Guardar datos de attendees en la base de datos
+                created_at=datetime.utcnow()
+            )
+            order_rows = [
+                order,
+                OrderItem(
+                    id=uuid.uuid4(),
+                    order_id=order.id,
+                    event_id=request.event_id,
+                    ticket_type_id=ticket_type.id,
+                    quantity=total_quantity,
+                    unit_price=ticket_type.price,
+                    final_price=subtotal
                 )
-                result_services = await db.execute(stmt_services)
-                services = result_services.scalars().all()
-
-                for service in services:
-                    quantity = request.selected_services.get(str(service.id), 0)
-                    if quantity > 0:
-                        service_item = OrderServiceItem(
-                            id=uuid.uuid4(),
-                            order_id=order.id,
-                            event_id=request.event_id,
-                            service_id=service.id,
-                            quantity=quantity,
-                            unit_price=service.price,
-                            final_price=float(service.price) * quantity
-                        )
-                        db.add(service_item)
-
-        await db.flush()
-
-        # Guardar attendees en cache para recuperarlos después del pago
-        # Necesario para pagos asíncronos (Mercado Pago y Payku) donde el webhook llega después
-        # Para transferencias bancarias, creamos tickets inmediatamente, no necesitamos cache
-        # IMPORTANTE: Usar order.idempotency_key (hash final) en lugar de request.idempotency_key
-        # para que coincida con la búsqueda en get_order_status
-        if not is_bank_transfer and order.idempotency_key:
-            attendees_cache_key = f"purchase:attendees:{order.idempotency_key}"
-            await cache_set(attendees_cache_key, attendees_data, expire=86400)  # 24 horas
-            # Datos de attendees guardados en cache (no loguear en producción)
-
-        # Reservar capacidad
-        reserved = await self.inventory_service.reserve_capacity(
-            db, request.event_id, total_quantity, f"order_{order.id}"
-        )
-
-        if not reserved:
-            await db.rollback()
-            raise ValueError("No se pudo reservar capacidad")
-
-        payment_link = None
+            ]
+            for service in services:
+                quantity = selected_services[str(service.id)]
+                order_rows.append(OrderServiceItem(
+                    id=uuid.uuid4(),
+                    order_id=order.id,
+                    event_id=request.event_id,
+                    service_id=service.id,
+                    quantity=quantity,
+                    unit_price=service.price,
+                    final_price=float(service.price) * quantity
+                ))
+            db.add_all(order_rows)
+
+            if accept_async:
+                # Se confirma junto con la orden: si el proceso cae después
+                # del commit, el relay igual entrega el pedido al worker
+                payment_request_id = await OutboxService.enqueue(db, order.id, ORDER_PAYMENT_REQUESTED)
+            # Transferencia bancaria: los tickets "pending" se crean en la misma transacción
+            if is_bank_transfer:
+                await self._generate_tickets(
+                    db, order, attendees_data, ticket_status="pending"
+                )
+            await self.inventory_service.commit_reservations(db)
+        except Exception as e:
+            # Revierte orden, tickets y reserva (también la de Redis)
+            logger.error(f"Error guardando la orden {order_id}: {str(e)}", exc_info=True)
+            await self.inventory_service.rollback_reservations(db)
+            if is_bank_transfer:
+                raise ValueError(f"Error creando tickets: {str(e)}")
+            raise
 
-        # Si es transferencia bancaria, crear tickets inmediatamente con status "pending"
         if is_bank_transfer:
-            try:
-                # Hacer flush para asegurar que order_items estén disponibles
-                await db.flush()
+            response = {
+                "order_id": str(order.id),
+                "payment_link": None,  # No hay payment_link para transferencias
+                "status": "pending",
+                "payment_method": payment_method  # bank_transfer
+            }
 
-                # Refrescar la orden para cargar order_items
-                await db.refresh(order, ["order_items"])
+            # Guardar en cache para idempotencia
+            await cache_set(cache_key, response, expire=3600)
 
-                # Verificar que order_items esté cargado
-                if not order.order_items:
-                    raise ValueError("No se encontraron order_items para crear tickets")
+            return response
 
-                # Crear tickets con status "pending" inmediatamente
-                tickets = await self._generate_tickets(
-                    db, order, attendees_data, ticket_status="pending"
-                )
+        # La orden ya está confirmada: si algo falla antes de devolver el link de
+        # pago (hold, outbox, proveedor, referencia) se cancela, lo que devuelve
+        # capacidad, stock y hold
+        try:
+            # Las órdenes de pago online mantienen la capacidad solo mientras dure el hold
+            await CapacityHoldService.place_hold(order.id)
 
-                # Actualizar orden - mantener status "pending" hasta verificación manual
-                order.status = "pending"
+            # Guardar attendees en cache para recuperarlos después del pago (el webhook
+            # llega después). Usar order.idempotency_key (hash final) para que coincida
+            # con la búsqueda en get_order_status. No es crítico: también están en la orden
+            if order.idempotency_key:
+                attendees_cache_key = f"purchase:attendees:{order.idempotency_key}"
+                try:
+                    await cache_set(attendees_cache_key, attendees_data, expire=86400)  # 24 horas
+                except Exception as cache_error:
+                    logger.warning(f"No se pudieron cachear los attendees de la orden {order.id}: {cache_error}")
 
-                await db.commit()
-                await db.refresh(order)
+            if accept_async:
+                if payment_request_id is not None:
+                    await OutboxService.dispatch(db, payment_request_id, order.id, ORDER_PAYMENT_REQUESTED)
 
                 response = {
                     "order_id": str(order.id),
-                    "payment_link": None,  # No hay payment_link para transferencias
+                    "payment_link": None,  # Llega por el canal de estado de la orden
                     "status": "pending",
-                    "payment_method": payment_method  # bank_transfer
+                    "payment_method": payment_method,
+                    "accepted": True
                 }
-
-                # Guardar en cache para idempotencia
                 await cache_set(cache_key, response, expire=3600)
-
                 return response
 
+            # --- 5. Proveedor ---
+            # La sesión ya no tiene transacción abierta: ninguna conexión del pool
+            # queda esperando la respuesta del proveedor
+            try:
+                if is_payku:
+                    payment_reference, payment_link = await self._create_payku_payment(order, event, total, request)
+                else:
+                    payment_reference, payment_link = await self._create_mercadopago_payment(
+                        order, event, ticket_type, services, selected_services, total_quantity, request
+                    )
             except Exception as e:
-                # Si falla la creación de tickets, liberar capacidad y rollback
-                import traceback
-                error_trace = traceback.format_exc()
-                logger.error(f"Error creando tickets para transferencia bancaria: {str(e)}", exc_info=True)
-                await self.inventory_service.release_capacity(
-                    db, request.event_id, total_quantity, "ticket_creation_failed"
-                )
-                await db.rollback()
-                raise ValueError(f"Error creando tickets: {str(e)}")
+                logger.error(f"Error creando pago para orden {order.id}: {str(e)}", exc_info=True)
+                if is_payku:
+                    raise ValueError(f"Error creando transacción de pago: {str(e)}")
+                raise ValueError(f"Error creando preferencia de pago: {str(e)}")
 
-        # Si es Payku, crear transacción de pago
-        elif is_payku:
-            try:
-                # Creando transacción de Payku
-
-                # Obtener información del primer attendee para la transacción
-                payer_email = None
-                if request.attendees and len(request.attendees) > 0:
-                    first_attendee = request.attendees[0]
-                    payer_email = first_attendee.email
-
-                if not payer_email:
-                    raise ValueError("Se requiere un email para crear la transacción de Payku")
-
-                # Crear descripción del pago
-                subject = f"Compra de tickets - {event.name}"
-
-                # Crear transacción con Payku (ASYNC - no bloquea el event loop)
-                transaction = await self.payku_service.create_transaction(
-                    order_id=str(order.id),
-                    email=payer_email,
-                    amount=total,
-                    subject=subject,
-                    currency=order.currency or "CLP"
-                )
+            # --- 6. Finalizar ---
+            order.payment_reference = payment_reference
+            await db.commit()
+        except Exception:
+            await self._abandon_order(db, order)
+            raise
+
+        response = {
+            "order_id": str(order.id),
+            "payment_link": payment_link,
+            "status": "pending",
+            "payment_method": payment_method
+        }
+        if is_payku:
+            response["transaction_id"] = payment_reference
+        else:
+            response["preference_id"] = payment_reference
 
-                logger.debug(f"Transacción Payku creada: {transaction.get('transaction_id')}")
+        # Guardar en cache para idempotencia
+        await cache_set(cache_key, response, expire=3600)
 
-                # Validar que la transacción tenga los campos necesarios
-                if not transaction.get("payment_link"):
-                    raise ValueError("La transacción no tiene payment_link")
+        return response
 
-                order.payment_reference = transaction.get("transaction_id")
-                payment_link = transaction["payment_link"]
+    async def create_order_payment(
+        self,
+        db: AsyncSession,
+        outbox_id: str,
+        final_attempt: bool = False
+    ) -> Dict:
+        """
+        Crear el pago en el proveedor de una orden aceptada en modo asíncrono
+        (evento `order_payment_requested` del outbox)
 
-            except Exception as e:
-                # Si falla la creación de transacción, liberar capacidad y rollback
-                import traceback
-                error_trace = traceback.format_exc()
-                logger.error(f"Error creando transacción de pago: {str(e)}", exc_info=True)
-                await self.inventory_service.release_capacity(
-                    db, request.event_id, total_quantity, "payment_creation_failed"
-                )
-                await db.rollback()
-                raise ValueError(f"Error creando transacción de pago: {str(e)}")
+        El link se publica en el canal de estado de la orden y reemplaza la
+        respuesta en cache, así que un reintento del POST lo devuelve directo.
+        Si el proveedor falla se relanza para que Celery reintente; en el
+        último intento (final_attempt) la orden se cancela y libera capacidad.
+
+        Returns:
+            Resumen de lo hecho en esta ejecución
+        """
+        summary = {"outbox_id": str(outbox_id), "payment_created": False}
 
+        outbox = await db.get(OutboxEvent, outbox_id)
+        if outbox is None or outbox.processed_at is not None:
             await db.commit()
-            await db.refresh(order)
+            summary["skipped"] = "already_processed"
+            return summary
 
-            response = {
-                "order_id": str(order.id),
-                "payment_link": payment_link,
-                "transaction_id": transaction.get("transaction_id"),
-                "status": "pending",
-                "payment_method": "payku"
-            }
+        order = await db.get(Order, outbox.aggregate_id)
+        if order is None or order.status != "pending" or order.payment_reference:
+            # Pagada, cancelada o expirada antes de llegar acá, o ya con pago
+            self._finish_outbox(outbox, f"Orden en estado {order.status if order else 'inexistente'}")
+            await db.commit()
+            summary["skipped"] = "order_not_waiting_payment"
+            return summary
 
-            # Response final preparado
+        await db.refresh(order, ["order_items", "order_service_items"])
+        if not order.order_items:
+            raise ValueError(f"La orden {order.id} no tiene items")
+        order_item = order.order_items[0]
 
-            # Guardar en cache para idempotencia
-            await cache_set(cache_key, response, expire=3600)
+        context = await PurchaseContextCache.get(db, str(order_item.event_id))
+        if not context:
+            raise ValueError("Evento no encontrado")
 
-            return response
+        # Items del pago con los precios guardados en la orden (no los actuales)
+        ticket_type = next(
+            (t for t in context.ticket_types if t.id == order_item.ticket_type_id),
+            context.default_ticket_type()
+        )
+        if not ticket_type:
+            raise ValueError("No se encontró tipo de ticket para el evento")
+        ticket_type = ticket_type._replace(price=order_item.unit_price)
+        services = []
+        selected_services: Dict[str, int] = {}
+        for item in order.order_service_items:
+            for service in context.services_for([item.service_id]):
+                services.append(service._replace(price=item.unit_price))
+                selected_services[str(service.id)] = item.quantity
+
+        # Datos del pagador desde los attendees guardados en la orden
+        request = PurchaseRequest(
+            event_id=str(order_item.event_id),
+            attendees=[AttendeeData(**attendee) for attendee in (order.attendees_data or [])]
+        )
+        is_payku = order.payment_provider == "payku"
 
-        # Si es Mercado Pago, crear preferencia de pago
-        else:
-            try:
-                # Creando preferencia de Mercado Pago
-                print(f"[DEBUG] Payment method recibido: {payment_method}")
-
-                # Construir items para la preferencia (tickets + servicios + comisiones)
-                items = []
-
-                # Item para tickets
-                ticket_type_name = ticket_type.name if hasattr(ticket_type, 'name') else "Ticket"
-                items.append({
-                    "title": f"{ticket_type_name} - {event.name}",
-                    "description": f"{total_quantity} ticket(s) para {event.name}",
-                    "quantity": total_quantity,
-                    "unit_price": float(ticket_type.price)
-                })
-
-                # Items para servicios adicionales
-                if request.selected_services:
-                    # Recargar servicios para obtener nombres
-                    stmt_services = select(EventService).where(
-                        EventService.event_id == request.event_id,
-                        EventService.id.in_(list(request.selected_services.keys()))
-                    )
-                    result_services = await db.execute(stmt_services)
-                    services = result_services.scalars().all()
-
-                    for service in services:
-                        quantity = request.selected_services.get(str(service.id), 0)
-                        if quantity > 0:
-                            items.append({
-                                "title": service.name or "Servicio adicional",
-                                "description": f"{service.name} - {event.name}",
-                                "quantity": quantity,
-                                "unit_price": float(service.price)
-                            })
+        # Liberar la conexión mientras responde el proveedor
+        await db.commit()
 
-                # --- COMISIONES BLOQUE COMPLETO - COMENTADO TEMPORALMENTE ---
-                # Las comisiones ya están incluidas en el precio del ticket por los administradores
-                # Comisión: 1500 CLP por cada entrada (adulto o niño)
-                # COMMISSION_PER_TICKET = 1500.0
-                #
-                # if total_quantity > 0:
-                #     items.append({
-                #         "title": "Comisión de servicio",
-                #         "description": f"Comisión de procesamiento por entrada ({total_quantity} entrada(s))",
-                #         "quantity": total_quantity,  # Una comisión por cada entrada
-                #         "unit_price": float(COMMISSION_PER_TICKET)  # 1500 CLP por entrada
-                #     })
-                #
-                # commission_total = total_quantity * COMMISSION_PER_TICKET
-                # print(f"[DEBUG] Items para preferencia: {items}")
-                # print(f"[DEBUG] Comisiones: {total_quantity} entrada(s) × {COMMISSION_PER_TICKET} CLP = {commission_total} CLP")
-                # ------------------------------------
-                print(f"[DEBUG] Items para preferencia: {items}")
-
-                # Obtener información del primer attendee para la preferencia
-                payer_email = None
-                payer_name = None
-                payer_identification = None
-                if request.attendees and len(request.attendees) > 0:
-                    first_attendee = request.attendees[0]
-                    payer_email = first_attendee.email
-                    payer_name = first_attendee.name
-                    # Construir identificación si está disponible
-                    if first_attendee.document_type and first_attendee.document_number:
-                        payer_identification = {
-                            "type": first_attendee.document_type,
-                            "number": first_attendee.document_number
-                        }
-
-                # Crear preferencia con múltiples items (ASYNC - no bloquea el event loop)
-                preference = await self.mercado_pago_service.create_preference_async(
-                    order_id=str(order.id),
-                    currency="CLP",
-                    items=items,
-                    payer_email=payer_email,
-                    payer_name=payer_name,
-                    payer_identification=payer_identification
+        try:
+            if is_payku:
+                payment_reference, payment_link = await self._create_payku_payment(
+                    order, context.event, float(order.total), request
+                )
+            else:
+                payment_reference, payment_link = await self._create_mercadopago_payment(
+                    order, context.event, ticket_type, services, selected_services,
+                    order_item.quantity, request
                 )
+        except Exception as e:
+            if not final_attempt:
+                raise
+            logger.error(f"Error creando pago para orden {order.id}: {str(e)}", exc_info=True)
+            await self._cancel_order(db, order, "payment_creation_failed")
+            outbox = await db.get(OutboxEvent, outbox_id)
+            self._finish_outbox(outbox, f"Error creando pago: {str(e)}"[:500])
+            await db.commit()
+            summary["cancelled"] = True
+            return summary
+
+        # Solo si sigue pendiente y sin pago (un reintento del POST pudo crearlo)
+        result = await db.execute(
+            update(Order)
+            .where(Order.id == order.id, Order.status == "pending", Order.payment_reference.is_(None))
+            .values(payment_reference=payment_reference)
+            .returning(Order.id)
+        )
+        stored = result.scalar_one_or_none() is not None
+        outbox = await db.get(OutboxEvent, outbox_id)
+        self._finish_outbox(outbox, None if stored else "La orden cambió mientras se creaba el pago")
+        await db.commit()
+
+        if not stored:
+            summary["skipped"] = "order_changed"
+            return summary
+
+        reference_field = "transaction_id" if is_payku else "preference_id"
+        await OrderStatusHub.publish(
+            order.id, "pending", payment_link=payment_link, **{reference_field: payment_reference}
+        )
+
+        if order.idempotency_key:
+            await cache_set(f"purchase:idempotency:{order.idempotency_key}", {
+                "order_id": str(order.id),
+                "payment_link": payment_link,
+                "status": "pending",
+                "payment_method": order.payment_provider,
+                reference_field: payment_reference
+            }, expire=3600)
+
+        summary["payment_created"] = True
+        summary[reference_field] = payment_reference
+        return summary
+
+    @staticmethod
+    def _finish_outbox(outbox: OutboxEvent, error: Optional[str] = None):
+        """Marcar procesada la fila del outbox (sin commit)"""
+        outbox.status = "processed"
+        outbox.processed_at = datetime.now(timezone.utc)
+        outbox.last_error = error
+
+    async def _create_payku_payment(
+        self,
+        order: Order,
+        event,
+        total: float,
+        request: PurchaseRequest
+    ) -> tuple:
+        """
+        Crear la transacción de Payku de una orden
 
-                logger.debug(f"Preferencia MercadoPago creada: {preference.get('preference_id')}")
+        Returns:
+            (transaction_id, payment_link)
+        """
+        # Obtener información del primer attendee para la transacción
+        payer_email = None
+        if request.attendees and len(request.attendees) > 0:
+            first_attendee = request.attendees[0]
+            payer_email = first_attendee.email
+
+        if not payer_email:
+            raise ValueError("Se requiere un email para crear la transacción de Payku")
+
+        # Crear descripción del pago
+        subject = f"Compra de tickets - {event.name}"
+
+        # Crear transacción con Payku (ASYNC - no bloquea el event loop)
+        transaction = await self.payku_service.create_transaction(
+            order_id=str(order.id),
+            email=payer_email,
+            amount=total,
+            subject=subject,
+            currency=order.currency or "CLP"
+        )
 
-                # Validar que la preferencia tenga los campos necesarios
-                if not preference.get("preference_id"):
-                    raise ValueError("La preferencia no tiene preference_id")
+        logger.debug(f"Transacción Payku creada: {transaction.get('transaction_id')}")
 
-                if not preference.get("payment_link"):
-                    logger.error(f"Preferencia creada pero sin payment_link: {preference.get('preference_id')}")
-                    raise ValueError("La preferencia se creó pero no tiene payment_link")
+        # Validar que la transacción tenga los campos necesarios
+        if not transaction.get("payment_link"):
+            raise ValueError("La transacción no tiene payment_link")
 
-                order.payment_reference = preference["preference_id"]
-                payment_link = preference["payment_link"]
+        return transaction.get("transaction_id"), transaction["payment_link"]
 
-            except Exception as e:
-                # Si falla la creación de preferencia, liberar capacidad y rollback
-                import traceback
-                error_trace = traceback.format_exc()
-                print(f"[ERROR] Error creando preferencia de pago: {str(e)}")
-                print(f"[ERROR] Traceback: {error_trace}")
-                await self.inventory_service.release_capacity(
-                    db, request.event_id, total_quantity, "payment_creation_failed"
-                )
-                await db.rollback()
-                raise ValueError(f"Error creando preferencia de pago: {str(e)}")
+    async def _create_mercadopago_payment(
+        self,
+        order: Order,
+        event,
+        ticket_type,
+        services: list,
+        selected_services: Dict[str, int],
+        total_quantity: int,
+        request: PurchaseRequest
+    ) -> tuple:
+        """
+        Crear la preferencia de Mercado Pago de una orden
 
-            await db.commit()
-            await db.refresh(order)
+        Returns:
+            (preference_id, payment_link)
+        """
+        print("[DEBUG] Creando preferencia de Mercado Pago")
+
+        # Construir items para la preferencia (tickets + servicios + comisiones)
+        items = []
+
+        # Item para tickets
+        ticket_type_name = ticket_type.name if hasattr(ticket_type, 'name') else "Ticket"
+        items.append({
+            "title": f"{ticket_type_name} - {event.name}",
+            "description": f"{total_quantity} ticket(s) para {event.name}",
+            "quantity": total_quantity,
+            "unit_price": float(ticket_type.price)
+        })
+
+        # Items para servicios adicionales
+        for service in services:
+            items.append({
+                "title": service.name or "Servicio adicional",
+                "description": f"{service.name} - {event.name}",
+                "quantity": selected_services[str(service.id)],
+                "unit_price": float(service.price)
+            })
 
-            response = {
-                "order_id": str(order.id),
-                "payment_link": payment_link,
-                "preference_id": preference["preference_id"],
-                "status": "pending",
-                "payment_method": "mercadopago"
-            }
+        # --- COMISIONES BLOQUE COMPLETO - COMENTADO TEMPORALMENTE ---
+        # Las comisiones ya están incluidas en el precio del ticket por los administradores
+        # Comisión: 1500 CLP por cada entrada (adulto o niño)
+        # COMMISSION_PER_TICKET = 1500.0
+        #
+        # if total_quantity > 0:
+        #     items.append({
+        #         "title": "Comisión de servicio",
+        #         "description": f"Comisión de procesamiento por entrada ({total_quantity} entrada(s))",
+        #         "quantity": total_quantity,  # Una comisión por cada entrada
+        #         "unit_price": float(COMMISSION_PER_TICKET)  # 1500 CLP por entrada
+        #     })
+        #
+        # commission_total = total_quantity * COMMISSION_PER_TICKET
+        # print(f"[DEBUG] Items para preferencia: {items}")
+        # print(f"[DEBUG] Comisiones: {total_quantity} entrada(s) × {COMMISSION_PER_TICKET} CLP = {commission_total} CLP")
+        # ------------------------------------
+        print(f"[DEBUG] Items para preferencia: {items}")
+
+        # Obtener información del primer attendee para la preferencia
+        payer_email = None
+        payer_name = None
+        payer_identification = None
+        if request.attendees and len(request.attendees) > 0:
+            first_attendee = request.attendees[0]
+            payer_email = first_attendee.email
+            payer_name = first_attendee.name
+            # Construir identificación si está disponible
+            if first_attendee.document_type and first_attendee.document_number:
+                payer_identification = {
+                    "type": first_attendee.document_type,
+                    "number": first_attendee.document_number
+                }
 
-            # Response final preparado
+        # Crear preferencia con múltiples items (ASYNC - no bloquea el event loop)
+        preference = await self.mercado_pago_service.create_preference_async(
+            order_id=str(order.id),
+            currency="CLP",
+            items=items,
+            payer_email=payer_email,
+            payer_name=payer_name,
+            payer_identification=payer_identification
+        )
 
-            # Guardar en cache para idempotencia
-            await cache_set(cache_key, response, expire=3600)
+        logger.debug(f"Preferencia MercadoPago creada: {preference.get('preference_id')}")
 
-            return response
+        # Validar que la preferencia tenga los campos necesarios
+        if not preference.get("preference_id"):
+            raise ValueError("La preferencia no tiene preference_id")
+
+        if not preference.get("payment_link"):
+            logger.error(f"Preferencia creada pero sin payment_link: {preference.get('preference_id')}")
+            raise ValueError("La preferencia se creó pero no tiene payment_link")
+
+        return preference["preference_id"], preference["payment_link"]
 
     async def process_payment_webhook(
         self,
@@ -754,7 +895,11 @@ class PurchaseService:
         Procesar webhook de Mercado Pago
 
         Returns:
-            True si se procesó correctamente
+            True si se procesó correctamente, False si la notificación no aplica
+
+        Raises:
+            Exception si Mercado Pago no respondió (red, 5xx, 429): la
+            notificación debe reintentarse, no descartarse
         """
         # Obtener datos de la notificación
         notification_data = payment_data.get("data", {})
@@ -762,9 +907,21 @@ class PurchaseService:
         resource_id = notification_data.get("id")
 
         if not resource_id:
-            print("⚠️  Webhook sin ID de recurso")
+            logger.warning("Webhook sin ID de recurso")
             return False
 
+        # Notificaciones repetidas: cortar antes de llamar a Mercado Pago
+        dedup_resource = f"{notification_type or 'payment'}:{resource_id}"
+        if notification_type == "order" and notification_data.get("status"):
+            notified_status = self._map_mp_order_status(notification_data.get("status"))
+            if await WebhookDedupStore.seen("mercadopago", dedup_resource, notified_status):
+                logger.debug(f"[WEBHOOK] Order {resource_id} ya procesada con estado {notified_status}, se ignora")
+                return True
+        elif payment_data.get("action") == "payment.created":
+            if await WebhookDedupStore.seen("mercadopago", dedup_resource):
+                logger.debug(f"[WEBHOOK] Pago {resource_id} ya procesado, se ignora payment.created repetido")
+                return True
+
         # Para notificaciones de tipo "order", usar external_reference directamente
         external_reference = None
         payment_status = None
@@ -780,7 +937,9 @@ class PurchaseService:
                     order_info = await self.mercado_pago_service.verify_order_async(resource_id)
                     external_reference = order_info.get("external_reference")
                     payment_status = order_info.get("status")
-                except Exception as e:
+                except MercadoPagoAPIError as e:
+                    if not e.permanent:
+                        raise
                     logger.warning(f"No se pudo obtener order {resource_id} (puede ser simulación): {e}")
                     return False
         else:
@@ -789,7 +948,9 @@ class PurchaseService:
                 payment_info = await self.mercado_pago_service.verify_payment_async(resource_id)
                 external_reference = payment_info.get("external_reference")
                 payment_status = payment_info.get("status")
-            except Exception as e:
+            except MercadoPagoAPIError as e:
+                if not e.permanent:
+                    raise
                 logger.warning(f"No se pudo obtener pago {resource_id} (puede ser simulación): {e}")
                 # Intentar obtener external_reference de la notificación directamente
                 external_reference = notification_data.get("external_reference")
@@ -800,6 +961,14 @@ class PurchaseService:
             logger.warning("Webhook sin external_reference")
             return False
 
+        if notification_type == "order":
+            payment_status = self._map_mp_order_status(payment_status)
+
+        # Estado ya aplicado (payment.updated reintentado): no tocar la DB
+        if await WebhookDedupStore.seen("mercadopago", dedup_resource, payment_status):
+            logger.debug(f"[WEBHOOK] {dedup_resource} ya procesado con estado {payment_status}, se ignora")
+            return True
+
         # Buscar orden
         stmt = select(Order).where(Order.id == external_reference)
         result = await db.execute(stmt)
@@ -812,66 +981,137 @@ class PurchaseService:
         # Mapear estados de order a estados de pago
         # Para notificaciones de tipo "order", el status puede ser "processed", "pending", etc.
         # Para notificaciones de tipo "payment", el status es "approved", "pending", etc.
-        print(f"🔔 [WEBHOOK] Tipo: {notification_type}, Estado recibido: {payment_status}, Resource ID: {resource_id}")
-        print(f"🔔 [WEBHOOK] External Reference: {external_reference}, Order ID: {order.id if order else 'NO ENCONTRADA'}")
-
-        if notification_type == "order":
-            # Mapear estados de order a estados de pago
-            print(f"🔔 [WEBHOOK] Mapeando estado de order: {payment_status}")
-            if payment_status == "processed":
-                payment_status = "approved"
-                print(f"🔔 [WEBHOOK] Estado mapeado a: approved")
-            elif payment_status in ["expired", "failed", "canceled"]:
-                payment_status = "cancelled"
-                print(f"🔔 [WEBHOOK] Estado mapeado a: cancelled")
-            elif payment_status == "pending":
-                print(f"🔔 [WEBHOOK] Estado sigue siendo pending - el pago aún no se ha completado")
+        logger.debug(f"[WEBHOOK] Tipo: {notification_type}, Estado recibido: {payment_status}, Resource ID: {resource_id}")
+        logger.debug(f"[WEBHOOK] External Reference: {external_reference}, Order ID: {order.id if order else 'NO ENCONTRADA'}")
 
         # Actualizar estado según el pago
-        print(f"🔔 [WEBHOOK] Estado final a procesar: {payment_status}")
+        logger.debug(f"[WEBHOOK] Estado final a procesar: {payment_status}")
         if payment_status == "approved":
-            print(f"✅ [WEBHOOK] Pago aprobado! Actualizando orden {order.id} a 'completed'")
-            order.status = "completed"  # Cambiar a "completed" según el modelo
-            order.paid_at = datetime.utcnow()
-            await db.flush()
-
-            # Generar tickets después de pago exitoso (solo para Mercado Pago)
-            # Las transferencias bancarias ya tienen tickets creados con status "pending"
-            if order.payment_provider == "mercadopago":
-                try:
-                    await self._generate_tickets(db, order, ticket_status="issued")
-                    await db.commit()
-                except Exception as e:
-                    await db.rollback()
-                    # Log error pero no fallar el webhook
-                    print(f"Error generando tickets para orden {order.id}: {e}")
-                    # Marcar orden como paid aunque falle la generación de tickets
-                    order.status = "completed"
-                    await db.commit()
-            else:
-                # Para transferencias bancarias, solo actualizar el estado de la orden
-                # Los tickets ya fueron creados con status "pending"
-                await db.commit()
+            logger.info(f"[WEBHOOK] Pago aprobado! Actualizando orden {order.id} a 'completed'")
+            # Tickets, PDF y email quedan en el outbox (se procesan en Celery)
+            await self._complete_paid_order(db, order)
+            await WebhookDedupStore.mark("mercadopago", dedup_resource, payment_status)
 
             return True
-        elif payment_status in ["rejected", "cancelled", "refunded"]:
-            print(f"❌ [WEBHOOK] Pago rechazado/cancelado. Actualizando orden {order.id} a 'cancelled'")
-            order.status = "cancelled"
-            await db.commit()
+        elif payment_status in MERCADOPAGO_CANCEL_STATUSES:
+            logger.info(f"[WEBHOOK] Pago devuelto ({payment_status}). Actualizando orden {order.id} a 'cancelled'")
+            await self._cancel_order(db, order, "payment_failed")
+            await WebhookDedupStore.mark("mercadopago", dedup_resource, payment_status)
 
-            # Liberar capacidad
-            for order_item in order.order_items:
-                await self.inventory_service.release_capacity(
-                    db, str(order_item.event_id), order_item.quantity, "payment_failed"
-                )
+            return True
+        elif payment_status in ["rejected", "cancelled"]:
+            # La orden sigue pendiente: el comprador puede reintentar el pago
+            # hasta que venza el hold, que es el que libera la capacidad
+            logger.info(f"[WEBHOOK] Pago {payment_status} para orden {order.id}; la orden sigue pendiente")
+            await WebhookDedupStore.mark("mercadopago", dedup_resource, payment_status)
 
             return True
 
         # Si el estado es "pending", el webhook se recibió pero el pago aún no está aprobado
-        print(f"⏳ [WEBHOOK] Estado '{payment_status}' - El pago aún está pendiente. No se actualiza la orden.")
-        print(f"⏳ [WEBHOOK] Esto es normal si el pago aún no se ha completado en Mercado Pago.")
+        logger.debug(f"[WEBHOOK] Estado '{payment_status}' - El pago aún está pendiente. No se actualiza la orden.")
         return False
 
+    @staticmethod
+    def _map_mp_order_status(status: Optional[str]) -> Optional[str]:
+        """Mapear estados de order de Mercado Pago a estados de pago"""
+        if status == "processed":
+            return "approved"
+        if status in ["expired", "failed", "canceled"]:
+            return "cancelled"
+        return status
+
+    async def process_payku_webhook(
+        self,
+        db: AsyncSession,
+        data: Dict
+    ) -> Dict:
+        """
+        Procesar webhook de Payku
+
+        Returns:
+            dict con status ("ok" | "ignored") y message
+        """
+        webhook_info = self.payku_service.process_webhook(data)
+
+        # Obtener order_id del webhook
+        order_id = webhook_info.get("order_id")
+        if not order_id:
+            logger.warning("No se encontró order_id en el webhook Payku")
+            return {"status": "ignored", "message": "No order_id found"}
+
+        status = webhook_info.get("status")
+        if await WebhookDedupStore.seen("payku", str(order_id), status):
+            logger.debug(f"[WEBHOOK PAYKU] Orden {order_id} ya procesada con estado {status}, se ignora")
+            return {"status": "ok", "message": f"Payment already {status}"}
+
+        # Buscar orden
+        stmt = select(Order).where(Order.id == order_id)
+        result = await db.execute(stmt)
+        order = result.scalar_one_or_none()
+
+        if not order:
+            logger.warning(f"[WEBHOOK PAYKU] Orden {order_id} no encontrada")
+            return {"status": "ignored", "message": f"Order {order_id} not found"}
+
+        # Actualizar estado según el webhook
+        logger.debug(f"[WEBHOOK PAYKU] Estado recibido: {status}")
+
+        if status == "approved":
+            logger.info(f"[WEBHOOK PAYKU] Pago aprobado! Actualizando orden {order.id} a 'completed'")
+            # Tickets, PDF y email quedan en el outbox: el webhook responde sin esperarlos.
+            # Los attendees se toman de orders.attendees_data (o del cache) al generar los tickets
+            await self._complete_paid_order(db, order)
+            await WebhookDedupStore.mark("payku", str(order_id), status)
+            logger.info(f"[WEBHOOK PAYKU] Orden {order.id} completada, tickets y email encolados")
+
+            return {"status": "ok", "message": "Payment approved, tickets queued"}
+
+        elif status in ["rejected", "cancelled"]:
+            logger.info(f"[WEBHOOK PAYKU] Pago rechazado/cancelado. Actualizando orden {order.id} a 'cancelled'")
+            await self._cancel_order(db, order, "payment_failed")
+            await WebhookDedupStore.mark("payku", str(order_id), status)
+
+            return {"status": "ok", "message": "Payment cancelled"}
+
+        # Si el estado es "pending", el webhook se recibió pero el pago aún no está aprobado
+        logger.debug(f"[WEBHOOK PAYKU] Estado '{status}' - El pago aún está pendiente.")
+        return {"status": "ignored", "message": f"Payment still {status}"}
+
+    async def get_order_status_snapshot(
+        self,
+        db: AsyncSession,
+        order_id: str
+    ) -> Optional[Dict]:
+        """
+        Estado mínimo de una orden para el canal push (sin consultar al proveedor)
+
+        Libera la conexión al terminar: SSE y long-poll mantienen la request
+        abierta mucho después de esta lectura.
+        """
+        result = await db.execute(
+            select(Order.id, Order.status, Order.user_id).where(Order.id == order_id)
+        )
+        row = result.first()
+        if row is None:
+            await db.commit()
+            return None
+
+        tickets_issued = False
+        if row.status == "completed":
+            tickets_issued = bool(await db.scalar(
+                select(func.count(Ticket.id))
+                .join(OrderItem, Ticket.order_item_id == OrderItem.id)
+                .where(OrderItem.order_id == row.id)
+            ))
+        await db.commit()
+
+        return {
+            "order_id": str(row.id),
+            "status": row.status,
+            "tickets_issued": tickets_issued,
+            "user_id": str(row.user_id) if row.user_id else None,
+        }
+
     async def get_order_status(
         self,
         db: AsyncSession,
@@ -1013,91 +1253,19 @@ class PurchaseService:
 
                 # Si el estado cambió, actualizar la orden
                 if mapped_status != order.status:
-                    print(f"✅ [get_order_status] Estado cambió de '{order.status}' a '{mapped_status}'. Actualizando orden...")
-
-                    # Guardar idempotency_key ANTES de cualquier operación que pueda fallar
-                    idempotency_key_str = str(order.idempotency_key) if order.idempotency_key else None
-
-                    order.status = mapped_status
+                    logger.info(
+                        f"[get_order_status] Orden {order_id}: estado '{order.status}' -> '{mapped_status}'"
+                    )
 
                     if mapped_status == "completed":
-                        order.paid_at = datetime.utcnow()
-                        await db.flush()
-
-                        # Intentar recuperar attendees - PRIORIDAD 1: desde la base de datos (más confiable)
-                        attendees_data = None
-                        if order.attendees_data:
-                            attendees_data = order.attendees_data
-                            print(f"🔍 [get_order_status] ✅ Attendees recuperados de la base de datos: {len(attendees_data)}")
-
-                        # PRIORIDAD 2: Si no están en BD, intentar desde cache
-                        if not attendees_data and idempotency_key_str:
-                            attendees_cache_key = f"purchase:attendees:{idempotency_key_str}"
-                            attendees_data = await cache_get(attendees_cache_key)
-                            print(f"🔍 [get_order_status] Attendees del cache: {attendees_data is not None}")
-                            if attendees_data:
-                                print(f"🔍 [get_order_status] ✅ Attendees recuperados del cache: {len(attendees_data)}")
-                                # Guardar en BD para futuras referencias
-                                order.attendees_data = attendees_data
-                                await db.flush()
-
-                        # OPTIMIZACIÓN: Generar tickets en background (no bloquea respuesta)
-                        # CRÍTICO: Los tickets SIEMPRE deben crearse con los datos del formulario
-                        try:
-                            if attendees_data:
-                                # Generar tickets de forma asíncrona en background
-                                from asyncio import create_task
-                                create_task(
-                                    self._generate_tickets_background(
-                                        str(order.id),
-                                        attendees_data
-                                    )
-                                )
-                                print(f"🚀 [get_order_status] Iniciando generación de tickets en background para orden {order_id}")
-                                # Responder inmediatamente sin esperar generación de tickets
-                                await db.commit()
-                                await db.refresh(order)
-                                print(f"✅ [get_order_status] Orden actualizada, tickets se generarán en background")
-                            else:
-                                # Si no hay attendees, esto es un error crítico - NO crear tickets genéricos
-                                raise ValueError(
-                                    f"❌ ERROR CRÍTICO: No se encontraron datos de attendees para orden {order_id}. "
-                                    f"Los tickets NO pueden crearse sin los datos del formulario. "
-                                    f"Idempotency key: {idempotency_key_str}. "
-                                    f"La orden quedará marcada como 'completed' pero SIN TICKETS. "
-                                    f"Se requiere intervención manual para generar los tickets con los datos correctos."
-                                )
-                        except Exception as e:
-                            await db.rollback()
-                            # Log error pero no fallar la verificación
-                            import traceback
-                            print(f"❌ [get_order_status] Error generando tickets para orden {order_id}: {str(e)}")
-                            print(f"❌ [get_order_status] Idempotency key: {idempotency_key_str}")
-                            print(f"❌ [get_order_status] Traceback: {traceback.format_exc()}")
-                            # Marcar orden como completed aunque falle la generación de tickets
-                            # Usar order_id en lugar de order para evitar MissingGreenlet después del rollback
-                            # Order ya está importado al inicio del archivo, no importar nuevamente
-                            try:
-                                stmt = select(Order).where(Order.id == order_id)
-                                result = await db.execute(stmt)
-                                order_for_update = result.scalar_one_or_none()
-                                if order_for_update:
-                                    order_for_update.status = "completed"
-                                    await db.commit()
-                                    print(f"⚠️  [get_order_status] Orden {order_id} marcada como completed sin tickets. Se pueden generar manualmente.")
-                            except Exception as commit_error:
-                                # Si incluso el commit falla, al menos loguear
-                                print(f"❌ [get_order_status] Error crítico al hacer commit: {str(commit_error)}")
-                                await db.rollback()
+                        # Mismo camino que el webhook: tickets, PDF y email quedan en el
+                        # outbox y los emite process_order_post_payment. Los attendees
+                        # se toman de orders.attendees_data (o del cache) al generarlos
+                        await self._complete_paid_order(db, order)
                     elif mapped_status == "cancelled":
-                        await db.commit()
-
-                        # Liberar capacidad
-                        for order_item in order.order_items:
-                            await self.inventory_service.release_capacity(
-                                db, str(order_item.event_id), order_item.quantity, "payment_failed"
-                            )
+                        await self._cancel_order(db, order, "payment_failed")
                     else:
+                        order.status = mapped_status
                         await db.commit()
 
                     # Refrescar la orden para obtener los valores actualizados
@@ -1185,12 +1353,190 @@ class PurchaseService:
                 "paid_at": None
         }
 
+    async def _lock_order_status(self, db: AsyncSession, order: Order) -> str:
+        """
+        Leer el estado persistido de la orden con SELECT ... FOR UPDATE
+
+        Los cambios aún no escritos sobre `order` no se flushean ni se pierden.
+        """
+        with db.no_autoflush:
+            result = await db.execute(
+                select(Order.status).where(Order.id == order.id).with_for_update()
+            )
+        return result.scalar_one()
+
+    async def _mark_order_paid(self, db: AsyncSession, order: Order) -> None:
+        """
+        Marcar una orden como pagada (sin commit)
+
+        Bloquea la fila para serializar con el sweeper de holds. Si la orden ya
+        había liberado su capacidad (hold expirado o cancelación), se vuelve a
+        reservar: el pago ya está capturado, así que la orden se completa igual.
+
+        La reserva queda en la transacción del llamador, que debe terminarla
+        con InventoryService.commit_reservations (o rollback_reservations)
+        junto con el resto de sus cambios.
+        """
+        # Expirada o cancelada: su capacidad ya se devolvió
+        was_released = await self._lock_order_status(db, order) in ["expired", "cancelled"]
+
+        order.status = "completed"
+        order.paid_at = datetime.utcnow()
+
+        await CapacityHoldService.release_hold(order.id)
+
+        if was_released:
+            for event_id, (quantity, services) in (await self._order_reservations(db, order)).items():
+                reserved, message = await self.inventory_service.reserve_order(
+                    db, event_id, quantity, services, f"order_{order.id}_late_payment", commit=False
+                )
+                if not reserved:
+                    logger.error(
+                        f"Pago tardío de orden liberada {order.id} sin capacidad/stock disponible "
+                        f"en evento {event_id} ({message}): posible sobreventa"
+                    )
+
+        await db.flush()
+
+    async def _complete_paid_order(self, db: AsyncSession, order: Order) -> bool:
+        """
+        Marcar una orden como pagada y encolar sus efectos (con commit)
+
+        La fila `order_paid` del outbox se escribe en la misma transacción que
+        el cambio a 'completed'; tickets, PDF y email los procesa
+        process_order_post_payment cuando el relay la publica. Es el único
+        camino por el que webhook, polling y verificación completan una orden.
+
+        Returns:
+            False si otro proceso ya la había completado
+        """
+        # Las transferencias bancarias ya tienen tickets creados con status "pending"
+        is_bank_transfer = order.payment_provider == "bank_transfer"
+        try:
+            if await self._lock_order_status(db, order) == "completed":
+                await db.commit()
+                return False
+            await self._mark_order_paid(db, order)
+            if not is_bank_transfer:
+                await OutboxService.enqueue(db, order.id, ORDER_PAID)
+        except Exception:
+            await self.inventory_service.rollback_reservations(db)
+            raise
+
+        # Estado, reserva tardía y outbox en un solo commit
+        await self.inventory_service.commit_reservations(db)
+
+        await OrderStatusHub.publish(order.id, "completed", tickets_issued=is_bank_transfer)
+        return True
+
+    async def complete_paid_orders(self, db: AsyncSession, orders: List[Order]) -> List[str]:
+        """
+        Marcar varias órdenes pagadas en una sola transacción (con commit)
+
+        Cada orden encola su `order_paid` en el outbox igual que
+        _complete_paid_order. Se saltan las que otro proceso ya completó
+        (webhook, polling) entre la lectura y el bloqueo.
+
+        Returns:
+            IDs de las órdenes completadas
+        """
+        completed = []
+        try:
+            for order in orders:
+                if await self._lock_order_status(db, order) == "completed":
+                    continue
+                await self._mark_order_paid(db, order)
+                if order.payment_provider != "bank_transfer":
+                    await OutboxService.enqueue(db, order.id, ORDER_PAID)
+                completed.append(str(order.id))
+        except Exception:
+            await self.inventory_service.rollback_reservations(db)
+            raise
+
+        await self.inventory_service.commit_reservations(db)
+
+        for order_id in completed:
+            await OrderStatusHub.publish(order_id, "completed", tickets_issued=False)
+        return completed
+
+    async def _cancel_order(
+        self,
+        db: AsyncSession,
+        order: Order,
+        reason: str = "payment_failed"
+    ) -> bool:
+        """
+        Cancelar una orden y liberar su capacidad (con commit)
+
+        No libera nada si la orden ya estaba cancelada o expirada, para no
+        devolver dos veces la misma capacidad.
+
+        Returns:
+            True si la orden pasó a 'cancelled'
+        """
+        if await self._lock_order_status(db, order) in ["cancelled", "expired"]:
+            await db.commit()
+            return False
+
+        reservations = await self._order_reservations(db, order)
+
+        order.status = "cancelled"
+        await db.commit()
+
+        await OrderStatusHub.publish(order.id, "cancelled")
+        await CapacityHoldService.release_hold(order.id)
+
+        # Liberar capacidad y stock de servicios
+        for event_id, (quantity, services) in reservations.items():
+            await self.inventory_service.release_order(db, event_id, quantity, services, reason)
+
+        return True
+
+    async def _abandon_order(self, db: AsyncSession, order: Order):
+        """
+        Cancelar una orden recién confirmada que no llegó a entregar su link de pago
+
+        Nunca lanza: el error original es el que debe ver el llamador.
+        """
+        order_id = order.id
+        try:
+            # El rollback expira la orden: volver a leerla antes de cancelar
+            await db.rollback()
+            order = await db.get(Order, order_id)
+            if order is not None:
+                await self._cancel_order(db, order, "payment_creation_failed")
+        except Exception as e:
+            logger.error(
+                f"No se pudo cancelar la orden {order_id} tras un error en la compra; "
+                f"queda pendiente con su capacidad reservada (revisar manualmente): {e}",
+                exc_info=True
+            )
+
+    async def _order_reservations(
+        self,
+        db: AsyncSession,
+        order: Order
+    ) -> Dict[str, tuple]:
+        """Asientos y servicios reservados por la orden: {event_id: (cantidad, {service_id: cantidad})}"""
+        await db.refresh(order, ["order_items", "order_service_items"])
+
+        reservations: Dict[str, tuple] = {}
+        for item in order.order_items:
+            quantity, services = reservations.get(str(item.event_id), (0, {}))
+            reservations[str(item.event_id)] = (quantity + item.quantity, services)
+        for item in order.order_service_items:
+            quantity, services = reservations.setdefault(str(item.event_id), (0, {}))
+            services[str(item.service_id)] = services.get(str(item.service_id), 0) + item.quantity
+
+        return reservations
+
     async def _generate_tickets(
         self,
         db: AsyncSession,
         order: Order,
         attendees_data: Optional[List[Dict]] = None,
-        ticket_status: str = "issued"
+        ticket_status: str = "issued",
+        send_emails: bool = True
     ) -> List[Ticket]:
         """
         Generar tickets después de pago exitoso o para transferencias bancarias
@@ -1200,6 +1546,7 @@ class PurchaseService:
             order: Orden
             attendees_data: Datos de attendees (opcional, si no se proporciona se busca en BD o cache)
             ticket_status: Estado inicial de los tickets ("issued" para Mercado Pago, "pending" para transferencias)
+            send_emails: Enviar el email con el PDF (False cuando lo hace el consumidor del outbox)
 
         Returns:
             Lista de tickets generados
@@ -1225,7 +1572,6 @@ class PurchaseService:
             if not attendees_data:
                 raise ValueError(f"No se encontraron datos de attendees para orden {order.id}")
 
-        tickets = []
         # --- COMISIONES BLOQUE COMPLETO - COMENTADO TEMPORALMENTE ---
         # Las comisiones ya están incluidas en el precio del ticket por los administradores
         # commission_total = 0.0
@@ -1241,14 +1587,20 @@ class PurchaseService:
         if not order_items_list:
             raise ValueError(f"No se encontraron order_items para la orden {order.id}")
 
+        # Construir todas las filas en memoria (IDs y QR precalculados) y
+        # escribirlas con un INSERT multi-fila por tabla
+        ticket_rows = []
+        child_rows = []
+        medication_rows = []
+
+        # Obtener tipos de ticket de todos los order items en una consulta
+        ticket_type_ids = {order_item.ticket_type_id for order_item in order_items_list}
+        result_ticket_types = await db.execute(select(TicketType.id).where(TicketType.id.in_(ticket_type_ids)))
+        existing_ticket_types = set(result_ticket_types.scalars().all())
+
         # Obtener order items
         for order_item in order_items_list:
-            # Obtener tipo de ticket
-            stmt_ticket_type = select(TicketType).where(TicketType.id == order_item.ticket_type_id)
-            result_ticket_type = await db.execute(stmt_ticket_type)
-            ticket_type = result_ticket_type.scalar_one_or_none()
-
-            if not ticket_type:
+            if order_item.ticket_type_id not in existing_ticket_types:
                 continue
 
             # Crear un ticket por cada attendee
@@ -1261,41 +1613,32 @@ class PurchaseService:
 
                 attendee_data = attendees_data[attendee_index]
                 attendee_index += 1
-                # Crear ticket
-                ticket_id = uuid.uuid4()
-                qr_signature = generate_qr_signature(str(ticket_id))
 
                 # Separar nombre completo en first_name y last_name
                 name_parts = attendee_data["name"].split(" ", 1)
                 first_name = name_parts[0] if name_parts else attendee_data["name"]
                 last_name = name_parts[1] if len(name_parts) > 1 else ""
 
-                # Normalizar email (lowercase, trim)
-                holder_email = None
-                if attendee_data.get("email"):
-                    holder_email = attendee_data["email"].lower().strip()
-
-                ticket = Ticket(
-                    id=ticket_id,
+                ticket_row = TicketIssuanceService.build_ticket_row(
                     order_item_id=order_item.id,
                     event_id=order_item.event_id,
-                    holder_first_name=first_name,
-                    holder_last_name=last_name,
-                    holder_email=holder_email,  # Email del attendee correspondiente
-                    holder_document_type=attendee_data.get("document_type"),
-                    holder_document_number=attendee_data.get("document_number"),
+                    first_name=first_name,
+                    last_name=last_name,
+                    email=attendee_data.get("email"),  # Email del attendee correspondiente
+                    document_type=attendee_data.get("document_type"),
+                    document_number=attendee_data.get("document_number"),
                     is_child=attendee_data.get("is_child", False),
-                    qr_signature=qr_signature,
-                    status=ticket_status,  # "issued" para Mercado Pago, "pending" para transferencias
-                    issued_at=datetime.utcnow() if ticket_status == "issued" else datetime.utcnow()  # Siempre establecer issued_at
+                    status=ticket_status  # "issued" para Mercado Pago, "pending" para transferencias
                 )
-                db.add(ticket)
-                await db.flush()
+                ticket_rows.append(ticket_row)
 
                 # Si es niño, crear detalles de niño
                 if attendee_data.get("is_child") and attendee_data.get("child_details"):
-                    child_details_data = attendee_data["child_details"]
-                    await self._create_child_details(db, ticket, child_details_data)
+                    child_row, child_medications = TicketIssuanceService.build_child_rows(
+                        ticket_row, attendee_data["child_details"]
+                    )
+                    child_rows.append(child_row)
+                    medication_rows.extend(child_medications)
 
                 # --- COMISIONES BLOQUE COMPLETO - COMENTADO TEMPORALMENTE ---
                 # Las comisiones ya están incluidas en el precio del ticket por los administradores
@@ -1308,14 +1651,16 @@ class PurchaseService:
                 # commission = OrderCommission(
                 #     id=uuid.uuid4(),
                 #     order_id=order.id,
-                #     ticket_id=ticket.id,
+                #     ticket_id=ticket_row["id"],
                 #     ticket_type="child" if attendee_data.get("is_child") else "adult",
                 #     commission_amount=commission_amount
                 # )
                 # db.add(commission)
                 # ------------------------------------
 
-                tickets.append(ticket)
+        tickets = await TicketIssuanceService.insert_tickets(
+            db, ticket_rows, child_rows, medication_rows
+        )
 
         # --- COMISIONES BLOQUE COMPLETO - COMENTADO TEMPORALMENTE ---
         # Las comisiones ya están incluidas en el precio del ticket por los administradores
@@ -1324,41 +1669,12 @@ class PurchaseService:
         # ------------------------------------
         await db.flush()
 
-        # ✅ ACTUALIZAR capacity_available de los eventos
-        # Agrupar tickets por evento para actualizar capacity_available correctamente
-        from collections import defaultdict
-        tickets_by_event = defaultdict(int)
-        for ticket in tickets:
-            tickets_by_event[ticket.event_id] += 1
-
-        # Actualizar capacity_available para cada evento
-        for event_id, tickets_count in tickets_by_event.items():
-            stmt_event = select(Event).where(Event.id == event_id)
-            result_event = await db.execute(stmt_event)
-            event = result_event.scalar_one_or_none()
-
-            if event:
-                # Calcular capacity_available correctamente: capacity_total - tickets_issued
-                # Contar todos los tickets emitidos (status = 'issued') para este evento
-                stmt_tickets_count = select(func.count(Ticket.id)).where(
-                    Ticket.event_id == event_id,
-                    Ticket.status == 'issued'
-                )
-                result_tickets_count = await db.execute(stmt_tickets_count)
-                total_tickets_issued = result_tickets_count.scalar() or 0
-
-                # Calcular capacity_available basándose en capacity_total - tickets_issued
-                new_capacity_available = max(0, event.capacity_total - total_tickets_issued)
-                old_capacity_available = event.capacity_available
-                event.capacity_available = new_capacity_available
-
-                print(f"✅ [_generate_tickets] Actualizado capacity_available para evento {event_id}: {old_capacity_available} -> {new_capacity_available} (capacity_total: {event.capacity_total}, tickets_issued: {total_tickets_issued})")
-                await db.flush()
-            else:
-                print(f"⚠️  [_generate_tickets] No se encontró el evento {event_id} para actualizar capacity_available")
+        # La capacidad ya se descontó al reservar la orden (reserve_order), así
+        # que emitir tickets no la vuelve a tocar. Los desvíos se detectan
+        # offline con CapacityReconciliationService.
 
         # Enviar emails con tickets (solo si el status es "issued", no para "pending")
-        if ticket_status == "issued" and tickets:
+        if send_emails and ticket_status == "issued" and tickets:
             try:
                 await self._send_ticket_emails(db, order, tickets)
             except Exception as e:
@@ -1373,19 +1689,21 @@ class PurchaseService:
         db: AsyncSession,
         order: Order,
         tickets: List[Ticket]
-    ):
+    ) -> bool:
         """
         Enviar UN SOLO email con PDF adjunto conteniendo TODOS los tickets de la orden.
 
         El PDF se genera llamando al microservicio pdfsvc y contiene una página por ticket,
         cada una con su QR code único.
+
+        Returns:
+            True si el email se envió
         """
-        import httpx
         from datetime import datetime
 
         if not tickets:
             logger.warning(f"No hay tickets para enviar en orden {order.id}")
-            return
+            return False
 
         # Obtener información del evento
         first_ticket = tickets[0]
@@ -1395,7 +1713,7 @@ class PurchaseService:
 
         if not event:
             logger.warning(f"No se encontró el evento {first_ticket.event_id} para enviar emails")
-            return
+            return False
 
         # Formatear fecha del evento
         event_date_str = "Fecha no especificada"
@@ -1447,27 +1765,26 @@ class PurchaseService:
         pdfsvc_url = os.getenv("PDFSVC_URL", "http://pdfsvc:9002")
 
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    f"{pdfsvc_url}/tickets/pdf/bulk",
-                    json={
-                        "tickets": tickets_data,
-                        "order_id": str(order.id),
-                        "buyer_name": attendees_names[0] if attendees_names else None,
-                    }
-                )
+            response = await get_http_client("pdfsvc").post(
+                f"{pdfsvc_url}/tickets/pdf/bulk",
+                json={
+                    "tickets": tickets_data,
+                    "order_id": str(order.id),
+                    "buyer_name": attendees_names[0] if attendees_names else None,
+                }
+            )
 
-                if response.status_code == 200:
-                    pdf_bytes = response.content
-                    logger.info(f"✅ PDF generado exitosamente para orden {order.id} ({len(tickets)} tickets, {len(pdf_bytes)} bytes)")
-                else:
-                    logger.error(f"❌ Error generando PDF: {response.status_code} - {response.text}")
+            if response.status_code == 200:
+                pdf_bytes = response.content
+                logger.info(f"✅ PDF generado exitosamente para orden {order.id} ({len(tickets)} tickets, {len(pdf_bytes)} bytes)")
+            else:
+                logger.error(f"❌ Error generando PDF: {response.status_code} - {response.text}")
         except Exception as e:
             logger.error(f"❌ Error conectando a pdfsvc: {e}", exc_info=True)
 
         if not pdf_bytes:
             logger.error(f"No se pudo generar PDF para orden {order.id}, no se enviará email")
-            return
+            return False
 
         # Determinar el email del comprador principal
         # Prioridad: primer attendee con email, o el holder del primer ticket
@@ -1482,7 +1799,7 @@ class PurchaseService:
 
         if not buyer_email:
             logger.warning(f"No hay email de comprador para orden {order.id}")
-            return
+            return False
 
         # Enviar UN solo email con el PDF adjunto
         email_service = EmailService()
@@ -1504,162 +1821,11 @@ class PurchaseService:
                 logger.info(f"✅ Email con {len(tickets)} entrada(s) enviado a {buyer_email} para orden {order.id}")
             else:
                 logger.error(f"❌ Error enviando email a {buyer_email} para orden {order.id}")
+            return bool(success)
 
         except Exception as e:
             logger.error(f"❌ Error enviando email a {buyer_email}: {e}", exc_info=True)
-
-    async def _create_child_details(
-        self,
-        db: AsyncSession,
-        ticket: Ticket,
-        child_details_data: Dict
-    ) -> TicketChildDetail:
-        """
-        Crear detalles de ticket para niño
-
-        Args:
-            db: Sesión de base de datos
-            ticket: Ticket del niño
-            child_details_data: Datos del niño del request original
-        """
-        # Calcular edad si tenemos birth_date
-        edad = 0
-        fecha_nacimiento = None
-        if child_details_data.get("birth_date"):
-            try:
-                if isinstance(child_details_data["birth_date"], str):
-                    # Intentar parsear como ISO format
-                    if "T" in child_details_data["birth_date"]:
-                        fecha_nacimiento = datetime.fromisoformat(child_details_data["birth_date"].replace("Z", "+00:00")).date()
-                    else:
-                        fecha_nacimiento = datetime.fromisoformat(child_details_data["birth_date"]).date()
-                elif isinstance(child_details_data["birth_date"], datetime):
-                    fecha_nacimiento = child_details_data["birth_date"].date()
-                elif isinstance(child_details_data["birth_date"], date):
-                    fecha_nacimiento = child_details_data["birth_date"]
-            except (ValueError, AttributeError) as e:
-                print(f"Error parseando birth_date: {e}, valor: {child_details_data.get('birth_date')}")
-                fecha_nacimiento = date.today()  # Usar fecha por defecto si falla
-
-            # Calcular edad
-            today = date.today()
-            edad = today.year - fecha_nacimiento.year
-            if today.month < fecha_nacimiento.month or (today.month == fecha_nacimiento.month and today.day < fecha_nacimiento.day):
-                edad -= 1
-
-        # Obtener nombre del ticket holder
-        nombre = f"{ticket.holder_first_name} {ticket.holder_last_name}".strip()
-        rut = ticket.holder_document_number or ""
-
-        child_detail = TicketChildDetail(
-            id=uuid.uuid4(),
-            ticket_id=ticket.id,
-            nombre=nombre,
-            rut=rut,
-            correo=ticket.holder_email,  # Usar el email del ticket (holder_email)
-            fecha_nacimiento=fecha_nacimiento or date.today(),
-            edad=edad,
-            tipo_documento=ticket.holder_document_type or "rut",
-            toma_medicamento=bool(child_details_data.get("medications")),
-            es_alergico=bool(child_details_data.get("allergies")),
-            detalle_alergias=child_details_data.get("allergies"),
-            tiene_necesidad_especial=bool(child_details_data.get("special_needs")),
-            detalle_necesidad_especial=child_details_data.get("special_needs"),
-            numero_emergencia=child_details_data.get("emergency_contact_phone", ""),
-            pais_telefono="CL",
-            nombre_contacto_emergencia=child_details_data.get("emergency_contact_name"),
-            parentesco_contacto_emergencia=None,
-            iglesia=None
-        )
-        db.add(child_detail)
-        await db.flush()
-
-        # Crear medicamentos si existen
-        if child_details_data.get("medications"):
-            medications = child_details_data["medications"]
-            # Asegurar que medications es una lista
-            if not isinstance(medications, list):
-                medications = []
-
-            for med_data in medications:
-                # Asegurar que med_data es un diccionario
-                if not isinstance(med_data, dict):
-                    continue
-
-                medication = TicketChildMedication(
-                    id=uuid.uuid4(),
-                    ticket_child_id=child_detail.id,
-                    nombre_medicamento=med_data.get("name", ""),
-                    frecuencia=med_data.get("frequency", ""),
-                    observaciones=med_data.get("notes")
-                )
-                db.add(medication)
-
-        return child_detail
-
-    async def _generate_tickets_background(
-        self,
-        order_id: str,
-        attendees_data: List[Dict]
-    ):
-        """
-        Genera tickets de forma asíncrona en background.
-        No bloquea la respuesta del endpoint.
-
-        Args:
-            order_id: ID de la orden (string)
-            attendees_data: Lista de datos de attendees
-        """
-        from shared.database.connection import async_session_maker
-        from uuid import UUID
-
-        try:
-            # Crear nueva sesión de BD para background task
-            if async_session_maker is None:
-                print(f"❌ [BACKGROUND] Database no inicializada, no se pueden generar tickets en background")
-                return
-
-            async with async_session_maker() as db:
-                try:
-                    # Buscar orden
-                    order = await db.get(Order, UUID(order_id))
-                    if not order:
-                        print(f"❌ [BACKGROUND] Orden {order_id} no encontrada para generar tickets")
-                        return
-
-                    # Verificar que la orden sigue siendo "completed"
-                    if order.status != "completed":
-                        print(f"⚠️  [BACKGROUND] Orden {order_id} no está completada (status: {order.status}), saltando generación de tickets")
-                        return
-
-                    # Verificar que no tenga tickets ya generados
-                    stmt_tickets = select(Ticket).join(OrderItem).where(OrderItem.order_id == order.id)
-                    result_tickets = await db.execute(stmt_tickets)
-                    existing_tickets = result_tickets.scalars().all()
-
-                    if existing_tickets:
-                        print(f"⚠️  [BACKGROUND] Orden {order_id} ya tiene {len(existing_tickets)} tickets, saltando generación")
-                        return
-
-                    # Generar tickets
-                    await self._generate_tickets(
-                        db,
-                        order,
-                        ticket_status="issued",
-                        attendees_data=attendees_data
-                    )
-                    await db.commit()
-                    print(f"✅ [BACKGROUND] Tickets generados exitosamente para orden {order_id}")
-
-                except Exception as e:
-                    await db.rollback()
-                    import traceback
-                    print(f"❌ [BACKGROUND] Error generando tickets para orden {order_id}: {str(e)}")
-                    print(f"❌ [BACKGROUND] Traceback: {traceback.format_exc()}")
-        except Exception as e:
-            import traceback
-            print(f"❌ [BACKGROUND] Error crítico en background task: {str(e)}")
-            print(f"❌ [BACKGROUND] Traceback: {traceback.format_exc()}")
+            return False
 
     def _generate_idempotency_key(self, request: PurchaseRequest) -> str:
         """Generar clave de idempotencia"""
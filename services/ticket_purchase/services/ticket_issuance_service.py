@@ -0,0 +1,184 @@
+"""
+Emisión de tickets por lotes
+
+Los IDs y firmas QR se calculan en Python y cada tabla (tickets,
+ticket_child_details, ticket_child_medications) se escribe con un solo INSERT
+multi-fila, así que emitir una orden de 1 o de 50 asistentes cuesta la misma
+cantidad de round trips. Para lotes muy grandes sin necesidad de objetos ORM
+(tickets manuales) se usa COPY.
+"""
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import insert
+from typing import Dict, List, Optional, Sequence, Tuple
+from datetime import datetime, date
+from shared.database.models import Ticket, TicketChildDetail, TicketChildMedication
+from shared.utils.qr_generator import generate_qr_signature
+import logging
+import os
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Desde cuántos tickets se usa COPY en vez de INSERT multi-fila
+TICKET_COPY_THRESHOLD = int(os.getenv("TICKET_COPY_THRESHOLD", "500"))
+
+
+class TicketIssuanceService:
+    """Construcción de filas y escritura por lotes de tickets"""
+
+    @staticmethod
+    def build_ticket_row(
+        order_item_id,
+        event_id,
+        first_name: str,
+        last_name: str,
+        email: Optional[str],
+        document_type: Optional[str],
+        document_number: Optional[str],
+        is_child: bool = False,
+        status: str = "issued"
+    ) -> Dict:
+        """Fila de ticket con ID y firma QR precalculados"""
+        ticket_id = uuid.uuid4()
+        return {
+            "id": ticket_id,
+            "order_item_id": order_item_id,
+            "event_id": event_id,
+            "holder_first_name": first_name,
+            "holder_last_name": last_name,
+            "holder_email": email.lower().strip() if email else None,
+            "holder_document_type": document_type,
+            "holder_document_number": document_number,
+            "is_child": is_child,
+            "qr_signature": generate_qr_signature(str(ticket_id)),
+            "status": status,
+            "issued_at": datetime.utcnow(),
+        }
+
+    @staticmethod
+    def build_child_rows(ticket_row: Dict, child_details_data: Dict) -> Tuple[Dict, List[Dict]]:
+        """
+        Filas de detalle de niño y sus medicamentos para un ticket
+
+        Returns:
+            (fila de ticket_child_details, filas de ticket_child_medications)
+        """
+        # Calcular edad si tenemos birth_date
+        edad = 0
+        fecha_nacimiento = None
+        if child_details_data.get("birth_date"):
+            try:
+                if isinstance(child_details_data["birth_date"], str):
+                    # Intentar parsear como ISO format
+                    if "T" in child_details_data["birth_date"]:
+                        fecha_nacimiento = datetime.fromisoformat(child_details_data["birth_date"].replace("Z", "+00:00")).date()
+                    else:
+                        fecha_nacimiento = datetime.fromisoformat(child_details_data["birth_date"]).date()
+                elif isinstance(child_details_data["birth_date"], datetime):
+                    fecha_nacimiento = child_details_data["birth_date"].date()
+                elif isinstance(child_details_data["birth_date"], date):
+                    fecha_nacimiento = child_details_data["birth_date"]
+            except (ValueError, AttributeError) as e:
+                print(f"Error parseando birth_date: {e}, valor: {child_details_data.get('birth_date')}")
+                fecha_nacimiento = date.today()  # Usar fecha por defecto si falla
+
+            if fecha_nacimiento:
+                today = date.today()
+                edad = today.year - fecha_nacimiento.year
+                if today.month < fecha_nacimiento.month or (today.month == fecha_nacimiento.month and today.day < fecha_nacimiento.day):
+                    edad -= 1
+
+        child_detail_id = uuid.uuid4()
+        child_row = {
+            "id": child_detail_id,
+            "ticket_id": ticket_row["id"],
+            "nombre": f"{ticket_row['holder_first_name']} {ticket_row['holder_last_name']}".strip(),
+            "rut": ticket_row["holder_document_number"] or "",
+            "correo": ticket_row["holder_email"],
+            "fecha_nacimiento": fecha_nacimiento or date.today(),
+            "edad": edad,
+            "tipo_documento": ticket_row["holder_document_type"] or "rut",
+            "toma_medicamento": bool(child_details_data.get("medications")),
+            "es_alergico": bool(child_details_data.get("allergies")),
+            "detalle_alergias": child_details_data.get("allergies"),
+            "tiene_necesidad_especial": bool(child_details_data.get("special_needs")),
+            "detalle_necesidad_especial": child_details_data.get("special_needs"),
+            "numero_emergencia": child_details_data.get("emergency_contact_phone", ""),
+            "pais_telefono": "CL",
+            "nombre_contacto_emergencia": child_details_data.get("emergency_contact_name"),
+            "parentesco_contacto_emergencia": None,
+            "iglesia": None,
+        }
+
+        medication_rows = []
+        medications = child_details_data.get("medications")
+        # Asegurar que medications es una lista de diccionarios
+        if isinstance(medications, list):
+            for med_data in medications:
+                if not isinstance(med_data, dict):
+                    continue
+                medication_rows.append({
+                    "id": uuid.uuid4(),
+                    "ticket_child_id": child_detail_id,
+                    "nombre_medicamento": med_data.get("name", ""),
+                    "frecuencia": med_data.get("frequency", ""),
+                    "observaciones": med_data.get("notes"),
+                })
+
+        return child_row, medication_rows
+
+    @staticmethod
+    async def _copy_rows(db: AsyncSession, table, rows: Sequence[Dict]):
+        """COPY de filas sobre la conexión de la sesión (misma transacción)"""
+        columns = list(rows[0].keys())
+        connection = await db.connection()
+        raw_connection = await connection.get_raw_connection()
+        await raw_connection.driver_connection.copy_records_to_table(
+            table.name,
+            records=[tuple(row[column] for column in columns) for row in rows],
+            columns=columns
+        )
+
+    @staticmethod
+    async def insert_tickets(
+        db: AsyncSession,
+        ticket_rows: Sequence[Dict],
+        child_rows: Sequence[Dict] = (),
+        medication_rows: Sequence[Dict] = (),
+        return_tickets: bool = True
+    ) -> List[Ticket]:
+        """
+        Escribir tickets, detalles de niños y medicamentos (un INSERT por tabla)
+
+        Args:
+            return_tickets: Devolver los Ticket ORM (en el orden de ticket_rows).
+                Si es False y el lote es grande se usa COPY.
+
+        Returns:
+            Tickets insertados (vacío si return_tickets=False)
+        """
+        if not ticket_rows:
+            return []
+
+        tickets: List[Ticket] = []
+        if not return_tickets and len(ticket_rows) >= TICKET_COPY_THRESHOLD:
+            # COPY no pasa por la unit of work: escribir antes lo pendiente (order_items)
+            await db.flush()
+            await TicketIssuanceService._copy_rows(db, Ticket.__table__, ticket_rows)
+        else:
+            result = await db.scalars(
+                insert(Ticket).returning(Ticket, sort_by_parameter_order=True),
+                list(ticket_rows)
+            )
+            tickets = list(result.all())
+
+        if child_rows:
+            await db.execute(insert(TicketChildDetail), list(child_rows))
+        if medication_rows:
+            await db.execute(insert(TicketChildMedication), list(medication_rows))
+
+        logger.debug(
+            f"Emitidos {len(ticket_rows)} tickets, {len(child_rows)} detalles de niño, "
+            f"{len(medication_rows)} medicamentos"
+        )
+        return tickets
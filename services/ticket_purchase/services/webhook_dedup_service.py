@@ -0,0 +1,88 @@
+"""
+Deduplicación de notificaciones de pago ya aplicadas
+
+Por cada recurso del proveedor (pago/order de Mercado Pago, transacción de
+Payku) se guarda un set de Redis `webhook:dedup:{provider}:{resource_id}` con
+los estados que ya se aplicaron a la orden, con TTL WEBHOOK_DEDUP_TTL. Solo se
+registran estados terminales (aprobado, rechazado, cancelado, reembolsado):
+una notificación `pending` nunca cambia la orden, así que no se marca.
+
+- Si la notificación trae su estado (order de Mercado Pago, Payku), un
+  SISMEMBER decide antes de cualquier llamada HTTP o consulta a la DB.
+- `payment.created` de Mercado Pago no trae estado, pero la creación nunca
+  es un estado nuevo: basta con que el recurso ya tenga un estado aplicado.
+- `payment.updated` puede traer un cambio real (reembolso), así que se
+  verifica con el proveedor y se deduplica después, antes de tocar la DB.
+
+Si Redis falla, todo cuenta como no visto: el procesamiento es idempotente y
+la deduplicación solo ahorra trabajo.
+"""
+from redis.exceptions import RedisError
+from typing import Optional
+from shared.cache.redis_client import get_redis
+from shared.utils.metrics import counter
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Segundos que se recuerda un estado aplicado (los proveedores reintentan durante horas)
+WEBHOOK_DEDUP_TTL = int(os.getenv("WEBHOOK_DEDUP_TTL", "172800"))
+
+TERMINAL_STATUSES = frozenset({"approved", "rejected", "cancelled", "refunded"})
+
+REDIS_FAILURES = (RedisError, OSError)
+
+_lookups = counter(
+    "webhook_dedup_lookups_total",
+    "Consultas al store de deduplicación de webhooks por proveedor y resultado (hit, miss)",
+    ("provider", "result")
+)
+
+
+class WebhookDedupStore:
+    """Set por recurso con los estados ya aplicados"""
+
+    @staticmethod
+    def _key(provider: str, resource_id: str) -> str:
+        return f"webhook:dedup:{provider}:{resource_id}"
+
+    @staticmethod
+    async def seen(provider: str, resource_id: Optional[str], status: Optional[str] = None) -> bool:
+        """
+        ¿Ya se aplicó este estado del recurso?
+
+        Con status=None pregunta si el recurso tiene cualquier estado aplicado.
+        """
+        if not resource_id:
+            return False
+
+        key = WebhookDedupStore._key(provider, resource_id)
+        try:
+            redis_conn = await get_redis()
+            if status is None:
+                hit = bool(await redis_conn.exists(key))
+            else:
+                hit = bool(await redis_conn.sismember(key, status))
+        except REDIS_FAILURES as e:
+            logger.warning(f"Store de deduplicación de webhooks no disponible: {e}")
+            hit = False
+
+        _lookups.inc(provider=provider, result="hit" if hit else "miss")
+        return hit
+
+    @staticmethod
+    async def mark(provider: str, resource_id: Optional[str], status: Optional[str]):
+        """Registrar un estado aplicado (llamar después del commit)"""
+        if not resource_id or status not in TERMINAL_STATUSES:
+            return
+
+        key = WebhookDedupStore._key(provider, resource_id)
+        try:
+            redis_conn = await get_redis()
+            async with redis_conn.pipeline(transaction=True) as pipe:
+                pipe.sadd(key, status)
+                pipe.expire(key, WEBHOOK_DEDUP_TTL)
+                await pipe.execute()
+        except REDIS_FAILURES as e:
+            logger.warning(f"No se pudo registrar el webhook {provider}:{resource_id} ({status}): {e}")
@@ -0,0 +1,331 @@
+"""
+Ingestión asíncrona de webhooks de pago con Redis Streams
+
+Los endpoints /webhook y /payku-webhook solo agregan la notificación cruda al
+stream `webhooks:stream` (XADD) y responden 200. El proceso
+`services.ticket_purchase.webhook_consumer` la procesa después como parte del
+consumer group `webhook-processors`:
+
+- Paralelismo: hasta WEBHOOK_CONSUMER_CONCURRENCY órdenes a la vez por consumidor,
+  así que una ráfaga de reintentos del proveedor no agota el pool de la DB.
+- Serialización por orden: las notificaciones de una misma orden se procesan
+  en el orden del stream y bajo un DistributedLock, también entre consumidores.
+  Las de pagos de Mercado Pago solo traen el ID del pago: al consumirlas se
+  resuelven a su orden (orders.payment_reference o la API) para compartir el
+  lock con las demás notificaciones de esa orden.
+- Entregas: un mensaje se confirma (XACK) solo después de procesarse. Uno que
+  queda pendiente más de WEBHOOK_CLAIM_IDLE_MS (consumidor caído o error) se
+  reclama y se reintenta; tras WEBHOOK_MAX_DELIVERIES entregas pasa a
+  `webhooks:dead` para revisión manual. Esperar el lock de la orden no cuenta
+  como entrega, y los errores transitorios del proveedor se reintentan en vez
+  de confirmarse como "ignored".
+
+Si Redis no está disponible, `ingest` devuelve None y la ruta procesa el
+webhook en línea como antes.
+"""
+from redis.exceptions import RedisError, ResponseError
+from typing import Dict, List, Optional, Tuple
+from datetime import datetime, timezone
+from shared.cache.redis_client import get_redis, DistributedLock, LockError
+from shared.utils.metrics import counter
+import asyncio
+import json
+import logging
+import os
+import socket
+
+logger = logging.getLogger(__name__)
+
+STREAM_KEY = "webhooks:stream"
+GROUP = "webhook-processors"
+DEAD_LETTER_KEY = "webhooks:dead"
+
+WEBHOOK_ASYNC_INGESTION = os.getenv("WEBHOOK_ASYNC_INGESTION", "true").lower() == "true"
+# Largo aproximado máximo del stream (los mensajes ya confirmados se recortan)
+WEBHOOK_STREAM_MAXLEN = int(os.getenv("WEBHOOK_STREAM_MAXLEN", "100000"))
+WEBHOOK_CONSUMER_CONCURRENCY = int(os.getenv("WEBHOOK_CONSUMER_CONCURRENCY", "4"))
+WEBHOOK_CONSUMER_BATCH = int(os.getenv("WEBHOOK_CONSUMER_BATCH", "50"))
+# Milisegundos que un mensaje puede quedar sin confirmar antes de reclamarlo
+WEBHOOK_CLAIM_IDLE_MS = int(os.getenv("WEBHOOK_CLAIM_IDLE_MS", "60000"))
+WEBHOOK_MAX_DELIVERIES = int(os.getenv("WEBHOOK_MAX_DELIVERIES", "5"))
+
+REDIS_FAILURES = (RedisError, OSError)
+
+_ingested = counter(
+    "webhook_ingested_total",
+    "Webhooks agregados al stream por proveedor",
+    ("provider",)
+)
+_processed = counter(
+    "webhook_processed_total",
+    "Webhooks procesados desde el stream por proveedor y resultado",
+    ("provider", "result")
+)
+_dead_lettered = counter(
+    "webhook_dead_lettered_total",
+    "Webhooks movidos a webhooks:dead tras agotar las entregas",
+    ("provider",)
+)
+
+
+class WebhookIngestionService:
+    """Productor y consumer group del stream de webhooks"""
+
+    @staticmethod
+    def serialization_key(provider: str, payload: Dict) -> str:
+        """
+        Clave de serialización: la orden cuando viene en la notificación,
+        si no el recurso del proveedor
+        """
+        if provider == "payku":
+            order_id = payload.get("order") or payload.get("ordencompra")
+            if order_id:
+                return str(order_id)
+            return f"payku:{payload.get('transaction_id') or payload.get('id') or 'unknown'}"
+
+        data = payload.get("data") or {}
+        if data.get("external_reference"):
+            return str(data["external_reference"])
+        return f"mercadopago:{data.get('id') or payload.get('id') or 'unknown'}"
+
+    @staticmethod
+    async def ingest(provider: str, payload: Dict, signature_valid: bool = True) -> Optional[str]:
+        """
+        Agregar una notificación al stream
+
+        Returns:
+            ID del mensaje, o None si la ingestión asíncrona está desactivada o
+            Redis falló (el llamador debe procesar en línea)
+        """
+        if not WEBHOOK_ASYNC_INGESTION:
+            return None
+
+        try:
+            redis_conn = await get_redis()
+            message_id = await redis_conn.xadd(
+                STREAM_KEY,
+                {
+                    "provider": provider,
+                    "key": WebhookIngestionService.serialization_key(provider, payload),
+                    "payload": json.dumps(payload),
+                    "signature_valid": "1" if signature_valid else "0",
+                    "received_at": datetime.now(timezone.utc).isoformat(),
+                },
+                maxlen=WEBHOOK_STREAM_MAXLEN,
+                approximate=True
+            )
+        except REDIS_FAILURES as e:
+            logger.error(f"No se pudo encolar webhook de {provider}, se procesa en línea: {e}")
+            return None
+
+        _ingested.inc(provider=provider)
+        return message_id
+
+    @staticmethod
+    async def ensure_group():
+        """Crear el consumer group (y el stream) si no existen"""
+        redis_conn = await get_redis()
+        try:
+            await redis_conn.xgroup_create(STREAM_KEY, GROUP, id="0", mkstream=True)
+            logger.info(f"Consumer group {GROUP} creado en {STREAM_KEY}")
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    @staticmethod
+    def default_consumer_name() -> str:
+        return f"{socket.gethostname()}-{os.getpid()}"
+
+    @staticmethod
+    async def _resolve_key(fields: Dict) -> str:
+        """
+        Clave de serialización al consumir: los pagos de Mercado Pago se
+        resuelven a su orden; si no se puede, queda la del pago
+        """
+        key = fields.get("key") or ""
+        if fields.get("provider") != "mercadopago" or not key.startswith("mercadopago:"):
+            return key
+
+        payload = json.loads(fields.get("payload") or "{}")
+        payment_id = (payload.get("data") or {}).get("id")
+        if not payment_id or (payload.get("type") or "payment") != "payment":
+            return key
+
+        from sqlalchemy import select
+        from shared.database import connection
+        from shared.database.models import Order
+        from services.ticket_purchase.services.mercado_pago_service import MercadoPagoService
+
+        try:
+            async with connection.async_session_maker() as db:
+                order_id = await db.scalar(
+                    select(Order.id).where(Order.payment_reference == str(payment_id)).limit(1)
+                )
+            if order_id is None:
+                payment_info = await MercadoPagoService().verify_payment_async(str(payment_id))
+                order_id = payment_info.get("external_reference")
+        except Exception as e:
+            logger.warning(f"No se pudo resolver la orden del pago {payment_id}, se serializa por pago: {e}")
+            return key
+        return str(order_id) if order_id else key
+
+    @staticmethod
+    async def _dispatch(provider: str, payload: Dict) -> str:
+        """Procesar una notificación con su propia sesión; devuelve el resultado"""
+        from shared.database import connection
+        from services.ticket_purchase.services.purchase_service import PurchaseService
+
+        service = PurchaseService()
+        async with connection.async_session_maker() as db:
+            if provider == "payku":
+                result = await service.process_payku_webhook(db, payload)
+                return result.get("status", "ok")
+            success = await service.process_payment_webhook(db, payload)
+            return "ok" if success else "ignored"
+
+    @staticmethod
+    async def _process_group(consumer: str, key: str, messages: List[Tuple[str, Dict]]) -> int:
+        """
+        Procesar en orden los mensajes de una misma clave
+
+        Se detiene en el primer error para no adelantar notificaciones
+        posteriores de la orden; los mensajes sin confirmar se reintentan.
+        """
+        redis_conn = await get_redis()
+        acked = 0
+        try:
+            async with DistributedLock(f"webhook:order:{key}", timeout=30, expire=120, name="webhook:order"):
+                for message_id, fields in messages:
+                    provider = fields.get("provider", "mercadopago")
+                    try:
+                        payload = json.loads(fields.get("payload") or "{}")
+                        result = await WebhookIngestionService._dispatch(provider, payload)
+                    except Exception as e:
+                        _processed.inc(provider=provider, result="error")
+                        logger.error(
+                            f"Error procesando webhook {message_id} ({provider}, clave {key}) "
+                            f"en {consumer}: {e}",
+                            exc_info=True
+                        )
+                        break
+
+                    await redis_conn.xack(STREAM_KEY, GROUP, message_id)
+                    _processed.inc(provider=provider, result=result)
+                    acked += 1
+        except LockError:
+            # Otro consumidor está procesando esta orden: queda pendiente y se reclama después
+            logger.warning(f"Orden {key} ocupada por otro consumidor, se reintenta más tarde")
+            await WebhookIngestionService._uncount_delivery(consumer, messages)
+        return acked
+
+    @staticmethod
+    async def _uncount_delivery(consumer: str, messages: List[Tuple[str, Dict]]):
+        """
+        Descontar la entrega de mensajes que no se procesaron por el lock
+
+        XCLAIM con RETRYCOUNT sobre los propios pendientes: la espera del lock
+        no acerca el mensaje a WEBHOOK_MAX_DELIVERIES.
+        """
+        try:
+            redis_conn = await get_redis()
+            for message_id, _fields in messages:
+                pending = await redis_conn.xpending_range(
+                    STREAM_KEY, GROUP, min=message_id, max=message_id, count=1
+                )
+                if not pending:
+                    continue
+                await redis_conn.xclaim(
+                    STREAM_KEY, GROUP, consumer, 0, [message_id],
+                    retrycount=max(0, pending[0]["times_delivered"] - 1),
+                    justid=True
+                )
+        except REDIS_FAILURES as e:
+            logger.warning(f"No se pudo descontar la entrega de {len(messages)} webhooks: {e}")
+
+    @staticmethod
+    async def _dead_letter(message_id: str, fields: Dict, deliveries: int):
+        redis_conn = await get_redis()
+        async with redis_conn.pipeline(transaction=True) as pipe:
+            pipe.xadd(DEAD_LETTER_KEY, {
+                **fields,
+                "original_id": message_id,
+                "deliveries": str(deliveries),
+                "dead_at": datetime.now(timezone.utc).isoformat(),
+            })
+            pipe.xack(STREAM_KEY, GROUP, message_id)
+            await pipe.execute()
+        _dead_lettered.inc(provider=fields.get("provider", "unknown"))
+        logger.error(f"Webhook {message_id} movido a {DEAD_LETTER_KEY} tras {deliveries} entregas")
+
+    @staticmethod
+    async def _claim_stale(consumer: str, count: int) -> List[Tuple[str, Dict]]:
+        """Reclamar mensajes pendientes de otros consumidores (o propios) vencidos"""
+        redis_conn = await get_redis()
+        pending = await redis_conn.xpending_range(
+            STREAM_KEY, GROUP, min="-", max="+", count=count, idle=WEBHOOK_CLAIM_IDLE_MS
+        )
+        if not pending:
+            return []
+
+        to_claim = []
+        for entry in pending:
+            deliveries = entry["times_delivered"]
+            if deliveries >= WEBHOOK_MAX_DELIVERIES:
+                messages = await redis_conn.xrange(STREAM_KEY, entry["message_id"], entry["message_id"])
+                if messages:
+                    await WebhookIngestionService._dead_letter(entry["message_id"], messages[0][1], deliveries)
+                else:
+                    # Recortado del stream: solo queda confirmarlo
+                    await redis_conn.xack(STREAM_KEY, GROUP, entry["message_id"])
+            else:
+                to_claim.append(entry["message_id"])
+
+        if not to_claim:
+            return []
+        claimed = await redis_conn.xclaim(STREAM_KEY, GROUP, consumer, WEBHOOK_CLAIM_IDLE_MS, to_claim)
+        # Mensajes ya recortados vuelven sin campos
+        return [(message_id, fields) for message_id, fields in claimed if fields]
+
+    @staticmethod
+    async def consume_once(
+        consumer: str,
+        block_ms: int = 5000,
+        concurrency: int = WEBHOOK_CONSUMER_CONCURRENCY
+    ) -> int:
+        """
+        Leer un lote (reclamados + nuevos) y procesarlo
+
+        Returns:
+            Cantidad de mensajes confirmados
+        """
+        redis_conn = await get_redis()
+        messages = await WebhookIngestionService._claim_stale(consumer, WEBHOOK_CONSUMER_BATCH)
+
+        new_messages = await redis_conn.xreadgroup(
+            GROUP, consumer, {STREAM_KEY: ">"},
+            count=WEBHOOK_CONSUMER_BATCH,
+            block=None if messages else block_ms
+        )
+        for _stream, entries in new_messages or []:
+            messages.extend(entries)
+
+        if not messages:
+            return 0
+
+        # Agrupar por clave (resuelta a la orden) conservando el orden del stream
+        resolved: Dict[str, str] = {}
+        groups: Dict[str, List[Tuple[str, Dict]]] = {}
+        for message_id, fields in sorted(messages, key=lambda m: tuple(int(p) for p in m[0].split("-"))):
+            raw_key = fields.get("key") or message_id
+            if raw_key not in resolved:
+                resolved[raw_key] = await WebhookIngestionService._resolve_key(fields) or raw_key
+            groups.setdefault(resolved[raw_key], []).append((message_id, fields))
+
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def run(key: str, group_messages: List[Tuple[str, Dict]]) -> int:
+            async with semaphore:
+                return await WebhookIngestionService._process_group(consumer, key, group_messages)
+
+        results = await asyncio.gather(*(run(key, group) for key, group in groups.items()))
+        return sum(results)
@@ -9,11 +9,15 @@ logger = logging.getLogger(__name__)
 
 def run_async(coro):
     """Helper para ejecutar coroutines en contexto síncrono de Celery"""
+    from shared.utils.http_clients import close_http_clients
+
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
     try:
         return loop.run_until_complete(coro)
     finally:
+        # Los clientes HTTP compartidos quedan atados a este loop
+        loop.run_until_complete(close_http_clients())
         loop.close()
 
 
@@ -0,0 +1,99 @@
+"""Relay del outbox transaccional y consumidores de sus eventos"""
+import logging
+from shared.cache.celery_app import celery_app
+from services.ticket_purchase.tasks.email_tasks import run_async
+from services.ticket_purchase.tasks.inventory_tasks import create_task_session_maker
+
+logger = logging.getLogger(__name__)
+
+
+@celery_app.task(
+    name="relay_outbox",
+    bind=True,
+    ignore_result=True,
+)
+def relay_outbox_task(self, batch_size: int = 100):
+    """Publicar en high_priority los eventos pendientes de outbox_events"""
+    from services.ticket_purchase.services.outbox_service import OutboxService
+
+    async def relay():
+        engine, async_session = create_task_session_maker()
+        try:
+            async with async_session() as db:
+                published = await OutboxService.relay(db, batch_size=batch_size)
+                if published:
+                    logger.info(f"[CELERY] {published} eventos de outbox publicados")
+                return {"published": published}
+        finally:
+            await engine.dispose()
+
+    return run_async(relay())
+
+
+@celery_app.task(
+    name="process_order_post_payment",
+    bind=True,
+    autoretry_for=(Exception,),
+    retry_backoff=True,
+    retry_backoff_max=600,
+    retry_kwargs={"max_retries": 5},
+)
+def process_order_post_payment_task(self, order_id: str, outbox_id: str):
+    """
+    Generar tickets, PDF y email de una orden pagada (evento order_paid)
+
+    Idempotente: cada paso queda marcado en la fila del outbox, así que una
+    re-entrega del relay o un retry no duplica tickets ni emails.
+    """
+    from services.ticket_purchase.services.order_fulfillment_service import OrderFulfillmentService
+    from shared.cache.redis_client import close_redis
+
+    logger.info(f"[CELERY] Procesando pago confirmado de orden {order_id} (outbox {outbox_id})")
+
+    async def process():
+        engine, async_session = create_task_session_maker()
+        try:
+            async with async_session() as db:
+                return await OrderFulfillmentService.process_order_paid(db, outbox_id)
+        finally:
+            await engine.dispose()
+            # _generate_tickets puede leer attendees del cache
+            await close_redis()
+
+    return run_async(process())
+
+
+@celery_app.task(
+    name="create_order_payment",
+    bind=True,
+    max_retries=3,
+)
+def create_order_payment_task(self, order_id: str, outbox_id: str):
+    """
+    Crear el pago en el proveedor de una orden aceptada en modo asíncrono
+    (evento order_payment_requested)
+
+    Reintenta con backoff corto (el comprador espera el link); si el último
+    intento falla, la orden se cancela y libera su capacidad.
+    """
+    from services.ticket_purchase.services.purchase_service import PurchaseService
+    from shared.cache.redis_client import close_redis
+
+    logger.info(f"[CELERY] Creando pago de orden {order_id} (outbox {outbox_id})")
+    final_attempt = self.request.retries >= self.max_retries
+
+    async def process():
+        engine, async_session = create_task_session_maker()
+        try:
+            async with async_session() as db:
+                return await PurchaseService().create_order_payment(db, outbox_id, final_attempt=final_attempt)
+        finally:
+            await engine.dispose()
+            # El link se publica en Redis (canal de estado y cache de idempotencia)
+            await close_redis()
+
+    try:
+        return run_async(process())
+    except Exception as e:
+        logger.warning(f"[CELERY] Error creando pago de orden {order_id}: {e}")
+        raise self.retry(exc=e, countdown=min(10, 2 ** self.request.retries))
@@ -0,0 +1,47 @@
+"""Reconciliación periódica de pagos pendientes con los proveedores"""
+import logging
+from shared.cache.celery_app import celery_app
+from services.ticket_purchase.tasks.email_tasks import run_async
+from services.ticket_purchase.tasks.inventory_tasks import create_task_session_maker
+
+logger = logging.getLogger(__name__)
+
+
+@celery_app.task(
+    name="reconcile_payments",
+    bind=True,
+    ignore_result=True,
+)
+def reconcile_payments_task(self, max_orders: int = None):
+    """
+    Verificar con Payku / Mercado Pago las órdenes pendientes viejas y aplicar
+    los pagos aprobados o rechazados que no llegaron por webhook
+    """
+    from services.ticket_purchase.services.payment_reconciliation_service import (
+        PaymentReconciliationService, PAYMENT_RECONCILE_MAX_ORDERS
+    )
+    from shared.cache.redis_client import DistributedLock, LockError, close_redis
+
+    async def reconcile():
+        engine, async_session = create_task_session_maker()
+        try:
+            # Una sola corrida a la vez aunque beat encole la siguiente antes de terminar
+            async with DistributedLock("payments:reconcile", timeout=0, expire=600):
+                async with async_session() as db:
+                    summary = await PaymentReconciliationService.reconcile(
+                        db, max_orders=max_orders or PAYMENT_RECONCILE_MAX_ORDERS
+                    )
+                    if summary["completed"] or summary["cancelled"]:
+                        logger.info(
+                            f"[CELERY] Reconciliación de pagos: {summary['checked']} revisadas, "
+                            f"{summary['completed']} completadas, {summary['cancelled']} canceladas"
+                        )
+                    return summary
+        except LockError:
+            logger.info("[CELERY] Reconciliación de pagos ya en curso, se omite esta corrida")
+            return {"skipped": True}
+        finally:
+            await engine.dispose()
+            await close_redis()
+
+    return run_async(reconcile())
@@ -0,0 +1,56 @@
+"""
+Consumidor del stream de webhooks de pago
+
+Uso:
+    python -m services.ticket_purchase.webhook_consumer
+
+Se pueden levantar varias réplicas: comparten el consumer group y cada una
+procesa hasta WEBHOOK_CONSUMER_CONCURRENCY órdenes a la vez.
+"""
+import asyncio
+import logging
+import os
+import signal
+
+from shared.database.connection import init_db, close_db
+from shared.cache.redis_client import init_redis, close_redis
+from shared.utils.http_clients import init_http_clients, close_http_clients
+from services.ticket_purchase.services.webhook_ingestion_service import WebhookIngestionService
+
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO"),
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+
+async def main():
+    consumer = os.getenv("WEBHOOK_CONSUMER_NAME") or WebhookIngestionService.default_consumer_name()
+    stop = asyncio.Event()
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await init_db()
+    await init_redis()
+    await init_http_clients()
+    await WebhookIngestionService.ensure_group()
+    logger.info(f"Consumidor de webhooks {consumer} iniciado")
+
+    try:
+        while not stop.is_set():
+            try:
+                await WebhookIngestionService.consume_once(consumer)
+            except Exception as e:
+                logger.error(f"Error en el consumidor de webhooks: {e}", exc_info=True)
+                await asyncio.sleep(1)
+    finally:
+        await close_db()
+        await close_redis()
+        await close_http_clients()
+        logger.info(f"Consumidor de webhooks {consumer} detenido")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
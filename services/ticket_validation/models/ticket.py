@@ -1,6 +1,7 @@
 """Modelos Pydantic para validación de tickets"""
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import List, Optional
+from datetime import datetime
 from uuid import UUID
 
 
@@ -17,3 +18,20 @@ class TicketValidationResponse(BaseModel):
     attendee_name: Optional[str] = None
     message: Optional[str] = None
 
+
+
+class OfflineScan(BaseModel):
+    qr_signature: str
+    scanned_at: datetime
+
+
+class OfflineScanSyncRequest(BaseModel):
+    device_id: Optional[str] = None
+    scans: List[OfflineScan] = Field(..., max_length=1000)
+
+
+class OfflineScanSyncResponse(BaseModel):
+    accepted: List[str]  # Marcados como usados con este lote
+    already_used: List[str]  # Dobles ingresos: otro dispositivo los aceptó antes
+    invalid: List[str]  # Anulados o pendientes
+    unknown: List[str]  # No existen o son de otro evento
@@ -1,14 +1,17 @@
 """Rutas de validación de tickets"""
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import Dict
+from typing import Dict, Optional
 from shared.database.session import get_db
 from shared.auth.dependencies import get_current_scanner
 from services.ticket_validation.models.ticket import (
     TicketValidationRequest,
-    TicketValidationResponse
+    TicketValidationResponse,
+    OfflineScanSyncRequest,
+    OfflineScanSyncResponse
 )
 from services.ticket_validation.services.ticket_service import TicketValidationService
+from services.ticket_validation.services.scanner_manifest_service import ScannerManifestService, KIND_FULL
 
 
 router = APIRouter()
@@ -37,6 +40,86 @@ async def validate_ticket(
     return TicketValidationResponse(**result)
 
 
+@router.get("/manifest/public-key")
+async def get_manifest_public_key(
+    current_user: Dict = Depends(get_current_scanner)
+):
+    """Clave pública Ed25519 para verificar los manifiestos de scanner"""
+    return ScannerManifestService.public_key()
+
+
+@router.get("/events/{event_id}/manifest")
+async def get_scanner_manifest(
+    event_id: str,
+    request: Request,
+    since: Optional[int] = Query(None, ge=1, description="Versión que ya tiene el dispositivo (devuelve un delta)"),
+    db: AsyncSession = Depends(get_db),
+    current_user: Dict = Depends(get_current_scanner)
+):
+    """
+    Manifiesto binario firmado de los tickets del evento para validar offline
+
+    Sin `since` devuelve el manifiesto completo; con `since` solo los cambios
+    posteriores a esa versión. La versión nueva viene en X-Manifest-Version.
+    Formato en scanner_manifest_service.
+    """
+    try:
+        manifest = await ScannerManifestService.get_manifest(db, event_id, since)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+    if manifest is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Evento no encontrado"
+        )
+
+    bundle, kind, version = manifest
+    etag = f'"{event_id}-{"full" if kind == KIND_FULL else since}-{version}"'
+    headers = {
+        "ETag": etag,
+        "X-Manifest-Version": str(version),
+        "X-Manifest-Kind": "full" if kind == KIND_FULL else "delta",
+        "Cache-Control": "private, no-cache",
+    }
+    if request.headers.get("If-None-Match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    return Response(content=bundle, media_type="application/octet-stream", headers=headers)
+
+
+@router.post("/events/{event_id}/scans", response_model=OfflineScanSyncResponse)
+async def sync_offline_scans(
+    event_id: str,
+    sync_request: OfflineScanSyncRequest,
+    db: AsyncSession = Depends(get_db),
+    current_user: Dict = Depends(get_current_scanner)
+):
+    """
+    Sincronizar los ingresos validados offline con el manifiesto
+
+    Marca usados los tickets todavía emitidos e informa los dobles ingresos
+    (ya usados por otro dispositivo o por la validación online).
+    """
+    try:
+        result = await ScannerManifestService.sync_scans(
+            db,
+            event_id,
+            [(scan.qr_signature, scan.scanned_at) for scan in sync_request.scans],
+            device_id=sync_request.device_id or current_user.get("user_id")
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+    return OfflineScanSyncResponse(**result)
+
+
 @router.get("/{ticket_id}")
 async def get_ticket(
     ticket_id: str,
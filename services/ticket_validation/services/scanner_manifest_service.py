@@ -0,0 +1,354 @@
+"""
+Manifiesto offline de tickets por evento para los scanners de la puerta
+
+En vez de un POST /tickets/validate por escaneo (Redis + Postgres en el
+momento de más carga, con la conectividad del recinto), cada dispositivo
+descarga un manifiesto binario firmado del evento y valida localmente con
+búsqueda binaria. Los ingresos registrados offline se sincronizan después en
+lote (sync_scans), que detecta dobles ingresos entre dispositivos.
+
+Formato (big-endian):
+
+    header   magic "CRSM" | formato u8 | tipo u8 (0 completo, 1 delta) |
+             event_id 16s | key_id 8s | version u64 | base_version u64 |
+             generated_at u64 | entradas u32
+    entradas por entrada, ordenadas por hash:
+             sha256(qr_signature)[:16] | estado u8 (0 válido, 1 usado, 2 anulado)
+    firma    Ed25519 (64 bytes) de header + entradas
+
+El manifiesto no contiene las qr_signature: con él no se pueden fabricar QR.
+El completo solo trae tickets válidos o usados; un delta (?since=<version>)
+trae todos los cambios, incluidas las anulaciones.
+
+La versión sigue el orden de commit, no el de inicio de la transacción: un
+trigger guarda en tickets.manifest_xid el ID de la transacción que escribió
+la fila, y la versión de cada lectura es el xmin del snapshot (toda
+transacción con ID menor ya terminó y es visible). La lectura siguiente
+desde esa versión vuelve a incluir las transacciones que seguían abiertas,
+por largas que sean. Una versión que no sale de este esquema (mayor que el
+xmin actual) recibe el manifiesto completo.
+
+Generación incremental: cada proceso guarda las entradas del evento y en
+cada pedido solo lee los tickets escritos desde su versión.
+"""
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, text
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from datetime import datetime, timezone, timedelta
+from collections import OrderedDict
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+from cryptography.hazmat.primitives import serialization
+from redis.exceptions import RedisError
+from shared.database.models import Ticket, Event
+from shared.cache.redis_client import get_redis
+from shared.utils.metrics import counter
+import base64
+import hashlib
+import logging
+import os
+import struct
+import uuid
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_MAGIC = b"CRSM"
+MANIFEST_FORMAT = 1
+KIND_FULL = 0
+KIND_DELTA = 1
+
+STATUS_VALID = 0
+STATUS_USED = 1
+STATUS_REVOKED = 2
+
+HASH_BYTES = 16
+_HEADER = struct.Struct(">4sBB16s8sQQQI")
+_ENTRY = struct.Struct(f">{HASH_BYTES}sB")
+
+# Eventos cuyo manifiesto se mantiene en memoria por proceso
+MANIFEST_CACHE_EVENTS = int(os.getenv("MANIFEST_CACHE_EVENTS", "32"))
+# Escaneos máximos por lote de sincronización
+MAX_SYNC_SCANS = 1000
+
+REDIS_FAILURES = (RedisError, OSError)
+
+_served = counter(
+    "scanner_manifest_served_total",
+    "Manifiestos de scanner servidos por tipo",
+    ("kind",)
+)
+_synced = counter(
+    "scanner_offline_scans_total",
+    "Escaneos offline sincronizados por resultado",
+    ("result",)
+)
+
+# Tickets del evento escritos por transacciones con ID >= :since, más el
+# xmin del mismo snapshot (LEFT JOIN: llega aunque no haya cambios)
+_CHANGED_SQL = text("""
+    WITH horizon AS (
+        SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint AS xmin
+    )
+    SELECT h.xmin, t.qr_signature, t.status
+    FROM horizon h
+    LEFT JOIN tickets t ON t.event_id = :event_id AND t.manifest_xid >= :since
+""")
+
+# Marcar usados los tickets escaneados offline que siguen emitidos
+_MARK_USED_SQL = text("""
+    UPDATE tickets t
+    SET status = 'used', used_at = s.scanned_at, updated_at = now()
+    FROM unnest(CAST(:signatures AS text[]), CAST(:scanned_at AS timestamptz[])) AS s(qr_signature, scanned_at)
+    WHERE t.qr_signature = s.qr_signature
+      AND t.event_id = :event_id
+      AND t.status = 'issued'
+    RETURNING t.qr_signature
+""")
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def ticket_hash(qr_signature: str) -> bytes:
+    """Hash con el que el dispositivo busca el QR escaneado en el manifiesto"""
+    return hashlib.sha256(qr_signature.encode("utf-8")).digest()[:HASH_BYTES]
+
+
+def ticket_manifest_status(status: Optional[str]) -> int:
+    if status == "issued":
+        return STATUS_VALID
+    if status in ("used", "validated"):
+        return STATUS_USED
+    return STATUS_REVOKED
+
+
+def _to_micros(moment: datetime) -> int:
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return (moment - _EPOCH) // timedelta(microseconds=1)
+
+
+def _load_signing_key() -> Ed25519PrivateKey:
+    """
+    Clave Ed25519 de SCANNER_MANIFEST_SIGNING_KEY (semilla de 32 bytes en
+    base64). Sin configurar se deriva de QR_SECRET (solo desarrollo).
+    """
+    encoded = os.getenv("SCANNER_MANIFEST_SIGNING_KEY")
+    if encoded:
+        seed = base64.b64decode(encoded)
+    else:
+        logger.warning("SCANNER_MANIFEST_SIGNING_KEY no configurada: usando una clave derivada de QR_SECRET")
+        secret = os.getenv("QR_SECRET", "dev-qr-secret-change-in-production")
+        seed = hashlib.sha256(f"scanner-manifest:{secret}".encode()).digest()
+    return Ed25519PrivateKey.from_private_bytes(seed)
+
+
+class _EventEntries(NamedTuple):
+    watermark: int
+    entries: Dict[bytes, int]
+    bundle: bytes
+
+
+class ScannerManifestService:
+    """Manifiestos firmados por evento y sincronización de escaneos offline"""
+
+    _signing_key: Optional[Ed25519PrivateKey] = None
+    _events: "OrderedDict[str, _EventEntries]" = OrderedDict()
+
+    @classmethod
+    def _key(cls) -> Ed25519PrivateKey:
+        if cls._signing_key is None:
+            cls._signing_key = _load_signing_key()
+        return cls._signing_key
+
+    @classmethod
+    def public_key(cls) -> Dict:
+        """Clave pública con la que los dispositivos verifican los manifiestos"""
+        raw = cls._key().public_key().public_bytes(
+            encoding=serialization.Encoding.Raw,
+            format=serialization.PublicFormat.Raw
+        )
+        return {
+            "algorithm": "Ed25519",
+            "key_id": cls._key_id().hex(),
+            "public_key": base64.b64encode(raw).decode(),
+            "format": MANIFEST_FORMAT,
+        }
+
+    @classmethod
+    def _key_id(cls) -> bytes:
+        raw = cls._key().public_key().public_bytes(
+            encoding=serialization.Encoding.Raw,
+            format=serialization.PublicFormat.Raw
+        )
+        return hashlib.sha256(raw).digest()[:8]
+
+    @classmethod
+    def _build(
+        cls,
+        event_id: str,
+        kind: int,
+        version: int,
+        base_version: int,
+        entries: Dict[bytes, int]
+    ) -> bytes:
+        """Serializar y firmar un manifiesto"""
+        header = _HEADER.pack(
+            MANIFEST_MAGIC, MANIFEST_FORMAT, kind, uuid.UUID(event_id).bytes, cls._key_id(),
+            version, base_version, _to_micros(datetime.now(timezone.utc)), len(entries)
+        )
+        body = b"".join(_ENTRY.pack(digest, entries[digest]) for digest in sorted(entries))
+        return header + body + cls._key().sign(header + body)
+
+    @staticmethod
+    async def _changed_since(db: AsyncSession, event_id: str, since: int) -> Tuple[int, Dict[bytes, int]]:
+        """
+        Tickets del evento escritos desde la versión `since`
+
+        Returns:
+            (versión nueva = xmin del snapshot, {hash: estado})
+        """
+        result = await db.execute(_CHANGED_SQL, {"event_id": event_id, "since": since})
+
+        horizon = 0
+        changes: Dict[bytes, int] = {}
+        for row in result:
+            horizon = row.xmin
+            if row.qr_signature is not None:
+                changes[ticket_hash(row.qr_signature)] = ticket_manifest_status(row.status)
+        await db.commit()
+        return horizon, changes
+
+    @classmethod
+    async def get_manifest(
+        cls,
+        db: AsyncSession,
+        event_id: str,
+        since: Optional[int] = None
+    ) -> Optional[Tuple[bytes, int, int]]:
+        """
+        Manifiesto firmado del evento: completo, o delta desde `since`
+
+        Returns:
+            (bundle, tipo, versión), o None si el evento no existe
+        """
+        event_id = str(uuid.UUID(str(event_id)))
+        cached = cls._events.get(event_id)
+        if cached is None and not await db.scalar(select(Event.id).where(Event.id == event_id)):
+            await db.commit()
+            return None
+
+        if since:
+            version, changes = await cls._changed_since(db, event_id, since)
+            if since <= version:
+                _served.inc(kind="delta")
+                return cls._build(event_id, KIND_DELTA, version, since, changes), KIND_DELTA, version
+            # Versión que no sale del xmin (p.ej. de un formato anterior): completo
+
+        base = cached.watermark if cached else 0
+        watermark, changes = await cls._changed_since(db, event_id, base)
+
+        entries = cached.entries if cached else {}
+        # Las transacciones abiertas en la lectura anterior se vuelven a leer:
+        # solo cambia si alguna fila difiere de lo ya aplicado
+        dirty = {
+            digest: manifest_status for digest, manifest_status in changes.items()
+            if entries.get(digest, STATUS_REVOKED) != manifest_status
+        }
+        if cached is not None and not dirty:
+            # El bundle guardado conserva su versión: desde ella el próximo
+            # delta sigue siendo correcto
+            cls._events.move_to_end(event_id)
+            _served.inc(kind="full")
+            return cached.bundle, KIND_FULL, cached.watermark
+
+        entries = dict(entries)
+        for digest, manifest_status in dirty.items():
+            if manifest_status == STATUS_REVOKED:
+                entries.pop(digest, None)
+            else:
+                entries[digest] = manifest_status
+
+        bundle = cls._build(event_id, KIND_FULL, watermark, 0, entries)
+        cls._events[event_id] = _EventEntries(watermark, entries, bundle)
+        cls._events.move_to_end(event_id)
+        while len(cls._events) > MANIFEST_CACHE_EVENTS:
+            cls._events.popitem(last=False)
+
+        _served.inc(kind="full")
+        return bundle, KIND_FULL, watermark
+
+    @staticmethod
+    async def sync_scans(
+        db: AsyncSession,
+        event_id: str,
+        scans: List[Tuple[str, datetime]],
+        device_id: Optional[str] = None
+    ) -> Dict:
+        """
+        Registrar ingresos validados offline (con commit)
+
+        Cada QR se marca usado solo si sigue emitido, con la hora del primer
+        escaneo. Los que ya estaban usados son dobles ingresos (otro
+        dispositivo o la validación online los aceptó antes).
+
+        Returns:
+            dict con accepted, already_used, invalid y unknown (listas de qr_signature)
+        """
+        if len(scans) > MAX_SYNC_SCANS:
+            raise ValueError(f"Máximo {MAX_SYNC_SCANS} escaneos por lote")
+        event_id = str(uuid.UUID(str(event_id)))
+
+        # Un QR repetido en el lote cuenta con su primer escaneo
+        first_scans: Dict[str, datetime] = {}
+        for qr_signature, scanned_at in scans:
+            if scanned_at.tzinfo is None:
+                scanned_at = scanned_at.replace(tzinfo=timezone.utc)
+            if qr_signature not in first_scans or scanned_at < first_scans[qr_signature]:
+                first_scans[qr_signature] = scanned_at
+
+        signatures = list(first_scans)
+        result = await db.execute(_MARK_USED_SQL, {
+            "event_id": event_id,
+            "signatures": signatures,
+            "scanned_at": [first_scans[s] for s in signatures],
+        })
+        accepted = set(result.scalars().all())
+
+        rejected = [s for s in signatures if s not in accepted]
+        statuses: Dict[str, str] = {}
+        if rejected:
+            rows = await db.execute(
+                select(Ticket.qr_signature, Ticket.status)
+                .where(Ticket.event_id == event_id, Ticket.qr_signature.in_(rejected))
+            )
+            statuses = {row.qr_signature: row.status for row in rows}
+        await db.commit()
+
+        summary = {"accepted": [], "already_used": [], "invalid": [], "unknown": []}
+        for qr_signature in signatures:
+            if qr_signature in accepted:
+                summary["accepted"].append(qr_signature)
+            elif qr_signature not in statuses:
+                summary["unknown"].append(qr_signature)
+            elif ticket_manifest_status(statuses[qr_signature]) == STATUS_USED:
+                summary["already_used"].append(qr_signature)
+            else:
+                summary["invalid"].append(qr_signature)
+
+        for result_name, items in summary.items():
+            if items:
+                _synced.inc(len(items), result=result_name)
+        if summary["already_used"]:
+            logger.warning(
+                f"Dobles ingresos en evento {event_id} (dispositivo {device_id}): "
+                f"{len(summary['already_used'])} QR ya usados"
+            )
+
+        # La validación online no debe seguir respondiendo "válido" desde cache
+        if summary["accepted"]:
+            try:
+                redis_conn = await get_redis()
+                await redis_conn.delete(*(f"ticket:validation:{s}" for s in summary["accepted"]))
+            except REDIS_FAILURES as e:
+                logger.warning(f"No se pudo invalidar el cache de validación: {e}")
+
+        return summary
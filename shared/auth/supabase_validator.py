@@ -1,9 +1,9 @@
-import httpx
 import os
 import hashlib
 import json
 from typing import Optional, Dict
 from jose import jwt
+from shared.utils.http_clients import get_http_client
 
 SUPABASE_URL = os.getenv('SUPABASE_URL')
 if not SUPABASE_URL:
@@ -42,50 +42,49 @@ async def verify_supabase_token(token: str) -> Optional[Dict]:
             return json.loads(cached_payload)
         
         # Token no en caché - validar con Supabase
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            response = await client.get(
-                f'{SUPABASE_URL}/auth/v1/user',
-                headers={
-                    'apikey': SUPABASE_ANON_KEY,
-                    'Authorization': f'Bearer {token}'
-                }
+        response = await get_http_client('supabase').get(
+            f'{SUPABASE_URL}/auth/v1/user',
+            headers={
+                'apikey': SUPABASE_ANON_KEY,
+                'Authorization': f'Bearer {token}'
+            }
+        )
+        
+        if response.status_code == 200:
+            user_data = response.json()
+            
+            # Decodificar el token SIN verificar (solo para extraer claims)
+            unverified_payload = jwt.get_unverified_claims(token)
+            
+            # Extraer el role desde user_metadata
+            user_metadata = unverified_payload.get('user_metadata', {})
+            role = user_metadata.get('role', 'user')
+            
+            # Construir payload compatible con el sistema actual
+            payload = {
+                'sub': user_data.get('id'),
+                'user_id': user_data.get('id'),
+                'email': user_data.get('email'),
+                'role': role,
+                'aud': unverified_payload.get('aud'),
+                'exp': unverified_payload.get('exp'),
+                'iat': unverified_payload.get('iat'),
+                'iss': unverified_payload.get('iss'),
+                'user_metadata': user_metadata,
+                'app_metadata': unverified_payload.get('app_metadata', {})
+            }
+            
+            # CACHEAR el resultado en Redis
+            await redis_client.setex(
+                cache_key,
+                CACHE_TTL_SECONDS,
+                json.dumps(payload)
             )
             
-            if response.status_code == 200:
-                user_data = response.json()
-                
-                # Decodificar el token SIN verificar (solo para extraer claims)
-                unverified_payload = jwt.get_unverified_claims(token)
-                
-                # Extraer el role desde user_metadata
-                user_metadata = unverified_payload.get('user_metadata', {})
-                role = user_metadata.get('role', 'user')
-                
-                # Construir payload compatible con el sistema actual
-                payload = {
-                    'sub': user_data.get('id'),
-                    'user_id': user_data.get('id'),
-                    'email': user_data.get('email'),
-                    'role': role,
-                    'aud': unverified_payload.get('aud'),
-                    'exp': unverified_payload.get('exp'),
-                    'iat': unverified_payload.get('iat'),
-                    'iss': unverified_payload.get('iss'),
-                    'user_metadata': user_metadata,
-                    'app_metadata': unverified_payload.get('app_metadata', {})
-                }
-                
-                # CACHEAR el resultado en Redis
-                await redis_client.setex(
-                    cache_key,
-                    CACHE_TTL_SECONDS,
-                    json.dumps(payload)
-                )
-                
-                return payload
-            else:
-                return None
-                
+            return payload
+        else:
+            return None
+            
     except Exception as e:
         print(f'Error validating token with Supabase: {e}')
         return None
@@ -20,6 +20,9 @@ celery_app = Celery(
     backend=REDIS_URL,
     include=[
         "services.ticket_purchase.tasks.email_tasks",
+        "services.ticket_purchase.tasks.inventory_tasks",
+        "services.ticket_purchase.tasks.outbox_tasks",
+        "services.ticket_purchase.tasks.payment_tasks",
     ]
 )
 
@@ -40,10 +43,72 @@ celery_app.conf.task_queues = (
 # Routing de tareas a colas específicas
 celery_app.conf.task_routes = {
     "process_order_post_payment": {"queue": "high_priority"},
+    "create_order_payment": {"queue": "high_priority"},
+    "relay_outbox": {"queue": "high_priority"},
     "verify_payment_status": {"queue": "high_priority"},
     "send_ticket_email": {"queue": "default"},
     "send_bulk_ticket_emails": {"queue": "default"},
     "generate_ticket_qr": {"queue": "low_priority"},
+    "flush_capacity_counters": {"queue": "default"},
+    "expire_capacity_holds": {"queue": "default"},
+    "flush_capacity_ledger": {"queue": "default"},
+    "rollup_capacity_ledger": {"queue": "low_priority"},
+    "reconcile_capacity": {"queue": "low_priority"},
+    "reconcile_payments": {"queue": "default"},
+}
+
+# Tareas periódicas (ejecutadas por celery beat)
+CAPACITY_FLUSH_INTERVAL = float(os.getenv("CAPACITY_FLUSH_INTERVAL", "5"))
+CAPACITY_HOLD_SWEEP_INTERVAL = float(os.getenv("CAPACITY_HOLD_SWEEP_INTERVAL", "30"))
+CAPACITY_LEDGER_FLUSH_INTERVAL = float(os.getenv("CAPACITY_LEDGER_FLUSH_INTERVAL", "5"))
+CAPACITY_LEDGER_ROLLUP_INTERVAL = float(os.getenv("CAPACITY_LEDGER_ROLLUP_INTERVAL", "3600"))
+CAPACITY_RECONCILE_INTERVAL = float(os.getenv("CAPACITY_RECONCILE_INTERVAL", "3600"))
+OUTBOX_RELAY_INTERVAL = float(os.getenv("OUTBOX_RELAY_INTERVAL", "1"))
+PAYMENT_RECONCILE_INTERVAL = float(os.getenv("PAYMENT_RECONCILE_INTERVAL", "120"))
+
+celery_app.conf.beat_schedule = {
+    # Write-back de los contadores de capacidad de Redis a events.capacity_available
+    "flush-capacity-counters": {
+        "task": "flush_capacity_counters",
+        "schedule": CAPACITY_FLUSH_INTERVAL,
+        "options": {"expires": CAPACITY_FLUSH_INTERVAL},
+    },
+    # Liberar capacidad de órdenes pendientes con hold vencido
+    "expire-capacity-holds": {
+        "task": "expire_capacity_holds",
+        "schedule": CAPACITY_HOLD_SWEEP_INTERVAL,
+        "options": {"expires": CAPACITY_HOLD_SWEEP_INTERVAL},
+    },
+    # Escritura por lotes del ledger de capacidad (capacity_logs)
+    "flush-capacity-ledger": {
+        "task": "flush_capacity_ledger",
+        "schedule": CAPACITY_LEDGER_FLUSH_INTERVAL,
+        "options": {"expires": CAPACITY_LEDGER_FLUSH_INTERVAL},
+    },
+    # Compactar capacity_logs antiguos en capacity_log_rollups
+    "rollup-capacity-ledger": {
+        "task": "rollup_capacity_ledger",
+        "schedule": CAPACITY_LEDGER_ROLLUP_INTERVAL,
+        "options": {"expires": CAPACITY_LEDGER_ROLLUP_INTERVAL},
+    },
+    # Auditar (y reparar si CAPACITY_RECONCILE_REPAIR=true) la capacidad de los eventos
+    "reconcile-capacity": {
+        "task": "reconcile_capacity",
+        "schedule": CAPACITY_RECONCILE_INTERVAL,
+        "options": {"expires": CAPACITY_RECONCILE_INTERVAL},
+    },
+    # Publicar los efectos post-pago del outbox (tickets, PDF, email)
+    "relay-outbox": {
+        "task": "relay_outbox",
+        "schedule": OUTBOX_RELAY_INTERVAL,
+        "options": {"expires": OUTBOX_RELAY_INTERVAL},
+    },
+    # Resolver con el proveedor las órdenes pendientes cuyo webhook no llegó
+    "reconcile-payments": {
+        "task": "reconcile_payments",
+        "schedule": PAYMENT_RECONCILE_INTERVAL,
+        "options": {"expires": PAYMENT_RECONCILE_INTERVAL},
+    },
 }
 
 # Configuración optimizada para alta concurrencia
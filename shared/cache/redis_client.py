@@ -3,10 +3,12 @@ import redis.asyncio as redis
 from redis.asyncio.connection import ConnectionPool
 import os
 import json
-from typing import Optional, Any
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional, Any, Set
 from functools import wraps
 import asyncio
 import logging
+import weakref
 
 logger = logging.getLogger(__name__)
 
@@ -56,6 +58,7 @@ async def get_redis() -> redis.Redis:
 async def close_redis():
     """Cerrar conexión a Redis y pool"""
     global redis_client, redis_pool
+    await _stop_fanout()
     if redis_client:
         await redis_client.close()
         redis_client = None
@@ -65,48 +68,335 @@ async def close_redis():
     logger.info("Redis desconectado")
 
 
+# KEYS: lock, fence | ARGV: identifier, expire_ms
+# Toma el lock y entrega el siguiente fencing token en una sola operación
+_LOCK_ACQUIRE_LUA = """
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    return redis.call('INCR', KEYS[2])
+end
+return 0
+"""
+
+# KEYS: lock | ARGV: identifier, channel
+_LOCK_RELEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('DEL', KEYS[1])
+    redis.call('PUBLISH', ARGV[2], '1')
+    return 1
+end
+return 0
+"""
+
+# KEYS: lock | ARGV: identifier, expire_ms
+_LOCK_EXTEND_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# KEYS: lock, fence | ARGV: identifier, token
+_LOCK_VALIDATE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] and redis.call('GET', KEYS[2]) == ARGV[2] then
+    return 1
+end
+return 0
+"""
+
+
+# KEYS: fence | ARGV: token
+_LOCK_ADVANCE_FENCE_LUA = """
+if tonumber(redis.call('GET', KEYS[1]) or '0') < tonumber(ARGV[1]) then
+    redis.call('SET', KEYS[1], ARGV[1])
+    return 1
+end
+return 0
+"""
+
+
+# Canales que reparte el listener pub/sub compartido del proceso
+FANOUT_PATTERNS = ("lock:*:released", "singleflight:*:done", "idempotency:*:done")
+
+
+class _ChannelFanout:
+    """
+    Una sola conexión pub/sub por event loop para todos los que esperan
+
+    Hace PSUBSCRIBE a FANOUT_PATTERNS y reparte cada mensaje a las colas
+    registradas para ese canal, así la cantidad de esperas no consume
+    conexiones del pool. Si la conexión se cae, despierta a todos con None
+    (vuelven a revisar el estado) y se reconecta en la próxima espera.
+    """
+
+    def __init__(self):
+        self._queues: Dict[str, Set[asyncio.Queue]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._ready: Optional[asyncio.Future] = None
+
+    def add(self, channel: str, queue: asyncio.Queue):
+        self._queues.setdefault(channel, set()).add(queue)
+
+    def discard(self, channel: str, queue: asyncio.Queue):
+        queues = self._queues.get(channel)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._queues[channel]
+
+    async def start(self):
+        """Asegurar que el listener está suscrito (confirmado por Redis)"""
+        if self._task is None or self._task.done():
+            loop = asyncio.get_running_loop()
+            self._ready = loop.create_future()
+            self._task = loop.create_task(self._run(self._ready))
+        await asyncio.shield(self._ready)
+
+    async def stop(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+        self._task = None
+
+    async def _run(self, ready: asyncio.Future):
+        pubsub = (await get_redis()).pubsub()
+        try:
+            await pubsub.psubscribe(*FANOUT_PATTERNS)
+            pending = len(FANOUT_PATTERNS)
+            async for message in pubsub.listen():
+                if message["type"] == "psubscribe":
+                    pending -= 1
+                    if pending <= 0 and not ready.done():
+                        ready.set_result(True)
+                elif message["type"] == "pmessage":
+                    for queue in list(self._queues.get(message["channel"], ())):
+                        queue.put_nowait(message["data"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Listener pub/sub compartido desconectado: {e}")
+            if not ready.done():
+                ready.set_exception(e)
+        finally:
+            if not ready.done():
+                ready.cancel()
+            for queues in self._queues.values():
+                for queue in queues:
+                    queue.put_nowait(None)
+            try:
+                await pubsub.reset()
+            except Exception:
+                pass
+
+
+# event loop -> listener; las tareas Celery corren cada una en su propio loop
+_fanouts: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _ChannelFanout]" = weakref.WeakKeyDictionary()
+
+
+async def _stop_fanout():
+    try:
+        fanout = _fanouts.pop(asyncio.get_running_loop(), None)
+    except RuntimeError:
+        return
+    if fanout is not None:
+        await fanout.stop()
+
+
+class ChannelSubscription:
+    """Espera de mensajes de un canal a través del listener compartido"""
+
+    def __init__(self, fanout: _ChannelFanout, queue: asyncio.Queue):
+        self._fanout = fanout
+        self._queue = queue
+
+    async def get(self, timeout: float) -> Optional[str]:
+        """
+        Esperar el próximo mensaje del canal
+
+        Returns:
+            El mensaje, o None si venció el timeout o el listener se reconectó
+        """
+        if self._queue.empty():
+            await self._fanout.start()
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout=max(timeout, 0))
+        except asyncio.TimeoutError:
+            return None
+
+
+@asynccontextmanager
+async def subscribe_channel(channel: str) -> AsyncIterator[ChannelSubscription]:
+    """
+    Escuchar un canal que cae en FANOUT_PATTERNS sin abrir otra conexión
+
+    Al entrar la suscripción ya está confirmada: lo publicado desde ese
+    momento llega a la cola.
+    """
+    loop = asyncio.get_running_loop()
+    fanout = _fanouts.get(loop)
+    if fanout is None:
+        fanout = _fanouts[loop] = _ChannelFanout()
+    queue: asyncio.Queue = asyncio.Queue()
+    fanout.add(channel, queue)
+    try:
+        await fanout.start()
+        yield ChannelSubscription(fanout, queue)
+    finally:
+        fanout.discard(channel, queue)
+
+
+class LockError(Exception):
+    """No se pudo adquirir el lock o se perdió el lease"""
+
+
 class DistributedLock:
-    """Lock distribuido usando Redis"""
+    """
+    Lock distribuido usando Redis
+
+    - Los que esperan se despiertan con un mensaje pub/sub al liberar (o
+      cuando vence el lease del dueño), sin polling. Todas las esperas del
+      proceso comparten una conexión (subscribe_channel).
+    - Cada adquisición entrega un fencing token creciente (`self.token`).
+      `validate()` solo lo compara en Redis: un lease que vence entre el
+      validate y el commit no se detecta. Las escrituras que lo necesitan
+      guardan el token junto al dato y condicionan el UPDATE
+      (`WHERE fence < :token`), como el write-back de CapacityEngine.
+    - `extend()` renueva el lease para dueños de larga duración.
+    - Exporta histogramas de espera y de tiempo retenido en /metrics.
+    """
 
-    def __init__(self, key: str, timeout: int = 10, expire: int = 30):
+    def __init__(self, key: str, timeout: int = 10, expire: int = 30, name: Optional[str] = None):
         self.key = f"lock:{key}"
+        self.fence_key = f"{self.key}:fence"
+        self.channel = f"{self.key}:released"
         self.timeout = timeout
         self.expire = expire
+        # Etiqueta de métricas sin el ID del recurso (p.ej. "capacity:sync")
+        self.name = name or (key.rsplit(":", 1)[0] if ":" in key else key)
         self.identifier = None
+        self.token: Optional[int] = None
+        self._acquired_at = None
 
-    async def acquire(self) -> bool:
-        """Adquirir lock"""
-        redis_conn = await get_redis()
+    async def _try_acquire(self, redis_conn) -> int:
+        return int(await redis_conn.eval(
+            _LOCK_ACQUIRE_LUA, 2, self.key, self.fence_key,
+            self.identifier, int(self.expire * 1000)
+        ))
+
+    async def acquire(self) -> Optional[int]:
+        """
+        Adquirir lock esperando hasta `timeout` segundos
+
+        Returns:
+            Fencing token de esta adquisición, o None si no se obtuvo
+        """
+        from shared.utils.metrics import histogram, counter
         import uuid
+
+        redis_conn = await get_redis()
         self.identifier = str(uuid.uuid4())
+        loop = asyncio.get_event_loop()
+        started = loop.time()
+        end_time = started + self.timeout
+
+        token = await self._try_acquire(redis_conn)
+        if not token:
+            # Suscribirse antes de reintentar para no perder la liberación
+            async with subscribe_channel(self.channel) as released:
+                token = await self._try_acquire(redis_conn)
+                while not token and loop.time() < end_time:
+                    # Si el dueño no libera, despertar cuando vence su lease
+                    ttl_ms = await redis_conn.pttl(self.key)
+                    wait = end_time - loop.time()
+                    if ttl_ms and ttl_ms > 0:
+                        wait = min(wait, ttl_ms / 1000)
+                    if wait > 0:
+                        await released.get(timeout=wait)
+                    token = await self._try_acquire(redis_conn)
+
+        histogram(
+            "lock_acquire_wait_seconds", "Tiempo esperando un lock distribuido", ["lock", "result"]
+        ).observe(loop.time() - started, lock=self.name, result="acquired" if token else "timeout")
 
-        end_time = asyncio.get_event_loop().time() + self.timeout
-        while asyncio.get_event_loop().time() < end_time:
-            if await redis_conn.set(self.key, self.identifier, nx=True, ex=self.expire):
-                return True
-            await asyncio.sleep(0.1)
+        if not token:
+            counter(
+                "lock_acquire_timeouts_total", "Locks distribuidos no obtenidos dentro del timeout", ["lock"]
+            ).inc(lock=self.name)
+            self.identifier = None
+            return None
 
-        return False
+        self.token = token
+        self._acquired_at = loop.time()
+        return token
+
+    async def extend(self, expire: Optional[int] = None) -> bool:
+        """
+        Renovar el lease del lock (por `expire` segundos desde ahora)
+
+        Returns:
+            False si el lock ya no es nuestro
+        """
+        if not self.identifier:
+            return False
+        redis_conn = await get_redis()
+        if expire:
+            self.expire = expire
+        return bool(await redis_conn.eval(
+            _LOCK_EXTEND_LUA, 1, self.key, self.identifier, int(self.expire * 1000)
+        ))
+
+    async def validate(self):
+        """
+        Verificar que seguimos siendo el dueño y el token es el último emitido
+
+        Llamar justo antes de confirmar una escritura protegida por el lock.
+        Es solo un chequeo en Redis; no reemplaza guardar el token en la DB.
+
+        Raises:
+            LockError si el lease venció o alguien más tomó el lock
+        """
+        redis_conn = await get_redis()
+        if not self.identifier or not await redis_conn.eval(
+            _LOCK_VALIDATE_LUA, 2, self.key, self.fence_key, self.identifier, self.token
+        ):
+            raise LockError(f"Lock perdido: {self.key} (token {self.token})")
+
+    async def advance_fence(self, token: int) -> bool:
+        """
+        Subir el contador de tokens a `token` si quedó por debajo
+
+        Para cuando la DB rechaza una escritura con un token ya visto (p.ej.
+        Redis perdió `{key}:fence`): la próxima adquisición vuelve a superarlo.
+
+        Returns:
+            True si el contador se movió
+        """
+        redis_conn = await get_redis()
+        return bool(await redis_conn.eval(_LOCK_ADVANCE_FENCE_LUA, 1, self.fence_key, int(token)))
 
     async def release(self):
-        """Liberar lock"""
+        """Liberar lock y despertar a quienes esperan"""
         if not self.identifier:
             return
 
+        from shared.utils.metrics import histogram
+
         redis_conn = await get_redis()
-        # Lua script para asegurar que solo el owner puede liberar
-        lua_script = """
-        if redis.call("get", KEYS[1]) == ARGV[1] then
-            return redis.call("del", KEYS[1])
-        else
-            return 0
-        end
-        """
-        await redis_conn.eval(lua_script, 1, self.key, self.identifier)
+        await redis_conn.eval(_LOCK_RELEASE_LUA, 1, self.key, self.identifier, self.channel)
+
+        if self._acquired_at is not None:
+            histogram(
+                "lock_hold_seconds", "Tiempo que se retuvo un lock distribuido", ["lock"]
+            ).observe(asyncio.get_event_loop().time() - self._acquired_at, lock=self.name)
+
+        self.identifier = None
+        self._acquired_at = None
 
     async def __aenter__(self):
         if not await self.acquire():
-            raise Exception(f"No se pudo adquirir lock: {self.key}")
+            raise LockError(f"No se pudo adquirir lock: {self.key}")
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
@@ -1,15 +1,34 @@
 """Conexión a la base de datos PostgreSQL"""
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.orm import declarative_base
-from sqlalchemy.pool import NullPool, QueuePool
+from sqlalchemy.pool import NullPool, QueuePool, AsyncAdaptedQueuePool
 from sqlalchemy import event
+from shared.utils.metrics import histogram
 import os
 from typing import AsyncGenerator
 import logging
 import asyncio
+import time
 
 logger = logging.getLogger(__name__)
 
+_pool_wait = histogram(
+    "db_pool_checkout_wait_seconds",
+    "Tiempo esperando una conexión libre del pool de la base de datos",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """Pool que mide cuánto espera cada checkout (pool agotado = espera alta)"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            _pool_wait.observe(time.perf_counter() - started)
+
 # Base para modelos SQLAlchemy
 Base = declarative_base()
 
@@ -94,6 +113,7 @@ async def init_db():
         database_url,
         echo=os.getenv("APP_DEBUG", "False").lower() == "true",
         connect_args=connect_args,
+        poolclass=InstrumentedPool,
         **pool_config
     )
 
@@ -1,5 +1,5 @@
 """Modelos SQLAlchemy compatibles con Supabase"""
-from sqlalchemy import Column, String, Integer, Boolean, DateTime, Date, ForeignKey, Numeric, Text
+from sqlalchemy import Column, String, Integer, Boolean, DateTime, Date, ForeignKey, Numeric, Text, UniqueConstraint
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
@@ -117,7 +117,7 @@ class Order(Base):
     total = Column(Numeric(12, 2), nullable=False, server_default="0")
     commission_total = Column(Numeric(12, 2), nullable=True, server_default="0")  # Comisiones por tickets
     currency = Column(String, nullable=True, server_default="CLP")
-    status = Column(String, nullable=False, server_default="pending")  # pending, processing, completed, cancelled, refunded
+    status = Column(String, nullable=False, server_default="pending")  # pending, processing, completed, cancelled, expired, refunded
     payment_provider = Column(String, nullable=True)
     payment_reference = Column(String, nullable=True)
     receipt_url = Column(String, nullable=True)  # URL del comprobante de transferencia bancaria
@@ -199,6 +199,46 @@ class CapacityLog(Base):
     user = relationship("User", foreign_keys=[caused_by_user])
 
 
+class CapacityLogRollup(Base):
+    """
+    Agregados por evento/hora/motivo de capacity_logs antiguos
+    (DDL en docs/sql/capacity_log_rollups.sql)
+    """
+    __tablename__ = "capacity_log_rollups"
+
+    event_id = Column(UUID(as_uuid=True), ForeignKey("events.id", ondelete="CASCADE"), primary_key=True)
+    bucket = Column(DateTime(timezone=True), primary_key=True)  # Inicio de la hora
+    reason = Column(String, primary_key=True)  # Motivo sin IDs de orden (order, hold_expired, ...)
+    delta_total = Column(Integer, nullable=False, server_default="0")
+    entries = Column(Integer, nullable=False, server_default="0")
+
+
+class OutboxEvent(Base):
+    """
+    Outbox transaccional de efectos posteriores al pago (tickets, PDF, email)
+    (DDL en docs/sql/outbox_events.sql)
+    """
+    __tablename__ = "outbox_events"
+    __table_args__ = (
+        UniqueConstraint("aggregate_id", "event_type", name="uq_outbox_events_aggregate_type"),
+    )
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    aggregate_id = Column(UUID(as_uuid=True), nullable=False)  # ID de la orden
+    event_type = Column(String, nullable=False)  # order_paid, order_payment_requested
+    payload = Column(JSONB, nullable=True)
+    status = Column(String, nullable=False, server_default="pending")  # pending, published, processed
+    attempts = Column(Integer, nullable=False, server_default="0")  # Publicaciones al broker
+    available_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    published_at = Column(DateTime(timezone=True), nullable=True)
+    tickets_issued_at = Column(DateTime(timezone=True), nullable=True)  # Paso 1 del consumidor
+    email_sent_at = Column(DateTime(timezone=True), nullable=True)  # Paso 2 del consumidor
+    locked_until = Column(DateTime(timezone=True), nullable=True)  # Lease del envío de email
+    processed_at = Column(DateTime(timezone=True), nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+
 class EventService(Base):
     __tablename__ = "event_services"
     
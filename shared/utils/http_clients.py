@@ -0,0 +1,174 @@
+"""
+Clientes HTTP salientes compartidos por upstream
+
+Un `httpx.AsyncClient` de larga vida por upstream (payku, supabase, pdfsvc,
+resend, mercadopago) con pool keep-alive, timeouts y límites propios, así que
+las llamadas reutilizan conexiones TCP/TLS en vez de abrir un cliente por
+request. La API los crea en el lifespan y los cierra al apagar; los workers
+de Celery (un event loop por tarea) los crean a demanda y los cierran con
+`close_http_clients()` en el finally de la tarea, igual que Redis.
+
+HTTP/2 se activa por upstream (HTTP_<UPSTREAM>_HTTP2=true) solo si el paquete
+`h2` está instalado.
+
+Métricas en /metrics:
+- http_client_request_duration_seconds{upstream,method,status}
+- http_client_in_flight_requests{upstream}
+- http_client_pool_connections{upstream,state} (active / idle)
+"""
+from typing import Dict, NamedTuple
+from shared.utils.metrics import histogram, gauge
+import asyncio
+import importlib.util
+import logging
+import os
+import time
+import weakref
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+class UpstreamConfig(NamedTuple):
+    timeout: float
+    connect_timeout: float
+    max_connections: int
+    max_keepalive: int
+    http2: bool
+
+
+def _config(name: str, timeout: float, max_connections: int, http2: bool = False) -> UpstreamConfig:
+    """Configuración de un upstream, sobreescribible con HTTP_<NAME>_*"""
+    prefix = f"HTTP_{name.upper()}_"
+    return UpstreamConfig(
+        timeout=float(os.getenv(prefix + "TIMEOUT", str(timeout))),
+        connect_timeout=float(os.getenv(prefix + "CONNECT_TIMEOUT", "5")),
+        max_connections=int(os.getenv(prefix + "MAX_CONNECTIONS", str(max_connections))),
+        max_keepalive=int(os.getenv(prefix + "MAX_KEEPALIVE", str(max_connections))),
+        http2=os.getenv(prefix + "HTTP2", str(http2)).lower() == "true",
+    )
+
+
+UPSTREAMS: Dict[str, UpstreamConfig] = {
+    "payku": _config("payku", timeout=30.0, max_connections=20, http2=True),
+    "mercadopago": _config("mercadopago", timeout=30.0, max_connections=20, http2=True),
+    "supabase": _config("supabase", timeout=5.0, max_connections=50, http2=True),
+    "resend": _config("resend", timeout=30.0, max_connections=10, http2=True),
+    # pdfsvc es HTTP/1.1 en la red interna
+    "pdfsvc": _config("pdfsvc", timeout=30.0, max_connections=10),
+}
+
+_request_duration = histogram(
+    "http_client_request_duration_seconds",
+    "Latencia de requests HTTP salientes por upstream",
+    ("upstream", "method", "status"),
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+_in_flight = gauge(
+    "http_client_in_flight_requests",
+    "Requests HTTP salientes en curso por upstream",
+    ("upstream",)
+)
+_pool_connections = gauge(
+    "http_client_pool_connections",
+    "Conexiones del pool HTTP por upstream y estado",
+    ("upstream", "state")
+)
+
+
+class _InstrumentedTransport(httpx.AsyncBaseTransport):
+    """Transporte que mide latencia y uso del pool del transporte real"""
+
+    def __init__(self, upstream: str, transport: httpx.AsyncHTTPTransport):
+        self.upstream = upstream
+        self._transport = transport
+
+    def _record_pool(self):
+        pool = getattr(self._transport, "_pool", None)
+        connections = getattr(pool, "connections", None)
+        if connections is None:
+            return
+        idle = sum(1 for connection in connections if connection.is_idle())
+        _pool_connections.set(idle, upstream=self.upstream, state="idle")
+        _pool_connections.set(len(connections) - idle, upstream=self.upstream, state="active")
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        started = time.perf_counter()
+        status = "error"
+        _in_flight.inc(upstream=self.upstream)
+        try:
+            response = await self._transport.handle_async_request(request)
+            status = str(response.status_code)
+            return response
+        finally:
+            _in_flight.dec(upstream=self.upstream)
+            _request_duration.observe(
+                time.perf_counter() - started,
+                upstream=self.upstream, method=request.method, status=status
+            )
+            self._record_pool()
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+# event loop -> {upstream: cliente}. Un cliente httpx no se puede usar desde
+# otro loop (tareas Celery, asyncio.run en threads), así que cada loop tiene
+# los suyos; los de loops ya descartados se liberan con el loop.
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, httpx.AsyncClient]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _create_client(name: str) -> httpx.AsyncClient:
+    config = UPSTREAMS[name]
+    http2 = config.http2 and HTTP2_AVAILABLE
+    transport = httpx.AsyncHTTPTransport(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=config.max_connections,
+            max_keepalive_connections=config.max_keepalive,
+            keepalive_expiry=30.0,
+        ),
+        retries=1,  # reintentar solo fallos de conexión
+    )
+    return httpx.AsyncClient(
+        transport=_InstrumentedTransport(name, transport),
+        timeout=httpx.Timeout(config.timeout, connect=config.connect_timeout),
+    )
+
+
+def get_http_client(name: str) -> httpx.AsyncClient:
+    """Cliente compartido de un upstream en el event loop actual (se crea a demanda)"""
+    if name not in UPSTREAMS:
+        raise ValueError(f"Upstream HTTP desconocido: {name}")
+
+    loop_clients = _clients.setdefault(asyncio.get_running_loop(), {})
+    client = loop_clients.get(name)
+    if client is None or client.is_closed:
+        client = _create_client(name)
+        loop_clients[name] = client
+    return client
+
+
+async def init_http_clients():
+    """Crear los clientes de todos los upstreams (lifespan de la API)"""
+    for name in UPSTREAMS:
+        get_http_client(name)
+    logger.info(
+        f"Clientes HTTP inicializados: {', '.join(UPSTREAMS)} "
+        f"(HTTP/2 {'disponible' if HTTP2_AVAILABLE else 'no disponible, falta h2'})"
+    )
+
+
+async def close_http_clients():
+    """Cerrar los clientes del event loop actual"""
+    loop_clients = _clients.pop(asyncio.get_running_loop(), {})
+    for name, client in loop_clients.items():
+        try:
+            await client.aclose()
+        except Exception as e:
+            logger.warning(f"Error cerrando cliente HTTP {name}: {e}")
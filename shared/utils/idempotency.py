@@ -0,0 +1,226 @@
+"""
+Idempotencia HTTP con respuestas guardadas (header Idempotency-Key)
+
+Uso:
+    router = APIRouter(route_class=IdempotentRoute)
+
+    @router.post("/algo")
+    @idempotent(ttl=86400)
+    async def crear_algo(...):
+        ...
+
+Si el request trae `Idempotency-Key`:
+1. Se busca la respuesta guardada en `idempotency:{path}:{principal}:{key}`,
+   donde `path` es la ruta concreta del request (con los parámetros ya
+   resueltos, p. ej. /admin/orders/<id>/confirm); si existe se devuelve tal cual (un GET a Redis, sin tocar la DB) con
+   `Idempotent-Replayed: true`.
+2. Si no, el primero toma un lease (SET NX PX). Los duplicados concurrentes
+   esperan la publicación del resultado hasta IDEMPOTENCY_WAIT_SECONDS y
+   si no llega responden 409.
+3. Al terminar se guarda status, headers (sin los hop-by-hop ni los que
+   recalcula el servidor) y body con TTL, y el replay los devuelve iguales
+   (p. ej. `Location` y `Preference-Applied` de un 202). Las respuestas 5xx y
+   las HTTPException no se guardan: el cliente puede reintentar.
+
+La misma key con otro body o query string responde 422. El principal es un hash del header
+Authorization, así que la key de un usuario no choca con la de otro. Sin el
+header, o si Redis falla, el endpoint se ejecuta normalmente.
+"""
+from fastapi import Request, Response
+from fastapi.routing import APIRoute
+from redis.exceptions import RedisError
+from typing import Callable, Optional
+from shared.cache.redis_client import get_redis, subscribe_channel
+from shared.utils.metrics import counter
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import uuid
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", "86400"))
+# Lease del primer request: debe cubrir la duración del endpoint más lento
+IDEMPOTENCY_LEASE_SECONDS = int(os.getenv("IDEMPOTENCY_LEASE_SECONDS", "60"))
+# Cuánto espera un duplicado concurrente antes de responder 409
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "10"))
+MAX_KEY_LENGTH = 255
+
+REDIS_FAILURES = (RedisError, OSError)
+
+# Headers que no se guardan: hop-by-hop (RFC 7230 §6.1) y los que el servidor
+# recalcula en cada respuesta. content-type va aparte, en el campo "c"
+_UNSTORED_HEADERS = frozenset({
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailer", "transfer-encoding", "upgrade",
+    "content-length", "content-type", "date", "server",
+})
+
+# Liberar el lease solo si sigue siendo nuestro
+_RELEASE_LUA = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+_requests = counter(
+    "idempotency_requests_total",
+    "Requests con Idempotency-Key por ruta y resultado (executed, replayed, conflict, mismatch, bypass)",
+    ("route", "result")
+)
+
+
+def idempotent(ttl: Optional[int] = None):
+    """Marcar un endpoint como idempotente (requiere IdempotentRoute en el router)"""
+    def decorator(func: Callable) -> Callable:
+        func.__idempotency_ttl__ = ttl or IDEMPOTENCY_TTL
+        return func
+    return decorator
+
+
+def _error(status_code: int, detail: str) -> Response:
+    return Response(
+        content=json.dumps({"detail": detail}),
+        status_code=status_code,
+        media_type="application/json"
+    )
+
+
+def _replay(record: dict) -> Response:
+    response = Response(
+        content=record["b"],
+        status_code=record["s"],
+        media_type=record.get("c") or "application/json"
+    )
+    # append y no dict: un header puede repetirse (p. ej. set-cookie)
+    for name, value in record.get("h") or []:
+        response.headers.append(name, value)
+    response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+
+class IdempotentRoute(APIRoute):
+    """Ruta que aplica Idempotency-Key a los endpoints marcados con @idempotent"""
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+        ttl = getattr(self.endpoint, "__idempotency_ttl__", None)
+        if ttl is None:
+            return handler
+
+        route_label = f"{','.join(sorted(self.methods or []))} {self.path}"
+
+        async def idempotent_handler(request: Request) -> Response:
+            key = request.headers.get(IDEMPOTENCY_HEADER)
+            if not key:
+                return await handler(request)
+            if len(key) > MAX_KEY_LENGTH:
+                return _error(400, f"{IDEMPOTENCY_HEADER} no puede superar {MAX_KEY_LENGTH} caracteres")
+
+            principal = hashlib.sha256(
+                (request.headers.get("Authorization") or "anon").encode()
+            ).hexdigest()[:16]
+            # El body ya leído queda cacheado en el request para el endpoint
+            digest = hashlib.sha256(request.url.query.encode())
+            digest.update(b"\0")
+            digest.update(await request.body())
+            fingerprint = digest.hexdigest()[:32]
+            # Ruta concreta, no la plantilla: la misma key en otra orden no reutiliza la respuesta
+            base = f"idempotency:{request.url.path}:{principal}:{key}"
+            record_key, lease_key, channel = base, f"{base}:lease", f"{base}:done"
+            token = str(uuid.uuid4())
+
+            try:
+                redis_conn = await get_redis()
+                stored = await redis_conn.get(record_key)
+                if stored is None:
+                    acquired = await redis_conn.set(
+                        lease_key, token, nx=True, px=IDEMPOTENCY_LEASE_SECONDS * 1000
+                    )
+                    if not acquired:
+                        stored = await _wait_for_record(redis_conn, record_key, lease_key, channel)
+                        if stored is None:
+                            _requests.inc(route=route_label, result="conflict")
+                            return _error(409, "Ya hay una solicitud en curso con esta Idempotency-Key")
+            except REDIS_FAILURES as e:
+                logger.warning(f"Idempotencia no disponible para {route_label}, ejecutando sin ella: {e}")
+                _requests.inc(route=route_label, result="bypass")
+                return await handler(request)
+
+            if stored is not None:
+                record = json.loads(stored)
+                if record.get("f") != fingerprint:
+                    _requests.inc(route=route_label, result="mismatch")
+                    return _error(422, "La Idempotency-Key ya se usó con otro contenido")
+                _requests.inc(route=route_label, result="replayed")
+                return _replay(record)
+
+            response: Optional[Response] = None
+            try:
+                response = await handler(request)
+                return response
+            finally:
+                await _finish(
+                    redis_conn, response, fingerprint, ttl,
+                    record_key, lease_key, channel, token
+                )
+                _requests.inc(route=route_label, result="executed")
+
+        return idempotent_handler
+
+
+async def _wait_for_record(redis_conn, record_key: str, lease_key: str, channel: str) -> Optional[str]:
+    """Esperar a que el primer request guarde su respuesta; None si no llega"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + IDEMPOTENCY_WAIT_SECONDS
+    # Suscribirse antes de revisar para no perder la publicación (conexión compartida del proceso)
+    async with subscribe_channel(channel) as done:
+        while True:
+            stored = await redis_conn.get(record_key)
+            if stored is not None:
+                return stored
+            if not await redis_conn.exists(lease_key):
+                # El primero terminó sin guardar (5xx) o murió
+                return None
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return None
+            await done.get(timeout=min(remaining, 1.0))
+
+
+async def _finish(
+    redis_conn,
+    response: Optional[Response],
+    fingerprint: str,
+    ttl: int,
+    record_key: str,
+    lease_key: str,
+    channel: str,
+    token: str
+):
+    """Guardar la respuesta final (si corresponde), liberar el lease y avisar"""
+    body = getattr(response, "body", None)
+    storable = response is not None and body is not None and response.status_code < 500
+    try:
+        async with redis_conn.pipeline(transaction=False) as pipe:
+            if storable:
+                record = {
+                    "s": response.status_code,
+                    "f": fingerprint,
+                    "c": response.headers.get("content-type"),
+                    "h": [
+                        [name, value] for name, value in response.headers.items()
+                        if name.lower() not in _UNSTORED_HEADERS
+                    ],
+                    "b": body.decode("utf-8"),
+                }
+                pipe.set(record_key, json.dumps(record, separators=(",", ":")), ex=ttl)
+            pipe.eval(_RELEASE_LUA, 1, lease_key, token)
+            pipe.publish(channel, "1")
+            await pipe.execute()
+    except (UnicodeDecodeError,) + REDIS_FAILURES as e:
+        logger.warning(f"No se pudo guardar la respuesta idempotente {record_key}: {e}")
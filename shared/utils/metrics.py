@@ -0,0 +1,191 @@
+"""
+Métricas en memoria con formato de exposición de Prometheus
+
+Registro mínimo de contadores, gauges e histogramas por proceso (cada worker de
+uvicorn/Celery tiene los suyos), expuesto en GET /metrics. No depende de
+prometheus_client.
+"""
+from typing import Dict, List, Optional, Sequence, Tuple
+import math
+import threading
+
+# Buckets (segundos) pensados para latencias de locks y operaciones de red
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry: Dict[str, "_Metric"] = {}
+_registry_lock = threading.Lock()
+
+
+def _format_labels(label_names: Sequence[str], label_values: Tuple[str, ...], extra: Optional[Dict[str, str]] = None) -> str:
+    pairs = list(zip(label_names, label_values))
+    if extra:
+        pairs.extend(extra.items())
+    if not pairs:
+        return ""
+    escaped = [
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in pairs
+    ]
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+
+
+class Counter(_Metric):
+    """Contador monótono"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = ()):
+        super().__init__(name, description, label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Valor instantáneo que puede subir y bajar"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = ()):
+        super().__init__(name, description, label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    """Histograma acumulativo con buckets fijos"""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, description, label_names)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # key -> (conteos por bucket, suma, cantidad)
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = [[0] * len(self.buckets), 0.0, 0]
+                self._series[key] = series
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    labels = _format_labels(self.label_names, key, {"le": _format_value(bound)})
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.label_names, key)
+                lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+def _get_or_create(cls, name: str, *args, **kwargs):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = cls(name, *args, **kwargs)
+            _registry[name] = metric
+        return metric
+
+
+def counter(name: str, description: str, label_names: Sequence[str] = ()) -> Counter:
+    """Obtener (o registrar) un contador"""
+    return _get_or_create(Counter, name, description, label_names)
+
+
+def gauge(name: str, description: str, label_names: Sequence[str] = ()) -> Gauge:
+    """Obtener (o registrar) un gauge"""
+    return _get_or_create(Gauge, name, description, label_names)
+
+
+def histogram(
+    name: str,
+    description: str,
+    label_names: Sequence[str] = (),
+    buckets: Sequence[float] = DEFAULT_BUCKETS
+) -> Histogram:
+    """Obtener (o registrar) un histograma"""
+    return _get_or_create(Histogram, name, description, label_names, buckets)
+
+
+def render_latest() -> str:
+    """Todas las métricas registradas en formato texto de Prometheus"""
+    with _registry_lock:
+        metrics = list(_registry.values())
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
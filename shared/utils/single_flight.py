@@ -0,0 +1,190 @@
+"""
+Coalescing de llamadas concurrentes (single-flight)
+
+Garantiza como máximo una llamada en curso por clave (p.ej. una verificación
+de transacción con el proveedor de pago) y entrega el mismo resultado a todos
+los que la pidieron mientras estaba en vuelo:
+
+- En el proceso: el primero crea una tarea y el resto la espera.
+- Entre workers: el dueño de la tarea toma un lease en Redis
+  (`singleflight:{name}:{key}:lease`, SET NX PX). Los demás workers esperan
+  `singleflight:{name}:{key}:done` en el listener pub/sub compartido del
+  proceso (subscribe_channel) y reciben el resultado.
+
+Solo se comparte lo que está en vuelo: el resultado no se guarda, así que
+quien llega después de la publicación hace una llamada nueva y nunca recibe
+un estado viejo (p.ej. 'pending' leído justo antes del webhook de aprobación).
+
+Si Redis no está disponible, o el dueño del lease desaparece sin publicar,
+se llama directamente: el coalescing solo ahorra llamadas, nunca las bloquea.
+Los resultados deben ser serializables a JSON.
+
+Métricas en /metrics:
+- single_flight_calls_total{name,role}: leader (llamó al proveedor),
+  local / remote (recibieron un resultado compartido), fallback (llamaron
+  sin coordinación)
+- single_flight_coalescing_ratio{name}: fracción de llamadas de este proceso
+  que no llegaron al proveedor
+"""
+from redis.exceptions import RedisError
+from typing import Any, Awaitable, Callable, Dict
+from shared.cache.redis_client import get_redis, subscribe_channel
+from shared.utils.metrics import counter, gauge
+import asyncio
+import json
+import logging
+import os
+import uuid
+import weakref
+
+logger = logging.getLogger(__name__)
+
+# El lease debe cubrir el timeout del proveedor para que nadie más llame mientras tanto
+SINGLE_FLIGHT_LEASE_SECONDS = float(os.getenv("SINGLE_FLIGHT_LEASE_SECONDS", "35"))
+SINGLE_FLIGHT_WAIT_SECONDS = float(os.getenv("SINGLE_FLIGHT_WAIT_SECONDS", "35"))
+
+REDIS_FAILURES = (RedisError, OSError)
+
+# Liberar el lease solo si sigue siendo nuestro
+_RELEASE_LUA = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+_calls = counter(
+    "single_flight_calls_total",
+    "Llamadas coalescidas por nombre y rol (leader, local, remote, fallback)",
+    ("name", "role")
+)
+_ratio = gauge(
+    "single_flight_coalescing_ratio",
+    "Fracción de llamadas que recibieron un resultado compartido en este proceso",
+    ("name",)
+)
+
+
+class SingleFlight:
+    """Una llamada en curso por clave, en el proceso y entre workers"""
+
+    def __init__(self, name: str):
+        self.name = name
+        # event loop -> {clave: tarea en curso}; una tarea no se puede esperar desde otro loop
+        self._inflight: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Task]]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._total = 0
+        self._shared = 0
+
+    def _record(self, role: str):
+        _calls.inc(name=self.name, role=role)
+        self._total += 1
+        if role in ("local", "remote"):
+            self._shared += 1
+        _ratio.set(self._shared / self._total, name=self.name)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Ejecutar `fn` una sola vez por clave y compartir su resultado
+
+        La tarea no se cancela si el llamador que la inició se desconecta: los
+        demás siguen esperándola.
+        """
+        loop = asyncio.get_running_loop()
+        inflight = self._inflight.setdefault(loop, {})
+        task = inflight.get(key)
+        if task is not None:
+            self._record("local")
+        else:
+            task = loop.create_task(self._do_shared(key, fn))
+            inflight[key] = task
+            task.add_done_callback(lambda t: self._forget(inflight, key, t))
+        return await asyncio.shield(task)
+
+    @staticmethod
+    def _forget(inflight: Dict[str, asyncio.Task], key: str, task: asyncio.Task):
+        if inflight.get(key) is task:
+            inflight.pop(key, None)
+        if not task.cancelled():
+            # Marcar la excepción como leída aunque todos los llamadores se hayan ido
+            task.exception()
+
+    async def _do_shared(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        base = f"singleflight:{self.name}:{key}"
+        lease_key, channel = f"{base}:lease", f"{base}:done"
+        token = str(uuid.uuid4())
+
+        try:
+            redis_conn = await get_redis()
+            acquired = await redis_conn.set(
+                lease_key, token, nx=True, px=int(SINGLE_FLIGHT_LEASE_SECONDS * 1000)
+            )
+        except REDIS_FAILURES as e:
+            logger.warning(f"Single-flight {self.name} sin Redis, llamando directo: {e}")
+            self._record("fallback")
+            return await fn()
+
+        if not acquired:
+            outcome = await self._follow(redis_conn, lease_key, channel)
+            if outcome is not None:
+                self._record("remote")
+                if not outcome.get("ok"):
+                    raise Exception(outcome.get("error") or "Error en la llamada compartida")
+                return outcome.get("result")
+
+            # El dueño desapareció sin publicar o se agotó la espera
+            try:
+                acquired = await redis_conn.set(
+                    lease_key, token, nx=True, px=int(SINGLE_FLIGHT_LEASE_SECONDS * 1000)
+                )
+            except REDIS_FAILURES:
+                acquired = False
+            if not acquired:
+                self._record("fallback")
+                return await fn()
+
+        self._record("leader")
+        return await self._lead(redis_conn, fn, token, lease_key, channel)
+
+    async def _lead(self, redis_conn, fn, token: str, lease_key: str, channel: str) -> Any:
+        outcome: Dict[str, Any] = {"ok": False, "error": "Llamada interrumpida"}
+        try:
+            result = await fn()
+            outcome = {"ok": True, "result": result}
+            return result
+        except Exception as e:
+            outcome = {"ok": False, "error": str(e)}
+            raise
+        finally:
+            try:
+                payload = json.dumps(outcome, default=str)
+                async with redis_conn.pipeline(transaction=False) as pipe:
+                    pipe.eval(_RELEASE_LUA, 1, lease_key, token)
+                    pipe.publish(channel, payload)
+                    await pipe.execute()
+            except (TypeError, ValueError) + REDIS_FAILURES as e:
+                # Los que esperan caen a llamar directo al vencer el lease
+                logger.warning(f"Single-flight {self.name} no pudo publicar el resultado: {e}")
+
+    async def _follow(self, redis_conn, lease_key: str, channel: str):
+        """Esperar el resultado del dueño del lease; None si no llega"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + SINGLE_FLIGHT_WAIT_SECONDS
+        try:
+            # Suscribirse antes de revisar para no perder la publicación
+            async with subscribe_channel(channel) as done:
+                while True:
+                    if not await redis_conn.exists(lease_key):
+                        # Puede haber publicado un error justo antes de soltar el lease
+                        message = await done.get(timeout=0.05)
+                        return json.loads(message) if message else None
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        return None
+                    message = await done.get(timeout=min(remaining, 1.0))
+                    if message:
+                        return json.loads(message)
+        except REDIS_FAILURES as e:
+            logger.warning(f"Single-flight {self.name} perdió la suscripción: {e}")
+            return None
@@ -0,0 +1,69 @@
+"""
+Fixtures compartidos de los tests
+
+- `redis_conn`: Redis en memoria (fakeredis, con Lua) en lugar del pool real.
+  Los scripts Lua, streams y pub/sub corren sobre él sin servidor.
+- `db`: sesión sobre TEST_DATABASE_URL (PostgreSQL). Crea las tablas de los
+  modelos más el DDL de docs/sql que usan los servicios y las vacía antes de
+  cada test, así que debe apuntar a una base descartable. Sin la variable,
+  los tests que la usan se saltan.
+"""
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+from pathlib import Path
+from shared.cache import redis_client as redis_module
+from shared.database import connection
+from shared.database.models import Base
+import fakeredis.aioredis
+import os
+import pytest
+import pytest_asyncio
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+# DDL fuera de los modelos que usan los servicios bajo test
+SQL_DIR = Path(__file__).resolve().parent.parent / "docs" / "sql"
+EXTRA_DDL = ("events_capacity_fence.sql", "inventory_degraded.sql")
+
+
+@pytest_asyncio.fixture
+async def redis_conn(monkeypatch):
+    from services.ticket_purchase.services import capacity_engine
+
+    conn = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(redis_module, "redis_client", conn)
+    capacity_engine._shard_config_cache.clear()
+    yield conn
+    await redis_module.close_redis()
+
+
+@pytest_asyncio.fixture
+async def session_maker(monkeypatch):
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL no configurada")
+
+    url = TEST_DATABASE_URL
+    for prefix in ("postgresql://", "postgresql+psycopg://"):
+        if url.startswith(prefix):
+            url = url.replace(prefix, "postgresql+asyncpg://", 1)
+    engine = create_async_engine(url, poolclass=NullPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        for name in EXTRA_DDL:
+            await conn.execute(text((SQL_DIR / name).read_text()))
+        tables = ", ".join(table.name for table in Base.metadata.sorted_tables)
+        await conn.execute(text(f"TRUNCATE {tables}, inventory_degraded CASCADE"))
+
+    maker = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    # Los servicios que abren su propia sesión (consumidores, tareas) usan esta
+    monkeypatch.setattr(connection, "async_session_maker", maker)
+    yield maker
+    await engine.dispose()
+
+
+@pytest_asyncio.fixture
+async def db(session_maker):
+    async with session_maker() as session:
+        yield session
+
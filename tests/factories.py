@@ -0,0 +1,71 @@
+"""Datos de prueba en la DB (requieren el fixture `db`)"""
+from sqlalchemy import text
+from datetime import datetime, timedelta
+from shared.database.models import (
+    User, Organizer, Event, TicketType, EventService, Order, OrderItem, OrderServiceItem
+)
+import uuid
+
+
+async def create_event(db, capacity: int = 10, services=()) -> Event:
+    """Evento con un tipo de ticket y, opcionalmente, servicios con stock [(nombre, stock)]"""
+    user = User(id=uuid.uuid4(), email=f"{uuid.uuid4().hex}@test.cl")
+    organizer = Organizer(id=uuid.uuid4(), org_name="Organizador", user_id=user.id)
+    event = Event(
+        id=uuid.uuid4(),
+        organizer_id=organizer.id,
+        name="Evento de prueba",
+        location_text="Santiago",
+        starts_at=datetime.utcnow() + timedelta(days=30),
+        ends_at=datetime.utcnow() + timedelta(days=30, hours=4),
+        capacity_total=capacity,
+        capacity_available=capacity,
+    )
+    ticket_type = TicketType(id=uuid.uuid4(), event_id=event.id, name="General", price=10000)
+    db.add_all([user, organizer, event, ticket_type])
+    for name, stock in services:
+        db.add(EventService(
+            id=uuid.uuid4(), event_id=event.id, name=name, stock=stock, stock_available=stock
+        ))
+    await db.commit()
+    return event
+
+
+async def create_order(
+    db,
+    event: Event,
+    quantity: int = 2,
+    services=None,
+    provider: str = "mercadopago",
+    status: str = "pending"
+) -> Order:
+    """Orden con `quantity` asientos del evento y servicios {service_id: cantidad}"""
+    ticket_type_id = await db.scalar(text("SELECT id FROM ticket_types WHERE event_id = :id"), {"id": event.id})
+    order = Order(
+        id=uuid.uuid4(),
+        total=10000 * quantity,
+        status=status,
+        payment_provider=provider,
+    )
+    db.add(order)
+    db.add(OrderItem(
+        id=uuid.uuid4(),
+        order_id=order.id,
+        event_id=event.id,
+        ticket_type_id=ticket_type_id,
+        quantity=quantity,
+        unit_price=10000,
+        final_price=10000 * quantity,
+    ))
+    for service_id, service_quantity in (services or {}).items():
+        db.add(OrderServiceItem(
+            id=uuid.uuid4(),
+            order_id=order.id,
+            event_id=event.id,
+            service_id=service_id,
+            quantity=service_quantity,
+            unit_price=0,
+            final_price=0,
+        ))
+    await db.commit()
+    return order
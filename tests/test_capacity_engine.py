@@ -0,0 +1,182 @@
+"""Scripts Lua del motor de capacidad: siembra, reserva, liberación y reserva de orden"""
+from sqlalchemy import select, text
+from shared.cache.redis_client import LockError
+from shared.database.models import Event
+from services.ticket_purchase.services.capacity_engine import (
+    CapacityEngine, INSUFFICIENT, STOCK_INSUFFICIENT, UNLIMITED, _SEED_LUA, _SEED_SERVICE_LUA
+)
+from tests.factories import create_event
+import asyncio
+import pytest
+import uuid
+
+EVENT_ID = str(uuid.uuid4())
+
+
+async def seed_event(redis_conn, event_id: str, available: int, total: int) -> int:
+    keys = [
+        CapacityEngine.available_key(event_id),
+        CapacityEngine.total_key(event_id),
+        CapacityEngine.PENDING_KEY,
+        CapacityEngine.shards_meta_key(event_id),
+    ]
+    return await redis_conn.eval(_SEED_LUA, len(keys), *keys, available, total, event_id, 1)
+
+
+async def seed_service(redis_conn, event_id: str, service_id: str, available: int, stock: int) -> int:
+    return await redis_conn.eval(
+        _SEED_SERVICE_LUA, 3,
+        CapacityEngine.service_available_key(service_id),
+        CapacityEngine.service_total_key(service_id),
+        CapacityEngine.SERVICE_PENDING_KEY,
+        available, stock,
+        CapacityEngine.service_pending_field(event_id, service_id)
+    )
+
+
+async def available(redis_conn, event_id: str = EVENT_ID) -> int:
+    return int(await redis_conn.get(CapacityEngine.available_key(event_id)))
+
+
+async def pending(redis_conn, event_id: str = EVENT_ID) -> int:
+    return int(await redis_conn.hget(CapacityEngine.PENDING_KEY, event_id) or 0)
+
+
+async def test_seed_adds_unflushed_delta_and_is_idempotent(redis_conn):
+    # Reservas en Redis aún no escritas en la DB
+    await redis_conn.hset(CapacityEngine.PENDING_KEY, EVENT_ID, -3)
+
+    assert await seed_event(redis_conn, EVENT_ID, 10, 10) == 1
+    assert await available(redis_conn) == 7
+
+    # Una segunda siembra no pisa el contador vivo
+    assert await seed_event(redis_conn, EVENT_ID, 10, 10) == 0
+    assert await available(redis_conn) == 7
+
+
+async def test_seed_clamps_to_total(redis_conn):
+    await redis_conn.hset(CapacityEngine.PENDING_KEY, EVENT_ID, 5)
+
+    await seed_event(redis_conn, EVENT_ID, 8, 10)
+
+    assert await available(redis_conn) == 10
+
+
+async def test_reserve_decrements_and_records_delta(redis_conn):
+    await seed_event(redis_conn, EVENT_ID, 10, 10)
+
+    assert await CapacityEngine.reserve(None, EVENT_ID, 3) == 7
+    assert await available(redis_conn) == 7
+    assert await pending(redis_conn) == -3
+
+
+async def test_reserve_rejects_without_touching_counter(redis_conn):
+    await seed_event(redis_conn, EVENT_ID, 2, 10)
+
+    assert await CapacityEngine.reserve(None, EVENT_ID, 3) == INSUFFICIENT
+    assert await available(redis_conn) == 2
+    assert await pending(redis_conn) == 0
+
+
+async def test_concurrent_reserves_never_oversell(redis_conn):
+    await seed_event(redis_conn, EVENT_ID, 5, 5)
+
+    results = await asyncio.gather(*(CapacityEngine.reserve(None, EVENT_ID, 1) for _ in range(20)))
+
+    assert sum(1 for result in results if result != INSUFFICIENT) == 5
+    assert await available(redis_conn) == 0
+    assert await pending(redis_conn) == -5
+
+
+async def test_release_never_exceeds_total(redis_conn):
+    await seed_event(redis_conn, EVENT_ID, 10, 10)
+    await CapacityEngine.reserve(None, EVENT_ID, 3)
+
+    assert await CapacityEngine.release(None, EVENT_ID, 5) == 10
+    # Solo se devuelve lo que faltaba: el delta neto queda en cero
+    assert await pending(redis_conn) == 0
+
+
+async def test_reserve_order_is_all_or_nothing(redis_conn):
+    food, parking = str(uuid.uuid4()), str(uuid.uuid4())
+    await seed_event(redis_conn, EVENT_ID, 10, 10)
+    await seed_service(redis_conn, EVENT_ID, food, 5, 5)
+    await seed_service(redis_conn, EVENT_ID, parking, 1, 1)
+
+    result, failed = await CapacityEngine.reserve_order(None, EVENT_ID, 2, {food: 2, parking: 2})
+
+    assert (result, failed) == (STOCK_INSUFFICIENT, parking)
+    # Ni asientos ni el servicio que sí alcanzaba se descontaron
+    assert await available(redis_conn) == 10
+    assert await redis_conn.get(CapacityEngine.service_available_key(food)) == "5"
+    assert await pending(redis_conn) == 0
+    assert not await redis_conn.exists(CapacityEngine.SERVICE_PENDING_KEY)
+
+    result, failed = await CapacityEngine.reserve_order(None, EVENT_ID, 2, {food: 2, parking: 1})
+
+    assert (result, failed) == (8, None)
+    assert await redis_conn.get(CapacityEngine.service_available_key(food)) == "3"
+    assert await redis_conn.get(CapacityEngine.service_available_key(parking)) == "0"
+    assert await redis_conn.hget(
+        CapacityEngine.SERVICE_PENDING_KEY, CapacityEngine.service_pending_field(EVENT_ID, food)
+    ) == "-2"
+
+
+async def test_reserve_order_rejects_seats_before_services(redis_conn):
+    food = str(uuid.uuid4())
+    await seed_event(redis_conn, EVENT_ID, 1, 10)
+    await seed_service(redis_conn, EVENT_ID, food, 5, 5)
+
+    assert await CapacityEngine.reserve_order(None, EVENT_ID, 2, {food: 1}) == (INSUFFICIENT, None)
+    assert await redis_conn.get(CapacityEngine.service_available_key(food)) == "5"
+
+
+async def test_unlimited_service_is_not_decremented(redis_conn):
+    water = str(uuid.uuid4())
+    await seed_event(redis_conn, EVENT_ID, 10, 10)
+    await seed_service(redis_conn, EVENT_ID, water, 0, 0)
+
+    assert await CapacityEngine.reserve_order(None, EVENT_ID, 1, {water: 50}) == (9, None)
+    assert await redis_conn.get(CapacityEngine.service_available_key(water)) == UNLIMITED
+
+
+async def test_reserve_seeds_from_database(redis_conn, db):
+    event = await create_event(db, capacity=10)
+    await db.execute(
+        Event.__table__.update().where(Event.id == event.id).values(capacity_available=4)
+    )
+    await db.commit()
+
+    assert await CapacityEngine.reserve(db, str(event.id), 3) == 1
+    assert await CapacityEngine.reserve(db, str(event.id), 2) == INSUFFICIENT
+
+
+async def test_flush_writes_delta_with_fence(redis_conn, db):
+    event = await create_event(db, capacity=10)
+    await CapacityEngine.reserve(db, str(event.id), 3)
+
+    assert await CapacityEngine.flush_event(db, str(event.id)) == -3
+
+    row = (await db.execute(
+        select(Event.capacity_available, text("capacity_fence")).where(Event.id == event.id)
+    )).one()
+    assert row[0] == 7
+    assert row[1] > 0
+    assert await pending(redis_conn, str(event.id)) == 0
+
+
+async def test_flush_with_stale_fence_is_rejected(redis_conn, db):
+    event_id = str((await create_event(db, capacity=10)).id)
+    await CapacityEngine.reserve(db, event_id, 3)
+    # Otro dueño del lock ya escribió con un token mayor
+    await db.execute(text("UPDATE events SET capacity_fence = 1000 WHERE id = :id"), {"id": event_id})
+    await db.commit()
+
+    with pytest.raises(LockError):
+        await CapacityEngine.flush_event(db, event_id)
+
+    assert await db.scalar(select(Event.capacity_available).where(Event.id == event_id)) == 10
+    # El delta vuelve al hash y el contador de tokens supera al de la DB
+    assert await pending(redis_conn, event_id) == -3
+    assert await CapacityEngine.flush_event(db, event_id) == -3
+    assert await db.scalar(select(Event.capacity_available).where(Event.id == event_id)) == 7
@@ -0,0 +1,139 @@
+"""Expiración de holds de capacidad y re-reserva de pagos tardíos"""
+from sqlalchemy import select, text
+from shared.database.models import Order, OutboxEvent
+from services.ticket_purchase.services.capacity_engine import CapacityEngine
+from services.ticket_purchase.services.capacity_hold_service import CapacityHoldService, HOLD_TTL_SECONDS
+from services.ticket_purchase.services.inventory_service import InventoryService
+from services.ticket_purchase.services.outbox_service import ORDER_PAID
+from services.ticket_purchase.services.purchase_service import PurchaseService
+from tests.factories import create_event, create_order
+import pytest
+
+
+@pytest.fixture
+async def pending_order(redis_conn, db):
+    """Orden Mercado Pago de 2 asientos con su capacidad reservada (evento de 10)"""
+    event = await create_event(db, capacity=10)
+    order = await create_order(db, event, quantity=2)
+    reserved, _ = await InventoryService.reserve_order(db, str(event.id), 2, {}, f"order_{order.id}")
+    assert reserved
+    return event, order
+
+
+async def available(event) -> int:
+    return int(await CapacityEngine.get_available(None, str(event.id)))
+
+
+async def order_status(db, order) -> str:
+    return await db.scalar(select(Order.status).where(Order.id == order.id))
+
+
+async def test_sweep_expires_overdue_hold_and_releases_capacity(redis_conn, db, pending_order):
+    event, order = pending_order
+    await CapacityHoldService.place_hold(order.id, ttl=-1)
+    assert await available(event) == 8
+
+    assert await CapacityHoldService.sweep_expired(db) == 1
+
+    assert await order_status(db, order) == "expired"
+    assert await available(event) == 10
+    assert await redis_conn.zcard(CapacityHoldService.HOLDS_KEY) == 0
+
+
+async def test_sweep_keeps_orders_within_their_hold(redis_conn, db, pending_order):
+    event, order = pending_order
+    await CapacityHoldService.place_hold(order.id)
+
+    assert await CapacityHoldService.sweep_expired(db) == 0
+
+    assert await order_status(db, order) == "pending"
+    assert await available(event) == 8
+
+
+async def test_sweep_expires_overdue_order_missing_from_redis(redis_conn, db, pending_order):
+    # El hold nunca llegó a Redis (caída tras el commit) o se perdió
+    event, order = pending_order
+    await db.execute(
+        text("UPDATE orders SET created_at = now() - make_interval(secs => :age) WHERE id = :id"),
+        {"age": HOLD_TTL_SECONDS + 60, "id": order.id}
+    )
+    await db.commit()
+
+    assert await CapacityHoldService.sweep_expired(db) == 1
+
+    assert await order_status(db, order) == "expired"
+    assert await available(event) == 10
+
+
+async def test_sweep_backstop_ignores_bank_transfers(redis_conn, db):
+    event = await create_event(db, capacity=10)
+    order = await create_order(db, event, provider="bank_transfer")
+    await db.execute(
+        text("UPDATE orders SET created_at = now() - make_interval(secs => :age) WHERE id = :id"),
+        {"age": HOLD_TTL_SECONDS + 60, "id": order.id}
+    )
+    await db.commit()
+
+    assert await CapacityHoldService.sweep_expired(db) == 0
+    assert await order_status(db, order) == "pending"
+
+
+async def test_concurrent_sweeps_release_capacity_once(redis_conn, session_maker, db, pending_order):
+    event, order = pending_order
+    await CapacityHoldService.place_hold(order.id, ttl=-1)
+
+    async with session_maker() as other:
+        first = await CapacityHoldService.sweep_expired(db)
+        second = await CapacityHoldService.sweep_expired(other)
+
+    assert first + second == 1
+    assert await available(event) == 10
+
+
+async def test_late_payment_re_reserves_expired_order(redis_conn, db, pending_order):
+    event, order = pending_order
+    await CapacityHoldService.place_hold(order.id, ttl=-1)
+    await CapacityHoldService.sweep_expired(db)
+    assert await available(event) == 10
+
+    order = await db.get(Order, order.id)
+    assert await PurchaseService()._complete_paid_order(db, order) is True
+
+    assert await order_status(db, order) == "completed"
+    assert await available(event) == 8
+    outbox = await db.scalar(select(OutboxEvent.event_type).where(OutboxEvent.aggregate_id == order.id))
+    assert outbox == ORDER_PAID
+
+
+async def test_payment_after_cancellation_re_reserves(redis_conn, db, pending_order):
+    event, order = pending_order
+    service = PurchaseService()
+    assert await service._cancel_order(db, order, "payment_failed") is True
+    assert await available(event) == 10
+
+    assert await service._complete_paid_order(db, order) is True
+
+    assert await order_status(db, order) == "completed"
+    assert await available(event) == 8
+
+
+async def test_payment_within_hold_keeps_original_reservation(redis_conn, db, pending_order):
+    event, order = pending_order
+    await CapacityHoldService.place_hold(order.id)
+
+    assert await PurchaseService()._complete_paid_order(db, order) is True
+
+    assert await available(event) == 8
+    assert await redis_conn.zcard(CapacityHoldService.HOLDS_KEY) == 0
+    # El hold ya no existe: el sweeper no la toca aunque venza el TTL
+    assert await CapacityHoldService.sweep_expired(db) == 0
+
+
+async def test_repeated_payment_completes_once(redis_conn, db, pending_order):
+    event, order = pending_order
+    service = PurchaseService()
+
+    assert await service._complete_paid_order(db, order) is True
+    assert await service._complete_paid_order(db, order) is False
+
+    assert await available(event) == 8
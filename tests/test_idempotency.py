@@ -0,0 +1,124 @@
+"""Idempotency-Key: replay de la respuesta guardada, mismatch y duplicados concurrentes"""
+from fastapi import APIRouter, FastAPI, Request
+from fastapi.responses import JSONResponse
+from shared.utils.idempotency import IdempotentRoute, idempotent, IDEMPOTENCY_HEADER
+import asyncio
+import httpx
+import pytest
+
+
+class Endpoint:
+    """Endpoint de prueba que cuenta sus ejecuciones"""
+
+    def __init__(self):
+        self.calls = 0
+        self.status_code = 202
+        self.delay = 0.0
+
+    def app(self) -> FastAPI:
+        router = APIRouter(route_class=IdempotentRoute)
+
+        @router.post("/orders/{order_id}/pay")
+        @idempotent()
+        async def pay(order_id: str, request: Request):
+            self.calls += 1
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            body = await request.json()
+            return JSONResponse(
+                {"order_id": order_id, "amount": body["amount"], "call": self.calls},
+                status_code=self.status_code,
+                headers={
+                    "Location": f"/orders/{order_id}/status",
+                    "Preference-Applied": "respond-async",
+                },
+            )
+
+        app = FastAPI()
+        app.include_router(router)
+        return app
+
+
+@pytest.fixture
+async def endpoint(redis_conn):
+    return Endpoint()
+
+
+@pytest.fixture
+async def client(endpoint):
+    async with httpx.AsyncClient(app=endpoint.app(), base_url="http://test") as client:
+        yield client
+
+
+def pay(client, order_id="o-1", amount=1000, key="key-1", **headers):
+    if key:
+        headers[IDEMPOTENCY_HEADER] = key
+    return client.post(f"/orders/{order_id}/pay", json={"amount": amount}, headers=headers)
+
+
+async def test_replays_stored_response_with_its_headers(client, endpoint):
+    first = await pay(client)
+    replay = await pay(client)
+
+    assert endpoint.calls == 1
+    assert replay.status_code == 202
+    assert replay.json() == first.json()
+    assert replay.headers["Idempotent-Replayed"] == "true"
+    assert replay.headers["Location"] == "/orders/o-1/status"
+    assert replay.headers["Preference-Applied"] == "respond-async"
+    assert replay.headers["content-type"] == first.headers["content-type"]
+
+
+async def test_same_key_with_other_body_is_rejected(client, endpoint):
+    await pay(client, amount=1000)
+
+    mismatch = await pay(client, amount=2000)
+
+    assert mismatch.status_code == 422
+    assert endpoint.calls == 1
+
+
+async def test_same_key_on_another_resource_runs_again(client, endpoint):
+    await pay(client, order_id="o-1")
+
+    other = await pay(client, order_id="o-2")
+
+    assert other.status_code == 202
+    assert "Idempotent-Replayed" not in other.headers
+    assert endpoint.calls == 2
+
+
+async def test_keys_are_scoped_by_principal(client, endpoint):
+    await pay(client, Authorization="Bearer a")
+    await pay(client, Authorization="Bearer b")
+
+    assert endpoint.calls == 2
+
+
+async def test_requests_without_key_always_run(client, endpoint):
+    await pay(client, key=None)
+    await pay(client, key=None)
+
+    assert endpoint.calls == 2
+
+
+async def test_server_errors_are_not_stored(client, endpoint):
+    endpoint.status_code = 503
+    assert (await pay(client)).status_code == 503
+
+    endpoint.status_code = 202
+    retry = await pay(client)
+
+    assert retry.status_code == 202
+    assert "Idempotent-Replayed" not in retry.headers
+    assert endpoint.calls == 2
+
+
+async def test_concurrent_duplicate_waits_for_the_first_response(client, endpoint):
+    endpoint.delay = 0.2
+
+    first, duplicate = await asyncio.gather(pay(client), pay(client))
+
+    assert endpoint.calls == 1
+    assert first.json() == duplicate.json()
+    assert {first.headers.get("Idempotent-Replayed"), duplicate.headers.get("Idempotent-Replayed")} == {None, "true"}
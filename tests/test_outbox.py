@@ -0,0 +1,145 @@
+"""Claim y relay de outbox_events"""
+from sqlalchemy import select, text
+from shared.database.models import OutboxEvent
+from services.ticket_purchase.services import outbox_service
+from services.ticket_purchase.services.outbox_service import (
+    OutboxService, ORDER_PAID, OUTBOX_REDELIVERY_SECONDS, _CLAIM_SQL
+)
+import pytest
+import uuid
+
+
+class FakeCelery:
+    """Registra los send_task; con `fail` lanza como un broker caído"""
+
+    def __init__(self):
+        self.sent = []
+        self.fail = False
+
+    def send_task(self, name, kwargs=None):
+        if self.fail:
+            raise ConnectionError("broker no disponible")
+        self.sent.append((name, kwargs))
+
+
+@pytest.fixture
+def celery(monkeypatch):
+    fake = FakeCelery()
+    monkeypatch.setattr(outbox_service, "celery_app", fake)
+    return fake
+
+
+async def enqueue(db, order_id=None, event_type=ORDER_PAID):
+    outbox_id = await OutboxService.enqueue(db, order_id or uuid.uuid4(), event_type)
+    await db.commit()
+    return outbox_id
+
+
+async def row(db, outbox_id) -> OutboxEvent:
+    db.expire_all()
+    return await db.scalar(select(OutboxEvent).where(OutboxEvent.id == outbox_id))
+
+
+async def test_enqueue_ignores_repeated_event_for_same_order(db):
+    order_id = uuid.uuid4()
+
+    assert await enqueue(db, order_id) is not None
+    assert await enqueue(db, order_id) is None
+
+    assert await db.scalar(text("SELECT count(*) FROM outbox_events")) == 1
+
+
+async def test_relay_publishes_each_pending_event_once(db, celery):
+    order_id = uuid.uuid4()
+    outbox_id = await enqueue(db, order_id)
+
+    assert await OutboxService.relay(db) == 1
+    assert await OutboxService.relay(db) == 0
+
+    assert celery.sent == [
+        ("process_order_post_payment", {"order_id": str(order_id), "outbox_id": str(outbox_id)})
+    ]
+    published = await row(db, outbox_id)
+    assert (published.status, published.attempts) == ("published", 1)
+
+
+async def test_relay_republishes_unprocessed_event_after_redelivery_window(db, celery):
+    outbox_id = await enqueue(db)
+    await OutboxService.relay(db)
+    await db.execute(
+        text("UPDATE outbox_events SET published_at = now() - make_interval(secs => :age) WHERE id = :id"),
+        {"age": OUTBOX_REDELIVERY_SECONDS + 1, "id": outbox_id}
+    )
+    await db.commit()
+
+    assert await OutboxService.relay(db) == 1
+
+    assert len(celery.sent) == 2
+    assert (await row(db, outbox_id)).attempts == 2
+
+
+async def test_relay_skips_processed_events(db, celery):
+    outbox_id = await enqueue(db)
+    await db.execute(text("UPDATE outbox_events SET processed_at = now() WHERE id = :id"), {"id": outbox_id})
+    await db.commit()
+
+    assert await OutboxService.relay(db) == 0
+    assert celery.sent == []
+
+
+async def test_failed_publication_backs_off(db, celery):
+    outbox_id = await enqueue(db)
+    celery.fail = True
+
+    assert await OutboxService.relay(db) == 0
+
+    failed = await row(db, outbox_id)
+    assert (failed.status, failed.attempts) == ("pending", 1)
+    assert "broker no disponible" in failed.last_error
+
+    # No se reintenta antes del backoff aunque el broker vuelva
+    celery.fail = False
+    assert await OutboxService.relay(db) == 0
+    await db.execute(text("UPDATE outbox_events SET available_at = now() WHERE id = :id"), {"id": outbox_id})
+    await db.commit()
+    assert await OutboxService.relay(db) == 1
+
+
+async def test_relays_do_not_claim_the_same_rows(db, session_maker, celery):
+    await enqueue(db)
+    await enqueue(db)
+
+    async with session_maker() as other:
+        # Otro relay tiene las filas tomadas (FOR UPDATE) mientras publica
+        claimed = (await other.execute(_CLAIM_SQL, {
+            "batch_size": 100, "redelivery": OUTBOX_REDELIVERY_SECONDS, "max_attempts": 10,
+        })).all()
+        assert len(claimed) == 2
+
+        assert await OutboxService.relay(db) == 0
+        await other.rollback()
+
+    assert await OutboxService.relay(db) == 2
+
+
+async def test_dispatch_publishes_once_and_relay_skips_it(db, celery):
+    order_id = uuid.uuid4()
+    outbox_id = await enqueue(db, order_id)
+
+    assert await OutboxService.dispatch(db, outbox_id, order_id, ORDER_PAID) is True
+    assert await OutboxService.dispatch(db, outbox_id, order_id, ORDER_PAID) is False
+    assert await OutboxService.relay(db) == 0
+
+    assert len(celery.sent) == 1
+
+
+async def test_failed_dispatch_leaves_event_for_the_relay(db, celery):
+    order_id = uuid.uuid4()
+    outbox_id = await enqueue(db, order_id)
+    celery.fail = True
+
+    assert await OutboxService.dispatch(db, outbox_id, order_id, ORDER_PAID) is False
+
+    celery.fail = False
+    assert await OutboxService.relay(db) == 1
+    assert (await row(db, outbox_id)).status == "published"
@@ -0,0 +1,126 @@
+"""Consumer group de webhooks: ack, reclamo de pendientes y dead-letter"""
+from shared.cache.redis_client import LockError
+from services.ticket_purchase.services import webhook_ingestion_service
+from services.ticket_purchase.services.webhook_ingestion_service import (
+    WebhookIngestionService, STREAM_KEY, GROUP, DEAD_LETTER_KEY
+)
+import asyncio
+import pytest
+import uuid
+
+
+class FakeDispatcher:
+    """Reemplaza el procesamiento en la DB; falla para las órdenes de `failing`"""
+
+    def __init__(self):
+        self.calls = []
+        self.failing = set()
+
+    async def __call__(self, provider, payload):
+        order_id = payload["data"]["external_reference"]
+        self.calls.append((order_id, payload["data"]["id"]))
+        if order_id in self.failing:
+            raise RuntimeError("proveedor no disponible")
+        return "ok"
+
+
+@pytest.fixture
+async def dispatcher(redis_conn, monkeypatch):
+    fake = FakeDispatcher()
+    monkeypatch.setattr(WebhookIngestionService, "_dispatch", staticmethod(fake))
+    # Cualquier pendiente es reclamable de inmediato
+    monkeypatch.setattr(webhook_ingestion_service, "WEBHOOK_CLAIM_IDLE_MS", 1)
+    await WebhookIngestionService.ensure_group()
+    return fake
+
+
+async def ingest(order_id: str, payment_id: str) -> str:
+    payload = {"type": "payment", "data": {"id": payment_id, "external_reference": order_id}}
+    return await WebhookIngestionService.ingest("mercadopago", payload)
+
+
+async def pending(redis_conn):
+    return await redis_conn.xpending_range(STREAM_KEY, GROUP, min="-", max="+", count=100)
+
+
+async def test_processed_messages_are_acked_in_stream_order(redis_conn, dispatcher):
+    order_id = str(uuid.uuid4())
+    await ingest(order_id, "1")
+    await ingest(order_id, "2")
+
+    assert await WebhookIngestionService.consume_once("worker-a", block_ms=1) == 2
+
+    assert dispatcher.calls == [(order_id, "1"), (order_id, "2")]
+    assert await pending(redis_conn) == []
+
+
+async def test_failure_stops_the_order_but_not_other_orders(redis_conn, dispatcher):
+    failing, healthy = str(uuid.uuid4()), str(uuid.uuid4())
+    dispatcher.failing.add(failing)
+    await ingest(failing, "1")
+    await ingest(failing, "2")
+    await ingest(healthy, "3")
+
+    assert await WebhookIngestionService.consume_once("worker-a", block_ms=1) == 1
+
+    # La segunda notificación de la orden fallida no se adelanta a la primera
+    assert (failing, "2") not in dispatcher.calls
+    assert len(await pending(redis_conn)) == 2
+
+
+async def test_stale_message_is_claimed_by_another_consumer(redis_conn, dispatcher):
+    order_id = str(uuid.uuid4())
+    dispatcher.failing.add(order_id)
+    await ingest(order_id, "1")
+    await WebhookIngestionService.consume_once("worker-a", block_ms=1)
+
+    dispatcher.failing.clear()
+    await asyncio.sleep(0.01)
+    assert await WebhookIngestionService.consume_once("worker-b", block_ms=1) == 1
+
+    assert dispatcher.calls == [(order_id, "1"), (order_id, "1")]
+    assert await pending(redis_conn) == []
+
+
+async def test_message_is_dead_lettered_after_max_deliveries(redis_conn, dispatcher, monkeypatch):
+    monkeypatch.setattr(webhook_ingestion_service, "WEBHOOK_MAX_DELIVERIES", 2)
+    order_id = str(uuid.uuid4())
+    dispatcher.failing.add(order_id)
+    message_id = await ingest(order_id, "1")
+
+    for _ in range(3):
+        await WebhookIngestionService.consume_once("worker-a", block_ms=1)
+        await asyncio.sleep(0.01)
+
+    assert len(dispatcher.calls) == 2
+    assert await pending(redis_conn) == []
+    dead = await redis_conn.xrange(DEAD_LETTER_KEY)
+    assert len(dead) == 1
+    assert dead[0][1]["original_id"] == message_id
+    assert dead[0][1]["deliveries"] == "2"
+
+
+async def test_waiting_for_the_order_lock_does_not_count_as_delivery(redis_conn, dispatcher, monkeypatch):
+    class BusyLock:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        async def __aenter__(self):
+            raise LockError("orden ocupada")
+
+        async def __aexit__(self, *exc):
+            return False
+
+    monkeypatch.setattr(webhook_ingestion_service, "DistributedLock", BusyLock)
+    monkeypatch.setattr(webhook_ingestion_service, "WEBHOOK_MAX_DELIVERIES", 2)
+    order_id = str(uuid.uuid4())
+    await ingest(order_id, "1")
+
+    for _ in range(4):
+        await WebhookIngestionService.consume_once("worker-a", block_ms=1)
+        await asyncio.sleep(0.01)
+
+    entries = await pending(redis_conn)
+    assert len(entries) == 1
+    assert entries[0]["times_delivered"] < 2
+    assert await redis_conn.xlen(DEAD_LETTER_KEY) == 0